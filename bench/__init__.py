@@ -0,0 +1,3 @@
+"""
+Benchmarks for the schema compiler and the runtime libraries
+"""
@@ -0,0 +1,153 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Measure the compression ratio of archives of complex messages written by
+scalgoproto.ArchiveWriter, and the throughput of writing them and of reading
+their messages in order and at random, across block sizes and compressions
+
+Run as python3 -m bench.archive from the root of the repository
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from .runtime import measure
+
+schemas = ["test/base.spr"]
+compressions = ["zlib", "lzma"]
+block_sizes = [1 << 12, 1 << 16, 1 << 20]
+
+
+def build(messages: int, elements: int) -> List[bytes]:
+    """Return complex messages with lists of elements entries"""
+    scalgoproto = importlib.import_module("scalgoproto")
+    base = importlib.import_module("base")
+    ans = []
+    for m in range(messages):
+        w = scalgoproto.Writer()
+        c = w.construct_table(base.ComplexOut)
+        c.add_member().id = m & 0x7FFF
+        c.text = "message %d" % m
+        l = c.add_int_list(elements)
+        for i in range(elements):
+            l[i] = m + i
+        l2 = c.add_text_list(elements)
+        for i in range(elements):
+            l2[i] = "text %d" % (i & 15)
+        ans.append(bytes(w.finalize(c)))
+    return ans
+
+
+def run(
+    messages: List[bytes], min_time: float, cache_blocks: int
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    scalgoproto = importlib.import_module("scalgoproto")
+    base = importlib.import_module("base")
+    size = sum(len(m) for m in messages)
+    rng = random.Random(42)
+    picks = [rng.randrange(len(messages)) for _ in range(1000)]
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for compression in compressions:
+        results[compression] = {}
+        for block_size in block_sizes:
+
+            def write() -> bytes:
+                f = io.BytesIO()
+                with scalgoproto.ArchiveWriter(f, block_size, compression) as w:
+                    for m in messages:
+                        w.add(m)
+                return f.getvalue()
+
+            data = write()
+
+            def read(indexes: List[int]) -> None:
+                a = scalgoproto.Archive(io.BytesIO(data), cache_blocks)
+                for i in indexes:
+                    a[i].root(base.ComplexIn).member.id
+
+            write_time = measure(write, min_time)
+            sequential = measure(lambda: read(range(len(messages))), min_time)
+            random_time = measure(lambda: read(picks), min_time)
+            results[compression][str(block_size)] = {
+                "ratio": size / len(data),
+                "write_mb_per_s": size / write_time / 2 ** 20,
+                "sequential_msgs_per_s": len(messages) / sequential,
+                "random_msgs_per_s": len(picks) / random_time,
+            }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark compressed archives.")
+    parser.add_argument(
+        "--messages", type=int, default=2000, help="number of messages archived"
+    )
+    parser.add_argument(
+        "--elements",
+        type=int,
+        default=100,
+        help="number of elements in the lists of every message",
+    )
+    parser.add_argument(
+        "--cache-blocks",
+        type=int,
+        default=8,
+        help="number of decompressed blocks cached when reading",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="run every measurement for at least this many seconds",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        cmd = [sys.executable, "-m", "scalgoprotoc", "build", "--py", d]
+        subprocess.check_call(cmd + schemas)
+        sys.path.insert(0, d)
+        sys.path.insert(0, os.path.join("lib", "python"))
+        messages = build(args.messages, args.elements)
+        results = run(messages, args.min_time, args.cache_blocks)
+
+    print(
+        "%-6s %8s %7s %10s %12s %12s"
+        % ("codec", "block", "ratio", "write MB/s", "seq msgs/s", "rand msgs/s")
+    )
+    for (compression, res) in results.items():
+        for (block_size, r) in res.items():
+            print(
+                "%-6s %8s %7.2f %10.1f %12.0f %12.0f"
+                % (
+                    compression,
+                    block_size,
+                    r["ratio"],
+                    r["write_mb_per_s"],
+                    r["sequential_msgs_per_s"],
+                    r["random_msgs_per_s"],
+                )
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "messages": args.messages,
+                    "elements": args.elements,
+                    "cache_blocks": args.cache_blocks,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
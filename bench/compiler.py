@@ -0,0 +1,170 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Time every stage of the schema compiler on synthetic schemas, and check
+that it scales linearly with table count, member count, nesting depth and
+import fan-out
+
+Run as python3 -m bench.compiler from the root of the repository
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+from scalgoprotoc import cpp_generator, python_generator
+from scalgoprotoc.annotate import annotate
+from scalgoprotoc.documents import Documents
+from scalgoprotoc.parser import Parser
+from scalgoprotoc.sp_tokenize import tokenize
+
+from . import corpus
+from .timing import slope
+
+stages = ["tokenize", "parse", "annotate", "py", "cpp"]
+
+axes = {
+    "tables": lambda v: dict(tables=v),
+    "members": lambda v: dict(tables=100, members=v),
+    "depth": lambda v: dict(tables=100, depth=v),
+    "imports": lambda v: dict(tables=100, imports=v),
+}
+
+
+def pipeline(
+    path: str, output: str, measure: Callable[[str, Callable[[], Any]], Any]
+) -> None:
+    """Run all stages of the compiler on the schema at path, calling every
+    stage through measure"""
+    contents = []
+    for name in sorted(glob.glob(os.path.join(os.path.dirname(path), "*.spr"))):
+        with open(name, "r") as f:
+            contents.append(f.read())
+
+    def tokenize_all():
+        for (i, content) in enumerate(contents):
+            deque(tokenize(content, i), maxlen=0)
+
+    measure("tokenize", tokenize_all)
+    documents = Documents()
+    documents.read_root(path)
+    ast = measure("parse", lambda: Parser(documents).parse_document())
+    if not measure("annotate", lambda: annotate(documents, ast)):
+        raise Exception("The generated schema %s is invalid" % path)
+    measure("py", lambda: python_generator.write(documents, ast, output, ""))
+    measure(
+        "cpp", lambda: cpp_generator.Generator(documents).generate(ast, output, True)
+    )
+
+
+def run(path: str, output: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Return the best time in seconds and the peak memory in bytes of
+    every stage of the compiler on the schema at path"""
+    times = {stage: math.inf for stage in stages}
+    memory = {stage: 0 for stage in stages}
+
+    def timed(stage: str, func: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        ans = func()
+        times[stage] = min(times[stage], time.perf_counter() - start)
+        return ans
+
+    def traced(stage: str, func: Callable[[], Any]) -> Any:
+        tracemalloc.start()
+        try:
+            ans = func()
+            memory[stage] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return ans
+
+    for _ in range(repeat):
+        pipeline(path, output, timed)
+    pipeline(path, output, traced)
+    return {"time": times, "memory": memory}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the schema compiler.")
+    parser.add_argument(
+        "--axis",
+        choices=sorted(axes),
+        action="append",
+        help="only vary this dimension of the schema, may be repeated",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="values of the varied dimension, defaults depend on the axis",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--max-slope",
+        type=float,
+        default=1.3,
+        help="flag stages whose log-log slope of time over size exceeds this",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    defaults = {
+        "tables": [250, 500, 1000, 2000],
+        "members": [8, 16, 32, 64],
+        "depth": [2, 4, 8, 16],
+        "imports": [1, 2, 4, 8],
+    }
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    flagged: List[str] = []
+    for axis in args.axis or sorted(axes):
+        sizes = args.sizes or defaults[axis]
+        results[axis] = []
+        print("%s" % axis)
+        print(
+            "%8s %s  %s"
+            % (
+                "value",
+                " ".join("%12s" % ("%s ms" % s) for s in stages),
+                " ".join("%12s" % ("%s MB" % s) for s in stages),
+            )
+        )
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as d:
+                os.mkdir(os.path.join(d, "out"))
+                path = corpus.write(d, **axes[axis](size))
+                res = run(path, os.path.join(d, "out"), args.repeat)
+            res["value"] = size
+            results[axis].append(res)
+            print(
+                "%8d %s  %s"
+                % (
+                    size,
+                    " ".join("%12.1f" % (res["time"][s] * 1000) for s in stages),
+                    " ".join("%12.2f" % (res["memory"][s] / 2 ** 20) for s in stages),
+                )
+            )
+        slopes = []
+        for stage in stages:
+            s = slope(sizes, [r["time"][stage] for r in results[axis]])
+            slopes.append(s)
+            if s > args.max_slope:
+                flagged.append("%s over %s (slope %.2f)" % (stage, axis, s))
+        print("%8s %s" % ("slope", " ".join("%12.2f" % s for s in slopes)))
+        print()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    for f in flagged:
+        print("Super-linear: %s" % f)
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
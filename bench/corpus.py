@@ -0,0 +1,93 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Generate synthetic schemas of a given size for benchmarking
+"""
+import os
+from typing import List
+
+memberTypes = [
+    "U32",
+    "F64 = 2.5",
+    "Bool",
+    "Text",
+    "Bytes",
+    "list U16",
+    "optional I32",
+    "%sEnum",
+    "%sStruct",
+    "list Text",
+]
+
+
+def magic(seed: int) -> str:
+    """Return a table magic for seed, distinct seeds give distinct magics"""
+    v = (seed * 2654435761 + 0x9E3779B9) & 0xFFFFFFFF
+    return "@%08X" % (v or 1)
+
+
+def nested(seed: int, depth: int, indent: str) -> List[str]:
+    """Return the lines of a member table nested depth levels deep"""
+    if depth == 0:
+        return []
+    ans = ["%sinner: table %s {" % (indent, magic(seed + depth))]
+    ans.append("%s\tv%d: U32;" % (indent, depth))
+    ans.extend(nested(seed, depth - 1, indent + "\t"))
+    ans.append("%s}" % indent)
+    return ans
+
+
+def schema(
+    tables: int,
+    members: int = 8,
+    depth: int = 0,
+    name: str = "bench",
+    imports: List[str] = [],
+    seed: int = 0,
+) -> str:
+    """Return the text of a schema with the given number of tables, each having
+    the given number of members and a member nested depth tables deep.
+    Tables refer to the previous table and to the first table of every import"""
+    prefix = name[0].upper() + name[1:]
+    out: List[str] = []
+    for i in imports:
+        out.append("import %s" % i)
+    out.append("namespace %s;" % name)
+    out.append("")
+    out.append("enum %sEnum {\n\ta, b, c\n}" % prefix)
+    out.append("")
+    out.append("/** Struct used by all tables */")
+    out.append("struct %sStruct {\n\tx: U32;\n\ty: F32;\n\tz: Bool;\n}" % prefix)
+    out.append("")
+    for t in range(tables):
+        base = (seed << 24) | (t << 6)
+        out.append("## Table number %d" % t)
+        out.append("table %sT%d %s {" % (prefix, t, magic(base)))
+        for m in range(members):
+            type_ = memberTypes[m % len(memberTypes)]
+            if "%s" in type_:
+                type_ = type_ % prefix
+            out.append("\tm%d: %s;" % (m, type_))
+        if t:
+            out.append("\tprev: %sT%d;" % (prefix, t - 1))
+        for i in imports:
+            out.append("\tref%s: %sT0;" % (i[0].upper() + i[1:], i[0].upper() + i[1:]))
+        out.extend(nested(base, depth, "\t"))
+        out.append("}")
+        out.append("")
+    return "\n".join(out)
+
+
+def write(
+    directory: str, tables: int, members: int = 8, depth: int = 0, imports: int = 0
+) -> str:
+    """Write a schema and the given number of schemas it imports to directory.
+    Returns the path of the root schema"""
+    names: List[str] = []
+    for i in range(imports):
+        names.append("bench%d" % i)
+        with open(os.path.join(directory, "%s.spr" % names[-1]), "w") as f:
+            f.write(schema(tables, members, depth, names[-1], [], i + 1))
+    path = os.path.join(directory, "bench.spr")
+    with open(path, "w") as f:
+        f.write(schema(tables, members, depth, "bench", names))
+    return path
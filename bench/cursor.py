@@ -0,0 +1,155 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Compare scanning lists of tables, structs and unions by indexing, by
+iteration and with ListIn.cursor, in time and in element objects created
+per element
+
+Run as python3 -m bench.cursor from the root of the repository
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Any, Callable, Dict, List, Tuple
+
+from .runtime import measure
+
+schemas = ["test/base.spr", "test/complex2.spr"]
+scans = ["index", "iterate", "cursor"]
+
+
+def build(elements: int) -> Tuple[Any, Any]:
+    """Return the complex and complex2 messages, with lists of elements entries"""
+    scalgoproto = importlib.import_module("scalgoproto")
+    base = importlib.import_module("base")
+    complex2 = importlib.import_module("complex2")
+
+    w = scalgoproto.Writer()
+    c = w.construct_table(base.ComplexOut)
+    members = c.add_member_list(elements).add_all()
+    for (i, m) in enumerate(members):
+        m.id = i & 0x7FFF
+    l = c.add_struct_list(elements)
+    for i in range(elements):
+        l[i] = base.MyStruct(i, 0.5, i & 1 == 1)
+    data = bytes(w.finalize(c))
+
+    w = scalgoproto.Writer()
+    r = w.construct_table(complex2.Complex2Out)
+    l2 = r.add_l2(elements)
+    for i in range(elements):
+        l2[i].text = "text"
+    data2 = bytes(w.finalize(r))
+
+    return (
+        scalgoproto.Reader(data).root(base.ComplexIn),
+        scalgoproto.Reader(data2).root(complex2.Complex2In),
+    )
+
+
+def scanner(kind: str, read: Callable[[Any], Any]) -> Callable[[Any], None]:
+    """Return a function reading one member of every element of a list"""
+    if kind == "index":
+
+        def scan(l):
+            for i in range(len(l)):
+                read(l[i])
+
+    elif kind == "iterate":
+
+        def scan(l):
+            for v in l:
+                read(v)
+
+    else:
+
+        def scan(l):
+            for v in l.cursor():
+                read(v)
+
+    return scan
+
+
+def count_objects(cls: type, func: Callable[[], None]) -> int:
+    """Return the number of objects of type cls created while calling func"""
+    created = [0]
+    init = cls.__init__
+
+    def counting(self, *args, **kwargs):
+        created[0] += 1
+        init(self, *args, **kwargs)
+
+    cls.__init__ = counting
+    try:
+        func()
+    finally:
+        cls.__init__ = init
+    return created[0]
+
+
+def run(elements: int, min_time: float) -> Dict[str, Dict[str, Dict[str, float]]]:
+    base = importlib.import_module("base")
+    (c, c2) = build(elements)
+    lists: List[Tuple[str, type, Any, Callable[[Any], Any]]] = [
+        ("tables", base.MemberIn, c.member_list, lambda v: v.id),
+        ("structs", base.MyStruct, c.struct_list, lambda v: v.x),
+        ("unions", base.NamedUnionIn, c2.l2, lambda v: v.type),
+    ]
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for (name, cls, l, read) in lists:
+        results[name] = {}
+        for kind in scans:
+            scan = scanner(kind, read)
+            t = measure(lambda: scan(l), min_time)
+            objects = count_objects(cls, lambda: scan(l))
+            results[name][kind] = {
+                "ns_per_element": t / elements * 1e9,
+                "objects_per_element": objects / elements,
+            }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark list cursors.")
+    parser.add_argument(
+        "--elements", type=int, default=100000, help="number of elements in the lists"
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="run every measurement for at least this many seconds",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        cmd = [sys.executable, "-m", "scalgoprotoc", "build", "--py", d]
+        subprocess.check_call(cmd + schemas)
+        sys.path.insert(0, d)
+        sys.path.insert(0, os.path.join("lib", "python"))
+        results = run(args.elements, args.min_time)
+
+    print("%-8s %-8s %12s %12s" % ("list", "scan", "ns/element", "objects/el"))
+    for (name, res) in results.items():
+        for kind in scans:
+            print(
+                "%-8s %-8s %12.1f %12.4f"
+                % (
+                    name,
+                    kind,
+                    res[kind]["ns_per_element"],
+                    res[kind]["objects_per_element"],
+                )
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"elements": args.elements, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
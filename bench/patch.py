@@ -0,0 +1,129 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Measure the size of scalgoproto.diff patches and the time to compute and
+apply them, for small edits of a complex message made in place, by
+appending and by writing the message again
+
+Run as python3 -m bench.patch from the root of the repository
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Callable, Dict, List, Tuple
+
+from .runtime import measure
+
+schemas = ["test/base.spr"]
+
+
+def build(elements: int, first_id: int = 0) -> bytes:
+    """Return a complex message with lists of elements entries"""
+    scalgoproto = importlib.import_module("scalgoproto")
+    base = importlib.import_module("base")
+    w = scalgoproto.Writer()
+    c = w.construct_table(base.ComplexOut)
+    c.add_member().id = 42
+    c.text = "text"
+    l = c.add_int_list(elements)
+    for i in range(elements):
+        l[i] = i
+    l2 = c.add_member_list(elements)
+    for i in range(elements):
+        l2.add(i).id = (first_id + i) & 0x7FFF
+    return bytes(w.finalize(c))
+
+
+def edits(elements: int) -> List[Tuple[str, Callable[[bytes], bytes]]]:
+    """Return named functions applying a small edit to a message"""
+    scalgoproto = importlib.import_module("scalgoproto")
+    base = importlib.import_module("base")
+
+    def mut(data: bytes) -> bytes:
+        ans = bytearray(data)
+        c = scalgoproto.Reader(ans).root(base.ComplexMut)
+        c.member.id = 43
+        return bytes(ans)
+
+    def append(data: bytes) -> bytes:
+        w = scalgoproto.Writer.open_append(data)
+        c = w.root(base.ComplexMut)
+        c.ntext = w.construct_text("appended")
+        m = w.construct_table(base.MemberOut)
+        m.id = 9
+        c.nmember = m
+        return bytes(w.finalize())
+
+    def rebuild(data: bytes) -> bytes:
+        return build(elements, 1)
+
+    return [("mut", mut), ("append", append), ("rebuild", rebuild)]
+
+
+def run(elements: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    scalgoproto = importlib.import_module("scalgoproto")
+    data = build(elements)
+    old = scalgoproto.Reader(data)
+    results: Dict[str, Dict[str, float]] = {}
+    for (name, edit) in edits(elements):
+        new = scalgoproto.Reader(edit(data))
+        patch = scalgoproto.diff(old, new)
+        assert scalgoproto.apply_patch(old, patch) == new._data
+        results[name] = {
+            "bytes": len(new._data),
+            "patch_bytes": len(patch),
+            "diff_seconds": measure(lambda: scalgoproto.diff(old, new), min_time),
+            "apply_seconds": measure(
+                lambda: scalgoproto.apply_patch(old, patch), min_time
+            ),
+        }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark message patches.")
+    parser.add_argument(
+        "--elements", type=int, default=10000, help="number of elements in the lists"
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="run every measurement for at least this many seconds",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        cmd = [sys.executable, "-m", "scalgoprotoc", "build", "--py", d]
+        subprocess.check_call(cmd + schemas)
+        sys.path.insert(0, d)
+        sys.path.insert(0, os.path.join("lib", "python"))
+        results = run(args.elements, args.min_time)
+
+    print(
+        "%-8s %10s %10s %10s %10s"
+        % ("edit", "bytes", "patch", "diff us", "apply us")
+    )
+    for (name, res) in results.items():
+        print(
+            "%-8s %10d %10d %10.1f %10.1f"
+            % (
+                name,
+                res["bytes"],
+                res["patch_bytes"],
+                res["diff_seconds"] * 1e6,
+                res["apply_seconds"] * 1e6,
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"elements": args.elements, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
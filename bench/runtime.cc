@@ -0,0 +1,303 @@
+// -*- mode: c++; tab-width: 4; indent-tabs-mode: t; eval: (progn (c-set-style "stroustrup") (c-set-offset 'innamespace 0)); -*-
+// vi:set ts=4 sts=4 sw=4 noet :
+
+// Measure the C++ side of python3 -m bench.runtime. Invoked by it as
+// runtime ELEMENTS MIN_TIME MESSAGE... and prints the results as json
+
+#include <chrono>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <random>
+#include <string>
+#include <vector>
+
+#include "base.hh"
+#include "complex2.hh"
+
+using namespace scalgoprototest;
+using namespace scalgoprototest2;
+
+namespace {
+
+volatile std::uint64_t sink;
+
+template <typename F>
+double measure(F f, double minTime) {
+	double best = 0;
+	for (int r=0; r < 3; ++r) {
+		size_t calls = 0;
+		auto start = std::chrono::steady_clock::now();
+		double elapsed = 0;
+		do {
+			f();
+			++calls;
+			elapsed = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+		} while (elapsed < minTime);
+		if (r == 0 || elapsed / calls < best) best = elapsed / calls;
+	}
+	return best;
+}
+
+std::uint64_t visit(MemberIn m) {return m.id();}
+
+std::uint64_t visit(NamedUnionIn<false> u) {
+	std::uint64_t ans = (std::uint64_t)u.type();
+	if (u.isMember()) ans += visit(u.member());
+	if (u.isText()) ans += u.text().size();
+	if (u.isMyBytes()) ans += u.myBytes().second;
+	if (u.isEnumList())
+		for (auto e: u.enumList()) ans += (std::uint64_t)e;
+	return ans;
+}
+
+struct Simple {
+	using IN = SimpleIn;
+	using OUT = SimpleOut;
+	size_t n;
+
+	SimpleOut build(scalgoproto::Writer & w) {
+		auto s = w.construct<SimpleOut>();
+		s.setE(MyEnum::c);
+		s.setS({MyEnum::d, {42, 27.0, true}, false, 8, 9, 10, 11, -8, -9, -10, -11, 27.0, 22.0});
+		s.setB(true);
+		s.setU8(242).setU16(4024).setU32(124474).setU64(5465778);
+		s.setI8(-40).setI16(4025).setI32(124475).setI64(5465779);
+		s.setF(2.0).setD(3.0);
+		s.setOs({43, 28.0, false});
+		s.setOb(false);
+		s.setOu32(124464);
+		s.setOd(6.4);
+		return s;
+	}
+
+	std::uint64_t traverse(SimpleIn s) {
+		std::uint64_t ans = 0;
+		if (s.hasE()) ans += (std::uint64_t)s.e();
+		auto fs = s.s();
+		ans += (std::uint64_t)fs.e + fs.s.x + (std::uint64_t)fs.s.y + fs.s.z + fs.b;
+		ans += fs.u8 + fs.u16 + fs.u32 + fs.u64 + fs.i8 + fs.i16 + fs.i32 + fs.i64;
+		ans += (std::uint64_t)fs.f + (std::uint64_t)fs.d;
+		ans += s.b() + s.u8() + s.u16() + s.u32() + s.u64();
+		ans += s.i8() + s.i16() + s.i32() + s.i64();
+		ans += (std::uint64_t)s.f() + (std::uint64_t)s.d();
+		if (s.hasOs()) ans += s.os().x;
+		if (s.hasOb()) ans += s.ob();
+		if (s.hasOu8()) ans += s.ou8();
+		if (s.hasOu16()) ans += s.ou16();
+		if (s.hasOu32()) ans += s.ou32();
+		if (s.hasOu64()) ans += s.ou64();
+		if (s.hasOi8()) ans += s.oi8();
+		if (s.hasOi16()) ans += s.oi16();
+		if (s.hasOi32()) ans += s.oi32();
+		if (s.hasOi64()) ans += s.oi64();
+		if (s.hasOf()) ans += (std::uint64_t)s.of();
+		if (s.hasOd()) ans += (std::uint64_t)s.od();
+		return ans;
+	}
+
+	std::uint64_t access(SimpleIn s, size_t which, size_t) {
+		switch (which % 4) {
+		case 0: return s.u32();
+		case 1: return (std::uint64_t)s.s().s.y;
+		case 2: return s.hasOu32() ? s.ou32() : 0;
+		default: return (std::uint64_t)s.e();
+		}
+	}
+};
+
+struct Complex {
+	using IN = ComplexIn;
+	using OUT = ComplexOut;
+	size_t n;
+
+	ComplexOut build(scalgoproto::Writer & w) {
+		auto s = w.construct<ComplexOut>();
+		s.addMember().setId(42);
+		s.addText("text");
+		s.addMyBytes("bytes", 5);
+		auto l = s.addIntList(n);
+		for (size_t i=0; i < n; ++i) l[i] = i;
+		auto l2 = s.addEnumList(n);
+		for (size_t i=0; i < n; ++i) l2[i] = (MyEnum)(i & 3);
+		auto l3 = s.addStructList(n);
+		for (size_t i=0; i < n; ++i) l3[i] = MyStruct{(std::uint32_t)i, 0.5, (i & 1) == 1};
+		auto l4 = s.addTextList(n);
+		for (size_t i=0; i < n; ++i) l4[i] = w.constructText("text " + std::to_string(i));
+		auto l5 = s.addBytesList(n);
+		for (size_t i=0; i < n; ++i) l5[i] = w.constructBytes("bytes", 5);
+		auto l6 = s.addMemberList(n);
+		for (size_t i=0; i < n; ++i) l6.add(i).setId(i);
+		auto l7 = s.addF64list(n);
+		for (size_t i=0; i < n; ++i) l7[i] = i * 0.5;
+		auto l8 = s.addBlist(n);
+		for (size_t i=0; i < n; ++i) l8[i] = (i & 1) == 1;
+		return s;
+	}
+
+	std::uint64_t traverse(ComplexIn s) {
+		std::uint64_t ans = 0;
+		if (s.hasMember()) ans += visit(s.member());
+		if (s.hasNmember()) ans += visit(s.nmember());
+		if (s.hasText()) ans += s.text().size();
+		if (s.hasMyBytes()) ans += s.myBytes().second;
+		if (s.hasNtext()) ans += s.ntext().size();
+		if (s.hasNbytes()) ans += s.nbytes().second;
+		if (s.hasIntList()) for (auto v: s.intList()) ans += v;
+		if (s.hasNintList()) for (auto v: s.nintList()) ans += v;
+		if (s.hasEnumList()) for (auto v: s.enumList()) ans += (std::uint64_t)v;
+		if (s.hasStructList()) for (auto v: s.structList()) ans += v.x;
+		if (s.hasTextList()) {
+			auto l = s.textList();
+			for (size_t i=0; i < l.size(); ++i) if (l.has(i)) ans += l[i].size();
+		}
+		if (s.hasBytesList()) {
+			auto l = s.bytesList();
+			for (size_t i=0; i < l.size(); ++i) if (l.has(i)) ans += l[i].second;
+		}
+		if (s.hasMemberList()) {
+			auto l = s.memberList();
+			for (size_t i=0; i < l.size(); ++i) if (l.has(i)) ans += visit(l[i]);
+		}
+		if (s.hasF32list()) for (auto v: s.f32list()) ans += (std::uint64_t)v;
+		if (s.hasF64list()) for (auto v: s.f64list()) ans += (std::uint64_t)v;
+		if (s.hasU8list()) for (auto v: s.u8list()) ans += v;
+		if (s.hasBlist()) for (auto v: s.blist()) ans += v;
+		return ans;
+	}
+
+	std::uint64_t access(ComplexIn s, size_t which, size_t i) {
+		switch (which % 6) {
+		case 0: return s.intList()[i % n];
+		case 1: return s.structList()[i % n].x;
+		case 2: return s.textList()[i % n].size();
+		case 3: return s.memberList()[i % n].id();
+		case 4: return (std::uint64_t)s.f64list()[i % n];
+		default: return s.member().id();
+		}
+	}
+};
+
+struct Complex2 {
+	using IN = Complex2In;
+	using OUT = Complex2Out;
+	size_t n;
+
+	Complex2Out build(scalgoproto::Writer & w) {
+		auto r = w.construct<Complex2Out>();
+		r.addHat().setId(43);
+		r.u1().addMember().setId(42);
+		r.u2().addText("text");
+		r.u3().addMyBytes("bytes", 5);
+		r.u5().setA();
+		auto l = r.addL(n);
+		for (size_t i=0; i < n; ++i) l[i] = Complex2L{(std::int16_t)(i & 0x7FFF), (i & 1) == 1};
+		r.setS({Complex2SX::p, {8}});
+		auto l2 = r.addL2(n);
+		for (size_t i=0; i < n; ++i) {
+			if (i & 1) l2[i].addText("text");
+			else l2[i].addMember().setId(i);
+		}
+		return r;
+	}
+
+	std::uint64_t traverse(Complex2In s) {
+		std::uint64_t ans = 0;
+		if (s.hasU1()) ans += visit(s.u1());
+		if (s.hasU2()) ans += visit(s.u2());
+		if (s.hasU3()) ans += visit(s.u3());
+		if (s.hasU4()) ans += visit(s.u4());
+		if (s.hasU5()) ans += (std::uint64_t)s.u5().type();
+		if (s.hasHat()) ans += s.hat().id();
+		if (s.hasL()) for (auto v: s.l()) ans += v.a + v.b;
+		ans += (std::uint64_t)s.s().x + s.s().y.z;
+		if (s.hasL2()) {
+			auto l = s.l2();
+			for (size_t i=0; i < l.size(); ++i) if (l.has(i)) ans += visit(l[i]);
+		}
+		return ans;
+	}
+
+	std::uint64_t access(Complex2In s, size_t which, size_t i) {
+		switch (which % 4) {
+		case 0: return s.l()[i % n].a;
+		case 1: return s.l2()[i % n].isText();
+		case 2: return s.hat().id();
+		default: return s.u1().member().id();
+		}
+	}
+};
+
+template <typename M>
+void run(M m, double minTime, const char * name, bool first) {
+	scalgoproto::Writer w;
+	auto [d, s] = w.finalize(m.build(w));
+	std::vector<char> data(d, d + s);
+
+	double build = measure([&]() {
+			scalgoproto::Writer w;
+			m.build(w);
+		}, minTime);
+	// Finalizing only writes the header, so it can be repeated on one writer
+	auto built = m.build(w);
+	double finalize = measure([&]() {
+			sink = w.finalize(built).second;
+		}, minTime);
+	double traverse = measure([&]() {
+			scalgoproto::Reader r(data.data(), data.size());
+			sink = m.traverse(r.root<typename M::IN>());
+		}, minTime);
+
+	std::mt19937 rng(42);
+	std::vector<std::pair<size_t, size_t> > picks;
+	for (size_t i=0; i < 1000; ++i)
+		picks.emplace_back(rng(), rng() % m.n);
+	scalgoproto::Reader reader(data.data(), data.size());
+	auto root = reader.root<typename M::IN>();
+	double random = measure([&]() {
+			std::uint64_t ans = 0;
+			for (auto [which, i]: picks) ans += m.access(root, which, i);
+			sink = ans;
+		}, minTime) / picks.size();
+
+	double copy = measure([&]() {
+			scalgoproto::Reader r(data.data(), data.size());
+			scalgoproto::Writer w;
+			auto o = w.construct<typename M::OUT>();
+			scalgoproto::copy(o, r.root<typename M::IN>());
+			sink = w.finalize(o).second;
+		}, minTime);
+
+	if (!first) std::cout << ",";
+	std::cout << "\"" << name << "\": {\"bytes\": " << data.size() << ", \"seconds\": {"
+			  << "\"build\": " << build
+			  << ", \"finalize\": " << finalize
+			  << ", \"traverse\": " << traverse
+			  << ", \"random\": " << random
+			  << ", \"copy\": " << copy << "}}";
+}
+
+} //anonymous namespace
+
+int main(int argc, char ** argv) {
+	if (argc < 3) {
+		std::cerr << "Usage: " << argv[0] << " ELEMENTS MIN_TIME MESSAGE..." << std::endl;
+		return 1;
+	}
+	size_t n = std::atoi(argv[1]);
+	double minTime = std::atof(argv[2]);
+	std::cout.precision(9);
+	std::cout << "{";
+	for (int i=3; i < argc; ++i) {
+		if (!strcmp(argv[i], "simple")) run(Simple{n}, minTime, argv[i], i == 3);
+		else if (!strcmp(argv[i], "complex")) run(Complex{n}, minTime, argv[i], i == 3);
+		else if (!strcmp(argv[i], "complex2")) run(Complex2{n}, minTime, argv[i], i == 3);
+		else {
+			std::cerr << "Unknown message " << argv[i] << std::endl;
+			return 1;
+		}
+	}
+	std::cout << "}" << std::endl;
+	return 0;
+}
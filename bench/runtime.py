@@ -0,0 +1,404 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Measure the throughput of building, finalizing, traversing, randomly
+accessing and copying messages of the test schemas, with the python
+runtime and the C++ header
+
+Run as python3 -m bench.runtime from the root of the repository
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+schemas = ["test/base.spr", "test/complex2.spr"]
+operations = ["build", "finalize", "traverse", "random", "copy"]
+
+
+def measure(func: Callable[[], Any], min_time: float, repeat: int = 3) -> float:
+    """Return the best average time in seconds of a call to func, calling it
+    enough times that every round takes at least min_time"""
+    best = None
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        if best is None or elapsed / calls < best:
+            best = elapsed / calls
+    return best
+
+
+class Messages:
+    """Build the benchmarked messages with the generated python code"""
+
+    def __init__(self, elements: int) -> None:
+        self.n = elements
+        self.scalgoproto = importlib.import_module("scalgoproto")
+        self.base = importlib.import_module("base")
+        self.complex2 = importlib.import_module("complex2")
+
+    def build_simple(self, w) -> Any:
+        base = self.base
+        s = w.construct_table(base.SimpleOut)
+        s.e = base.MyEnum.c
+        s.s = base.FullStruct(
+            base.MyEnum.d,
+            base.MyStruct(42, 27.0, True),
+            False,
+            8,
+            9,
+            10,
+            11,
+            -8,
+            -9,
+            -10,
+            -11,
+            27.0,
+            22.0,
+        )
+        s.b = True
+        s.u8 = 242
+        s.u16 = 4024
+        s.u32 = 124474
+        s.u64 = 5465778
+        s.i8 = -40
+        s.i16 = 4025
+        s.i32 = 124475
+        s.i64 = 5465779
+        s.f = 2.0
+        s.d = 3.0
+        s.os = base.MyStruct(43, 28.0, False)
+        s.ob = False
+        s.ou32 = 124464
+        s.od = 6.4
+        return s
+
+    def build_complex(self, w) -> Any:
+        base = self.base
+        n = self.n
+        s = w.construct_table(base.ComplexOut)
+        s.add_member().id = 42
+        s.text = "text"
+        s.my_bytes = b"bytes"
+        l = s.add_int_list(n)
+        for i in range(n):
+            l[i] = i
+        l2 = s.add_enum_list(n)
+        for i in range(n):
+            l2[i] = base.MyEnum(i & 3)
+        l3 = s.add_struct_list(n)
+        for i in range(n):
+            l3[i] = base.MyStruct(i, 0.5, i & 1 == 1)
+        l4 = s.add_text_list(n)
+        for i in range(n):
+            l4[i] = "text %d" % i
+        l5 = s.add_bytes_list(n)
+        for i in range(n):
+            l5[i] = b"bytes"
+        l6 = s.add_member_list(n)
+        for i in range(n):
+            l6.add(i).id = i
+        l7 = s.add_f64list(n)
+        for i in range(n):
+            l7[i] = i * 0.5
+        l8 = s.add_blist(n)
+        for i in range(n):
+            l8[i] = i & 1 == 1
+        return s
+
+    def build_complex2(self, w) -> Any:
+        base = self.base
+        complex2 = self.complex2
+        n = self.n
+        r = w.construct_table(complex2.Complex2Out)
+        r.add_hat().id = 43
+        r.u1.add_member().id = 42
+        r.u2.text = "text"
+        r.u3.my_bytes = b"bytes"
+        r.u5.add_a()
+        l = r.add_l(n)
+        for i in range(n):
+            l[i] = complex2.Complex2L(i & 0x7FFF, i & 1 == 1)
+        r.s = complex2.Complex2S(complex2.Complex2SX.p, complex2.Complex2SY(8))
+        l2 = r.add_l2(n)
+        for i in range(n):
+            if i & 1:
+                l2[i].text = "text"
+            else:
+                l2[i].add_member().id = i
+        return r
+
+    def types(self, name: str) -> Tuple[Any, Any, Callable[[Any], Any]]:
+        """Return the in type, out type and builder of a message"""
+        if name == "simple":
+            return (self.base.SimpleIn, self.base.SimpleOut, self.build_simple)
+        if name == "complex":
+            return (self.base.ComplexIn, self.base.ComplexOut, self.build_complex)
+        return (
+            self.complex2.Complex2In,
+            self.complex2.Complex2Out,
+            self.build_complex2,
+        )
+
+    def random_access(self, name: str) -> List[Callable[[Any, int], Any]]:
+        """Return accessors of single fields in a message, given an index"""
+        n = self.n
+        if name == "simple":
+            return [
+                lambda r, i: r.u32,
+                lambda r, i: r.s.s.y,
+                lambda r, i: r.ou32 if r.has_ou32 else None,
+                lambda r, i: r.e,
+            ]
+        if name == "complex":
+            return [
+                lambda r, i: r.int_list[i % n],
+                lambda r, i: r.struct_list[i % n].x,
+                lambda r, i: r.text_list[i % n],
+                lambda r, i: r.member_list[i % n].id,
+                lambda r, i: r.f64list[i % n],
+                lambda r, i: r.member.id,
+            ]
+        return [
+            lambda r, i: r.l[i % n].a,
+            lambda r, i: r.l2[i % n].is_text,
+            lambda r, i: r.hat.id,
+            lambda r, i: r.u1.member.id,
+        ]
+
+
+class Traverser:
+    """Read every member of a message through the generated accessors"""
+
+    def __init__(self, scalgoproto) -> None:
+        self.scalgoproto = scalgoproto
+        self.fields: Dict[type, List[Tuple[str, str]]] = {}
+
+    def members(self, cls: type) -> List[Tuple[str, str]]:
+        """Return the (name, guard) of every property of a generated class"""
+        if cls in self.fields:
+            return self.fields[cls]
+        names = set()
+        for c in cls.__mro__:
+            for (name, v) in vars(c).items():
+                if isinstance(v, property):
+                    names.add(name)
+        ans = []
+        for name in sorted(names):
+            if name.startswith("has_") or name.startswith("is_") or name == "type":
+                continue
+            guard = None
+            for prefix in ("has_", "is_"):
+                if prefix + name in names:
+                    guard = prefix + name
+            ans.append((name, guard))
+        self.fields[cls] = ans
+        return ans
+
+    def traverse(self, v: Any) -> int:
+        """Visit v and everything it contains, returning the number of values"""
+        sp = self.scalgoproto
+        if isinstance(v, (sp.TableIn, sp.UnionIn)):
+            cnt = 1
+            for (name, guard) in self.members(type(v)):
+                if guard is None or getattr(v, guard):
+                    cnt += self.traverse(getattr(v, name))
+            return cnt
+        if isinstance(v, sp.ListIn):
+            cnt = 1
+            for i in range(len(v)):
+                if v.has(i):
+                    cnt += self.traverse(v[i])
+            return cnt
+        return 1
+
+
+def run_python(
+    directory: str, names: List[str], elements: int, min_time: float
+) -> Dict[str, Dict[str, Any]]:
+    sys.path.insert(0, directory)
+    sys.path.insert(0, os.path.join("lib", "python"))
+    messages = Messages(elements)
+    scalgoproto = messages.scalgoproto
+    traverser = Traverser(scalgoproto)
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        (in_type, out_type, build) = messages.types(name)
+        w = scalgoproto.Writer()
+        data = bytes(w.finalize(build(w)))
+        size = len(data)
+
+        def build_only():
+            w = scalgoproto.Writer()
+            build(w)
+
+        def traverse():
+            traverser.traverse(scalgoproto.Reader(data).root(in_type))
+
+        accessors = messages.random_access(name)
+        rng = random.Random(42)
+        picks = [
+            (rng.choice(accessors), rng.randrange(elements)) for _ in range(1000)
+        ]
+        root = scalgoproto.Reader(data).root(in_type)
+
+        def random_access():
+            for (a, i) in picks:
+                a(root, i)
+
+        def copy():
+            w = scalgoproto.Writer()
+            w.finalize(w.copy(out_type, scalgoproto.Reader(data).root(in_type)))
+
+        times = {"build": measure(build_only, min_time)}
+        # Finalizing only writes the header, so it can be repeated on one writer
+        built = build(w)
+        times["finalize"] = measure(lambda: w.finalize(built), min_time)
+        times["traverse"] = measure(traverse, min_time)
+        times["random"] = measure(random_access, min_time) / len(picks)
+        times["copy"] = measure(copy, min_time)
+        results[name] = report(size, times)
+    return results
+
+
+def report(size: int, times: Dict[str, float]) -> Dict[str, Any]:
+    """Convert the time in seconds of every operation into throughputs"""
+    ans: Dict[str, Any] = {"bytes": size}
+    for op in operations:
+        t = times[op]
+        if op == "random":
+            ans[op] = {"seconds": t, "accesses_per_s": 1 / t if t else None}
+        else:
+            ans[op] = {
+                "seconds": t,
+                "msgs_per_s": 1 / t if t else None,
+                "mb_per_s": size / t / 2 ** 20 if t else None,
+            }
+    return ans
+
+
+def run_cpp(
+    directory: str, names: List[str], elements: int, min_time: float
+) -> Dict[str, Dict[str, Any]]:
+    binary = os.path.join(directory, "runtime")
+    subprocess.check_call(
+        [
+            os.environ.get("CXX", "g++"),
+            "-O2",
+            "-DNDEBUG",
+            "-std=c++17",
+            "-I",
+            directory,
+            "-I",
+            os.path.join("lib", "cpp"),
+            os.path.join("bench", "runtime.cc"),
+            "-o",
+            binary,
+        ]
+    )
+    out = subprocess.check_output([binary, str(elements), str(min_time)] + names)
+    results: Dict[str, Dict[str, Any]] = {}
+    for (name, res) in json.loads(out.decode("utf-8")).items():
+        results[name] = report(res["bytes"], res["seconds"])
+    return results
+
+
+def commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the runtimes.")
+    parser.add_argument(
+        "--elements",
+        type=int,
+        default=1000,
+        help="number of elements in the lists of the complex messages",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="run every measurement for at least this many seconds",
+    )
+    parser.add_argument(
+        "--message",
+        choices=["simple", "complex", "complex2"],
+        action="append",
+        help="only benchmark this message, may be repeated",
+    )
+    parser.add_argument("--no-python", action="store_true")
+    parser.add_argument("--no-cpp", action="store_true")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    names = args.message or ["simple", "complex", "complex2"]
+
+    results: Dict[str, Any] = {
+        "commit": commit(),
+        "elements": args.elements,
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as d:
+        cmd = [sys.executable, "-m", "scalgoprotoc", "build", "--py", d, "--cpp", d]
+        subprocess.check_call(cmd + ["--single"] + schemas)
+        if not args.no_python:
+            results["results"]["python"] = run_python(
+                d, names, args.elements, args.min_time
+            )
+        if not args.no_cpp:
+            results["results"]["cpp"] = run_cpp(
+                d, names, args.elements, args.min_time
+            )
+
+    print(
+        "%-8s %-10s %-9s %14s %12s"
+        % ("runtime", "message", "operation", "msgs/s", "MB/s")
+    )
+    for (runtime, res) in results["results"].items():
+        for name in names:
+            for op in operations:
+                r = res[name][op]
+                if op == "random":
+                    print(
+                        "%-8s %-10s %-9s %14.0f %12s"
+                        % (runtime, name, op, r["accesses_per_s"] or 0, "")
+                    )
+                else:
+                    print(
+                        "%-8s %-10s %-9s %14.0f %12.1f"
+                        % (
+                            runtime,
+                            name,
+                            op,
+                            r["msgs_per_s"] or 0,
+                            r["mb_per_s"] or 0,
+                        )
+                    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
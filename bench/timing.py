@@ -0,0 +1,29 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Helpers for timing things and checking how they scale
+"""
+import math
+import time
+from typing import Callable, List, Sequence
+
+
+def best_time(func: Callable[[], object], repeat: int = 3) -> float:
+    """Return the shortest wall time in seconds of repeat calls of func"""
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def slope(sizes: Sequence[float], times: Sequence[float]) -> float:
+    """Return the least squares slope of log(times) as a function of log(sizes).
+    A slope of 1 means linear scaling, 2 quadratic and so on"""
+    xs: List[float] = [math.log(s) for s in sizes]
+    ys: List[float] = [math.log(max(t, 1e-9)) for t in times]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    num = sum((x - mx) * (y - my) for (x, y) in zip(xs, ys))
+    den = sum((x - mx) ** 2 for x in xs)
+    return num / den
@@ -0,0 +1,55 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Check that tokenizing scales linearly with the size of the schema
+
+Run as python3 -m bench.tokenizer from the root of the repository
+"""
+import argparse
+import sys
+from collections import deque
+
+from scalgoprotoc.sp_tokenize import tokenize
+
+from . import corpus
+from .timing import best_time, slope
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the tokenizer.")
+    parser.add_argument(
+        "--tables",
+        type=int,
+        nargs="+",
+        default=[1250, 2500, 5000, 10000],
+        help="number of tables in the generated schemas",
+    )
+    parser.add_argument(
+        "--max-slope",
+        type=float,
+        default=1.2,
+        help="fail if the log-log slope of time over size exceeds this",
+    )
+    args = parser.parse_args()
+
+    times = []
+    sizes = []
+    print("%8s %10s %10s %12s" % ("tables", "bytes", "ms", "ns/byte"))
+    for tables in args.tables:
+        data = corpus.schema(tables)
+        t = best_time(lambda: deque(tokenize(data, 0), maxlen=0))
+        sizes.append(len(data))
+        times.append(t)
+        print(
+            "%8d %10d %10.1f %12.1f"
+            % (tables, len(data), t * 1000, t * 1e9 / len(data))
+        )
+    s = slope(sizes, times)
+    print("slope %.2f" % s)
+    if s > args.max_slope:
+        print("Tokenizing does not scale linearly")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
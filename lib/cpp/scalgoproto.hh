@@ -2,19 +2,48 @@
 // vi:set ts=4 sts=4 sw=4 noet :
 #ifndef __SCALGOPROTO_HH__
 #define __SCALGOPROTO_HH__
+#include <algorithm>
+#include <array>
 #include <cstdint>
 #include <cstring>
 #include <cassert>
+#include <deque>
+#include <initializer_list>
 #include <limits>
 #include <cmath>
+#include <optional>
 #include <stdexcept>
+#include <string>
+#include <type_traits>
+#include <unordered_map>
 #include <utility>
+#include <vector>
+#if __has_include(<zlib.h>)
+// Compressed Bytes members require zlib, linked with -lz
+#include <zlib.h>
+#endif
+#if __has_include(<sys/mman.h>)
+// Continuing a message in a file in place maps it into memory
+#include <cerrno>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <system_error>
+#include <unistd.h>
+#endif
 
 namespace scalgoproto {
 
+static constexpr uint32_t MESSAGEMAGIC = 0xB5C0C4B3;
+static constexpr uint32_t LARGEMESSAGEMAGIC = 0x9C1A35E7;
+// Default number of bytes of texts and bytes a deduplicating Writer remembers
+static constexpr size_t DEDUPELIMIT = 1 << 20;
+// Pointers in large messages count units of 8 bytes instead of bytes
+static constexpr unsigned LARGESHIFT = 3;
 static constexpr uint32_t LISTMAGIC = 0x3400BB46;
 static constexpr uint32_t TEXTMAGIC = 0xD812C8F5;
 static constexpr uint32_t BYTESMAGIC = 0xDCDBBE10;
+static constexpr uint32_t MAPMAGIC = 0x4FD9A3E6;
 
 class Out;
 class UnionOut;
@@ -41,6 +70,27 @@ using Bytes = std::pair<const char *, size_t>;
 template <typename T>
 class ListOut;
 
+template <typename T>
+class ListBuilder;
+
+template <std::uint32_t ...>
+class ColumnsOut;
+
+template <typename T>
+class PackedListIn;
+
+template <typename T>
+class PackedListOut;
+
+class DictionaryListIn;
+class DictionaryListOut;
+
+template <typename, typename>
+class MapIn;
+
+template <typename, typename>
+class MapOut;
+
 template <typename, typename>
 class ListAccessHelp;
 
@@ -49,20 +99,62 @@ public:
 	Error() : std::runtime_error("Error") {}
 };
 
+#ifdef ZLIB_VERSION
+/**
+ * Return data compressed as a zlib stream, the way compressed Bytes members
+ * are stored
+ */
+inline std::string zlibCompress(const void * data, size_t size) {
+	uLongf compressedSize = compressBound(size);
+	std::string out(compressedSize, '\0');
+	if (compress2((Bytef *)out.data(), &compressedSize, (const Bytef *)data, size,
+				  Z_DEFAULT_COMPRESSION) != Z_OK)
+		throw std::bad_alloc();
+	out.resize(compressedSize);
+	return out;
+}
+
+/**
+ * Return the content of the zlib stream b, throwing Error if it is not one.
+ * Nothing is cached, so a shared Reader may be read from many threads
+ */
+inline std::string zlibDecompress(Bytes b) {
+	// The size is not stored, so grow the output until the stream ends
+	std::string out(std::max<size_t>(b.second * 4, 64), '\0');
+	z_stream s{};
+	if (inflateInit(&s) != Z_OK) throw std::bad_alloc();
+	s.next_in = (Bytef *)b.first;
+	s.avail_in = (uInt)b.second;
+	int ret;
+	do {
+		if (s.total_out == out.size()) out.resize(out.size() * 2);
+		s.next_out = (Bytef *)out.data() + s.total_out;
+		s.avail_out = (uInt)(out.size() - s.total_out);
+		ret = inflate(&s, Z_NO_FLUSH);
+	} while (ret == Z_OK);
+	out.resize(s.total_out);
+	inflateEnd(&s);
+	if (ret != Z_STREAM_END) throw Error();
+	return out;
+}
+#endif
+
 class TextOut {
 	friend class Writer;
 	friend class Out;
 	template <typename, typename> friend class ListAccessHelp;
+	template <typename> friend class ListBuilder;
 protected:
-	std::uint32_t offset_;
+	std::uint64_t offset_;
 };
 
 class BytesOut {
 	friend class Writer;
 	friend class Out;
 	template <typename, typename> friend class ListAccessHelp;
+	template <typename> friend class ListBuilder;
 protected:
-	std::uint32_t offset_;
+	std::uint64_t offset_;
 };
 
 
@@ -99,6 +191,7 @@ class Reader {
 private:
 	friend class In;
 	friend class TableIn;
+	template <typename O> friend Bytes compact(const Reader & reader, Writer & writer);
 	template <typename, typename>
 	friend class ListAccessHelp;
 	template <bool>
@@ -106,11 +199,20 @@ private:
 
 	const char * data;
 	size_t size;
+	// Pointers count units of 1 << shift bytes, see Writer::Writer
+	unsigned shift;
+
+	static unsigned shiftOf_(const char * data, size_t size) noexcept {
+		std::uint32_t magic = 0;
+		if (size >= 4) memcpy(&magic, data, 4);
+		return magic == LARGEMESSAGEMAGIC ? LARGESHIFT : 0;
+	}
 
 	template <uint32_t magic, uint32_t mult=1, uint32_t add=0>
-	Ptr getPtr_(uint32_t offset) const {
+	Ptr getPtr_(uint32_t pointer) const {
+		const uint64_t offset = uint64_t(pointer) << shift;
 		// Validate that the offset is within the reader boundary
-		if ( uint64_t(offset) + 8 >= size) throw Error();
+		if (offset + 8 > size) throw Error();
 		// Check that we have the right magic
 		uint32_t word;
 		memcpy(&word, data+offset, 4);
@@ -131,17 +233,18 @@ private:
 		if (p.start[p.size] != '\0') throw Error();
 
 	}
+
 public:
-	Reader(const char * data, size_t size) noexcept : data(data), size(size) {};
+	Reader(const char * data, size_t size) noexcept : data(data), size(size), shift(shiftOf_(data, size)) {};
 
-	explicit Reader(scalgoproto::Bytes bytes) noexcept : data(bytes.first), size(bytes.second) {};
+	explicit Reader(scalgoproto::Bytes bytes) noexcept : Reader(bytes.first, bytes.second) {};
 	
 	template <typename T>
 	T root() const {
 		std::uint32_t magic, offset;
 		memcpy(&magic, data, 4);
 		memcpy(&offset, data+4, 4);
-		if (magic != 0xB5C0C4B3) throw Error();
+		if (magic != MESSAGEMAGIC && magic != LARGEMESSAGEMAGIC) throw Error();
 		return T(*this, getPtr_<T::MAGIC>(offset));
 	}
 };
@@ -160,6 +263,29 @@ protected:
 
 	template <typename T>
 	static std::pair<const T *, size_t> getListRaw_(Ptr p) noexcept {return {reinterpret_cast<const T *>(p.start), (size_t)p.size};}
+
+	template <typename T>
+	static T getColumns_(const Reader & reader, Ptr p) {
+		// Both columns and packed lists start with a 32 bit count
+		if (p.start + 4 > reader.data + reader.size) throw Error();
+		T ans(reader, p);
+		if (ans.end_() > reader.data + reader.size) throw Error();
+		return ans;
+	}
+
+	template <typename T>
+	static PackedListIn<T> getPackedList_(const Reader & reader, Ptr p) {
+		return getColumns_<PackedListIn<T> >(reader, p);
+	}
+
+	static inline DictionaryListIn getDictionaryList_(const Reader & reader, Ptr p);
+
+	template <typename K, typename V>
+	static MapIn<K, V> getMap_(const Reader & reader, Ptr p) {
+		// Probing wraps around by masking with the capacity minus one
+		if (p.size == 0 || (p.size & (p.size - 1)) != 0) throw Error();
+		return MapIn<K, V>(reader, p);
+	}
 };
 
 
@@ -182,7 +308,7 @@ struct ListAccessHelp<BoolTag, T> : public In {
 		template <typename> friend class ListOut;
 		char * const byte;
 		const size_t bit;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
 	public:
 		void operator=(bool value) noexcept {
 			std::uint8_t v;
@@ -192,7 +318,7 @@ struct ListAccessHelp<BoolTag, T> : public In {
 		}
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset,
+	static void copy(Writer & writer, std::uint64_t offset,
 			const Reader &, const char * start,
 			std::uint32_t size);
 };
@@ -212,12 +338,12 @@ struct ListAccessHelp<PodTag, T>: public In {
 	class Setter {
 		template <typename> friend class ListOut;
 		char * location;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
 	public:
 		void operator=(const T & value) noexcept {memcpy(location, &value, sizeof(T));}
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset, 
+	static void copy(Writer & writer, std::uint64_t offset, 
 					const Reader &, const char * start, 
 					std::uint32_t size);
 };
@@ -240,13 +366,13 @@ struct ListAccessHelp<EnumTag, T>: public In {
 
 	class Setter {
 		template <typename> friend class ListOut;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
 		char * const location;
 	public:
 		void operator=(const T & value) noexcept {memcpy(location, &value, sizeof(T));}
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset, 
+	static void copy(Writer & writer, std::uint64_t offset, 
 				const Reader &, const char * start, 
 				std::uint32_t size);
 };
@@ -273,15 +399,15 @@ struct ListAccessHelp<TextTag, T>: public In {
 	}
 	class Setter {
 		template <typename> friend class ListOut;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
 		Writer & writer;
 		char * const location;
 	public:
-		T operator=(const T & value) noexcept {memcpy(location, &value.offset_, 4); return value;}
+		T operator=(const T & value);
 		TextOut operator=(std::string_view t);
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset, 
+	static void copy(Writer & writer, std::uint64_t offset, 
 			const Reader &, const char * start, 
 			std::uint32_t size);
 };
@@ -306,15 +432,15 @@ struct ListAccessHelp<BytesTag, T>: public In {
 	}
 	class Setter {
 		template <typename> friend class ListOut;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
 		char * const location;
 		Writer & writer;
 	public:
-		void operator=(const T & value) noexcept {memcpy(location, &value.offset_, 4);}
-		void operator=(Bytes bytes) noexcept;
+		void operator=(const T & value);
+		void operator=(Bytes bytes);
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset, 
+	static void copy(Writer & writer, std::uint64_t offset, 
 			const Reader &, const char * start, 
 			std::uint32_t size);
 };
@@ -339,20 +465,18 @@ struct ListAccessHelp<TableTag, T>: public In {
 		return getObject_<T>(reader, reader.getPtr_<T::MAGIC>(off));
 	}
 
-	static T add(Writer & w, std::uint32_t offset, std::uint32_t index);
+	static T add(Writer & w, std::uint64_t offset, std::uint32_t index);
 
 	class Setter {
 		template <typename> friend class ListOut;
-		Setter(Writer & writer, std::uint32_t offset, std::uint32_t index);
+		Setter(Writer & writer, std::uint64_t offset, std::uint32_t index);
+		Writer & writer;
 		char * const location;
 	public:
-		void operator=(const T & value) noexcept {
-			uint32_t o = value.offset_-8;
-			memcpy(location, &o, 4);
-		}
+		void operator=(const T & value);
 	};
 
-	static void copy(Writer & writer, std::uint32_t offset, 
+	static void copy(Writer & writer, std::uint64_t offset, 
 			const Reader &, const char * start, 
 			std::uint32_t size);
 };
@@ -380,7 +504,7 @@ struct ListAccessHelp<UnionTag, T>: public In {
 		return getObject_<T>(reader, type, off);
 	}
 
-	static void copy(Writer & writer, std::uint32_t offset,
+	static void copy(Writer & writer, std::uint64_t offset,
 				const Reader &, const char * start,
 				std::uint32_t size);
 
@@ -449,6 +573,8 @@ public:
 template <typename T>
 class ListIn : public In {
 	friend class In;
+	friend class Writer;
+	template <typename, auto> friend class SortedListIn;
 	const Reader & reader_;
 	const char * start_;
 	const std::uint32_t size_;
@@ -489,8 +615,244 @@ public:
 	}
 };
 
+/**
+ * Read a list of tables sorted by a member, declared as list T sorted by
+ * member in the schema. key is the accessor of that member on T. Keys are
+ * found by binary search, reading only the tables probed
+ */
+template <typename T, auto key>
+class SortedListIn : public ListIn<T> {
+	friend class In;
+	SortedListIn(const Reader & reader, Ptr p) noexcept : ListIn<T>(reader, p) {}
+public:
+	using key_type = std::decay_t<decltype((std::declval<T>().*key)())>;
+	using typename ListIn<T>::iterator;
+	using typename ListIn<T>::size_type;
+
+	/**
+	 * Return the index of the first element whose key is not less than k
+	 */
+	size_type lowerBound(const key_type & k) const {
+		size_type lo = 0, hi = this->size();
+		while (lo < hi) {
+			size_type mid = (lo + hi) / 2;
+			if (((*this)[mid].*key)() < k) lo = mid + 1;
+			else hi = mid;
+		}
+		return lo;
+	}
+
+	/**
+	 * Return the index of the first element whose key is greater than k
+	 */
+	size_type upperBound(const key_type & k) const {
+		size_type lo = 0, hi = this->size();
+		while (lo < hi) {
+			size_type mid = (lo + hi) / 2;
+			if (k < ((*this)[mid].*key)()) hi = mid;
+			else lo = mid + 1;
+		}
+		return lo;
+	}
+
+	/**
+	 * Return the first element with key k, if any
+	 */
+	std::optional<T> find(const key_type & k) const {
+		size_type i = lowerBound(k);
+		if (i == this->size()) return std::nullopt;
+		T v = (*this)[i];
+		if ((v.*key)() == k) return v;
+		return std::nullopt;
+	}
+
+	/**
+	 * Return the iterators of the elements whose keys k satisfy lo <= k < hi
+	 */
+	std::pair<iterator, iterator> range(const key_type & lo, const key_type & hi) const {
+		return {this->begin() + lowerBound(lo), this->begin() + lowerBound(hi)};
+	}
+};
+
+/**
+ * Base class for reading a columnar list of tables.
+ *
+ * Every member of the tables is stored in a column of its own, widths gives
+ * the bytes per row of every column, zero for a column of bits. The generated
+ * subclasses return the columns as ListIn, and rows reading the members of a
+ * single table on indexing.
+ *
+ * The columns are preceded by the number of columns stored. Messages written
+ * with fewer members in the table store fewer columns, rows read the default
+ * value of the missing members, and reading them as a column throws
+ * std::out_of_range
+ */
+template <std::uint32_t ... widths>
+class ColumnsIn : public In {
+protected:
+	friend class In;
+	template <std::uint32_t ...> friend class ColumnsOut;
+	static constexpr size_t columns = sizeof...(widths);
+
+	const Reader & reader_;
+	const char * start_;
+	std::uint32_t size_;
+	std::uint32_t stored_;
+	const char * def_;
+	std::array<std::uint64_t, columns + 1> offsets_;
+
+	/**
+	 * Read the columns at p, def is the concatenated default values of all
+	 * columns that are not bits
+	 */
+	ColumnsIn(const Reader & reader, Ptr p, const char * def) noexcept : reader_(reader), start_(p.start + 8), size_(p.size), def_(def) {
+		constexpr std::uint32_t w[] = {widths...};
+		memcpy(&stored_, p.start, 4);
+		offsets_[0] = 0;
+		for (size_t c=0; c < columns; ++c)
+			offsets_[c+1] = offsets_[c] + (w[c] ? (std::uint64_t)w[c] * size_ : ((std::uint64_t)size_ + 7) >> 3);
+	}
+
+	const char * end_() const noexcept {return start_ + offsets_[std::min<size_t>(stored_, columns)];}
+
+	template <typename T, size_t c>
+	ListIn<T> column_() const {
+		if (c >= stored_) throw std::out_of_range("column not stored");
+		return getObject_<ListIn<T> >(reader_, Ptr{start_ + offsets_[c], size_});
+	}
+
+	template <typename T, size_t c>
+	T get_(std::uint32_t index) const noexcept {
+		if (c < stored_) return ListAccess<T>::get(reader_, start_ + offsets_[c], index);
+		if constexpr (std::is_same_v<T, bool>)
+			return false;
+		else {
+			constexpr std::uint32_t w[] = {widths...};
+			std::uint64_t o = 0;
+			for (size_t i=0; i < c; ++i) o += w[i];
+			return ListAccess<T>::get(reader_, def_ + o, 0);
+		}
+	}
+public:
+	using size_type = std::size_t;
+
+	size_type size() const noexcept {return size_;}
+	bool empty() const noexcept {return size_ == 0;}
+};
+
+/**
+ * Iterate over the rows of a columnar list
+ */
+template <typename C>
+class ColumnsIterator {
+	const C * columns_;
+	std::uint32_t index_;
+public:
+	ColumnsIterator(const C * columns, std::uint32_t index) noexcept : columns_(columns), index_(index) {}
+	auto operator*() const noexcept {return (*columns_)[index_];}
+	bool operator != (const ColumnsIterator & o) const noexcept {return index_ != o.index_;}
+	bool operator == (const ColumnsIterator & o) const noexcept {return index_ == o.index_;}
+	ColumnsIterator & operator++() noexcept {index_++; return *this;}
+};
+
+template <typename T>
+class PackedListIterator;
+
+/**
+ * Read a packed list of integers.
+ *
+ * The values are stored as varints of the zigzag encoded differences
+ * between consecutive values, so they can only be decoded in order. Iterate
+ * over the list or decode all of it into a buffer with decode
+ */
+template <typename T>
+class PackedListIn : public In {
+	friend class In;
+	friend class Writer;
+	friend class PackedListIterator<T>;
+	const char * start_;
+	const char * stop_;
+	std::uint32_t size_;
+
+	PackedListIn(const Reader &, Ptr p) noexcept : start_(p.start + 4), size_(p.size) {
+		std::uint32_t bytes;
+		memcpy(&bytes, p.start, 4);
+		stop_ = start_ + bytes;
+	}
+
+	const char * end_() const noexcept {return stop_;}
+
+	static std::uint64_t next_(const char *& cur, const char * stop) {
+		std::uint64_t v = 0;
+		for (unsigned shift=0;; shift += 7) {
+			if (cur == stop || shift > 63) throw Error();
+			std::uint8_t b = *cur++;
+			v |= std::uint64_t(b & 0x7F) << shift;
+			if (!(b & 0x80)) break;
+		}
+		return (v >> 1) ^ -(v & 1);
+	}
+public:
+	using value_type = T;
+	using size_type = std::size_t;
+	using iterator = PackedListIterator<T>;
+
+	size_type size() const noexcept {return size_;}
+	bool empty() const noexcept {return size_ == 0;}
+	inline iterator begin() const;
+	inline iterator end() const noexcept;
+
+	/**
+	 * Decode all values into out, which must have room for size() values
+	 */
+	void decode(T * out) const {
+		const char * cur = start_;
+		std::uint64_t v = 0;
+		for (std::uint32_t i=0; i < size_; ++i) {
+			v += next_(cur, stop_);
+			out[i] = T(v);
+		}
+	}
+};
+
+/**
+ * Iterate over the values of a packed list, decoding them one at a time
+ */
+template <typename T>
+class PackedListIterator {
+	friend class PackedListIn<T>;
+	const char * cur_;
+	const char * stop_;
+	std::uint32_t index_;
+	std::uint32_t size_;
+	std::uint64_t value_ = 0;
+
+	PackedListIterator(const char * cur, const char * stop, std::uint32_t index, std::uint32_t size) : cur_(cur), stop_(stop), index_(index), size_(size) {
+		read_();
+	}
+
+	void read_() {
+		if (index_ < size_) value_ += PackedListIn<T>::next_(cur_, stop_);
+	}
+public:
+	using value_type = T;
+
+	T operator*() const noexcept {return T(value_);}
+	bool operator != (const PackedListIterator & o) const noexcept {return index_ != o.index_;}
+	bool operator == (const PackedListIterator & o) const noexcept {return index_ == o.index_;}
+	PackedListIterator & operator++() {index_++; read_(); return *this;}
+};
+
+template <typename T>
+PackedListIterator<T> PackedListIn<T>::begin() const {return iterator(start_, stop_, 0, size_);}
+
+template <typename T>
+PackedListIterator<T> PackedListIn<T>::end() const noexcept {return iterator(stop_, stop_, size_, size_);}
+
 class TableIn: public In {
 protected:
+	friend class TableOut;
+	friend class Writer;
 	const Reader & reader_;
 	const char * start_;
 	const uint32_t size_;
@@ -536,6 +898,36 @@ protected:
 			return *(const uint8_t *)(start_ + o) & 1 << bit;
 		return def;
 	}
+
+	/**
+	 * Used by the generated Mut classes to change a member of fixed size
+	 * in place. The message must be in writable memory, and the member
+	 * stored in the table
+	 */
+	template <typename T, uint32_t o>
+	void mutInner_(const T & t) const {
+		if (o + sizeof(T) > size_) throw std::out_of_range("member not stored in the table");
+		memcpy(const_cast<char *>(start_) + o, &t, sizeof(T));
+	}
+
+	/**
+	 * Point at the object whose header starts at offset, written by a
+	 * writer continuing the message, see Writer::openAppend
+	 */
+	template <uint32_t o>
+	void mutPtr_(std::uint64_t offset) const {
+		mutInner_<std::uint32_t, o>(std::uint32_t(offset >> reader_.shift));
+	}
+
+	template <typename T>
+	static std::uint64_t outOffset_(const T & t) noexcept;
+
+	template <uint32_t o, uint8_t bit>
+	void mutBit_(bool value) const {
+		if (o >= size_) throw std::out_of_range("member not stored in the table");
+		std::uint8_t & b = *(std::uint8_t *)(const_cast<char *>(start_) + o);
+		b = value ? b | (1 << bit) : b & ~(1 << bit);
+	}
 };
 
 template <bool inplace>
@@ -586,16 +978,256 @@ struct MetaMagic<BytesOut> {using t=BytesTag;};
 template <>
 struct MetaMagic<Bytes> {using t=BytesTag;};
 
+/**
+ * Read a dictionary encoded list of texts.
+ *
+ * Every distinct text is stored once in the dictionary, and the list stores
+ * the index in the dictionary of the text of every element, as codes of
+ * width() bytes. The codes can be grouped on without reading any texts
+ */
+class DictionaryListIn : public In {
+	friend class In;
+	friend class Writer;
+	ListIn<std::string_view> dictionary_;
+	const char * start_;
+	std::uint32_t size_;
+	std::uint32_t width_;
+
+	DictionaryListIn(ListIn<std::string_view> dictionary, const char * start, std::uint32_t size, std::uint32_t width) noexcept
+		: dictionary_(dictionary), start_(start), size_(size), width_(width) {}
+public:
+	using value_type = std::string_view;
+	using size_type = std::size_t;
+
+	class iterator {
+		const DictionaryListIn * list_;
+		std::uint32_t index_;
+	public:
+		iterator(const DictionaryListIn * list, std::uint32_t index) noexcept : list_(list), index_(index) {}
+		std::string_view operator*() const {return (*list_)[index_];}
+		bool operator != (const iterator & o) const noexcept {return index_ != o.index_;}
+		bool operator == (const iterator & o) const noexcept {return index_ == o.index_;}
+		iterator & operator++() noexcept {index_++; return *this;}
+	};
+
+	size_type size() const noexcept {return size_;}
+	bool empty() const noexcept {return size_ == 0;}
+	iterator begin() const noexcept {return iterator(this, 0);}
+	iterator end() const noexcept {return iterator(this, size_);}
+
+	/**
+	 * The distinct texts of the list
+	 */
+	ListIn<std::string_view> dictionary() const noexcept {return dictionary_;}
+
+	/**
+	 * The number of bytes of every code, 1, 2 or 4
+	 */
+	std::uint32_t width() const noexcept {return width_;}
+
+	/**
+	 * The index in the dictionary of the text of element pos
+	 */
+	std::uint32_t code(size_type pos) const noexcept {
+		assert(pos < size_);
+		std::uint32_t c = 0;
+		memcpy(&c, start_ + pos * width_, width_);
+		return c;
+	}
+
+	/**
+	 * Store the index in the dictionary of every element in out, which
+	 * must have room for size() codes
+	 */
+	void codes(std::uint32_t * out) const noexcept {
+		for (std::uint32_t i=0; i < size_; ++i) out[i] = code(i);
+	}
+
+	bool has(size_type pos) const {
+		std::uint32_t c = code(pos);
+		if (c >= dictionary_.size()) throw Error();
+		return dictionary_.has(c);
+	}
+
+	std::string_view operator[] (size_type pos) const {
+		assert(has(pos));
+		return dictionary_[code(pos)];
+	}
+
+	std::string_view at(size_type pos) const {
+		if (pos >= size_) throw std::out_of_range("out of range");
+		if (!has(pos)) throw std::out_of_range("unset member");
+		return dictionary_[code(pos)];
+	}
+};
+
+DictionaryListIn In::getDictionaryList_(const Reader & reader, Ptr p) {
+	std::uint32_t dictionary, width;
+	memcpy(&dictionary, p.start, 4);
+	memcpy(&width, p.start + 4, 4);
+	if (width != 1 && width != 2 && width != 4) throw Error();
+	if (p.start + 8 + std::uint64_t(p.size) * width > reader.data + reader.size) throw Error();
+	return DictionaryListIn(
+		getObject_<ListIn<std::string_view> >(reader, reader.getPtr_<LISTMAGIC, 4>(dictionary)),
+		p.start + 8, p.size, width);
+}
+
+/**
+ * Return the hash of a text key of a map, its crc32. The hash is never 0,
+ * which marks empty slots
+ */
+inline std::uint32_t mapHash(std::string_view key) noexcept {
+	static const std::array<std::uint32_t, 256> table = []() {
+		std::array<std::uint32_t, 256> t{};
+		for (std::uint32_t i=0; i < 256; ++i) {
+			std::uint32_t c = i;
+			for (int j=0; j < 8; ++j) c = (c & 1) ? 0xEDB88320 ^ (c >> 1) : c >> 1;
+			t[i] = c;
+		}
+		return t;
+	}();
+	std::uint32_t c = 0xFFFFFFFF;
+	for (char ch: key) c = table[(c ^ std::uint8_t(ch)) & 0xFF] ^ (c >> 8);
+	c ^= 0xFFFFFFFF;
+	return c ? c : 1;
+}
+
+/**
+ * Return the hash of an integer key of a map, the high half of the
+ * splitmix64 finalizer of the key. The hash is never 0
+ */
+template <typename K>
+std::uint32_t mapHash(K key) noexcept {
+	static_assert(std::is_integral_v<K> && !std::is_same_v<K, bool>);
+	std::uint64_t x = std::uint64_t(key) + 0x9E3779B97F4A7C15;
+	x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9;
+	x = (x ^ (x >> 27)) * 0x94D049BB133111EB;
+	std::uint32_t h = std::uint32_t((x ^ (x >> 31)) >> 32);
+	return h ? h : 1;
+}
+
+/**
+ * Read a map, stored as an open addressing hash table.
+ *
+ * Looking up a key probes a few slots of the message without reading the
+ * rest of the map. K is std::string_view or an integer type, and V the type
+ * of the values as in ListIn. Iteration is in the order of the slots and
+ * gives pairs of keys and values
+ */
+template <typename K, typename V>
+class MapIn : public In {
+	friend class In;
+	friend class Writer;
+	using A = ListAccess<V>;
+	static constexpr bool text = std::is_same_v<K, std::string_view>;
+	const Reader & reader_;
+	const char * start_;
+	std::uint32_t size_;
+	std::uint32_t capacity_;
+
+	MapIn(const Reader & reader, Ptr p) noexcept : reader_(reader), start_(p.start + 4), capacity_(p.size) {
+		memcpy(&size_, p.start, 4);
+	}
+
+	const char * slot_(std::uint32_t index) const noexcept {
+		return start_ + std::uint64_t(index) * SLOT;
+	}
+
+	static std::uint32_t tag_(const char * slot) noexcept {
+		std::uint32_t tag;
+		memcpy(&tag, slot, 4);
+		return tag;
+	}
+
+	K key_(const char * slot) const {
+		if constexpr (text) {
+			return ListAccess<std::string_view>::get(reader_, slot + 4, 0);
+		} else {
+			K key;
+			memcpy(&key, slot + 4, sizeof(K));
+			return key;
+		}
+	}
+
+	V value_(const char * slot) const {
+		return A::get(reader_, slot + 4 + KEYSIZE, 0);
+	}
+
+	const char * find_(K key) const {
+		const std::uint32_t hash = mapHash(key);
+		const std::uint32_t mask = capacity_ - 1;
+		std::uint32_t index = hash & mask;
+		for (std::uint32_t i=0; i < capacity_; ++i, index = (index + 1) & mask) {
+			const char * slot = slot_(index);
+			std::uint32_t tag = tag_(slot);
+			if (tag == 0) break;
+			if (tag == hash && key_(slot) == key) return slot;
+		}
+		return nullptr;
+	}
+public:
+	// Number of bytes of a key
+	static constexpr std::uint32_t KEYSIZE = text ? 4 : sizeof(K);
+	// Number of bytes of a slot: the hash of its key, the key and the value
+	static constexpr std::uint32_t SLOT = 4 + KEYSIZE + A::mult;
+
+	using key_type = K;
+	using mapped_type = V;
+	using value_type = std::pair<K, V>;
+	using size_type = std::size_t;
+
+	class iterator {
+		const MapIn * map_;
+		std::uint32_t index_;
+
+		void skip_() noexcept {
+			while (index_ < map_->capacity_ && tag_(map_->slot_(index_)) == 0) ++index_;
+		}
+	public:
+		iterator(const MapIn * map, std::uint32_t index) noexcept : map_(map), index_(index) {skip_();}
+		value_type operator*() const {
+			const char * slot = map_->slot_(index_);
+			return value_type(map_->key_(slot), map_->value_(slot));
+		}
+		bool operator != (const iterator & o) const noexcept {return index_ != o.index_;}
+		bool operator == (const iterator & o) const noexcept {return index_ == o.index_;}
+		iterator & operator++() noexcept {index_++; skip_(); return *this;}
+	};
+
+	size_type size() const noexcept {return size_;}
+	bool empty() const noexcept {return size_ == 0;}
+	iterator begin() const noexcept {return iterator(this, 0);}
+	iterator end() const noexcept {return iterator(this, capacity_);}
+
+	bool contains(K key) const {return find_(key) != nullptr;}
+
+	/**
+	 * Return the value of key, or nothing if key is not in the map
+	 */
+	std::optional<V> get(K key) const {
+		const char * slot = find_(key);
+		if (!slot) return std::nullopt;
+		return value_(slot);
+	}
+
+	V at(K key) const {
+		const char * slot = find_(key);
+		if (!slot) throw std::out_of_range("missing key");
+		return value_(slot);
+	}
+};
+
 template <typename T>
 class ListOut {
 protected:
 	friend class Writer;
 	friend class Out;
+	friend class ListBuilder<T>;
 	Writer & writer_;
-	uint32_t offset_;
+	std::uint64_t offset_;
 	uint32_t size_;
 	using A=ListAccess<T>;
-	ListOut(Writer & writer, uint32_t offset, uint32_t size_): writer_(writer), offset_(offset), size_(size_) {}
+	ListOut(Writer & writer, std::uint64_t offset, uint32_t size_): writer_(writer), offset_(offset), size_(size_) {}
 public:
 	using value_type = T;
 
@@ -624,61 +1256,453 @@ public:
 template <typename A>
 struct MetaMagic<ListOut<A>> {using t=ListTag;};
 
+/**
+ * A packed list of integers written by Writer::constructPackedList
+ */
+template <typename T>
+class PackedListOut {
+	friend class Writer;
+	friend class Out;
+	std::uint64_t offset_;
+	explicit PackedListOut(std::uint64_t offset) noexcept : offset_(offset) {}
+};
+
+/**
+ * A dictionary encoded list of texts written by
+ * Writer::constructDictionaryList
+ */
+class DictionaryListOut {
+	friend class Writer;
+	friend class Out;
+	std::uint64_t offset_;
+	explicit DictionaryListOut(std::uint64_t offset) noexcept : offset_(offset) {}
+};
+
+/**
+ * A map written by Writer::constructMap
+ */
+template <typename K, typename V>
+class MapOut {
+	friend class Writer;
+	friend class Out;
+	std::uint64_t offset_;
+	explicit MapOut(std::uint64_t offset) noexcept : offset_(offset) {}
+};
+
+/**
+ * How much deduplication has saved a Writer, see Writer::Writer
+ */
+struct DedupeReport {
+	// Number of texts and bytes constructed
+	size_t objects = 0;
+	// Number of those that reused an identical earlier object
+	size_t hits = 0;
+	// Bytes not written because of the reuse
+	size_t bytesSaved = 0;
+	// Number and total size of the objects remembered
+	size_t entries = 0;
+	size_t memory = 0;
+	// Number of tables interned, and how many reused an earlier table
+	size_t tables = 0;
+	size_t tableHits = 0;
+};
+
 class Writer {
 private:
 	char * data = nullptr;
 	size_t size = 0;
 	size_t capacity = 0;
+	unsigned shift = 0;
+	// Offsets of earlier texts and bytes by magic and content, oldest first
+	bool dedupe = false;
+	size_t dedupeLimit = 0;
+	std::unordered_map<std::string, std::uint64_t> dedupeMap;
+	std::deque<const std::string *> dedupeOrder;
+	// Offsets of interned tables by their bytes
+	std::unordered_map<std::string, std::uint64_t> interned;
+	// Lists of tables to sort on finalize, and the functions sorting them
+	std::vector<std::pair<std::uint64_t, std::vector<std::uint32_t> (*)(const Writer &, std::uint64_t)> > sorted_;
+	// While compacting the offsets of the tables copied by where they are
+	// copied from, see compact
+	bool compact_ = false;
+	std::unordered_map<const char *, std::uint64_t> compacted_;
+	// True when continuing a message, whose root finalize may keep
+	bool appending_ = false;
+	// The number of rollbacks done, and the number before and the mark of
+	// every rollback not followed by one to a smaller mark. Used to detect
+	// handles of removed tables in debug builds
+	std::uint64_t rollbackCount_ = 0;
+	std::vector<std::pair<std::uint64_t, std::uint64_t> > rollbacks_;
+	// When continuing a file in place, its descriptor and the function
+	// mapping capacity bytes of it to data, or releasing it for 0. See
+	// openAppendFile
+	int fd_ = -1;
+	void (*remap_)(Writer &, size_t) = nullptr;
+
+	/**
+	 * Return true if the table whose content starts at offset is not
+	 * removed by the rollbacks after the first given number of them
+	 */
+	bool live_(std::uint64_t offset, std::uint64_t rollbacks) const noexcept {
+		// The marks increase along rollbacks_, so the first rollback after
+		// the table has the smallest mark of the later ones
+		auto it = std::lower_bound(rollbacks_.begin(), rollbacks_.end(), std::make_pair(rollbacks, std::uint64_t(0)));
+		return it == rollbacks_.end() || offset - 8 < it->second;
+	}
+
+	void pushRollback_(std::uint64_t mark) {
+		while (!rollbacks_.empty() && rollbacks_.back().second >= mark) rollbacks_.pop_back();
+		rollbacks_.emplace_back(rollbackCount_++, mark);
+	}
+	DedupeReport report;
 	friend class Out;
 	friend class InplaceUnionOut;
 	friend class UnionOut;
 	friend class TableOut;
 	template <typename> friend class ListOut;
+	template <typename> friend class ListBuilder;
 	template <typename, typename> friend class ListAccessHelp;
+	template <std::uint32_t ...> friend class ColumnsOut;
+	template <typename O> friend Bytes compact(const Reader & reader, Writer & writer);
 	void reserve(size_t size) {
 		if (size <= capacity) return;
+		if (remap_) {
+			remap_(*this, size);
+			return;
+		}
 		data = (char *)realloc(data, size);
 		capacity = size;
 	}
 
-	void expand(uint32_t s) {
+	/**
+	 * Release data
+	 */
+	void release_() noexcept {
+		if (remap_) remap_(*this, 0);
+		else if (data) free(data);
+		remap_ = nullptr;
+		data = nullptr;
+		size = 0;
+		capacity = 0;
+	}
+
+	void expand(size_t s) {
 		while (size + s > capacity) reserve(capacity * 2);
 		size += s;
 	}
 
 	template <typename T>
-	void write(const T & t, uint32_t offset) {
+	void write(const T & t, std::uint64_t offset) {
 		memcpy(data + offset, &t, sizeof(T));
 	}
+
+	/**
+	 * Pad so the next object starts where a pointer can point, and
+	 * return where that is
+	 */
+	size_t align_() {
+		size_t pad = -size & ((size_t(1) << shift) - 1);
+		expand(pad);
+		memset(data + size - pad, 0, pad);
+		return size;
+	}
+
+	/**
+	 * Write an object with the given magic and content, followed by a zero
+	 * byte if nul is true, and return where its content starts. When
+	 * deduplicating the offset of an identical earlier object is returned
+	 * instead if it is remembered
+	 */
+	std::uint64_t constructObject_(std::uint32_t magic, const char * content, size_t s, bool nul) {
+		std::string key;
+		if (dedupe) {
+			++report.objects;
+			key.reserve(s + 4);
+			key.append(reinterpret_cast<const char *>(&magic), 4);
+			key.append(content, s);
+			auto it = dedupeMap.find(key);
+			if (it != dedupeMap.end()) {
+				++report.hits;
+				size_t bytes = 8 + s + nul;
+				report.bytesSaved += bytes + (-bytes & ((size_t(1) << shift) - 1));
+				return it->second;
+			}
+		}
+		std::uint64_t o = align_();
+		expand(s + 8 + nul);
+		write(magic, o);
+		write((uint32_t)s, o+4);
+		memcpy(data + o + 8, content, s);
+		if (nul) data[o + 8 + s] = 0;
+		if (dedupe && s <= dedupeLimit) {
+			auto it = dedupeMap.emplace(std::move(key), o + 8).first;
+			dedupeOrder.push_back(&it->first);
+			report.memory += s;
+			while (report.memory > dedupeLimit) {
+				// Forget the oldest objects first
+				report.memory -= dedupeOrder.front()->size() - 4;
+				dedupeMap.erase(*dedupeOrder.front());
+				dedupeOrder.pop_front();
+			}
+		}
+		return o + 8;
+	}
+
+	/**
+	 * Write the header of a dictionary encoded list of count codes of
+	 * width bytes, whose dictionary starts at dictionary, and return where
+	 * its content starts
+	 */
+	std::uint64_t dictionaryList_(std::uint64_t dictionary, size_t count, std::uint32_t width) {
+		std::uint64_t o = align_();
+		expand(16 + count * width);
+		write(LISTMAGIC, o);
+		write((uint32_t)count, o+4);
+		write(pointer_(dictionary - 8), o+8);
+		write(width, o+12);
+		return o + 8;
+	}
+
+	/**
+	 * Write the value v of a map at location
+	 */
+	template <typename V>
+	void mapValue_(char * location, const V & v) {
+		using Tag = typename MetaMagic<V>::t;
+		std::uint32_t p;
+		if constexpr (std::is_same_v<Tag, PodTag>) {
+			memcpy(location, &v, sizeof(V));
+			return;
+		} else if constexpr (std::is_same_v<Tag, TableTag>)
+			p = pointer_(v.offset_ - 8);
+		else
+			p = pointer_(v.offset_);
+		memcpy(location, &p, 4);
+	}
+
+	/**
+	 * Return a copy of the value v of a map, writing copies of the texts,
+	 * bytes and tables it refers to
+	 */
+	template <typename V, typename I>
+	V copyMapValue_(I v) {
+		using Tag = typename MetaMagic<V>::t;
+		if constexpr (std::is_same_v<Tag, TableTag>) {
+			V o = construct<V>();
+			o.copy_(v);
+			return o;
+		} else if constexpr (std::is_same_v<Tag, TextTag>)
+			return constructText(v);
+		else if constexpr (std::is_same_v<Tag, BytesTag>)
+			return constructBytes(v);
+		else
+			return v;
+	}
+
+	/**
+	 * Return the pointers of the list of tables whose content starts at
+	 * offset stably sorted by the member key of the tables, read as I. has
+	 * tells if the key is set, or is nullptr for keys that are always set.
+	 * Called on finalize, throws Error if an element or key is not set
+	 */
+	template <typename I, auto key, auto has>
+	static std::vector<std::uint32_t> sortList_(const Writer & w, std::uint64_t offset) {
+		std::uint32_t size;
+		memcpy(&size, w.data + offset - 4, 4);
+		Reader reader(w.data, w.size);
+		ListIn<I> list(reader, Ptr{w.data + offset, size});
+		std::vector<std::pair<typename SortedListIn<I, key>::key_type, std::uint32_t> > keyed;
+		keyed.reserve(size);
+		for (std::uint32_t i=0; i < size; ++i) {
+			if (!list.has(i)) throw Error();
+			if constexpr (!std::is_same_v<decltype(has), std::nullptr_t>)
+				if (!(list[i].*has)()) throw Error();
+			std::uint32_t p;
+			memcpy(&p, w.data + offset + i * 4, 4);
+			keyed.emplace_back((list[i].*key)(), p);
+		}
+		std::stable_sort(keyed.begin(), keyed.end(), [](const auto & a, const auto & b) {
+				return a.first < b.first;
+			});
+		std::vector<std::uint32_t> ans(size);
+		for (std::uint32_t i=0; i < size; ++i) ans[i] = keyed[i].second;
+		return ans;
+	}
+
+	/**
+	 * Return a copy of the table i written as O. While compacting a table
+	 * copied before is returned instead of copying it again
+	 */
+	template <typename O>
+	O copyTable_(typename O::IN i) {
+		O o = construct<O>();
+		if (compact_) {
+			auto [it, inserted] = compacted_.emplace(i.start_, o.offset_);
+			if (!inserted) {
+				// Remove the table just written, like internTable
+				size = o.offset_ - 8;
+				o.offset_ = it->second;
+				return o;
+			}
+		}
+		o.copy_(i);
+		return o;
+	}
+
+	/**
+	 * Return the encoding of a pointer to the object starting at offset.
+	 * Throws std::length_error if the offset can not be encoded, as the
+	 * message exceeds 4 GB, or 32 GB in the large format
+	 */
+	std::uint32_t pointer_(std::uint64_t offset) const {
+		if ((offset >> shift) >> 32 != 0) throw std::length_error("Message too large");
+		return std::uint32_t(offset >> shift);
+	}
+
+	/**
+	 * Write the magic and sort the sorted lists, see finalize
+	 */
+	inline Bytes finalize_();
 public:
-	Writer(size_t capacity=256): size(8) {reserve(capacity);}
+	/**
+	 * If large is true the message is written in the large format, where
+	 * pointers count units of 8 bytes. This allows messages of up to 32 GB
+	 * at the price of padding every object to 8 bytes.
+	 *
+	 * If dedupe is true texts and bytes identical to an earlier one are not
+	 * written again, the earlier one is pointed to instead. The content of
+	 * at most dedupeLimit bytes of objects is remembered, forgetting the
+	 * oldest first
+	 */
+	Writer(size_t capacity=256, bool large=false, bool dedupe=false, size_t dedupeLimit=DEDUPELIMIT)
+		: size(8), shift(large ? LARGESHIFT : 0), dedupe(dedupe), dedupeLimit(dedupeLimit) {reserve(capacity);}
 	Writer(const Writer &) = delete;
 	Writer & operator=(const Writer &) = delete;
-	Writer(Writer && o) : data(o.data), size(o.size), capacity(o.capacity) {
+	Writer(Writer && o) : data(o.data), size(o.size), capacity(o.capacity), shift(o.shift),
+						  dedupe(o.dedupe), dedupeLimit(o.dedupeLimit), dedupeMap(std::move(o.dedupeMap)),
+						  dedupeOrder(std::move(o.dedupeOrder)), interned(std::move(o.interned)),
+						  sorted_(std::move(o.sorted_)), appending_(o.appending_), rollbackCount_(o.rollbackCount_),
+						  rollbacks_(std::move(o.rollbacks_)), fd_(o.fd_), remap_(o.remap_), report(o.report) {
 		o.data = nullptr;
 		o.size = 0;
 		o.capacity = 0;
+		o.fd_ = -1;
+		o.remap_ = nullptr;
 	}
 	Writer & operator=(Writer && o) {
-		if (data) free(data);
+		release_();
 		data = o.data;
 		size = o.size;
 		capacity = o.capacity;
+		shift = o.shift;
+		dedupe = o.dedupe;
+		dedupeLimit = o.dedupeLimit;
+		dedupeMap = std::move(o.dedupeMap);
+		dedupeOrder = std::move(o.dedupeOrder);
+		interned = std::move(o.interned);
+		sorted_ = std::move(o.sorted_);
+		appending_ = o.appending_;
+		rollbackCount_ = o.rollbackCount_;
+		rollbacks_ = std::move(o.rollbacks_);
+		fd_ = o.fd_;
+		remap_ = o.remap_;
+		report = o.report;
 		o.data = nullptr;
 		o.size = 0;
 		o.capacity = 0;
+		o.fd_ = -1;
+		o.remap_ = nullptr;
 		return *this;
 	}
 	
 	~Writer() {
-		if (data) free(data);
-		data = nullptr;
-		size = 0;
-		capacity = 0;
+		release_();
 	}
 	
-	void clear() noexcept {
+	/**
+	 * Remove everything written, like a rollback to the first mark
+	 */
+	void clear() {
 		size = 8;
+		dedupeMap.clear();
+		dedupeOrder.clear();
+		interned.clear();
+		compacted_.clear();
+		sorted_.clear();
+		appending_ = false;
+		report = DedupeReport();
+		pushRollback_(8);
+	}
+
+	/**
+	 * Return a table identical to t written earlier with internTable, or t
+	 * if there is none. If t is the last object written, it is removed
+	 * when an identical table exists.
+	 *
+	 * Tables are compared by their bytes, so the children of t must be
+	 * interned before t, and t must not be changed afterwards
+	 */
+	template <typename T>
+	T internTable(T t) {
+		static_assert(!T::INPLACE, "Tables with inplace members can not be interned");
+		std::uint64_t start = t.offset_ - 8;
+		std::uint64_t end = t.offset_ + T::SIZE;
+		++report.tables;
+		auto [it, inserted] = interned.emplace(std::string(data + start, end - start), t.offset_);
+		if (inserted) return t;
+		++report.tableHits;
+		// Only padding may follow a table that is the last object written
+		if (size >= end && size - end < (size_t(1) << shift)) {
+			report.bytesSaved += size - start;
+			memset(data + start, 0, size - start);
+			size = start;
+		}
+		t.offset_ = it->second;
+		return t;
+	}
+
+	/**
+	 * Return a mark to roll back to, see rollback
+	 */
+	std::uint64_t mark() const noexcept {return size;}
+
+	/**
+	 * Remove everything written after mark was returned by mark.
+	 *
+	 * The objects written before the mark must not point to the removed
+	 * ones. In debug builds using the handle of a removed table fails an
+	 * assertion
+	 */
+	void rollback(std::uint64_t mark) {
+		assert(8 <= mark && mark <= size);
+		memset(data + mark, 0, size - mark);
+		size = mark;
+		// Objects are remembered in the order they are written
+		while (!dedupeOrder.empty()) {
+			auto it = dedupeMap.find(*dedupeOrder.back());
+			if (it->second - 8 < mark) break;
+			report.memory -= it->first.size() - 4;
+			dedupeOrder.pop_back();
+			dedupeMap.erase(it);
+		}
+		for (auto it=interned.begin(); it != interned.end();) {
+			if (it->second - 8 >= mark) it = interned.erase(it);
+			else ++it;
+		}
+		sorted_.erase(std::remove_if(sorted_.begin(), sorted_.end(),
+									 [&](const auto & s) {return s.first - 8 >= mark;}),
+					  sorted_.end());
+		pushRollback_(mark);
+	}
+
+	/**
+	 * Return how much deduplication has saved since construction or the
+	 * last clear
+	 */
+	DedupeReport dedupeReport() const noexcept {
+		DedupeReport ans = report;
+		ans.entries = dedupeMap.size();
+		return ans;
 	}
 
 	bool isClean() const noexcept {
@@ -686,6 +1710,53 @@ public:
 	}
 	
 	inline Bytes finalize(const TableOut & root);
+
+	/**
+	 * Finalize a message continued with openAppend, keeping its root.
+	 * Throws std::logic_error for other writers
+	 */
+	inline Bytes finalize();
+
+	/**
+	 * Return a writer continuing the finalized message of size bytes at
+	 * message, which is copied.
+	 *
+	 * New objects are written after the message. They are pointed to from
+	 * its tables through the Mut classes of the tables, read from a Reader
+	 * over finalize(). Such a reader is only valid until the next object is
+	 * written, as the writer may move its data.
+	 *
+	 * Continuing a message costs time and memory linear in its size, not in
+	 * the size of the additions: the message is copied into a writer of
+	 * twice its size, and finalize returns all of it to be written out
+	 * again. See openAppendFile to continue a file in place
+	 */
+	static Writer openAppend(const char * message, size_t messageSize) {
+		std::uint32_t magic = 0;
+		if (messageSize >= 8) memcpy(&magic, message, 4);
+		if (magic != MESSAGEMAGIC && magic != LARGEMESSAGEMAGIC) throw Error();
+		Writer w(std::max(messageSize * 2, size_t(256)), magic == LARGEMESSAGEMAGIC);
+		memcpy(w.data, message, messageSize);
+		w.size = messageSize;
+		w.appending_ = true;
+		return w;
+	}
+
+	static Writer openAppend(Bytes message) {
+		return openAppend(message.first, message.second);
+	}
+
+	/**
+	 * Return a writer continuing in place the finalized message that is the
+	 * content of the file at path, like openAppend.
+	 *
+	 * The file is mapped into memory: the Mut classes change it where they
+	 * write, new objects grow it, and finalize writes the header, cuts the
+	 * file to the message and returns the map. This costs time linear in
+	 * the size of the additions and the pages touched. Only available where
+	 * <sys/mman.h> is
+	 */
+	static inline Writer openAppendFile(const char * path);
 	
 	template <typename T>
 	T construct() {
@@ -694,22 +1765,13 @@ public:
 
 	TextOut constructText(std::string_view text) {
 		TextOut o;
-		o.offset_ = size;
-		expand(text.size()+9);
-		write((uint32_t)0xD812C8F5, o.offset_);
-		write((uint32_t)text.size(), o.offset_+4);
-		memcpy(data+o.offset_+8, text.data(), text.size());
-		data[o.offset_+8+text.size()] = 0;
+		o.offset_ = constructObject_(TEXTMAGIC, text.data(), text.size(), true) - 8;
 		return o;
 	}
 
 	BytesOut constructBytes(const void * data, size_t size) {
 		BytesOut o;
-		o.offset_ = this->size;
-		expand(size+8);
-		write((uint32_t)0xDCDBBE10, o.offset_);
-		write((uint32_t)size, o.offset_+4);
-		memcpy(this->data+o.offset_+8, data, size);
+		o.offset_ = constructObject_(BYTESMAGIC, (const char *)data, size, false) - 8;
 		return o;
 	}
 
@@ -720,7 +1782,7 @@ public:
 	template <typename T>
 	ListOut<T> constructList(size_t size) {
 		using A = ListAccess<T>;
-		ListOut<T> o(*this, this->size, size);
+		ListOut<T> o(*this, align_(), size);
 		expand(computeSize<A::mult>(size)+8);
 		write((uint32_t)0x3400BB46, o.offset_);
 		write((uint32_t)size, o.offset_+4);
@@ -729,20 +1791,292 @@ public:
 		return o;
 	}
 
+	/**
+	 * Construct a columnar list of size tables, T is the generated
+	 * columns writer of the table
+	 */
+	template <typename T>
+	T constructColumns(size_t size) {
+		return T(*this, true, size);
+	}
+
+	/**
+	 * Construct a packed list of the count integers at values. Every value
+	 * is stored as a varint of the zigzag encoded difference to the
+	 * previous value, so sorted or clustered values take few bytes each
+	 */
+	template <typename T>
+	PackedListOut<T> constructPackedList(const T * values, size_t count) {
+		static_assert(std::is_integral_v<T> && !std::is_same_v<T, bool>);
+		PackedListOut<T> o(align_());
+		// Reserve room for the largest encoding and give back what is unused
+		expand(12 + 10 * count);
+		write(LISTMAGIC, o.offset_);
+		write((uint32_t)count, o.offset_+4);
+		std::uint8_t * cur = reinterpret_cast<std::uint8_t *>(data + o.offset_ + 12);
+		std::uint64_t prev = 0;
+		for (size_t i=0; i < count; ++i) {
+			std::uint64_t v = std::uint64_t(values[i]);
+			std::uint64_t d = v - prev;
+			prev = v;
+			d = (d << 1) ^ -(d >> 63);
+			while (d >= 0x80) {
+				*cur++ = std::uint8_t(d) | 0x80;
+				d >>= 7;
+			}
+			*cur++ = std::uint8_t(d);
+		}
+		size = reinterpret_cast<char *>(cur) - data;
+		write((uint32_t)(size - o.offset_ - 12), o.offset_+8);
+		o.offset_ += 8;
+		return o;
+	}
+
+	/**
+	 * Construct a copy of a packed list, without decoding it
+	 */
+	template <typename T>
+	PackedListOut<T> constructPackedList(PackedListIn<T> in) {
+		PackedListOut<T> o(align_());
+		size_t bytes = in.stop_ - in.start_;
+		expand(12 + bytes);
+		write(LISTMAGIC, o.offset_);
+		write((uint32_t)in.size_, o.offset_+4);
+		write((uint32_t)bytes, o.offset_+8);
+		memcpy(data + o.offset_ + 12, in.start_, bytes);
+		o.offset_ += 8;
+		return o;
+	}
+
+	/**
+	 * Construct a dictionary encoded list of the count texts at values.
+	 * Every distinct text is written once, and every element as a code of
+	 * 1, 2 or 4 bytes depending on the number of distinct texts
+	 */
+	DictionaryListOut constructDictionaryList(const std::string_view * values, size_t count) {
+		std::unordered_map<std::string_view, std::uint32_t> index;
+		std::vector<std::string_view> texts;
+		std::vector<std::uint32_t> codes(count);
+		for (size_t i=0; i < count; ++i) {
+			auto [it, inserted] = index.emplace(values[i], (std::uint32_t)texts.size());
+			if (inserted) texts.push_back(values[i]);
+			codes[i] = it->second;
+		}
+		auto dictionary = constructList<TextOut>(texts.size());
+		for (size_t i=0; i < texts.size(); ++i)
+			dictionary[i] = constructText(texts[i]);
+		std::uint32_t width = texts.size() <= 0x100 ? 1 : texts.size() <= 0x10000 ? 2 : 4;
+		DictionaryListOut o(dictionaryList_(dictionary.offset_, count, width));
+		for (size_t i=0; i < count; ++i)
+			memcpy(data + o.offset_ + 8 + i * width, &codes[i], width);
+		return o;
+	}
+
+	/**
+	 * Construct a copy of a dictionary encoded list, copying its codes
+	 * without looking at them
+	 */
+	DictionaryListOut constructDictionaryList(DictionaryListIn in) {
+		auto dictionary = constructList<TextOut>(in.dictionary_.size());
+		dictionary.copy_(in.dictionary_);
+		DictionaryListOut o(dictionaryList_(dictionary.offset_, in.size_, in.width_));
+		memcpy(data + o.offset_ + 8, in.start_, std::uint64_t(in.size_) * in.width_);
+		return o;
+	}
+
+	/**
+	 * Construct a map of the count pairs of keys and values at items,
+	 * stored as an open addressing hash table that MapIn looks keys up in
+	 * directly. K is std::string_view or an integer type, and V the type of
+	 * the values as in ListOut. The keys must be distinct. The texts of the
+	 * keys are written before the map, in order
+	 */
+	template <typename K, typename V>
+	MapOut<K, V> constructMap(const std::pair<K, V> * items, size_t count) {
+		constexpr bool text = std::is_same_v<K, std::string_view>;
+		constexpr size_t keySize = text ? 4 : sizeof(K);
+		constexpr size_t slot = 4 + keySize + ListAccess<V>::mult;
+		std::vector<std::uint32_t> keys;
+		if constexpr (text) {
+			keys.reserve(count);
+			for (size_t i=0; i < count; ++i)
+				keys.push_back(pointer_(constructText(items[i].first).offset_));
+		}
+		// Keep at most three quarters of the slots used, so probes are short
+		size_t capacity = 1;
+		while (capacity * 3 < count * 4) capacity *= 2;
+		std::uint64_t o = align_();
+		expand(12 + capacity * slot);
+		write(MAPMAGIC, o);
+		write((uint32_t)capacity, o+4);
+		write((uint32_t)count, o+8);
+		char * slots = data + o + 12;
+		memset(slots, 0, capacity * slot);
+		for (size_t i=0; i < count; ++i) {
+			std::uint32_t hash = mapHash(items[i].first);
+			size_t index = hash & (capacity - 1);
+			for (std::uint32_t tag;; index = (index + 1) & (capacity - 1)) {
+				memcpy(&tag, slots + index * slot, 4);
+				if (tag == 0) break;
+			}
+			char * s = slots + index * slot;
+			memcpy(s, &hash, 4);
+			if constexpr (text)
+				memcpy(s + 4, &keys[i], 4);
+			else
+				memcpy(s + 4, &items[i].first, sizeof(K));
+			mapValue_(s + 4 + keySize, items[i].second);
+		}
+		return MapOut<K, V>(o + 8);
+	}
+
+	/**
+	 * Construct a copy of a map, writing copies of the texts, bytes and
+	 * tables it refers to. V is the type of the values written
+	 */
+	template <typename K, typename V, typename I>
+	MapOut<K, V> constructMap(MapIn<K, I> in) {
+		std::vector<std::pair<K, V> > items;
+		items.reserve(in.size());
+		for (auto [k, v]: in) items.emplace_back(k, copyMapValue_<V>(v));
+		return constructMap(items.data(), items.size());
+	}
+
 	ListOut<TextOut> constructTextList(size_t size) {return constructList<TextOut>(size);}
 	ListOut<BytesOut> constructBytesList(size_t size) {return constructList<BytesOut>(size);}
+
+	/**
+	 * Construct a builder for a list of T whose size is not known up front.
+	 * See ListBuilder
+	 */
+	template <typename T>
+	ListBuilder<T> constructListBuilder(size_t capacity=16) {
+		return ListBuilder<T>(*this, capacity);
+	}
+
+	inline ListBuilder<TextOut> constructTextListBuilder(size_t capacity=16);
+	inline ListBuilder<BytesOut> constructBytesListBuilder(size_t capacity=16);
+};
+
+/**
+ * Build a list by appending elements to it one at a time.
+ *
+ * The elements are stored in a buffer of the builder that doubles in size
+ * when full. finish() writes them to the writer as a single list of the right
+ * size, which can be given to the generated list setters. Lists of unions
+ * cannot be built this way
+ */
+template <typename T>
+class ListBuilder {
+	friend class Writer;
+	using A = ListAccess<T>;
+	using Tag = typename MetaMagic<T>::t;
+	static_assert(!std::is_same_v<Tag, UnionTag>, "Union lists can not be built by appending");
+	Writer & writer_;
+	std::vector<char> data_;
+	uint32_t size_ = 0;
+
+	ListBuilder(Writer & writer, size_t capacity): writer_(writer) {
+		data_.resize(computeSize<A::mult>(capacity ? capacity : 1), (char)A::def);
+	}
+
+	char * next_() {
+		size_t bytes = computeSize<A::mult>(size_ + 1);
+		if (bytes > data_.size()) data_.resize(std::max(bytes, data_.size() * 2), (char)A::def);
+		return data_.data() + computeSize<A::mult>(size_);
+	}
+
+	void pushOffset_(std::uint64_t o) {
+		std::uint32_t p = writer_.pointer_(o);
+		memcpy(next_(), &p, 4);
+		++size_;
+	}
+public:
+	using value_type = T;
+
+	uint32_t size() const noexcept {return size_;}
+
+	/**
+	 * Append value to the list. Texts and bytes may be given as
+	 * std::string_view and Bytes, in which case they are constructed
+	 */
+	template <typename V>
+	void push_back(const V & value) {
+		if constexpr (std::is_same_v<Tag, BoolTag>) {
+			next_();
+			if (value) data_[size_ >> 3] |= (char)(1 << (size_ & 7));
+			++size_;
+		} else if constexpr (std::is_same_v<Tag, PodTag> || std::is_same_v<Tag, EnumTag>) {
+			const T v = value;
+			memcpy(next_(), &v, sizeof(T));
+			++size_;
+		} else if constexpr (std::is_same_v<Tag, TextTag>) {
+			if constexpr (std::is_same_v<V, TextOut>) pushOffset_(value.offset_);
+			else pushOffset_(writer_.constructText(value).offset_);
+		} else if constexpr (std::is_same_v<Tag, BytesTag>) {
+			if constexpr (std::is_same_v<V, BytesOut>) pushOffset_(value.offset_);
+			else pushOffset_(writer_.constructBytes(value).offset_);
+		} else {
+			static_assert(std::is_same_v<V, T>, "Tables must be of the list type");
+			pushOffset_(value.offset_ - 8);
+		}
+	}
+
+	/**
+	 * Append an unset element to the list
+	 */
+	void skip() {
+		next_();
+		++size_;
+	}
+
+	/**
+	 * Construct a table and append it to the list
+	 */
+	T add() {
+		static_assert(A::hasAdd, "Only tables can be added");
+		T ans = writer_.construct<T>();
+		push_back(ans);
+		return ans;
+	}
+
+	/**
+	 * Write the elements to the writer as a list and return it.
+	 * Must be called exactly once
+	 */
+	ListOut<T> finish() {
+		size_t bytes = computeSize<A::mult>(size_);
+		ListOut<T> o(writer_, writer_.align_(), size_);
+		writer_.expand(bytes+8);
+		writer_.write(LISTMAGIC, o.offset_);
+		writer_.write(size_, o.offset_+4);
+		o.offset_ += 8;
+		memcpy(writer_.data+o.offset_, data_.data(), bytes);
+		std::vector<char>().swap(data_);
+		return o;
+	}
 };
 
+ListBuilder<TextOut> Writer::constructTextListBuilder(size_t capacity) {return constructListBuilder<TextOut>(capacity);}
+ListBuilder<BytesOut> Writer::constructBytesListBuilder(size_t capacity) {return constructListBuilder<BytesOut>(capacity);}
+
 class Out {
 protected:
 	friend class Writer;
+	friend class TableIn;
 
 	template <typename T>
-	static uint32_t getOffset_(const T & t) noexcept {return t.offset_;}
+	static std::uint64_t getOffset_(const T & t) noexcept {
+		if constexpr (std::is_base_of_v<TableOut, T>) t.checkLive_();
+		return t.offset_;
+	}
 
 	template <typename T, typename ... TT>
 	static T construct_(TT && ... vv) noexcept {return T(std::forward<TT>(vv)...);}
 
+	template <typename O>
+	static O copyTable_(Writer & writer, typename O::IN i) {return writer.copyTable_<O>(i);}
+
 	template <typename T>
 	static T addInplaceTable_(Writer & writer, size_t start) noexcept {
 		assert(writer.size == start);
@@ -762,6 +2096,12 @@ protected:
 		writer.data[start+str.size()] = 0;
 	}
 
+	template <typename T>
+	static T addInplaceColumns_(Writer & writer, size_t start, size_t size) noexcept {
+		assert(writer.size == start);
+		return T(writer, false, size);
+	}
+
 	template < typename T>
 	static ListOut<T> addInplaceList_(Writer & writer, size_t start, size_t size) noexcept {
 		assert(writer.size == start);
@@ -783,26 +2123,26 @@ protected:
 	friend class ListOut;
 
 	Writer & writer_;
-	uint32_t offset_;
+	std::uint64_t offset_;
 
 	void setType_(uint16_t type) noexcept {
 		writer_.write(type, offset_);
 	}
 
-	void setObject_(uint32_t p) noexcept {
-		writer_.write(p, offset_+2);
+	void setObject_(std::uint64_t offset) {
+		writer_.write(writer_.pointer_(offset), offset_+2);
 	}
 
-	UnionOut(Writer & writer, uint32_t offset): writer_(writer), offset_(offset) {}
-	UnionOut(Writer & writer, uint32_t offset, size_t index): writer_(writer), offset_(offset+index*6) {}
+	UnionOut(Writer & writer, std::uint64_t offset): writer_(writer), offset_(offset) {}
+	UnionOut(Writer & writer, std::uint64_t offset, size_t index): writer_(writer), offset_(offset+index*6) {}
 };
 
 class InplaceUnionOut: public Out {
 protected:
 	friend class Writer;
 	Writer & writer_;
-	uint32_t offset_;
-	uint32_t next_;
+	std::uint64_t offset_;
+	std::uint64_t next_;
 
 	void setType_(uint16_t type) noexcept {
 		writer_.write(type, offset_);
@@ -812,7 +2152,7 @@ protected:
 		writer_.write(size, offset_+2);
 	}
 
-	InplaceUnionOut(Writer & writer, uint32_t offset, uint32_t next): writer_(writer), offset_(offset), next_(next) {}
+	InplaceUnionOut(Writer & writer, std::uint64_t offset, std::uint64_t next): writer_(writer), offset_(offset), next_(next) {}
 };
 
 
@@ -820,11 +2160,20 @@ class TableOut : public Out {
 protected:
 	friend class Writer;
 	template <typename, typename> friend class ListAccessHelp;
+	template <typename> friend class ListBuilder;
+
+	friend class Out;
 
 	Writer & writer_;
-	uint32_t offset_;
+	std::uint64_t offset_;
+	// The number of rollbacks of the writer when the table was constructed
+	std::uint64_t rollbacks_;
+public:
+	// True for tables with inplace members
+	static constexpr bool INPLACE = false;
+protected:
 
-	TableOut(Writer & writer, bool withHeader, std::uint32_t magic, const char * def, std::uint32_t size): writer_(writer), offset_(writer.size) {
+	TableOut(Writer & writer, bool withHeader, std::uint32_t magic, const char * def, std::uint32_t size): writer_(writer), offset_(withHeader ? writer.align_() : writer.size), rollbacks_(writer.rollbackCount_) {
 		if (withHeader) {
 			writer_.expand(8);
 			writer_.write(magic, offset_);
@@ -835,71 +2184,191 @@ protected:
 		memcpy(writer_.data + offset_, def, size);
 	}
 
+	/**
+	 * Assert that the table is not removed by Writer::rollback
+	 */
+	void checkLive_() const noexcept {
+		assert(writer_.live_(offset_, rollbacks_) && "Use of a table removed by Writer::rollback");
+	}
+
 	template <typename T, uint32_t o>
 	void setInner_(const T & t) {
+		checkLive_();
 		writer_.write(t, offset_ + o);
 	}
 
+	template <uint32_t o>
+	void setPtr_(std::uint64_t offset) {
+		checkLive_();
+		writer_.write(writer_.pointer_(offset), offset_ + o);
+	}
+
+	template <typename I, auto key, auto has>
+	void sortOnFinalize_(std::uint64_t offset) {
+		writer_.sorted_.emplace_back(offset, &Writer::sortList_<I, key, has>);
+	}
+
+	/**
+	 * Called by copy_ after the members stored in the table are copied and
+	 * before the objects it points to are. When compacting, store the table,
+	 * the last object written, without its trailing default bytes.
+	 *
+	 * The pointers of i that are set are set in the copy later, so they are
+	 * kept as well. fields are the start and end of the members of more than
+	 * one byte, which are never cut
+	 */
+	template <std::uint32_t size>
+	void trimCopy_(const TableIn & i, const char * def,
+				   std::initializer_list<std::pair<std::uint32_t, std::uint32_t> > fields) {
+		if (!writer_.compact_ || writer_.size != offset_ + size) return;
+		const char * out = writer_.data + offset_;
+		std::uint32_t s = std::min(i.size_, size);
+		std::uint32_t n = size;
+		while (n && out[n-1] == def[n-1] && (n > s || i.start_[n-1] == def[n-1])) --n;
+		for (auto [start, end]: fields)
+			if (start < n && n < end) n = end;
+		writer_.write(n, offset_ - 4);
+		writer_.size = offset_ + n;
+	}
+
 	template <uint32_t o, uint8_t b>
 	void setBit_() {
+		checkLive_();
 		*(uint8_t *)(writer_.data + offset_ + o) |= (1 << b);
 	}
 
 	template <uint32_t o, uint8_t b>
 	void unsetBit_() {
+		checkLive_();
 		*(uint8_t *)(writer_.data + offset_ + o) &= ~(1 << b);
 	}
 
 	template <typename T, uint32_t offset>
 	T getInner_() const noexcept {
+		checkLive_();
 		T ans;
 		memcpy(&ans, writer_.data + offset_ + offset , sizeof(T));
 		return ans;
 	}
 };
 
+/**
+ * Base class for writing a columnar list of tables. See ColumnsIn.
+ *
+ * The generated subclasses return the columns as ListOut, and rows setting
+ * the members of a single table on indexing
+ */
+template <std::uint32_t ... widths>
+class ColumnsOut : public Out {
+protected:
+	friend class Out;
+	friend class Writer;
+	static constexpr size_t columns = sizeof...(widths);
+
+	Writer * writer_;
+	std::uint64_t offset_;
+	std::uint32_t size_;
+	std::array<std::uint64_t, columns + 1> offsets_;
+
+	/**
+	 * Write the columns, filling them with the default values def. These
+	 * are the concatenated default values of all columns that are not bits
+	 */
+	ColumnsOut(Writer & writer, bool withHeader, std::uint32_t size, const char * def): writer_(&writer), offset_(withHeader ? writer.align_() : writer.size), size_(size) {
+		constexpr std::uint32_t w[] = {widths...};
+		if (withHeader) {
+			writer.expand(8);
+			writer.write(LISTMAGIC, offset_);
+			writer.write(size, offset_+4);
+			offset_ += 8;
+		}
+		writer.expand(8);
+		writer.write((std::uint32_t)columns, offset_);
+		writer.write((std::uint32_t)0, offset_+4);
+		offsets_[0] = offset_ + 8;
+		for (size_t c=0; c < columns; ++c)
+			offsets_[c+1] = offsets_[c] + (w[c] ? (std::uint64_t)w[c] * size : ((std::uint64_t)size + 7) >> 3);
+		writer.expand(offsets_[columns] - offsets_[0]);
+		for (size_t c=0; c < columns; ++c) {
+			char * o = writer.data + offsets_[c];
+			if (w[c] == 0) {
+				memset(o, 0, offsets_[c+1] - offsets_[c]);
+				continue;
+			}
+			for (std::uint32_t i=0; i < size; ++i, o += w[c]) memcpy(o, def, w[c]);
+			def += w[c];
+		}
+	}
+
+	template <typename T, size_t c>
+	ListOut<T> column_() const noexcept {
+		return construct_<ListOut<T> >(*writer_, offsets_[c], size_);
+	}
+
+	template <typename T, size_t c>
+	void set_(std::uint32_t index, const T & value) noexcept {
+		if constexpr (std::is_same_v<T, bool>) {
+			char & byte = writer_->data[offsets_[c] + (index >> 3)];
+			byte = value ? byte | (1 << (index & 7)) : byte & ~(1 << (index & 7));
+		} else
+			memcpy(writer_->data + offsets_[c] + index * sizeof(T), &value, sizeof(T));
+	}
+public:
+	std::uint32_t size() const noexcept {return size_;}
+
+	void copy_(const ColumnsIn<widths...> & in) {
+		assert(in.size() == size());
+		memcpy(writer_->data + offsets_[0], in.start_, in.offsets_[std::min<size_t>(in.stored_, columns)]);
+	}
+};
+
 template <typename T>
-ListAccessHelp<BoolTag, T>::Setter::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index): byte(writer.data + offset + (index >> 3)), bit(index & 7) {}
+ListAccessHelp<BoolTag, T>::Setter::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index): byte(writer.data + offset + (index >> 3)), bit(index & 7) {}
 
 template <typename T>
-void ListAccessHelp<BoolTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<BoolTag, T>::copy(Writer & writer, std::uint64_t offset,
 			const Reader &, const char * start,
 			std::uint32_t size) {
 	memcpy(writer.data + offset, start, (size + 7) >> 3);
 }
 
 template <typename T>
-ListAccessHelp<PodTag, T>::Setter::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index) : location(writer.data + offset + index * sizeof(T)) {}
+ListAccessHelp<PodTag, T>::Setter::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index) : location(writer.data + offset + index * sizeof(T)) {}
 
 template <typename T>
-void ListAccessHelp<PodTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<PodTag, T>::copy(Writer & writer, std::uint64_t offset,
 					const Reader &, const char * start,
 					std::uint32_t size) {
 	memcpy(writer.data + offset, start, size * sizeof(T));
 }
 
 template <typename T>
-ListAccessHelp<EnumTag, T>::Setter ::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index) : location(writer.data + offset + index * sizeof(T)) {}
+ListAccessHelp<EnumTag, T>::Setter ::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index) : location(writer.data + offset + index * sizeof(T)) {}
 
 template <typename T>
-void ListAccessHelp<EnumTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<EnumTag, T>::copy(Writer & writer, std::uint64_t offset,
 				const Reader &, const char * start,
 				std::uint32_t size) {
 	memcpy(writer.data + offset, start, size*sizeof(T));
 }
 
 template <typename T>
-ListAccessHelp<TextTag, T>::Setter::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index) :  writer(writer), location(writer.data + offset + index * 4) {}
+ListAccessHelp<TextTag, T>::Setter::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index) :  writer(writer), location(writer.data + offset + index * 4) {}
 
 template <typename T>
-TextOut ListAccessHelp<TextTag, T>::Setter::operator=(std::string_view t) {
-	auto value = writer.constructText(t);
-	memcpy(location, &value.offset_, 4);
+T ListAccessHelp<TextTag, T>::Setter::operator=(const T & value) {
+	std::uint32_t p = writer.pointer_(value.offset_);
+	memcpy(location, &p, 4);
 	return value;
 }
 
 template <typename T>
-void ListAccessHelp<TextTag, T>::copy(Writer & writer, std::uint32_t offset, 
+TextOut ListAccessHelp<TextTag, T>::Setter::operator=(std::string_view t) {
+	return (*this) = writer.constructText(t);
+}
+
+template <typename T>
+void ListAccessHelp<TextTag, T>::copy(Writer & writer, std::uint64_t offset, 
 			const Reader & reader, const char * start, 
 			std::uint32_t size) {
 	for (size_t index=0; index < size; ++index) {
@@ -908,16 +2377,16 @@ void ListAccessHelp<TextTag, T>::copy(Writer & writer, std::uint32_t offset,
 		if (off == 0) continue;
 		auto t = getText_(reader, reader.getPtr_<TEXTMAGIC, 1, 1>(off));
 		auto v = writer.constructText(t);
-		uint32_t o = v.offset_;
+		uint32_t o = writer.pointer_(v.offset_);
 		memcpy(writer.data + offset + 4*index, &o, 4);
 	}
 }
 
 template <typename T>
-ListAccessHelp<BytesTag, T>::Setter::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index) : location(writer.data + offset + index * 4), writer(writer) {}
+ListAccessHelp<BytesTag, T>::Setter::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index) : location(writer.data + offset + index * 4), writer(writer) {}
 
 template <typename T>
-void ListAccessHelp<BytesTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<BytesTag, T>::copy(Writer & writer, std::uint64_t offset,
 			const Reader & reader, const char * start,
 			std::uint32_t size) {
 	for (size_t index=0; index < size; ++index) {
@@ -926,29 +2395,41 @@ void ListAccessHelp<BytesTag, T>::copy(Writer & writer, std::uint32_t offset,
 		if (off == 0) continue;
 		auto b = getBytes_(reader.getPtr_<BYTESMAGIC>(off));
 		auto v = writer.constructBytes(b.first, b.second);
-		uint32_t o = v.offset_;
+		uint32_t o = writer.pointer_(v.offset_);
 		memcpy(writer.data + offset + 4*index, &o, 4);
 	}
 }
 
 template <typename T>
-void ListAccessHelp<BytesTag, T>::Setter::operator=(Bytes bytes) noexcept {
+void ListAccessHelp<BytesTag, T>::Setter::operator=(const T & value) {
+	std::uint32_t p = writer.pointer_(value.offset_);
+	memcpy(location, &p, 4);
+}
+
+template <typename T>
+void ListAccessHelp<BytesTag, T>::Setter::operator=(Bytes bytes) {
 	(*this) = writer.constructBytes(bytes);	
 }
 
 template <typename T>
-ListAccessHelp<TableTag, T>::Setter::Setter(Writer & writer, std::uint32_t offset, std::uint32_t index) : location(writer.data + offset + index * 4) {}
+ListAccessHelp<TableTag, T>::Setter::Setter(Writer & writer, std::uint64_t offset, std::uint32_t index) : writer(writer), location(writer.data + offset + index * 4) {}
+
+template <typename T>
+void ListAccessHelp<TableTag, T>::Setter::operator=(const T & value) {
+	std::uint32_t p = writer.pointer_(value.offset_ - 8);
+	memcpy(location, &p, 4);
+}
 
 template <typename T>
-T ListAccessHelp<TableTag, T>::add(Writer & w, std::uint32_t offset, std::uint32_t index) {
+T ListAccessHelp<TableTag, T>::add(Writer & w, std::uint64_t offset, std::uint32_t index) {
 	auto ans = w.construct<T>();
-	uint32_t o = ans.offset_ - 8;
+	uint32_t o = w.pointer_(ans.offset_ - 8);
 	memcpy(w.data + offset + index * 4, &o, 4);
 	return ans;
 }
 
 template <typename T>
-void ListAccessHelp<TableTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<TableTag, T>::copy(Writer & writer, std::uint64_t offset,
 			const Reader & reader, const char * start,
 			std::uint32_t size) {
 	for (size_t index=0; index < size; ++index) {
@@ -956,15 +2437,14 @@ void ListAccessHelp<TableTag, T>::copy(Writer & writer, std::uint32_t offset,
 		memcpy(&off, start + index * 4, 4);
 		if (off == 0) continue;
 		auto t = getObject_<typename T::IN>(reader, reader.getPtr_<T::MAGIC>(off));
-		auto v = writer.construct<T>();
-		v.copy_(t);
-		uint32_t o = v.offset_;
+		auto v = writer.copyTable_<T>(t);
+		uint32_t o = writer.pointer_(v.offset_ - 8);
 		memcpy(writer.data + offset + 4*index, &o, 4);
 	}
 }
 
 template <typename T>
-void ListAccessHelp<UnionTag, T>::copy(Writer & writer, std::uint32_t offset,
+void ListAccessHelp<UnionTag, T>::copy(Writer & writer, std::uint64_t offset,
 			const Reader & reader, const char * start,
 			std::uint32_t size) {
 	for (size_t index=0; index < size; ++index) {
@@ -979,15 +2459,110 @@ void ListAccessHelp<UnionTag, T>::copy(Writer & writer, std::uint32_t offset,
 }
 
 Bytes Writer::finalize(const TableOut & root) {
-	write((std::uint32_t)0xB5C0C4B3, 0);
-	write(root.offset_ - 8, 4);
+	finalize_();
+	write(pointer_(root.offset_ - 8), 4);
 	return std::make_pair(data, size);
 }
 
+Bytes Writer::finalize() {
+	if (!appending_) throw std::logic_error("No root given");
+	return finalize_();
+}
+
+Bytes Writer::finalize_() {
+	// Sort every list before writing anything, so a list with an unset
+	// element or key leaves the writer unchanged
+	std::vector<std::vector<std::uint32_t> > sorted;
+	sorted.reserve(sorted_.size());
+	for (auto [offset, sort]: sorted_) sorted.push_back(sort(*this, offset));
+	write(shift ? LARGEMESSAGEMAGIC : MESSAGEMAGIC, 0);
+	for (size_t i=0; i < sorted.size(); ++i)
+		memcpy(data + sorted_[i].first, sorted[i].data(), sorted[i].size() * 4);
+	sorted_.clear();
+	// Cut a file continued in place to the message
+	if (remap_ && capacity != size) remap_(*this, size);
+	return std::make_pair(data, size);
+}
+
+#ifdef MAP_FAILED
+Writer Writer::openAppendFile(const char * path) {
+	int fd = ::open(path, O_RDWR);
+	if (fd == -1) throw std::system_error(errno, std::generic_category(), path);
+	struct stat st;
+	std::uint32_t magic = 0;
+	if (fstat(fd, &st) == -1 || (st.st_size >= 8 && pread(fd, &magic, 4, 0) != 4)) {
+		int e = errno;
+		::close(fd);
+		throw std::system_error(e, std::generic_category(), path);
+	}
+	if (magic != MESSAGEMAGIC && magic != LARGEMESSAGEMAGIC) {
+		::close(fd);
+		throw Error();
+	}
+	Writer w(0, magic == LARGEMESSAGEMAGIC);
+	w.fd_ = fd;
+	w.remap_ = [](Writer & o, size_t capacity) {
+		if (capacity == 0) {
+			if (o.data) munmap(o.data, o.capacity);
+			::close(o.fd_);
+			o.fd_ = -1;
+			return;
+		}
+		// Map the new size before unmapping, so a failure changes nothing
+		if (capacity > o.capacity && ftruncate(o.fd_, capacity) == -1)
+			throw std::system_error(errno, std::generic_category());
+		void * p = mmap(nullptr, capacity, PROT_READ | PROT_WRITE, MAP_SHARED, o.fd_, 0);
+		if (p == MAP_FAILED) throw std::system_error(errno, std::generic_category());
+		if (o.data) munmap(o.data, o.capacity);
+		bool shrink = capacity < o.capacity;
+		o.data = (char *)p;
+		o.capacity = capacity;
+		if (shrink && ftruncate(o.fd_, capacity) == -1)
+			throw std::system_error(errno, std::generic_category());
+	};
+	w.size = st.st_size;
+	w.remap_(w, st.st_size);
+	w.appending_ = true;
+	return w;
+}
+#endif
+
+template <typename T>
+std::uint64_t TableIn::outOffset_(const T & t) noexcept {
+	return Out::getOffset_(t);
+}
+
 template <typename O>
 void copy(O out, typename O::IN in) {
 	out.copy_(in);
 }
 
+/**
+ * Write the message of reader to writer with only the objects reachable from
+ * its root, a table written as O, in depth first order, and return it.
+ *
+ * Every table is stored without its trailing default bytes, which readers
+ * return when reading past the stored size. Tables with inplace members are
+ * stored in full. Tables pointed to more than once and identical texts and
+ * bytes are written once, lists pointed to more than once are written for
+ * every pointer. The writer is cleared first
+ */
+template <typename O>
+Bytes compact(const Reader & reader, Writer & writer) {
+	writer.clear();
+	writer.shift = reader.shift;
+	bool dedupe = writer.dedupe;
+	size_t dedupeLimit = writer.dedupeLimit;
+	writer.dedupe = true;
+	writer.dedupeLimit = std::numeric_limits<size_t>::max();
+	writer.compact_ = true;
+	auto root = writer.copyTable_<O>(reader.root<typename O::IN>());
+	writer.compact_ = false;
+	writer.compacted_.clear();
+	writer.dedupe = dedupe;
+	writer.dedupeLimit = dedupeLimit;
+	return writer.finalize(root);
+}
+
 } //namespace scalgoproto
 #endif //__SCALGOPROTO_HH__
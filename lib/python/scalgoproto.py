@@ -1,34 +1,85 @@
 # -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+import array
+import bisect
 import enum
+import gc
 import math
 import struct
+import sys
+import zlib
 from abc import abstractmethod
-from typing import Callable, ClassVar, Generic, Sequence, Tuple, Type, TypeVar, Union
+from typing import (
+    BinaryIO,
+    Callable,
+    ClassVar,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 MESSAGE_MAGIC = 0xB5C0C4B3
+LARGE_MESSAGE_MAGIC = 0x9C1A35E7
+# Pointers in large messages count units of 8 bytes instead of bytes
+LARGE_SHIFT = 3
+# Default number of bytes of texts and bytes a deduplicating Writer remembers
+DEDUPE_LIMIT = 1 << 20
 TEXT_MAGIC = 0xD812C8F5
 BYTES_MAGIC = 0xDCDBBE10
 LIST_MAGIC = 0x3400BB46
+MAP_MAGIC = 0x4FD9A3E6
+PATCH_MAGIC = 0x6A1F5E2D
+ARCHIVE_MAGIC = 0x2C7E91B4
 
 B = TypeVar("B")
 
 
 class StructType(Generic[B]):
     _WIDTH: ClassVar[int] = 0
+    _VIEW: ClassVar[type] = None
+    _DTYPE: ClassVar[dict] = {}
 
     @staticmethod
     @abstractmethod
     def _write(writer: "Writer", offset: int, value: B) -> B:
         ...
 
+    @staticmethod
+    @abstractmethod
+    def _read_into(reader: "Reader", offset: int, ins: B) -> B:
+        ...
+
+
+class StructView(object):
+    """Base class for reading the members of a struct on demand"""
+
+    __slots__ = ["_reader", "_offset"]
+    _WIDTH: ClassVar[int] = 0
+
+    def __init__(self, reader: "Reader", offset: int) -> None:
+        """Private constructor. Use struct_views on Reader to get instances"""
+        self._reader = reader
+        self._offset = offset
+
 
 TI = TypeVar("TI", bound="TableIn")
 TO = TypeVar("TO", bound="TableOut")
 UO = TypeVar("UO", bound="UnionOut")
+UI = TypeVar("UI", bound="UnionIn")
 E = TypeVar("E", bound=enum.IntEnum)
 S = TypeVar("S", bound=StructType)
 
 TT = TypeVar("TT")
+K = TypeVar("K")
+V = TypeVar("V")
 
 
 class Adder(Generic[B]):
@@ -50,6 +101,7 @@ class ListIn(Sequence[B]):
         offset: int,
         getter: Callable[["Reader", int, int], B],
         haser: Callable[["Reader", int, int], bool],
+        mover: Callable[["Reader", int, int, B], B] = None,
     ) -> None:
         """Private constructor. Use the accessor methods on tables to get an instance"""
         self._reader = reader
@@ -57,6 +109,7 @@ class ListIn(Sequence[B]):
         self._size = size
         self._getter = getter
         self._haser = haser
+        self._mover = mover
 
     def has(self, idx: int) -> bool:
         """Return True if there is an element on possision idx. Note that idx must be less than size"""
@@ -75,6 +128,542 @@ class ListIn(Sequence[B]):
     def __str__(self) -> str:
         return "[%s]" % (", ".join(map(str, self)))
 
+    def cursor(self) -> Iterator[Optional[B]]:
+        """Iterate over the list, yielding None for unset elements.
+
+        For lists of tables and structs a single object is yielded for all
+        elements, moved to the next element on every step, so a scan creates
+        O(1) objects. The object is only valid until the next step"""
+        r = self._reader
+        s = self._offset
+        getter = self._getter
+        haser = self._haser
+        mover = self._mover
+        cur = None
+        for i in range(self._size):
+            if not haser(r, s, i):
+                yield None
+            elif mover is None:
+                yield getter(r, s, i)
+            elif cur is None:
+                cur = getter(r, s, i)
+                yield cur
+            else:
+                yield mover(r, s, i, cur)
+
+
+class SortedListIn(ListIn[B], Generic[B, K]):
+    """A list of tables sorted by a member, declared as list T sorted by
+    member in the schema. Keys are found by binary search, reading only the
+    tables probed"""
+
+    def __init__(self, l: ListIn[B], key: Callable[[B], K]) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        super().__init__(l._reader, l._size, l._offset, l._getter, l._haser, l._mover)
+        self._key = key
+
+    def _key_at(self, idx: int) -> K:
+        return self._key(self._getter(self._reader, self._offset, idx))
+
+    def lower_bound(self, key: K) -> int:
+        """Return the index of the first element whose key is not less than key"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def upper_bound(self, key: K) -> int:
+        """Return the index of the first element whose key is greater than key"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._key_at(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def find(self, key: K) -> Optional[B]:
+        """Return the first element with the given key, or None if there is none"""
+        idx = self.lower_bound(key)
+        if idx == self._size:
+            return None
+        v = self._getter(self._reader, self._offset, idx)
+        return v if self._key(v) == key else None
+
+    def range(self, lo: K, hi: K) -> Iterator[B]:
+        """Iterate over the elements whose keys k satisfy lo <= k < hi"""
+        for idx in range(self.lower_bound(lo), self.lower_bound(hi)):
+            yield self._getter(self._reader, self._offset, idx)
+
+
+class StructListIn(ListIn[S]):
+    """Class for reading a list of structs S. The list can also be read as
+    numpy arrays sharing memory with the message"""
+
+    _dtypes: ClassVar[Dict[type, object]] = {}
+
+    def __init__(self, struct_type: Type[S], *args) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        super().__init__(*args)
+        self._struct = struct_type
+
+    def to_records(self) -> "numpy.ndarray":
+        """Return the list as a numpy structured array without copying.
+        Enums are represented by their integer values. Requires numpy"""
+        import numpy
+
+        dtype = StructListIn._dtypes.get(self._struct)
+        if dtype is None:
+            dtype = StructListIn._dtypes[self._struct] = numpy.dtype(
+                self._struct._DTYPE
+            )
+        return numpy.frombuffer(
+            self._reader._data, dtype=dtype, count=self._size, offset=self._offset
+        )
+
+    def struct_column(self, name: str) -> "numpy.ndarray":
+        """Return the member name of every struct in the list as a strided
+        numpy array without copying. Members of nested structs are named
+        like "s.x". Requires numpy"""
+        ans = self.to_records()
+        for part in name.split("."):
+            ans = ans[part]
+        return ans
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _pack_varints(values: Iterable[int]) -> Tuple[bytes, int]:
+    """Return the packed encoding of values and the number of values. Every
+    value is stored as the zigzag encoded difference to the previous value
+    modulo 2**64, written as a little endian base 128 varint"""
+    out = bytearray()
+    prev = 0
+    count = 0
+    for v in values:
+        v &= _MASK64
+        d = (v - prev) & _MASK64
+        if d >> 63:
+            d -= 1 << 64
+        z = (d << 1) ^ (d >> 63)
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+        prev = v
+        count += 1
+    return (bytes(out), count)
+
+
+class PackedListIn(Sequence[int]):
+    """Class for reading a packed list of integers.
+
+    The values are delta and varint encoded, so they are decoded in order.
+    Indexing decodes the whole list once, to_array and to_numpy decode it
+    in bulk"""
+
+    __slots__ = ["_reader", "_format", "_offset", "_size", "_values"]
+
+    def __init__(self, reader: "Reader", f: str, offset: int, size: int) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        self._reader = reader
+        self._format = f
+        self._offset = offset
+        self._size = size
+        self._values: List[int] = None
+
+    def _payload(self) -> Tuple[int, int]:
+        """Return the start and end of the encoded values"""
+        o = self._offset
+        n = struct.unpack("<I", self._reader._data[o : o + 4])[0]
+        return (o + 4, o + 4 + n)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        (start, end) = self._payload()
+        data = self._reader._data
+        bits = struct.calcsize(self._format) * 8
+        mask = (1 << bits) - 1
+        signed = self._format.islower()
+        v = 0
+        z = 0
+        shift = 0
+        for i in range(start, end):
+            b = data[i]
+            z |= (b & 0x7F) << shift
+            shift += 7
+            if b & 0x80:
+                continue
+            v = (v + ((z >> 1) ^ -(z & 1))) & _MASK64
+            ans = v & mask
+            yield ans - (1 << bits) if signed and ans >> (bits - 1) else ans
+            z = 0
+            shift = 0
+
+    def __getitem__(self, index: int) -> int:
+        if self._values is None:
+            self._values = list(self)
+        return self._values[index]
+
+    def to_array(self) -> array.array:
+        """Return the values as an array of the integer type of the list"""
+        return array.array(self._format, self)
+
+    def to_numpy(self) -> "numpy.ndarray":
+        """Return the values as a numpy array of the integer type of the
+        list, decoding them with vectorized operations. Requires numpy"""
+        import numpy
+
+        dtype = numpy.dtype("<" + self._format)
+        if self._size == 0:
+            return numpy.zeros(0, dtype=dtype)
+        (start, end) = self._payload()
+        b = numpy.frombuffer(
+            self._reader._data, dtype=numpy.uint8, count=end - start, offset=start
+        )
+        ends = numpy.flatnonzero(b < 0x80)
+        starts = numpy.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        shifts = (numpy.arange(len(b)) - numpy.repeat(starts, ends - starts + 1)) * 7
+        z = numpy.bitwise_or.reduceat(
+            (b & 0x7F).astype(numpy.uint64) << shifts.astype(numpy.uint64), starts
+        )
+        one = numpy.uint64(1)
+        d = (z >> one) ^ (numpy.uint64(0) - (z & one))
+        v = numpy.cumsum(d, dtype=numpy.uint64)
+        if dtype.kind == "i":
+            v = v.view(numpy.int64)
+        return v.astype(dtype)
+
+    def __str__(self) -> str:
+        return "[%s]" % (", ".join(map(str, self)))
+
+
+_CODE_FORMATS = {1: "B", 2: "H", 4: "I"}
+
+
+class DictionaryListIn(Sequence[str]):
+    """Class for reading a dictionary encoded list of texts.
+
+    Every distinct text is stored once in the dictionary, and the list
+    stores the index in the dictionary of the text of every element. The
+    codes can be grouped on without decoding any texts"""
+
+    __slots__ = ["_reader", "_offset", "_size", "_width", "_dictionary", "_texts"]
+
+    def __init__(self, reader: "Reader", offset: int, size: int) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        self._reader = reader
+        self._offset = offset
+        self._size = size
+        (ptr, self._width) = struct.unpack("<II", reader._data[offset : offset + 8])
+        if self._width not in _CODE_FORMATS:
+            raise Exception("Bad code width")
+        ptr <<= reader._shift
+        self._dictionary = reader._get_text_list(
+            ptr + 8, reader._read_size(ptr, LIST_MAGIC)
+        )
+        self._texts: List[Optional[str]] = None
+
+    @property
+    def dictionary(self) -> ListIn[str]:
+        """The distinct texts of the list"""
+        return self._dictionary
+
+    def _code(self, idx: int) -> int:
+        w = self._width
+        o = self._offset + 8 + idx * w
+        return struct.unpack("<" + _CODE_FORMATS[w], self._reader._data[o : o + w])[0]
+
+    def has(self, idx: int) -> bool:
+        """Return True if there is an element on possision idx. Note that idx must be less than size"""
+        return self._dictionary.has(self._code(idx))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError()
+        if self._texts is None:
+            d = self._dictionary
+            self._texts = [d[i] if d.has(i) else None for i in range(len(d))]
+        return self._texts[self._code(idx)]
+
+    def codes(self) -> array.array:
+        """Return the index in the dictionary of every element"""
+        ans = array.array(_CODE_FORMATS[self._width])
+        o = self._offset + 8
+        ans.frombytes(self._reader._data[o : o + self._size * self._width])
+        if sys.byteorder == "big":
+            ans.byteswap()
+        return ans
+
+    def codes_numpy(self) -> "numpy.ndarray":
+        """Return the index in the dictionary of every element as a numpy
+        array viewing the message without copying. Requires numpy"""
+        import numpy
+
+        return numpy.frombuffer(
+            self._reader._data,
+            dtype=numpy.dtype("<u%d" % self._width),
+            count=self._size,
+            offset=self._offset + 8,
+        )
+
+    def __str__(self) -> str:
+        return "[%s]" % (", ".join(map(str, self)))
+
+
+def _map_hash(key: Union[bytes, int]) -> int:
+    """Return the hash of a map key, given as the utf-8 encoding of a text or
+    as an integer. Texts are hashed with crc32 and integers with the
+    splitmix64 finalizer. The hash is never 0, which marks empty slots"""
+    if isinstance(key, bytes):
+        h = zlib.crc32(key)
+    else:
+        x = ((key & _MASK64) + 0x9E3779B97F4A7C15) & _MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+        h = (x ^ (x >> 31)) >> 32
+    return h or 1
+
+
+def _map_width(t: Union[str, type]) -> int:
+    """Return the number of bytes of a key or value of a map of type t"""
+    if t in ("text", "bytes"):
+        return 4
+    if isinstance(t, str):
+        return struct.calcsize("<" + t)
+    if issubclass(t, (TableIn, TableOut)):
+        return 4
+    return t._WIDTH
+
+
+class MapIn(Mapping[K, V]):
+    """Class for reading a map.
+
+    The map is stored as an open addressing hash table, so looking up a key
+    probes a few slots of the message without reading the rest of the map.
+    Iteration is in the order of the slots"""
+
+    __slots__ = ["_reader", "_key", "_value", "_offset", "_capacity", "_slot"]
+
+    def __init__(
+        self,
+        reader: "Reader",
+        key: str,
+        value: Union[str, type],
+        offset: int,
+        size: int,
+    ) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        if size == 0 or size & (size - 1):
+            raise Exception("Bad map capacity")
+        self._reader = reader
+        self._key = key
+        self._value = value
+        self._offset = offset
+        self._capacity = size
+        self._slot = 4 + _map_width(key) + _map_width(value)
+
+    def _find(self, key: K) -> int:
+        """Return the offset of the slot of key, or -1 if it is not in the map"""
+        r = self._reader
+        data = r._data
+        text = self._key == "text"
+        try:
+            k = key.encode("utf-8") if text else struct.pack("<" + self._key, key)
+        except (AttributeError, struct.error):
+            return -1
+        h = _map_hash(k if text else key)
+        mask = self._capacity - 1
+        i = h & mask
+        for _ in range(self._capacity):
+            o = self._offset + 4 + i * self._slot
+            tag = struct.unpack("<I", data[o : o + 4])[0]
+            if tag == 0:
+                return -1
+            if tag == h:
+                if not text:
+                    if data[o + 4 : o + 4 + len(k)] == k:
+                        return o
+                else:
+                    p = struct.unpack("<I", data[o + 4 : o + 8])[0] << r._shift
+                    n = r._read_size(p, TEXT_MAGIC)
+                    if data[p + 8 : p + 8 + n] == k:
+                        return o
+            i = (i + 1) & mask
+        return -1
+
+    def _key_at(self, o: int) -> K:
+        r = self._reader
+        if self._key != "text":
+            w = struct.calcsize("<" + self._key)
+            return struct.unpack("<" + self._key, r._data[o + 4 : o + 4 + w])[0]
+        p = struct.unpack("<I", r._data[o + 4 : o + 8])[0] << r._shift
+        n = r._read_size(p, TEXT_MAGIC)
+        return r._data[p + 8 : p + 8 + n].decode("utf-8")
+
+    def _value_at(self, o: int) -> V:
+        r = self._reader
+        t = self._value
+        o += 4 + _map_width(self._key)
+        if t in ("text", "bytes"):
+            p = struct.unpack("<I", r._data[o : o + 4])[0] << r._shift
+            n = r._read_size(p, TEXT_MAGIC if t == "text" else BYTES_MAGIC)
+            v = r._data[p + 8 : p + 8 + n]
+            return v.decode("utf-8") if t == "text" else v
+        if isinstance(t, str):
+            return struct.unpack("<" + t, r._data[o : o + struct.calcsize("<" + t)])[0]
+        if issubclass(t, TableIn):
+            p = struct.unpack("<I", r._data[o : o + 4])[0] << r._shift
+            return t(r, p + 8, r._read_size(p, t._MAGIC))
+        return t._read(r, o)
+
+    def __len__(self) -> int:
+        o = self._offset
+        return struct.unpack("<I", self._reader._data[o : o + 4])[0]
+
+    def __iter__(self) -> Iterator[K]:
+        data = self._reader._data
+        for i in range(self._capacity):
+            o = self._offset + 4 + i * self._slot
+            if data[o : o + 4] != b"\0\0\0\0":
+                yield self._key_at(o)
+
+    def __contains__(self, key: object) -> bool:
+        return self._find(key) >= 0
+
+    def __getitem__(self, key: K) -> V:
+        o = self._find(key)
+        if o < 0:
+            raise KeyError(key)
+        return self._value_at(o)
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """Return the value of key, or default if key is not in the map"""
+        o = self._find(key)
+        return self._value_at(o) if o >= 0 else default
+
+    def __str__(self) -> str:
+        return "{%s}" % (", ".join("%s: %s" % (k, v) for (k, v) in self.items()))
+
+
+# Columnar lists start with the number of columns stored followed by four
+# zero bytes
+_COLUMNS_HEADER = struct.Struct("<II")
+
+
+def _column_starts(offset: int, size: int, widths: Sequence[int]) -> List[int]:
+    """Return the offsets of the columns of a columnar list of size rows
+    starting at offset, followed by the end of the list. A width of zero
+    denotes a column of bits"""
+    ans = [offset]
+    for w in widths:
+        offset += w * size if w else (size + 7) >> 3
+        ans.append(offset)
+    return ans
+
+
+def _column_defaults(
+    size: int, widths: Sequence[int], defaults: Sequence[bytes]
+) -> bytes:
+    """Return columns of size rows filled with their default values"""
+    return b"".join(
+        d * size if w else b"\0" * ((size + 7) >> 3)
+        for (w, d) in zip(widths, defaults)
+    )
+
+
+class RowIn(object):
+    """Base class for reading a row of a columnar list of tables"""
+
+    __slots__ = ["_columns", "_index"]
+
+    def __init__(self, columns: "ColumnsIn", index: int) -> None:
+        """Private constructor. Index a ColumnsIn to get an instance"""
+        self._columns = columns
+        self._index = index
+
+    def _get(self, c: int, f: str, w: int) -> Union[int, float]:
+        columns = self._columns
+        return struct.unpack_from(
+            f, columns._reader._data, columns._starts[c] + self._index * w
+        )[0]
+
+    def _get_bit(self, c: int) -> bool:
+        columns = self._columns
+        i = self._index
+        return (columns._reader._data[columns._starts[c] + (i >> 3)] >> (i & 7)) & 1 != 0
+
+    def _get_struct(self, c: int, t: Type[S]) -> S:
+        columns = self._columns
+        return t._read(columns._reader, columns._starts[c] + self._index * t._WIDTH)
+
+
+RI = TypeVar("RI", bound=RowIn)
+
+
+class ColumnsIn(Sequence[RI]):
+    """Base class for reading a columnar list of tables.
+
+    Every member of the tables is stored in a column of its own. The
+    generated properties return the columns as lists, and indexing returns a
+    row reading the members of a single table"""
+
+    __slots__ = ["_reader", "_offset", "_size", "_starts"]
+    _WIDTHS: ClassVar[Tuple[int, ...]] = ()
+    _DEFAULTS: ClassVar[Tuple[bytes, ...]] = ()
+    _ROW: ClassVar[type] = RowIn
+
+    def __init__(self, reader: "Reader", offset: int, size: int) -> None:
+        """Private constructor. Use the accessor methods on tables to get an instance"""
+        columns = _COLUMNS_HEADER.unpack_from(reader._data, offset)[0]
+        if columns < len(self._WIDTHS):
+            # Written with a schema of fewer members, give the members not
+            # stored their default values
+            end = _column_starts(offset, size, self._WIDTHS[:columns])[-1]
+            end += _COLUMNS_HEADER.size
+            reader = Reader(
+                bytes(reader._data[offset:end])
+                + _column_defaults(
+                    size, self._WIDTHS[columns:], self._DEFAULTS[columns:]
+                ),
+                reader._struct_views,
+            )
+            offset = 0
+        self._reader = reader
+        self._offset = offset
+        self._size = size
+        self._starts = _column_starts(
+            offset + _COLUMNS_HEADER.size, size, self._WIDTHS
+        )
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, idx: int) -> RI:
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError()
+        return self._ROW(self, idx)
+
+    def __str__(self) -> str:
+        return "[%s]" % (", ".join(map(str, self)))
+
 
 class UnionIn(object):
     __slots__ = ["_reader", "_type", "_offset", "_size"]
@@ -89,7 +678,8 @@ class UnionIn(object):
     def _get_ptr(self, magic: int) -> Tuple[int, int]:
         if self._size:
             return (self._offset, self._size)
-        return (self._offset + 8, self._reader._read_size(self._offset, magic))
+        off = self._offset << self._reader._shift
+        return (off + 8, self._reader._read_size(off, magic))
 
 
 class TableIn(object):
@@ -207,7 +797,7 @@ class TableIn(object):
         )
 
     def _get_ptr(self, o: int, magic: int) -> Tuple[int, int]:
-        off = self._get_uint32_f(o)
+        off = self._get_uint32_f(o) << self._reader._shift
         size = self._reader._read_size(off, magic)
         return (off + 8, size)
 
@@ -215,13 +805,87 @@ class TableIn(object):
         size = self._get_uint32_f(o)
         return (self._offset + self._size, size)
 
+    def _get_compressed_bytes(self, o: int) -> bytes:
+        return self._reader._decompress(*self._get_ptr(o, BYTES_MAGIC))
+
+
+class TableMut(TableIn):
+    """Base class for changing the members of fixed size of a table in place,
+    in a message read from writable data like a bytearray or a writable mmap.
+
+    Only members stored in the table can be changed. Tables written by older
+    schemas may be shorter, then the message must be copied instead"""
+
+    __slots__ = []
+
+    def _pack(self, o: int, fmt: str, v) -> None:
+        if o + struct.calcsize(fmt) > self._size:
+            raise Exception("The member is not stored in the table")
+        struct.pack_into(fmt, self._reader._data, self._offset + o, v)
+
+    def _set_int8(self, o: int, v: int) -> None:
+        self._pack(o, "<b", v)
+
+    def _set_uint8(self, o: int, v: int) -> None:
+        self._pack(o, "<B", v)
+
+    def _set_int16(self, o: int, v: int) -> None:
+        self._pack(o, "<h", v)
+
+    def _set_uint16(self, o: int, v: int) -> None:
+        self._pack(o, "<H", v)
+
+    def _set_int32(self, o: int, v: int) -> None:
+        self._pack(o, "<i", v)
+
+    def _set_uint32(self, o: int, v: int) -> None:
+        self._pack(o, "<I", v)
+
+    def _set_int64(self, o: int, v: int) -> None:
+        self._pack(o, "<q", v)
+
+    def _set_uint64(self, o: int, v: int) -> None:
+        self._pack(o, "<Q", v)
+
+    def _set_float32(self, o: int, v: float) -> None:
+        self._pack(o, "<f", v)
+
+    def _set_float64(self, o: int, v: float) -> None:
+        self._pack(o, "<d", v)
+
+    def _set_bit(self, o: int, b: int, v: bool) -> None:
+        if o >= self._size:
+            raise Exception("The member is not stored in the table")
+        d = self._reader._data
+        if v:
+            d[self._offset + o] |= 1 << b
+        else:
+            d[self._offset + o] &= ~(1 << b)
+
+    def _set_ptr(self, o: int, offset: int) -> None:
+        """Point at the object whose content starts at offset"""
+        self._set_uint32(o, (offset - 8) >> self._reader._shift)
+
+    def _set_struct(self, o: int, s: Type[S], v: S) -> None:
+        if o + s._WIDTH > self._size:
+            raise Exception("The member is not stored in the table")
+        # Structs are written through the _data of the writer
+        s._write(self._reader, self._offset + o, v)
+
 
 class Reader(object):
     """Responsible for reading a message"""
 
-    def __init__(self, data: bytes) -> None:
-        """data is the message to read from"""
+    def __init__(self, data: bytes, struct_views: bool = False) -> None:
+        """data is the message to read from. If struct_views is true lists of
+        structs return views reading members on demand instead of structs"""
         self._data = data
+        self._struct_views = struct_views
+        self._shift = 0
+        # Content of the compressed bytes read, by their offset
+        self._decompressed: Dict[int, bytes] = {}
+        if len(data) >= 4 and struct.unpack("<I", data[0:4])[0] == LARGE_MESSAGE_MAGIC:
+            self._shift = LARGE_SHIFT
 
     def _read_size(self, offset: int, magic: int):
         m, size = struct.unpack("<II", self._data[offset : offset + 8])
@@ -229,12 +893,29 @@ class Reader(object):
             raise Exception("Bad magic")
         return size
 
+    def _decompress(self, offset: int, size: int) -> bytes:
+        """Return the content of the compressed bytes of size bytes at
+        offset, decompressing them on the first call only"""
+        ans = self._decompressed.get(offset)
+        if ans is None:
+            ans = zlib.decompress(self._data[offset : offset + size])
+            self._decompressed[offset] = ans
+        return ans
+
     def _get_table_list(self, t: Type[TI], off: int, size: int) -> ListIn[TI]:
         def getter(r: "Reader", s: int, i: int) -> TI:
             ooo = struct.unpack("<I", r._data[s + 4 * i : s + 4 * i + 4])[0]
+            ooo <<= r._shift
             sss = r._read_size(ooo, t._MAGIC)
             return t(r, ooo + 8, sss)
 
+        def mover(r: "Reader", s: int, i: int, cur: TI) -> TI:
+            ooo = struct.unpack("<I", r._data[s + 4 * i : s + 4 * i + 4])[0]
+            ooo <<= r._shift
+            cur._size = r._read_size(ooo, t._MAGIC)
+            cur._offset = ooo + 8
+            return cur
+
         return ListIn[TI](
             self,
             size,
@@ -242,6 +923,7 @@ class Reader(object):
             getter,
             lambda r, s, i: struct.unpack("<I", r._data[s + 4 * i : s + 4 * i + 4])[0]
             != 0,
+            mover,
         )
 
     def _get_bool_list(self, off: int, size: int) -> ListIn[bool]:
@@ -277,13 +959,31 @@ class Reader(object):
             ),
         )
 
-    def _get_struct_list(self, t: Type[S], off: int, size: int) -> ListIn[S]:
-        return ListIn[S](
+    def _get_struct_list(self, t: Type[S], off: int, size: int) -> "StructListIn[S]":
+        if self._struct_views:
+            v = t._VIEW
+
+            def mover(r: "Reader", s: int, i: int, cur: StructView) -> StructView:
+                cur._offset = s + i * v._WIDTH
+                return cur
+
+            return StructListIn[S](
+                t,
+                self,
+                size,
+                off,
+                lambda r, s, i: v(r, s + i * v._WIDTH),
+                lambda r, s, i: True,
+                mover,
+            )
+        return StructListIn[S](
+            t,
             self,
             size,
             off,
             lambda r, s, i: t._read(r, s + i * t._WIDTH),
             lambda r, s, i: True,
+            lambda r, s, i, cur: t._read_into(r, s + i * t._WIDTH, cur),
         )
 
     def _get_enum_list(self, t: Type[E], off: int, size: int) -> ListIn[E]:
@@ -298,6 +998,7 @@ class Reader(object):
     def _get_text_list(self, off: int, size: int) -> ListIn[str]:
         def getter(r: "Reader", s: int, i: int) -> str:
             ooo = struct.unpack("<I", r._data[s + 4 * i : s + 4 * i + 4])[0]
+            ooo <<= r._shift
             sss = r._read_size(ooo, TEXT_MAGIC)
             return r._data[ooo + 8 : ooo + 8 + sss].decode("utf-8")
 
@@ -313,6 +1014,7 @@ class Reader(object):
     def _get_bytes_list(self, off: int, size: int) -> ListIn[bytes]:
         def getter(r: "Reader", s: int, i: int) -> bytes:
             ooo = struct.unpack("<I", r._data[s + 4 * i : s + 4 * i + 4])[0]
+            ooo <<= r._shift
             sss = r._read_size(ooo, BYTES_MAGIC)
             return r._data[ooo + 8 : ooo + 8 + sss]
 
@@ -325,10 +1027,33 @@ class Reader(object):
             != 0,
         )
 
+    def _get_union_list(self, t: Type[UI], off: int, size: int) -> ListIn[UI]:
+        def getter(r: "Reader", s: int, i: int) -> UI:
+            (type, offset) = struct.unpack("<HI", r._data[s + 6 * i : s + 6 * i + 6])
+            return t(r, type, offset)
+
+        def mover(r: "Reader", s: int, i: int, cur: UI) -> UI:
+            (cur._type, cur._offset) = struct.unpack(
+                "<HI", r._data[s + 6 * i : s + 6 * i + 6]
+            )
+            return cur
+
+        return ListIn[UI](
+            self,
+            size,
+            off,
+            getter,
+            lambda r, s, i: struct.unpack("<H", r._data[s + 6 * i : s + 6 * i + 2])[0]
+            != 0,
+            mover,
+        )
+
     def root(self, type: Type[TI]) -> TI:
         """Return root node of message, of type type"""
         magic, offset = struct.unpack("<II", self._data[0:8])
-        if magic != MESSAGE_MAGIC:
+        if magic == LARGE_MESSAGE_MAGIC:
+            offset <<= LARGE_SHIFT
+        elif magic != MESSAGE_MAGIC:
             raise Exception("Bad magic")
         size = self._read_size(offset, type._MAGIC)
         return type(self, offset + 8, size)
@@ -347,16 +1072,31 @@ class BytesOut(object):
 class TableOut(object):
     __slots__ = ["_writer", "_offset"]
     _MAGIC: ClassVar[int] = 0
+    _DEFAULT: ClassVar[bytes] = b""
+    # True for tables with inplace members
+    _INPLACE: ClassVar[bool] = False
+    # The type reading the table
+    _IN: ClassVar[type] = TableIn
 
     def __init__(self, writer: "Writer", with_weader: bool, default: bytes) -> None:
         """Private constructor. Use factory methods on writer"""
         self._writer = writer
+        if with_weader:
+            writer._align()
         self._writer._reserve(len(default) + 8)
         if with_weader:
             writer._write(struct.pack("<II", self._MAGIC, len(default)))
         self._offset = writer._used
         writer._write(default)
 
+    @classmethod
+    def _at(cls: Type[TO], writer: "Writer", offset: int) -> TO:
+        """Return a handle for an already written table at offset"""
+        res = cls.__new__(cls)
+        res._writer = writer
+        res._offset = offset
+        return res
+
     def _set_int8(self, o: int, v: int) -> None:
         self._writer._put(self._offset + o, struct.pack("<b", v))
 
@@ -394,20 +1134,56 @@ class TableOut(object):
         self._writer._data[self._offset + o] &= ~(1 << b)
 
     def _set_table(self, o: int, v: TO) -> None:
-        self._writer._put(self._offset + o, struct.pack("<I", v._offset - 8))
+        self._writer._put(self._offset + o, self._writer._pack_ptr(v._offset))
 
     def _set_text(self, o: int, v: Union[TextOut, str]) -> None:
         if not isinstance(v, TextOut):
             v = self._writer.construct_text(v)
-        self._writer._put(self._offset + o, struct.pack("<I", v._offset - 8))
+        self._writer._put(self._offset + o, self._writer._pack_ptr(v._offset))
 
     def _set_bytes(self, o: int, v: Union[BytesOut, bytes]) -> None:
         if not isinstance(v, BytesOut):
             v = self._writer.construct_bytes(v)
-        self._writer._put(self._offset + o, struct.pack("<I", v._offset - 8))
+        self._writer._put(self._offset + o, self._writer._pack_ptr(v._offset))
+
+    def _set_compressed_bytes(self, o: int, v: bytes) -> None:
+        self._set_bytes(o, self._writer.construct_compressed_bytes(v))
 
     def _set_list(self, o: int, v: "OutList") -> None:
-        self._writer._put(self._offset + o, struct.pack("<I", v._offset - 8))
+        self._writer._put(self._offset + o, self._writer._pack_ptr(v._offset))
+
+    def _set_sorted_list(
+        self, o: int, v: "TableListOut", t: Type[TI], key: Callable[[TI], K]
+    ) -> None:
+        self._set_list(o, v)
+        self._writer._sorted.append((v._offset, v._size, t, key))
+
+    def _set_packed_list(
+        self, o: int, v: Union["PackedListOut", PackedListIn, Iterable[int]]
+    ) -> None:
+        if not isinstance(v, PackedListOut):
+            v = self._writer.construct_packed_list(v)
+        self._set_list(o, v)
+
+    def _set_dictionary_list(
+        self,
+        o: int,
+        v: Union["DictionaryListOut", DictionaryListIn, Iterable[Optional[str]]],
+    ) -> None:
+        if not isinstance(v, DictionaryListOut):
+            v = self._writer.construct_dictionary_list(v)
+        self._set_list(o, v)
+
+    def _set_map(
+        self,
+        o: int,
+        v: Union["MapOut", MapIn, Mapping],
+        key: str,
+        value: Union[str, type],
+    ) -> None:
+        if not isinstance(v, MapOut):
+            v = self._writer.construct_map(key, value, v)
+        self._writer._put(self._offset + o, self._writer._pack_ptr(v._offset))
 
     def _get_uint16(self, o: int) -> int:
         return struct.unpack(
@@ -429,6 +1205,66 @@ class TableOut(object):
     def _set_inplace_list(self, o: int, size: int) -> None:
         self._writer._put(self._offset + o, struct.pack("<I", size))
 
+    def _trim(self, i: TableIn, fields: Tuple[Tuple[int, int], ...]) -> None:
+        """Called by _copy after the members stored in the table are copied
+        and before the objects it points to are. When compacting, store the
+        table, the last object written, without its trailing default bytes.
+
+        The pointers of i that are set are set in the copy later, so they are
+        kept as well. fields are the start and end of the members of more
+        than one byte, which are never cut"""
+        w = self._writer
+        d = self._DEFAULT
+        n = len(d)
+        if w._compacted is None or w._used != self._offset + n:
+            return
+        out = w._data
+        o = self._offset
+        src = i._reader._data
+        s = min(i._size, n)
+        while (
+            n
+            and out[o + n - 1] == d[n - 1]
+            and (n > s or src[i._offset + n - 1] == d[n - 1])
+        ):
+            n -= 1
+        for (start, end) in fields:
+            if start < n < end:
+                n = end
+        w._put(o - 4, struct.pack("<I", n))
+        w._used = o + n
+
+
+class TablesOut(Sequence[TO]):
+    """Tables of the same type written next to each other by
+    Writer.construct_tables. Handles for the tables are created when accessed"""
+
+    def __init__(self, writer: "Writer", t: Type[TO], offset: int, size: int) -> None:
+        """Private constructor. Use factory methods on writer"""
+        self._writer = writer
+        self._t = t
+        self._offset = offset
+        self._size = size
+        self._stride = len(t._DEFAULT) + 8
+        self._stride += -self._stride & ((1 << writer._shift) - 1)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> TO:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("Table index out of range")
+        return self._t._at(self._writer, self._offset + index * self._stride)
+
+    def _pointers(self) -> range:
+        """Return the encoded pointers to every table"""
+        shift = self._writer._shift
+        start = (self._offset - 8) >> shift
+        stride = self._stride >> shift
+        return range(start, start + self._size * stride, stride)
+
 
 class UnionOut(object):
     __slots__ = ["_writer", "_offset", "_end"]
@@ -441,15 +1277,19 @@ class UnionOut(object):
     def _set(self, idx: int, offset: int) -> None:
         self._writer._put(self._offset, struct.pack("<HI", idx, offset))
 
+    def _set_ptr(self, idx: int, offset: int) -> None:
+        """Point at the object whose content starts at offset"""
+        self._set(idx, (offset - 8) >> self._writer._shift)
+
     def _set_text(self, idx: int, v: Union[TextOut, str]) -> None:
         if not isinstance(v, TextOut):
             v = self._writer.construct_text(v)
-        self._set(idx, v._offset - 8)
+        self._set_ptr(idx, v._offset)
 
     def _set_bytes(self, idx: int, v: Union[BytesOut, bytes]) -> None:
         if not isinstance(v, BytesOut):
             v = self._writer.construct_bytes(v)
-        self._set(idx, v._offset - 8)
+        self._set_ptr(idx, v._offset)
 
     def _add_inplace_text(self, idx: int, v: str) -> None:
         assert self._writer._used == self._end
@@ -459,6 +1299,13 @@ class UnionOut(object):
         self._writer._write(tt)
         self._writer._write(b"\0")
 
+    def _add_inplace_bytes(self, idx: int, v: bytes) -> None:
+        assert self._writer._used == self._end
+        self._set(idx, len(v))
+        self._writer._reserve(len(v))
+        self._writer._write(v)
+
+
 class OutList:
     _offset: int = 0
     _size: int = 0
@@ -468,6 +1315,8 @@ class OutList:
     ) -> None:
         """Private constructor. Use factory methods on writer"""
         self._writer = writer
+        if with_weader:
+            writer._align()
         writer._reserve(len(d) + 8)
         if with_weader:
             writer._write(struct.pack("<II", LIST_MAGIC, size))
@@ -478,6 +1327,10 @@ class OutList:
     def __len__(self):
         return self._size
 
+    def _copy_raw(self, i: ListIn, width: int) -> None:
+        assert len(i) == self._size
+        self._writer._put(self._offset, i._reader._data[i._offset : i._offset + width])
+
 
 class BasicListOut(OutList, Generic[B]):
     def __init__(
@@ -493,6 +1346,9 @@ class BasicListOut(OutList, Generic[B]):
         assert 0 <= index < self._size
         self._writer._put(self._offset + index * self._w, struct.pack(self._e, value))
 
+    def _copy(self, i: ListIn[B]) -> None:
+        self._copy_raw(i, self._size * self._w)
+
 
 class BoolListOut(OutList):
     def __init__(self, writer: "Writer", size: int, with_header: bool = True) -> None:
@@ -507,6 +1363,9 @@ class BoolListOut(OutList):
         else:
             self._writer._data[self._offset + (index >> 3)] &= ~(1 << (index & 7))
 
+    def _copy(self, i: ListIn[bool]) -> None:
+        self._copy_raw(i, (self._size + 7) >> 3)
+
 
 class EnumListOut(OutList, Generic[E]):
     def __init__(
@@ -519,6 +1378,9 @@ class EnumListOut(OutList, Generic[E]):
         """Add value to list at index"""
         self._writer._put(self._offset + index, struct.pack("B", int(value)))
 
+    def _copy(self, i: ListIn[E]) -> None:
+        self._copy_raw(i, self._size)
+
 
 class StructListOut(OutList, Generic[S]):
     def __init__(
@@ -533,6 +1395,9 @@ class StructListOut(OutList, Generic[S]):
         assert 0 <= index < self._size
         self._s._write(self._writer, self._offset + index * self._s._WIDTH, value)
 
+    def _copy(self, i: ListIn[S]) -> None:
+        self._copy_raw(i, self._size * self._s._WIDTH)
+
 
 class TableListOut(OutList, Generic[TO]):
     def __init__(
@@ -546,7 +1411,9 @@ class TableListOut(OutList, Generic[TO]):
         """Add value to list at index"""
         assert 0 <= index < self._size
         assert isinstance(value, self.table)
-        self._writer._put(self._offset + index * 4, struct.pack("I", value._offset - 8))
+        self._writer._put(
+            self._offset + index * 4, self._writer._pack_ptr(value._offset)
+        )
 
     def add(self, index: int) -> TO:
         assert 0 <= index < self._size
@@ -554,6 +1421,20 @@ class TableListOut(OutList, Generic[TO]):
         self[index] = res
         return res
 
+    def add_all(self) -> TablesOut[TO]:
+        """Construct a table for every index in the list"""
+        res = self._writer.construct_tables(self.table, self._size)
+        self._writer._put(
+            self._offset, struct.pack("<%dI" % self._size, *res._pointers())
+        )
+        return res
+
+    def _copy(self, i: ListIn[TI]) -> None:
+        assert len(i) == self._size
+        for index in range(self._size):
+            if i.has(index):
+                self[index] = self._writer.copy(self.table, i[index])
+
 
 class TextListOut(OutList):
     def __init__(self, writer: "Writer", size: int, with_header: bool = True) -> None:
@@ -565,19 +1446,36 @@ class TextListOut(OutList):
         assert 0 <= index < self._size
         if not isinstance(value, TextOut):
             value = self._writer.construct_text(value)
-        self._writer._put(self._offset + index * 4, struct.pack("I", value._offset - 8))
+        self._writer._put(
+            self._offset + index * 4, self._writer._pack_ptr(value._offset)
+        )
 
+    def _copy(self, i: ListIn[str]) -> None:
+        assert len(i) == self._size
+        for index in range(self._size):
+            if i.has(index):
+                self[index] = i[index]
 
-class BytesListOut(OutList, Generic[TO]):
+
+class BytesListOut(OutList):
     def __init__(self, writer: "Writer", size: int, with_header: bool = True) -> None:
         """Private constructor. Use factory methods on writer"""
         super().__init__(writer, b"\0\0\0\0" * size, size, with_header)
 
-    def __setitem__(self, index: int, value: TO) -> None:
+    def __setitem__(self, index: int, value: Union[BytesOut, bytes]) -> None:
         """Add value to list at index"""
         assert 0 <= index < self._size
-        assert isinstance(value, BytesOut)
-        self._writer._put(self._offset + index * 4, struct.pack("I", value._offset - 8))
+        if not isinstance(value, BytesOut):
+            value = self._writer.construct_bytes(value)
+        self._writer._put(
+            self._offset + index * 4, self._writer._pack_ptr(value._offset)
+        )
+
+    def _copy(self, i: ListIn[bytes]) -> None:
+        assert len(i) == self._size
+        for index in range(self._size):
+            if i.has(index):
+                self[index] = i[index]
 
 
 class UnionListOut(OutList, Generic[UO]):
@@ -591,14 +1489,276 @@ class UnionListOut(OutList, Generic[UO]):
     def __getitem__(self, index: int) -> B:
         return self._u(self._writer, self._offset + index * 6)
 
+    def _copy(self, i: ListIn[UI]) -> None:
+        assert len(i) == self._size
+        for index in range(self._size):
+            if i.has(index):
+                self[index]._copy(i[index])
+
+
+class PackedListOut(OutList):
+    def __init__(self, writer: "Writer", d: bytes, size: int) -> None:
+        """Private constructor. Use factory methods on writer"""
+        super().__init__(writer, struct.pack("<I", len(d)) + d, size, True)
+
+
+class DictionaryListOut(OutList):
+    def __init__(
+        self, writer: "Writer", dictionary: TextListOut, width: int, codes: bytes
+    ) -> None:
+        """Private constructor. Use factory methods on writer"""
+        d = writer._pack_ptr(dictionary._offset) + struct.pack("<I", width) + codes
+        super().__init__(writer, d, len(codes) // width, True)
+
+
+class MapOut(object):
+    def __init__(self, offset: int, size: int) -> None:
+        """Private constructor. Use factory methods on writer"""
+        self._offset = offset
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class RowOut(object):
+    """Base class for writing a row of a columnar list of tables"""
+
+    __slots__ = ["_columns", "_index"]
+
+    def __init__(self, columns: "ColumnsOut", index: int) -> None:
+        """Private constructor. Index a ColumnsOut to get an instance"""
+        self._columns = columns
+        self._index = index
+
+    def _set(self, c: int, f: str, w: int, value: Union[int, float]) -> None:
+        columns = self._columns
+        columns._writer._put(
+            columns._starts[c] + self._index * w, struct.pack(f, value)
+        )
+
+    def _set_bit(self, c: int, value: bool) -> None:
+        columns = self._columns
+        i = self._index
+        o = columns._starts[c] + (i >> 3)
+        if value:
+            columns._writer._data[o] |= 1 << (i & 7)
+        else:
+            columns._writer._data[o] &= ~(1 << (i & 7))
+
+    def _set_struct(self, c: int, t: Type[S], value: S) -> None:
+        columns = self._columns
+        t._write(columns._writer, columns._starts[c] + self._index * t._WIDTH, value)
+
+
+RO = TypeVar("RO", bound=RowOut)
+
+
+class ColumnsOut(Sequence[RO]):
+    """Base class for writing a columnar list of tables.
+
+    The generated setters assign a member of every table at once, and
+    indexing returns a row setting the members of a single table"""
+
+    __slots__ = ["_writer", "_offset", "_size", "_starts"]
+    _WIDTHS: ClassVar[Tuple[int, ...]] = ()
+    _DEFAULTS: ClassVar[Tuple[bytes, ...]] = ()
+    _ROW: ClassVar[type] = RowOut
+
+    def __init__(self, writer: "Writer", size: int, with_header: bool = True) -> None:
+        """Private constructor. Use factory methods on writer"""
+        d = _column_defaults(size, self._WIDTHS, self._DEFAULTS)
+        self._writer = writer
+        if with_header:
+            writer._align()
+        writer._reserve(len(d) + 16)
+        if with_header:
+            writer._write(struct.pack("<II", LIST_MAGIC, size))
+        self._offset = writer._used
+        self._size = size
+        writer._write(_COLUMNS_HEADER.pack(len(self._WIDTHS), 0))
+        self._starts = _column_starts(writer._used, size, self._WIDTHS)
+        writer._write(d)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> RO:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError()
+        return self._ROW(self, index)
+
+    def _set_column(self, c: int, f: str, values: Sequence[Union[int, float]]) -> None:
+        assert len(values) == self._size
+        self._writer._put(
+            self._starts[c], struct.pack("<%d%s" % (self._size, f), *values)
+        )
+
+    def _set_bit_column(self, c: int, values: Sequence[bool]) -> None:
+        assert len(values) == self._size
+        d = bytearray((self._size + 7) >> 3)
+        for (i, v) in enumerate(values):
+            if v:
+                d[i >> 3] |= 1 << (i & 7)
+        self._writer._put(self._starts[c], d)
+
+    def _set_struct_column(self, c: int, t: Type[S], values: Sequence[S]) -> None:
+        assert len(values) == self._size
+        o = self._starts[c]
+        for v in values:
+            t._write(self._writer, o, v)
+            o += t._WIDTH
+
+    def _copy(self, i: ColumnsIn) -> None:
+        assert len(i) == self._size
+        self._writer._put(
+            self._starts[0], i._reader._data[i._starts[0] : i._starts[-1]]
+        )
+
+
+CO = TypeVar("CO", bound=ColumnsOut)
+
+
+class ListBuilder(Generic[B]):
+    """Build a list of B whose size is not known up front by appending to it.
+
+    The elements are stored in a buffer of the builder that doubles in size
+    when full. finish writes them to the writer as a single list of the right
+    size. The builder can be given directly to the generated list setters,
+    which finish it"""
+
+    def __init__(
+        self,
+        writer: "Writer",
+        bits: int,
+        put: Callable[["ListBuilder[B]", int, B], None],
+        construct: Callable[[int], OutList],
+        default: int = 0,
+    ) -> None:
+        """Private constructor. Use factory methods on writer"""
+        self._writer = writer
+        self._bits = bits
+        self._put = put
+        self._construct = construct
+        self._default = default
+        self._data = bytearray([default]) * 64
+        self._size = 0
+        self._list: OutList = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self) -> None:
+        assert self._list is None, "The list has been finished"
+        if ((self._size + 1) * self._bits + 7) >> 3 > len(self._data):
+            self._data += bytearray([self._default]) * len(self._data)
+
+    def append(self, value: B) -> None:
+        """Add value to the end of the list"""
+        self._grow()
+        self._put(self, self._size, value)
+        self._size += 1
+
+    def skip(self) -> None:
+        """Add an unset element to the end of the list"""
+        self._grow()
+        self._size += 1
+
+    def extend(self, values: Iterable[B]) -> None:
+        """Add all values to the end of the list"""
+        for value in values:
+            self.append(value)
+
+    def finish(self) -> OutList:
+        """Write the list to the writer and return it"""
+        if self._list is None:
+            self._list = self._construct(self._size)
+            size = (self._size * self._bits + 7) >> 3
+            self._writer._put(self._list._offset, memoryview(self._data)[:size])
+            self._data = None
+        return self._list
+
+    @property
+    def _offset(self) -> int:
+        return self.finish()._offset
+
+
+class TableListBuilder(ListBuilder[TO]):
+    def __init__(self, writer: "Writer", t: Type[TO]) -> None:
+        """Private constructor. Use factory methods on writer"""
+        super().__init__(
+            writer,
+            32,
+            TableListBuilder._put_table,
+            lambda size: TableListOut[TO](writer, t, size),
+        )
+        self.table = t
+
+    @staticmethod
+    def _put_table(b: "TableListBuilder[TO]", index: int, value: TO) -> None:
+        assert isinstance(value, b.table)
+        b._data[index * 4 : index * 4 + 4] = b._writer._pack_ptr(value._offset)
+
+    def add(self) -> TO:
+        """Construct a table and add it to the end of the list"""
+        res = self._writer.construct_table(self.table)
+        self.append(res)
+        return res
+
+
+def _put_bool(b: ListBuilder[bool], index: int, value: bool) -> None:
+    if value:
+        b._data[index >> 3] |= 1 << (index & 7)
+
+
+def _put_enum(b: ListBuilder[E], index: int, value: E) -> None:
+    b._data[index] = int(value)
+
+
+def _put_text(b: ListBuilder[str], index: int, value: Union[TextOut, str]) -> None:
+    if not isinstance(value, TextOut):
+        value = b._writer.construct_text(value)
+    b._data[index * 4 : index * 4 + 4] = b._writer._pack_ptr(value._offset)
+
+
+def _put_bytes(
+    b: ListBuilder[bytes], index: int, value: Union[BytesOut, bytes]
+) -> None:
+    if not isinstance(value, BytesOut):
+        value = b._writer.construct_bytes(value)
+    b._data[index * 4 : index * 4 + 4] = b._writer._pack_ptr(value._offset)
+
+
+class _Removed(object):
+    """The writer and offset of handles of objects removed by
+    Writer.rollback, raising when used"""
+
+    def _fail(self, *args):
+        raise Exception("Use of an object removed by Writer.rollback")
+
+    __getattr__ = __add__ = __radd__ = __sub__ = __index__ = _fail
+
+
+_REMOVED = _Removed()
+
 
 class Writer:
     _data: bytearray = None
     _used: int = 0
+    _shift: int = 0
+    # While compacting the offsets of the tables copied by the offsets they
+    # are copied from, see compact
+    _compacted: Optional[Dict[int, int]] = None
 
     def _reserve(self, s: int):
         while self._used + s > len(self._data):
-            self._data += b"\0" * len(self._data)
+            if isinstance(self._data, bytearray):
+                self._data += b"\0" * len(self._data)
+            else:
+                # Growing the map of a file continued in place grows the file
+                self._data.resize(len(self._data) * 2)
 
     def _write(self, v: bytes):
         self._data[self._used : self._used + len(v)] = v
@@ -607,14 +1767,113 @@ class Writer:
     def _put(self, offset: int, value: bytes):
         self._data[offset : offset + len(value)] = value
 
-    def __init__(self):
+    def _align(self) -> None:
+        """Pad so the next object starts where a pointer can point"""
+        pad = -self._used & ((1 << self._shift) - 1)
+        if pad:
+            self._reserve(pad)
+            self._write(b"\0" * pad)
+
+    def _pack_ptr(self, offset: int) -> bytes:
+        """Return the encoding of a pointer to the object whose content
+        starts at offset"""
+        return struct.pack("<I", (offset - 8) >> self._shift)
+
+    def __init__(
+        self,
+        large: bool = False,
+        dedupe: bool = False,
+        dedupe_limit: int = DEDUPE_LIMIT,
+        debug: bool = False,
+    ):
+        """If large is true the message is written in the large format, where
+        pointers count units of 8 bytes. This allows messages of up to 32 GB
+        at the price of padding every object to 8 bytes.
+
+        If dedupe is true texts and bytes identical to an earlier one are not
+        written again, the earlier one is pointed to instead. The content of
+        at most dedupe_limit bytes of objects is remembered, forgetting the
+        oldest first.
+
+        If debug is true rollback makes the handles of the tables, lists and
+        unions it removes raise when used. This looks through every object
+        of the program on each rollback"""
         self._data = bytearray(b"\0" * 256)
         self._used = 8
+        self._shift = LARGE_SHIFT if large else 0
+        self._dedupe: Dict[Tuple[int, bytes], int] = {} if dedupe else None
+        self._dedupe_limit = dedupe_limit
+        self._dedupe_memory = 0
+        self._dedupe_report = {
+            "objects": 0,
+            "hits": 0,
+            "bytes_saved": 0,
+            "tables": 0,
+            "table_hits": 0,
+        }
+        self._interned: Dict[bytes, int] = {}
+        # Lists of tables to sort on finalize, see _sorted_pointers
+        self._sorted: List[Tuple[int, int, type, Callable]] = []
+        self._debug = debug
+        # True when continuing a message, whose root finalize may keep
+        self._appending = False
+
+    @classmethod
+    def open_append(cls, message: Union[bytes, BinaryIO]) -> "Writer":
+        """Return a writer continuing the finalized message, given as bytes
+        or a binary file holding only the message.
+
+        New objects are written after the message. They are pointed to from
+        its tables through the Mut type of the tables, see root. Finalizing
+        without a root keeps the root of the message.
+
+        A file opened for reading and writing, like open(path, "r+b"), is
+        continued in place: it is mapped into memory, the Mut types change
+        it where they write, new objects grow it, and finalize writes the
+        header and returns the map. This costs time linear in the size of
+        the additions and the pages touched. Other messages are copied in
+        full, and finalize returns all of it to be written out again"""
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            data = bytearray(message)
+        elif message.writable():
+            import mmap
+
+            message.flush()
+            data = mmap.mmap(message.fileno(), 0)
+        else:
+            data = bytearray(message.read())
+        magic = struct.unpack("<I", data[0:4])[0]
+        if magic not in (MESSAGE_MAGIC, LARGE_MESSAGE_MAGIC):
+            raise Exception("Bad magic")
+        w = cls(large=magic == LARGE_MESSAGE_MAGIC)
+        w._data = data
+        w._used = len(data)
+        w._appending = True
+        return w
+
+    def root(self, t: Type[TI]) -> TI:
+        """Return the root of a message continued with open_append, read
+        with t. If t is a Mut type the root is changed in place"""
+        return Reader(self._data).root(t)
 
     def construct_table(self, t: Type[TO]) -> TO:
         """Construct a table of the given type"""
         return t(self, True)
 
+    def construct_tables(self, t: Type[TO], size: int) -> TablesOut[TO]:
+        """Construct size tables of the given type with a single write"""
+        item = struct.pack("<II", t._MAGIC, len(t._DEFAULT)) + t._DEFAULT
+        item += b"\0" * (-len(item) & ((1 << self._shift) - 1))
+        self._align()
+        self._reserve(len(item) * size)
+        o = self._used + 8
+        self._write(item * size)
+        return TablesOut[TO](self, t, o, size)
+
+    def construct_columns(self, t: Type[CO], size: int) -> CO:
+        """Construct a columnar list of size tables of the given type"""
+        return t(self, size)
+
     def construct_int8_list(self, size: int) -> BasicListOut[int]:
         return BasicListOut[int](self, "b", 1, size)
 
@@ -666,28 +1925,641 @@ class Writer:
     def construct_union_list(self, u: Type[UO], size: int) -> UnionListOut[UO]:
         return UnionListOut[UO](self, u, size)
 
-    def construct_bytes(self, b: bytes) -> BytesOut:
-        self._reserve(len(b) + 8)
-        self._write(struct.pack("<II", BYTES_MAGIC, len(b)))
+    def construct_packed_list(
+        self, values: Union[PackedListIn, Iterable[int]]
+    ) -> PackedListOut:
+        """Construct a packed list of the integers values. The encoding is
+        the same for all integer types"""
+        if isinstance(values, PackedListIn):
+            (start, end) = values._payload()
+            d = bytes(values._reader._data[start:end])
+            return PackedListOut(self, d, len(values))
+        return PackedListOut(self, *_pack_varints(values))
+
+    def construct_dictionary_list(
+        self, values: Union[DictionaryListIn, Iterable[Optional[str]]]
+    ) -> DictionaryListOut:
+        """Construct a dictionary encoded list of the texts values, where None
+        is an unset element. Every distinct text is written once"""
+        if isinstance(values, DictionaryListIn):
+            dictionary = self.construct_text_list(len(values.dictionary))
+            dictionary._copy(values.dictionary)
+            o = values._offset + 8
+            codes = values._reader._data[o : o + len(values) * values._width]
+            return DictionaryListOut(self, dictionary, values._width, bytes(codes))
+        index: Dict[Optional[str], int] = {}
+        c = [index.setdefault(v, len(index)) for v in values]
+        dictionary = self.construct_text_list(len(index))
+        for (v, i) in index.items():
+            if v is not None:
+                dictionary[i] = v
+        width = 1 if len(index) <= 0x100 else 2 if len(index) <= 0x10000 else 4
+        codes = struct.pack("<%d%s" % (len(c), _CODE_FORMATS[width]), *c)
+        return DictionaryListOut(self, dictionary, width, codes)
+
+    def _map_value(self, t: Union[str, type], v):
+        """Return v as a value of a map of type t, writing the texts, bytes
+        and copies of tables it needs"""
+        if t == "text":
+            return v if isinstance(v, TextOut) else self.construct_text(v)
+        if t == "bytes":
+            return v if isinstance(v, BytesOut) else self.construct_bytes(v)
+        if isinstance(v, TableIn):
+            return self.copy(t, v)
+        return v
+
+    def construct_map(
+        self, key: str, value: Union[str, type], items: Union[MapIn, Mapping]
+    ) -> MapOut:
+        """Construct a map of the key value pairs of items, stored as a hash
+        table that readers look keys up in directly.
+
+        key is "text" or the struct format of integer keys. value is "text",
+        "bytes", the struct format of numbers, a table writer type or a struct
+        type. The values not already written are written before the map in
+        the order of items, followed by the texts of the keys"""
+        values = [(k, self._map_value(value, v)) for (k, v) in items.items()]
+        entries = []
+        for (k, v) in values:
+            if key == "text":
+                b = k.encode("utf-8")
+                kd = self._pack_ptr(self._construct_object(TEXT_MAGIC, b, b"\0"))
+                entries.append((_map_hash(b), kd, v))
+            else:
+                entries.append((_map_hash(k), struct.pack("<" + key, k), v))
+        # Keep at most three quarters of the slots used, so probes are short
+        capacity = 1
+        while capacity * 3 < len(entries) * 4:
+            capacity *= 2
+        slot = 4 + _map_width(key) + _map_width(value)
+        self._align()
+        self._reserve(12 + capacity * slot)
+        self._write(struct.pack("<III", MAP_MAGIC, capacity, len(entries)))
         o = self._used
-        self._write(b)
-        return BytesOut(o)
+        self._write(bytes(capacity * slot))
+        mask = capacity - 1
+        for (h, kd, v) in entries:
+            i = h & mask
+            while self._data[o + i * slot : o + i * slot + 4] != b"\0\0\0\0":
+                i = (i + 1) & mask
+            s = o + i * slot
+            self._put(s, struct.pack("<I", h) + kd)
+            s += 4 + len(kd)
+            if isinstance(v, (TextOut, BytesOut, TableOut)):
+                self._put(s, self._pack_ptr(v._offset))
+            elif isinstance(value, str):
+                self._put(s, struct.pack("<" + value, v))
+            else:
+                value._write(self, s, v)
+        return MapOut(o - 4, len(entries))
+
+    def construct_basic_list_builder(self, e: str, w: int) -> ListBuilder[B]:
+        """Construct a builder for a list of numbers of struct format e and
+        width w, like construct_basic_list_builder("I", 4) for uint32"""
+        s = struct.Struct("<" + e)
+        return ListBuilder[B](
+            self,
+            w * 8,
+            lambda b, index, value: s.pack_into(b._data, index * w, value),
+            lambda size: BasicListOut[B](self, e, w, size),
+        )
 
-    def construct_text(self, t: str) -> TextOut:
-        tt = t.encode("utf-8")
-        self._reserve(len(tt) + 9)
-        self._write(struct.pack("<II", TEXT_MAGIC, len(tt)))
+    def construct_int8_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("b", 1)
+
+    def construct_uint8_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("B", 1)
+
+    def construct_int16_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("h", 2)
+
+    def construct_uint16_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("H", 2)
+
+    def construct_int32_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("i", 4)
+
+    def construct_uint32_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("I", 4)
+
+    def construct_int64_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("q", 8)
+
+    def construct_uint64_list_builder(self) -> ListBuilder[int]:
+        return self.construct_basic_list_builder("Q", 8)
+
+    def construct_float32_list_builder(self) -> ListBuilder[float]:
+        return self.construct_basic_list_builder("f", 4)
+
+    def construct_float64_list_builder(self) -> ListBuilder[float]:
+        return self.construct_basic_list_builder("d", 8)
+
+    def construct_enum_list_builder(self, e: Type[E]) -> ListBuilder[E]:
+        return ListBuilder[E](
+            self, 8, _put_enum, lambda size: EnumListOut[E](self, e, size), 255
+        )
+
+    def construct_struct_list_builder(self, s: Type[S]) -> ListBuilder[S]:
+        return ListBuilder[S](
+            self,
+            s._WIDTH * 8,
+            lambda b, index, value: s._write(b, index * s._WIDTH, value),
+            lambda size: StructListOut[S](self, s, size),
+        )
+
+    def construct_table_list_builder(self, t: Type[TO]) -> TableListBuilder[TO]:
+        return TableListBuilder[TO](self, t)
+
+    def construct_text_list_builder(self) -> ListBuilder[str]:
+        return ListBuilder[str](
+            self, 32, _put_text, lambda size: TextListOut(self, size)
+        )
+
+    def construct_bytes_list_builder(self) -> ListBuilder[bytes]:
+        return ListBuilder[bytes](
+            self, 32, _put_bytes, lambda size: BytesListOut(self, size)
+        )
+
+    def construct_bool_list_builder(self) -> ListBuilder[bool]:
+        return ListBuilder[bool](
+            self, 1, _put_bool, lambda size: BoolListOut(self, size)
+        )
+
+    def _construct_object(self, magic: int, content: bytes, tail: bytes) -> int:
+        """Write an object with the given magic and content followed by tail,
+        and return where its content starts. When deduplicating the offset of
+        an identical earlier object is returned instead if it is remembered"""
+        dedupe = self._dedupe
+        if dedupe is not None:
+            key = (magic, bytes(content))
+            report = self._dedupe_report
+            report["objects"] += 1
+            o = dedupe.get(key)
+            if o is not None:
+                report["hits"] += 1
+                size = 8 + len(content) + len(tail)
+                report["bytes_saved"] += size + (-size & ((1 << self._shift) - 1))
+                return o
+        self._align()
+        self._reserve(len(content) + len(tail) + 8)
+        self._write(struct.pack("<II", magic, len(content)))
         o = self._used
-        self._write(tt)
-        self._write(b"\0")
-        return TextOut(o)
+        self._write(content)
+        self._write(tail)
+        if dedupe is not None and len(content) <= self._dedupe_limit:
+            dedupe[key] = o
+            self._dedupe_memory += len(content)
+            while self._dedupe_memory > self._dedupe_limit:
+                # Forget the oldest objects first
+                k = next(iter(dedupe))
+                self._dedupe_memory -= len(k[1])
+                del dedupe[k]
+        return o
+
+    def construct_bytes(self, b: bytes) -> BytesOut:
+        return BytesOut(self._construct_object(BYTES_MAGIC, b, b""))
+
+    def construct_compressed_bytes(self, b: bytes) -> BytesOut:
+        """Construct bytes holding b compressed as a zlib stream, the way
+        compressed Bytes members are stored"""
+        return self.construct_bytes(zlib.compress(b))
+
+    def construct_text(self, t: str) -> TextOut:
+        return TextOut(self._construct_object(TEXT_MAGIC, t.encode("utf-8"), b"\0"))
+
+    def intern_table(self, t: TO) -> TO:
+        """Return a table identical to t written earlier with intern_table,
+        or t if there is none. If t is the last object written, it is removed
+        when an identical table exists.
+
+        Tables are compared by their bytes, so the children of t must be
+        interned before t, and t must not be changed afterwards. Tables with
+        inplace members can not be interned"""
+        if t._INPLACE:
+            raise Exception("Tables with inplace members can not be interned")
+        start = t._offset - 8
+        end = t._offset + len(t._DEFAULT)
+        key = bytes(self._data[start:end])
+        report = self._dedupe_report
+        report["tables"] += 1
+        o = self._interned.setdefault(key, t._offset)
+        if o == t._offset:
+            return t
+        report["table_hits"] += 1
+        # Only padding may follow a table that is the last object written
+        if 0 <= self._used - end < 1 << self._shift:
+            report["bytes_saved"] += self._used - start
+            self._data[start : self._used] = bytes(self._used - start)
+            self._used = start
+        return type(t)._at(self, o)
+
+    def mark(self) -> int:
+        """Return a mark to roll back to, see rollback"""
+        return self._used
+
+    def rollback(self, mark: int) -> None:
+        """Remove everything written after mark was returned by mark.
+
+        The objects written before the mark must not point to the removed
+        ones. If the writer is debugging, the handles of removed tables,
+        lists and unions raise when used"""
+        assert 8 <= mark <= self._used
+        self._data[mark : self._used] = bytes(self._used - mark)
+        self._used = mark
+        # Objects are remembered in the order they are written
+        dedupe = self._dedupe
+        while dedupe:
+            (k, o) = dedupe.popitem()
+            if o - 8 < mark:
+                dedupe[k] = o
+                break
+            self._dedupe_memory -= len(k[1])
+        interned = self._interned
+        while interned:
+            (k, o) = interned.popitem()
+            if o - 8 < mark:
+                interned[k] = o
+                break
+        self._sorted = [s for s in self._sorted if s[0] - 8 < mark]
+        if self._debug:
+            for h in gc.get_referrers(self):
+                if (
+                    isinstance(h, (TableOut, UnionOut, OutList))
+                    and h._writer is self
+                    and h._offset - 8 >= mark
+                ):
+                    h._writer = _REMOVED
+                    h._offset = _REMOVED
+
+    def dedupe_report(self) -> Dict[str, int]:
+        """Return how much deduplication has saved: the number of texts and
+        bytes constructed, how many of them were earlier objects reused, the
+        bytes not written because of that, the number and total size of the
+        objects remembered, and the number of tables interned and how many of
+        them were earlier tables reused"""
+        ans = dict(self._dedupe_report)
+        ans["entries"] = len(self._dedupe) if self._dedupe is not None else 0
+        ans["memory"] = self._dedupe_memory
+        return ans
 
     def copy(self, t: Type[TO], i: TI) -> TO:
+        compacted = self._compacted
+        if compacted is not None:
+            o = compacted.get(i._offset)
+            if o is not None:
+                return t._at(self, o)
         res = t(self, True)
         res._copy(i)
+        if compacted is not None:
+            compacted[i._offset] = res._offset
         return res
 
-    def finalize(self, root: TableOut) -> bytes:
-        """Return finalized message given root object"""
-        self._data[0:8] = struct.pack("<II", MESSAGE_MAGIC, root._offset - 8)
+    def finalize(self, root: Optional[TableOut] = None) -> bytes:
+        """Return finalized message given root object. The root may be left
+        out when continuing a message with open_append, to keep its root.
+        When continuing a file in place it is cut to the message, and its
+        map is returned"""
+        if root is None and not self._appending:
+            raise Exception("No root given")
+        # Sort every list before writing anything, so a list with an unset
+        # element or key leaves the writer unchanged
+        sorted_ = [
+            (offset, size, self._sorted_pointers(offset, size, t, key))
+            for (offset, size, t, key) in self._sorted
+        ]
+        magic = LARGE_MESSAGE_MAGIC if self._shift else MESSAGE_MAGIC
+        self._data[0:4] = struct.pack("<I", magic)
+        for (offset, size, pointers) in sorted_:
+            struct.pack_into("<%dI" % size, self._data, offset, *pointers)
+        self._sorted = []
+        if root is not None:
+            self._data[4:8] = self._pack_ptr(root._offset)
+        if not isinstance(self._data, bytearray):
+            self._data.resize(self._used)
+            return self._data
         return self._data[0 : self._used]
+
+    def _sorted_pointers(
+        self, offset: int, size: int, t: Type[TI], key: Callable[[TI], Optional[K]]
+    ) -> Tuple[int, ...]:
+        """Return the pointers of the list of tables at offset stably sorted
+        by the keys of the tables, read with the reader t. The key is None
+        for tables where it is not set"""
+        r = Reader(self._data)
+        pointers = struct.unpack_from("<%dI" % size, self._data, offset)
+        keyed = []
+        for p in pointers:
+            if p == 0:
+                raise Exception("Unset element in sorted list")
+            o = p << self._shift
+            k = key(t(r, o + 8, r._read_size(o, t._MAGIC)))
+            if k is None:
+                raise Exception("Unset key in sorted list")
+            keyed.append((k, p))
+        keyed.sort(key=lambda e: e[0])
+        return tuple(p for (_, p) in keyed)
+
+
+def compact(reader: Reader, root_type: Type[TO]) -> bytes:
+    """Return the message of reader rewritten with only the objects reachable
+    from its root, a table written by root_type, in depth first order.
+
+    Every table is stored without its trailing default bytes, which readers
+    return when reading past the stored size. Tables with inplace members
+    are stored in full. Tables pointed to more than once and identical texts
+    and bytes are written once, lists pointed to more than once are written
+    for every pointer"""
+    w = Writer(large=reader._shift != 0, dedupe=True, dedupe_limit=sys.maxsize)
+    w._compacted = {}
+    root = w.copy(root_type, reader.root(root_type._IN))
+    w._compacted = None
+    return bytes(w.finalize(root))
+
+
+# Bytes compared at a time when diffing, see diff
+_DIFF_BLOCK = 64
+_PATCH_HEADER = struct.Struct("<IIQQI")
+_PATCH_REGION = struct.Struct("<QI")
+
+
+def diff(old: Reader, new: Reader) -> bytes:
+    """Return a patch turning the message of old into the message of new,
+    see apply_patch.
+
+    The patch holds the byte ranges that differ and the bytes following the
+    old message, compared byte for byte without reading any objects, so
+    padding and dead objects are carried like everything else. It is small
+    when new continues old with Writer.open_append and changes it in place
+    with Mut types, since objects then keep their offsets. Messages written
+    from scratch may move every object"""
+    o = memoryview(old._data)
+    n = memoryview(new._data)
+    common = min(len(o), len(n))
+    regions: List[Tuple[int, int]] = []
+    for block in range(0, common, _DIFF_BLOCK):
+        end = min(block + _DIFF_BLOCK, common)
+        if o[block:end] == n[block:end]:
+            continue
+        first = block
+        while o[first] == n[first]:
+            first += 1
+        last = end
+        while o[last - 1] == n[last - 1]:
+            last -= 1
+        # Join regions closer than the cost of a region header
+        if regions and first - regions[-1][1] <= _PATCH_REGION.size:
+            first = regions.pop()[0]
+        regions.append((first, last))
+    if len(n) > common:
+        if regions and common - regions[-1][1] <= _PATCH_REGION.size:
+            regions[-1] = (regions[-1][0], len(n))
+        else:
+            regions.append((common, len(n)))
+    parts = [
+        _PATCH_HEADER.pack(
+            PATCH_MAGIC, zlib.crc32(o), len(o), len(n), len(regions)
+        )
+    ]
+    for (start, end) in regions:
+        parts.append(_PATCH_REGION.pack(start, end - start))
+        parts.append(n[start:end])
+    return b"".join(parts)
+
+
+def apply_patch(old: Union[Reader, bytes], patch: bytes) -> bytes:
+    """Return the message of the patch returned by diff, applied to the old
+    message it was computed from"""
+    data = old._data if isinstance(old, Reader) else old
+    (magic, crc, old_size, new_size, count) = _PATCH_HEADER.unpack_from(patch, 0)
+    if magic != PATCH_MAGIC:
+        raise Exception("Bad magic")
+    if len(data) != old_size or zlib.crc32(data) != crc:
+        raise Exception("The patch is not of this message")
+    ans = bytearray(new_size)
+    ans[0 : min(old_size, new_size)] = memoryview(data)[0:new_size]
+    o = _PATCH_HEADER.size
+    for _ in range(count):
+        (start, size) = _PATCH_REGION.unpack_from(patch, o)
+        o += _PATCH_REGION.size
+        if start + size > new_size:
+            raise Exception("Bad patch")
+        ans[start : start + size] = patch[o : o + size]
+        o += size
+    return bytes(ans)
+
+
+# Compressions of archive blocks, see ArchiveWriter
+_ARCHIVE_COMPRESSIONS = {"none": 0, "zlib": 1, "lzma": 2}
+# Magic and compression
+_ARCHIVE_HEADER = struct.Struct("<II")
+# Offset and size of the compressed index, number of blocks and messages, magic
+_ARCHIVE_FOOTER = struct.Struct("<QQQQI")
+# Offset in the archive, compressed size and first message of a block
+_ARCHIVE_BLOCK = struct.Struct("<QQQ")
+# Offset in the decompressed block and size of a message
+_ARCHIVE_MESSAGE = struct.Struct("<QQ")
+
+
+def _archive_codec(
+    compression: int, level: Optional[int] = None
+) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """Return the compress and decompress functions of a compression"""
+    if compression == 0:
+        return (bytes, bytes)
+    if compression == 1:
+        return (
+            lambda d: zlib.compress(d, -1 if level is None else level),
+            zlib.decompress,
+        )
+    if compression == 2:
+        import lzma
+
+        return (lambda d: lzma.compress(d, preset=level), lzma.decompress)
+    raise Exception("Unknown compression %d" % compression)
+
+
+class ArchiveWriter(object):
+    """Write messages to an archive read by Archive. Messages are grouped into
+    blocks compressed independently, followed by an index of the blocks and
+    messages, so any message can be read decompressing only its block"""
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        block_size: int = 1 << 20,
+        compression: str = "zlib",
+        level: Optional[int] = None,
+    ) -> None:
+        """Write the archive to file from its current position. Offsets in
+        the archive are relative to that position, so it may follow other
+        data. A block is compressed once it holds block_size bytes of
+        messages. compression is "zlib", "lzma" or "none", compressing at
+        level if given"""
+        if compression not in _ARCHIVE_COMPRESSIONS:
+            raise Exception("Unknown compression %s" % compression)
+        self._file = file
+        self._owned = False
+        self._block_size = block_size
+        self._compression = _ARCHIVE_COMPRESSIONS[compression]
+        self._compress = _archive_codec(self._compression, level)[0]
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._blocks: List[bytes] = []
+        self._messages: List[bytes] = []
+        self._used = _ARCHIVE_HEADER.size
+        file.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, self._compression))
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "ArchiveWriter":
+        """Create the archive file path, closed with the writer"""
+        ans = cls(open(path, "wb"), **kwargs)
+        ans._owned = True
+        return ans
+
+    def add(self, message: bytes) -> int:
+        """Add a finalized message, returning its index in the archive"""
+        if len(message) < 8 or struct.unpack("<I", message[0:4])[0] not in (
+            MESSAGE_MAGIC,
+            LARGE_MESSAGE_MAGIC,
+        ):
+            raise Exception("Bad magic")
+        self._messages.append(_ARCHIVE_MESSAGE.pack(self._pending_size, len(message)))
+        self._pending.append(bytes(message))
+        self._pending_size += len(message)
+        if self._pending_size >= self._block_size:
+            self._flush()
+        return len(self._messages) - 1
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        data = self._compress(b"".join(self._pending))
+        first = len(self._messages) - len(self._pending)
+        self._blocks.append(_ARCHIVE_BLOCK.pack(self._used, len(data), first))
+        self._file.write(data)
+        self._used += len(data)
+        self._pending = []
+        self._pending_size = 0
+
+    def close(self) -> None:
+        """Write the last block and the index. The writer can not be used
+        afterwards"""
+        if self._file is None:
+            return
+        self._flush()
+        index = self._compress(b"".join(self._blocks + self._messages))
+        self._file.write(index)
+        self._file.write(
+            _ARCHIVE_FOOTER.pack(
+                self._used,
+                len(index),
+                len(self._blocks),
+                len(self._messages),
+                ARCHIVE_MAGIC,
+            )
+        )
+        if self._owned:
+            self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class Archive(Sequence[Reader]):
+    """Read the messages of an archive written by ArchiveWriter. Indexing
+    returns a Reader of a message, decompressing only the block holding it.
+    The last cache_blocks blocks decompressed are kept, so reading messages
+    near each other decompresses every block once"""
+
+    def __init__(
+        self, file: BinaryIO, cache_blocks: int = 8, struct_views: bool = False
+    ) -> None:
+        """Read the archive at the end of file, which may follow other data.
+        The Readers returned are constructed with struct_views"""
+        end = file.seek(-_ARCHIVE_FOOTER.size, 2)
+        (offset, size, blocks, messages, end_magic) = _ARCHIVE_FOOTER.unpack(
+            file.read(_ARCHIVE_FOOTER.size)
+        )
+        if end_magic != ARCHIVE_MAGIC or offset + size > end:
+            raise Exception("Bad magic")
+        # The index ends where the footer starts
+        self._base = end - size - offset
+        file.seek(self._base)
+        (magic, compression) = _ARCHIVE_HEADER.unpack(file.read(_ARCHIVE_HEADER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise Exception("Bad magic")
+        self._file = file
+        self._owned = False
+        self._decompress = _archive_codec(compression)[1]
+        self._struct_views = struct_views
+        file.seek(self._base + offset)
+        index = self._decompress(file.read(size))
+        self._blocks = [
+            _ARCHIVE_BLOCK.unpack_from(index, i * _ARCHIVE_BLOCK.size)
+            for i in range(blocks)
+        ]
+        self._firsts = [b[2] for b in self._blocks]
+        self._messages = index
+        self._messages_offset = blocks * _ARCHIVE_BLOCK.size
+        self._size = messages
+        self._cache: Dict[int, bytes] = {}
+        self._cache_blocks = max(cache_blocks, 1)
+        self._report = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "Archive":
+        """Open the archive file path, closed with the archive"""
+        ans = cls(open(path, "rb"), **kwargs)
+        ans._owned = True
+        return ans
+
+    def _block(self, block: int) -> bytes:
+        data = self._cache.pop(block, None)
+        if data is None:
+            self._report["misses"] += 1
+            (offset, size, _) = self._blocks[block]
+            self._file.seek(self._base + offset)
+            data = self._decompress(self._file.read(size))
+            if len(self._cache) >= self._cache_blocks:
+                del self._cache[next(iter(self._cache))]
+        else:
+            self._report["hits"] += 1
+        self._cache[block] = data
+        return data
+
+    def message(self, idx: int) -> bytes:
+        """Return the bytes of message number idx"""
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError()
+        (start, size) = _ARCHIVE_MESSAGE.unpack_from(
+            self._messages, self._messages_offset + idx * _ARCHIVE_MESSAGE.size
+        )
+        data = self._block(bisect.bisect_right(self._firsts, idx) - 1)
+        return data[start : start + size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, idx: int) -> Reader:
+        return Reader(self.message(idx), self._struct_views)
+
+    def cache_report(self) -> Dict[str, int]:
+        """Return the number of block reads served by the cache and the number
+        of blocks decompressed"""
+        return dict(self._report)
+
+    def close(self) -> None:
+        if self._owned:
+            self._file.close()
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -5,7 +5,7 @@ Main executable
 import argparse
 import sys
 
-from . import cpp_generator, magic, python_generator, validate
+from . import build, compact, cpp_generator, magic, python_generator, validate
 from .parser import ParseError, Parser
 
 parser = argparse.ArgumentParser(description="Process schema.")
@@ -14,6 +14,8 @@ validate.setup(subparsers)
 magic.setup(subparsers)
 cpp_generator.setup(subparsers)
 python_generator.setup(subparsers)
+build.setup(subparsers)
+compact.setup(subparsers)
 
 
 def main():
@@ -31,6 +31,50 @@ class ContentType(enum.Enum):
     UNION = 2
 
 
+# Types of the table members that can be stored in a column
+columnTypes = (
+    TokenType.BOOL,
+    TokenType.U8,
+    TokenType.U16,
+    TokenType.UI32,
+    TokenType.UI64,
+    TokenType.I8,
+    TokenType.I16,
+    TokenType.I32,
+    TokenType.I64,
+    TokenType.F32,
+    TokenType.F64,
+)
+
+packedTypes = (
+    TokenType.U8,
+    TokenType.U16,
+    TokenType.UI32,
+    TokenType.UI64,
+    TokenType.I8,
+    TokenType.I16,
+    TokenType.I32,
+    TokenType.I64,
+)
+
+mapKeyTypes = packedTypes + (TokenType.TEXT,)
+
+mapValueTypes = (
+    TokenType.U8,
+    TokenType.U16,
+    TokenType.UI32,
+    TokenType.UI64,
+    TokenType.I8,
+    TokenType.I16,
+    TokenType.I32,
+    TokenType.I64,
+    TokenType.F32,
+    TokenType.F64,
+    TokenType.TEXT,
+    TokenType.BYTES,
+)
+
+
 class Annotater:
     enums: Dict[str, Enum]
     structs: Dict[str, Struct]
@@ -173,6 +217,76 @@ class Annotater:
             if not 1 <= node.magic < 2 ** 32:
                 self.error(node.id_, "Magic outside range")
 
+    def visit_columnar(self, v: Value, t: ContentType) -> None:
+        """Check that the tables of the list v can be stored as one column per
+        member, and mark the table so column readers and writers are generated"""
+        if t != ContentType.TABLE:
+            self.error(v.columnar, "Only allowed in tables")
+            return
+        table = v.table
+        if not table:
+            self.error(v.columnar, "Only lists of tables can be columnar")
+            return
+        if table.document != v.document:
+            self.error(v.type_, "Columnar tables must be declared in the same document")
+            return
+        if table.empty:
+            self.error(v.type_, "Columnar tables must have members")
+        for m in table.members:
+            if (
+                m.optional
+                or m.list_
+                or m.map_
+                or m.inplace
+                or not (m.type_.type in columnTypes or m.enum or m.struct)
+            ):
+                self.error(m.identifier, "Not allowed in columnar tables")
+                self.error(v.columnar, "Used as columnar here")
+        table.columnar = True
+
+    def visit_map(self, v: Value, t: ContentType) -> None:
+        """Check the key and value types of the map v, whose value type has
+        been looked up"""
+        if t != ContentType.TABLE:
+            self.error(v.map_, "Only allowed in tables")
+        for m in (v.optional, v.list_, v.inplace, v.columnar, v.packed, v.dictionary):
+            if m:
+                self.error(m, "Not allowed for maps")
+        if v.key.type not in mapKeyTypes:
+            self.error(v.key, "Map keys must be texts or integers")
+        if not (v.table or v.struct or v.type_.type in mapValueTypes):
+            self.error(
+                v.type_, "Map values must be tables, structs, texts, bytes or numbers"
+            )
+
+    def visit_sorted(self, v: Value, t: ContentType) -> None:
+        """Look up the member the list of tables v is sorted by"""
+        if t != ContentType.TABLE:
+            self.error(v.sorted_, "Only allowed in tables")
+            return
+        if not v.table:
+            self.error(v.sorted_, "Only lists of tables can be sorted")
+            return
+        if v.inplace or v.columnar:
+            self.error(v.sorted_, "Sorted lists can not be inplace or columnar")
+            return
+        key = self.value(v.sort_key)
+        for m in v.table.members:
+            if self.value(m.identifier) == key:
+                v.sort_member = m
+        m = v.sort_member
+        if not m:
+            self.error(v.sort_key, "Unknown member")
+        elif (
+            m.type_.type not in mapKeyTypes
+            or m.optional
+            or m.list_
+            or m.map_
+            or m.packed
+            or m.dictionary
+        ):
+            self.error(v.sort_key, "Sort keys must be integer or text members")
+
     def visit_content(
         self, name: str, values: List[Value], t: ContentType, inplace_context: bool
     ) -> bytes:
@@ -252,6 +366,21 @@ class Annotater:
             if v.inplace:
                 inplace = v
 
+            if v.columnar and not v.list_:
+                self.error(v.columnar, "Only allowed for lists")
+
+            if v.packed and not v.list_:
+                self.error(v.packed, "Only allowed for lists")
+
+            if v.dictionary and not v.list_:
+                self.error(v.dictionary, "Only allowed for lists")
+
+            if v.sorted_ and not v.list_:
+                self.error(v.sorted_, "Only allowed for lists")
+
+            if v.compressed and (v.list_ or v.map_ or v.type_.type != TokenType.BYTES):
+                self.error(v.compressed, "Only allowed for Bytes")
+
             if v.optional and v.type_.type in (
                 TokenType.U8,
                 TokenType.U16,
@@ -273,7 +402,7 @@ class Annotater:
                 bool_bit += 1
 
             typeName = self.value(v.type_)
-            if v.list_:
+            if v.list_ or v.map_:
                 if v.direct_enum:
                     v.enum = v.direct_enum
                 elif v.direct_table:
@@ -298,10 +427,33 @@ class Annotater:
                         self.outer.uses.add(v.union)
                     else:
                         self.error(v.type_, "Unknown type")
-                if t == ContentType.STRUCT:
+                if v.map_:
+                    self.visit_map(v, t)
+                elif t == ContentType.STRUCT:
                     self.error(v.list_, "Not allowed in structs")
-                if v.optional:
+                if v.optional and v.list_:
                     self.error(v.optional, "Lists are alwayes optional")
+                if v.columnar:
+                    self.visit_columnar(v, t)
+                if v.packed:
+                    if t != ContentType.TABLE:
+                        self.error(v.packed, "Only allowed in tables")
+                    elif v.type_.type not in packedTypes:
+                        self.error(v.packed, "Only lists of integers can be packed")
+                    elif v.inplace:
+                        self.error(v.packed, "Packed lists can not be inplace")
+                if v.dictionary:
+                    if t != ContentType.TABLE:
+                        self.error(v.dictionary, "Only allowed in tables")
+                    elif v.type_.type != TokenType.TEXT:
+                        self.error(
+                            v.dictionary,
+                            "Only lists of texts can be dictionary encoded",
+                        )
+                    elif v.inplace:
+                        self.error(v.dictionary, "Dictionary lists can not be inplace")
+                if v.sorted_ and v.list_:
+                    self.visit_sorted(v, t)
                 default.append(b"\0\0\0\0")
                 v.bytes = 4
                 v.offset = bytes
@@ -399,6 +551,11 @@ class Annotater:
                     self.error(v.optional, "Are alwayes optional")
                 if t == ContentType.STRUCT:
                     self.error(v.type_, "Not allowed in structs")
+                if v.compressed:
+                    if t != ContentType.TABLE:
+                        self.error(v.compressed, "Only allowed in tables")
+                    elif v.inplace:
+                        self.error(v.compressed, "Compressed bytes can not be inplace")
                 default.append(b"\0\0\0\0")
                 v.bytes = 4
                 v.offset = bytes
@@ -506,12 +663,28 @@ class Annotater:
             raise ICE()
         return default2
 
+    def register(self, node: AstNode) -> None:
+        """Make a node annotated by a previous annotater visible by name"""
+        if isinstance(node, Struct):
+            self.structs[node.name] = node
+        elif isinstance(node, Enum):
+            self.enums[node.name] = node
+        elif isinstance(node, Table):
+            self.tables[node.name] = node
+        elif isinstance(node, Union):
+            self.unions[node.name] = node
+        elif isinstance(node, Namespace):
+            self.namespace[node.document] = node.namespace
+
     def annotate(self, ast: List[AstNode]) -> None:
         self.enums = {}
         self.structs = {}
         self.tables = {}
         self.unions = {}
         for node in ast:
+            if node.document in self.documents.annotated:
+                self.register(node)
+                continue
             self.context = "outer"
             self.create_doc_string(node)
             self.outer = node
@@ -562,4 +735,7 @@ class Annotater:
 def annotate(documents: Documents, ast: List[AstNode]) -> bool:
     a = Annotater(documents)
     a.annotate(ast)
-    return a.errors == 0
+    if a.errors != 0:
+        return False
+    documents.annotated.update(node.document for node in ast)
+    return True
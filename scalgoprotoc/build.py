@@ -0,0 +1,90 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Generate code for several schemas in one process
+"""
+import concurrent.futures
+from typing import List, Tuple
+
+from . import cpp_generator, python_generator
+from .annotate import annotate
+from .documents import Documents, addDocumentsParams
+from .parser import AstNode, ParseError, Parser
+from .util import write_depfile
+
+Job = Tuple[str, Documents, int, List[AstNode], str, object]
+
+
+def generate(job: Job) -> List[str]:
+    """Generate the output of a single schema, possibly in a worker process.
+    Returns the paths of the generated files"""
+    (kind, documents, root, ast, output, option) = job
+    documents.root = documents.by_id[root]
+    if kind == "py":
+        return [python_generator.write(documents, ast, output, option)]
+    g = cpp_generator.Generator(documents)
+    g.generate(ast, output, option)
+    return g.files
+
+
+def run(args) -> int:
+    documents = Documents()
+    schemas: List[Tuple[int, List[AstNode]]] = []
+    for schema in args.schemas:
+        root = documents.read_root(schema)
+        p = Parser(documents)
+        try:
+            if root.id in documents.parsed:
+                ast = p.reuse_document(root.id)
+            else:
+                ast = p.parse_document()
+        except ParseError as err:
+            err.describe(documents)
+            return 1
+        if not annotate(documents, ast):
+            print("Schema %s is invalid" % schema)
+            return 1
+        schemas.append((root.id, ast))
+
+    jobs: List[Job] = []
+    for (root, ast) in schemas:
+        if args.py:
+            jobs.append(("py", documents, root, ast, args.py, args.import_prefix))
+        if args.cpp:
+            jobs.append(("cpp", documents, root, ast, args.cpp, args.single))
+
+    if args.jobs > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+            files = list(executor.map(generate, jobs))
+    else:
+        files = [generate(job) for job in jobs]
+
+    if args.depfile:
+        dependencies: List[str] = []
+        for (root, _) in schemas:
+            for path in documents.dependencies(root):
+                if not path in dependencies:
+                    dependencies.append(path)
+        targets = [path for paths in files for path in paths]
+        write_depfile(args.depfile, targets, dependencies)
+    return 0
+
+
+def setup(subparsers) -> None:
+    cmd = subparsers.add_parser("build", help="Generate code for several schemas")
+    cmd.add_argument("schemas", nargs="+", help="schemas to generate things from")
+    cmd.add_argument("--py", help="where do we store the python output")
+    cmd.add_argument("--cpp", help="where do we store the cpp output")
+    cmd.add_argument("--single", action="store_true")
+    cmd.add_argument(
+        "--import-prefix", help="Prefix to put infront of python imports", default=""
+    )
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes used to generate the output",
+    )
+    cmd.add_argument("--depfile", help="write a make style depfile to this path")
+    addDocumentsParams(cmd)
+    cmd.set_defaults(func=run)
@@ -0,0 +1,76 @@
+# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+"""
+Compact a message, see scalgoproto.compact
+"""
+import argparse
+import importlib
+import sys
+import tempfile
+
+from . import build
+from .annotate import annotate
+from .documents import Documents, addDocumentsParams
+from .parser import ParseError, Parser
+
+
+def run(args) -> int:
+    documents = Documents()
+    documents.read_root(args.schema)
+    try:
+        ast = Parser(documents).parse_document()
+    except ParseError as err:
+        err.describe(documents)
+        return 1
+    if not annotate(documents, ast):
+        print("Schema is invalid")
+        return 1
+
+    import scalgoproto
+
+    with tempfile.TemporaryDirectory() as d:
+        options = argparse.Namespace(
+            schemas=documents.dependencies(),
+            py=d,
+            cpp=None,
+            import_prefix="",
+            single=False,
+            jobs=1,
+            depfile=None,
+        )
+        if build.run(options):
+            return 1
+        sys.path.insert(0, d)
+        try:
+            module = importlib.import_module(documents.root.name)
+        finally:
+            sys.path.remove(d)
+    root_type = getattr(module, "%sOut" % args.table, None)
+    if not isinstance(root_type, type) or not issubclass(
+        root_type, scalgoproto.TableOut
+    ):
+        print("Unknown table %s" % args.table)
+        return 1
+
+    with open(args.input, "rb") as f:
+        data = f.read()
+    compacted = scalgoproto.compact(scalgoproto.Reader(data), root_type)
+    with open(args.output, "wb") as f:
+        f.write(compacted)
+    print(
+        "Compacted %d bytes to %d bytes, saving %d bytes"
+        % (len(data), len(compacted), len(data) - len(compacted))
+    )
+    return 0
+
+
+def setup(subparsers) -> None:
+    cmd = subparsers.add_parser(
+        "compact",
+        help="Rewrite a message without unreachable objects and default bytes",
+    )
+    cmd.add_argument("schema", help="schema of the message")
+    cmd.add_argument("table", help="table at the root of the message")
+    cmd.add_argument("input", help="message to compact")
+    cmd.add_argument("output", help="where do we store the compacted message")
+    addDocumentsParams(cmd)
+    cmd.set_defaults(func=run)
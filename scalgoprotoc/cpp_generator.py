@@ -20,7 +20,16 @@ from .parser import (
     ICE,
 )
 from .sp_tokenize import Token, TokenType
-from .util import cescape, lcamel, ucamel, snake
+from .util import (
+    cescape,
+    lcamel,
+    pointer_member,
+    trim_fields,
+    ucamel,
+    snake,
+    write_depfile,
+    write_if_changed,
+)
 from .documents import Documents, Document
 
 typeMap = {
@@ -49,6 +58,7 @@ class Generator:
         self.out: io.StringIO = None
         self.current_namespace: str = None
         self.current_file: str = None
+        self.files: List[str] = []
 
     def in_list_types(self, node: Value) -> Tuple[str, str]:
         typeName: str = None
@@ -191,22 +201,18 @@ class Generator:
             )
         else:
             self.o(
-                "\t%s & set%s(scalgoproto::ListOut<%s> value) noexcept {"
+                "\t%s & set%s(scalgoproto::ListOut<%s> value) {"
                 % (outer, uname, typeName)
             )
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(value)-8);" % (node.offset)
-            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
             self.o("\t\treturn * this;")
             self.o("\t}")
             self.o(
-                "\tscalgoproto::ListOut<%s> add%s(size_t size) noexcept {"
+                "\tscalgoproto::ListOut<%s> add%s(size_t size) {"
                 % (typeName, uname)
             )
             self.o("\t\tauto res = writer_.constructList<%s>(size);" % typeName)
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(res)-8);" % (node.offset)
-            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(res)-8);" % (node.offset))
             self.o("\t\treturn res;")
         self.o("\t}")
 
@@ -224,7 +230,7 @@ class Generator:
             self.o("\t\treturn addInplaceList_<%s>(writer_, next_, size);" % (typeName))
         else:
             self.o(
-                "\tvoid set%s(scalgoproto::ListOut<%s> value) noexcept {"
+                "\tvoid set%s(scalgoproto::ListOut<%s> value) {"
                 % (uname, typeName)
             )
             self.o("\t\tsetType_(%d);" % (idx))
@@ -239,6 +245,192 @@ class Generator:
             self.o("\t\treturn res;")
         self.o("\t}")
 
+    def generate_columnar_in(self, node: Value, uname: str) -> None:
+        typeName = "%sColumnsIn" % self.qualify(node.table)
+        self.o("\tbool has%s() const noexcept {" % (uname))
+        self.o("\t\treturn getInner_<std::uint32_t, %d>(0) != 0;" % (node.offset))
+        self.o("\t}")
+        self.o("\t")
+        self.output_doc(node, "\t")
+        self.o("\t%s %s() const {" % (typeName, lcamel(uname)))
+        self.o("\t\tassert(has%s());" % uname)
+        self.o(
+            "\t\treturn getColumns_<%s>(reader_, getPtr_<%s, scalgoproto::LISTMAGIC, %d, 0>());"
+            % (typeName, bs(node.inplace), node.offset)
+        )
+        self.o("\t}")
+
+    def generate_columnar_out(self, node: Value, uname: str, outer: str) -> None:
+        typeName = "%sColumnsOut" % self.qualify(node.table)
+        if node.inplace:
+            self.o("\t%s add%s(size_t size) noexcept {" % (typeName, uname))
+            self.o("\t\tsetInner_<std::uint32_t, %d>(size);" % (node.offset))
+            self.o(
+                "\t\treturn addInplaceColumns_<%s>(writer_, offset_ + SIZE, size);"
+                % (typeName)
+            )
+        else:
+            self.o("\t%s & set%s(%s value) {" % (outer, uname, typeName))
+            self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
+            self.o("\t\treturn * this;")
+            self.o("\t}")
+            self.o("\t%s add%s(size_t size) {" % (typeName, uname))
+            self.o("\t\tauto res = writer_.constructColumns<%s>(size);" % typeName)
+            self.o("\t\tsetPtr_<%d>(getOffset_(res)-8);" % (node.offset))
+            self.o("\t\treturn res;")
+        self.o("\t}")
+
+    def generate_packed_in(self, node: Value, uname: str) -> None:
+        typeName = typeMap[node.type_.type]
+        self.o("\tbool has%s() const noexcept {" % (uname))
+        self.o("\t\treturn getInner_<std::uint32_t, %d>(0) != 0;" % (node.offset))
+        self.o("\t}")
+        self.o("\t")
+        self.output_doc(node, "\t")
+        self.o(
+            "\tscalgoproto::PackedListIn<%s> %s() const {" % (typeName, lcamel(uname))
+        )
+        self.o("\t\tassert(has%s());" % uname)
+        self.o(
+            "\t\treturn getPackedList_<%s>(reader_, getPtr_<false, scalgoproto::LISTMAGIC, %d, 1, 4>());"
+            % (typeName, node.offset)
+        )
+        self.o("\t}")
+
+    def generate_packed_out(self, node: Value, uname: str, outer: str) -> None:
+        typeName = typeMap[node.type_.type]
+        self.o(
+            "\t%s & set%s(scalgoproto::PackedListOut<%s> value) {"
+            % (outer, uname, typeName)
+        )
+        self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
+        self.o("\t\treturn * this;")
+        self.o("\t}")
+        self.o(
+            "\t%s & add%s(const %s * values, size_t count) {"
+            % (outer, uname, typeName)
+        )
+        self.o(
+            "\t\treturn set%s(writer_.constructPackedList(values, count));" % (uname)
+        )
+        self.o("\t}")
+
+    def map_key_type(self, node: Value) -> str:
+        if node.key.type == TokenType.TEXT:
+            return "std::string_view"
+        return typeMap[node.key.type]
+
+    def generate_map_in(self, node: Value, uname: str) -> None:
+        types = "%s, %s" % (self.map_key_type(node), self.in_list_types(node)[0])
+        self.o("\tbool has%s() const noexcept {" % (uname))
+        self.o("\t\treturn getInner_<std::uint32_t, %d>(0) != 0;" % (node.offset))
+        self.o("\t}")
+        self.o("\t")
+        self.output_doc(node, "\t")
+        self.o("\tscalgoproto::MapIn<%s> %s() const {" % (types, lcamel(uname)))
+        self.o("\t\tassert(has%s());" % uname)
+        self.o(
+            "\t\treturn getMap_<%s>(reader_, getPtr_<false, scalgoproto::MAPMAGIC, %d, scalgoproto::MapIn<%s>::SLOT, 4>());"
+            % (types, node.offset, types)
+        )
+        self.o("\t}")
+
+    def generate_map_out(self, node: Value, uname: str, outer: str) -> None:
+        keyType = self.map_key_type(node)
+        valueType = self.out_list_type(node)
+        self.o(
+            "\t%s & set%s(scalgoproto::MapOut<%s, %s> value) {"
+            % (outer, uname, keyType, valueType)
+        )
+        self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
+        self.o("\t\treturn * this;")
+        self.o("\t}")
+        self.o(
+            "\t%s & add%s(const std::pair<%s, %s> * items, size_t count) {"
+            % (outer, uname, keyType, valueType)
+        )
+        self.o("\t\treturn set%s(writer_.constructMap(items, count));" % (uname))
+        self.o("\t}")
+
+    def sorted_list_type(self, node: Value, suffix: str) -> str:
+        """Return the SortedListIn of a sorted list, or the In type of its
+        tables and the accessors of their key and if it is set for suffix Key"""
+        tableIn = "%sIn" % self.qualify(node.table)
+        name = lcamel(self.value(node.sort_member.identifier))
+        key = "&%s::%s" % (tableIn, name)
+        if suffix == "Key":
+            has = "nullptr"
+            if node.sort_member.type_.type == TokenType.TEXT:
+                has = "&%s::has%s" % (tableIn, ucamel(name))
+            return "%s, %s, %s" % (tableIn, key, has)
+        return "scalgoproto::SortedListIn<%s, %s>" % (tableIn, key)
+
+    def generate_sorted_in(self, node: Value, uname: str) -> None:
+        typeName = self.sorted_list_type(node, "In")
+        self.o("\tbool has%s() const noexcept {" % (uname))
+        self.o("\t\treturn getInner_<std::uint32_t, %d>(0) != 0;" % (node.offset))
+        self.o("\t}")
+        self.o("\t")
+        self.output_doc(node, "\t")
+        self.o("\t%s %s() const {" % (typeName, lcamel(uname)))
+        self.o("\t\tassert(has%s());" % uname)
+        self.o(
+            "\t\treturn getObject_<%s>(reader_, getPtr_<false, scalgoproto::LISTMAGIC, %d, 4>());"
+            % (typeName, node.offset)
+        )
+        self.o("\t}")
+
+    def generate_sorted_out(self, node: Value, uname: str, outer: str) -> None:
+        typeName = self.out_list_type(node)
+        key = self.sorted_list_type(node, "Key")
+        self.output_doc(node, "\t", [], ["The list is sorted on finalize"])
+        self.o(
+            "\t%s & set%s(scalgoproto::ListOut<%s> value) {"
+            % (outer, uname, typeName)
+        )
+        self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
+        self.o("\t\tsortOnFinalize_<%s>(getOffset_(value));" % key)
+        self.o("\t\treturn * this;")
+        self.o("\t}")
+        self.output_doc(node, "\t", [], ["The list is sorted on finalize"])
+        self.o("\tscalgoproto::ListOut<%s> add%s(size_t size) {" % (typeName, uname))
+        self.o("\t\tauto res = writer_.constructList<%s>(size);" % typeName)
+        self.o("\t\tset%s(res);" % uname)
+        self.o("\t\treturn res;")
+        self.o("\t}")
+
+    def generate_dictionary_in(self, node: Value, uname: str) -> None:
+        self.o("\tbool has%s() const noexcept {" % (uname))
+        self.o("\t\treturn getInner_<std::uint32_t, %d>(0) != 0;" % (node.offset))
+        self.o("\t}")
+        self.o("\t")
+        self.output_doc(node, "\t")
+        self.o("\tscalgoproto::DictionaryListIn %s() const {" % (lcamel(uname)))
+        self.o("\t\tassert(has%s());" % uname)
+        self.o(
+            "\t\treturn getDictionaryList_(reader_, getPtr_<false, scalgoproto::LISTMAGIC, %d, 1, 8>());"
+            % (node.offset)
+        )
+        self.o("\t}")
+
+    def generate_dictionary_out(self, node: Value, uname: str, outer: str) -> None:
+        self.o(
+            "\t%s & set%s(scalgoproto::DictionaryListOut value) {"
+            % (outer, uname)
+        )
+        self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
+        self.o("\t\treturn * this;")
+        self.o("\t}")
+        self.o(
+            "\t%s & add%s(const std::string_view * values, size_t count) {"
+            % (outer, uname)
+        )
+        self.o(
+            "\t\treturn set%s(writer_.constructDictionaryList(values, count));"
+            % (uname)
+        )
+        self.o("\t}")
+
     def generate_bool_in(self, node: Value, uname: str) -> None:
         if node.inplace:
             raise ICE()
@@ -415,24 +607,20 @@ class Generator:
         self.o("")
         if not node.inplace:
             self.o(
-                "\t%s & set%s(%sOut value) noexcept {"
+                "\t%s & set%s(%sOut value) {"
                 % (outer, uname, self.qualify(node.table))
             )
             self.o("\t\tassert(!has%s());" % (uname))
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(value)-8);" % (node.offset)
-            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(value)-8);" % (node.offset))
             self.o("\t\treturn *this;")
             self.o("\t}")
-            self.o("\t%sOut add%s() noexcept {" % (self.qualify(node.table), uname))
+            self.o("\t%sOut add%s() {" % (self.qualify(node.table), uname))
             self.o("\t\tassert(!has%s());" % (uname))
             self.o(
                 "\t\tauto res = writer_.construct<%sOut>();"
                 % (self.qualify(node.table),)
             )
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(res)-8);" % (node.offset)
-            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(res)-8);" % (node.offset))
             self.o("\t\treturn res;")
             self.o("\t}")
         elif not node.table.empty:
@@ -464,7 +652,7 @@ class Generator:
             self.o("\t}")
         elif not inplace:
             self.o(
-                "\tvoid set%s(%sOut value) noexcept {"
+                "\tvoid set%s(%sOut value) {"
                 % (uname, self.qualify(node.table))
             )
             self.o("\t\tsetType_(%d);" % (idx))
@@ -518,15 +706,15 @@ class Generator:
             self.o("\t\tsetInner_<std::uint32_t, %d>(text.size());" % (node.offset))
             self.o("\t\taddInplaceText_(writer_, offset_+SIZE, text);")
         else:
-            self.o("\t%s set%s(scalgoproto::TextOut t) noexcept {" % (outer, uname))
-            self.o("\t\tsetInner_<std::uint32_t, %d>(getOffset_(t));" % (node.offset))
+            self.o("\t%s set%s(scalgoproto::TextOut t) {" % (outer, uname))
+            self.o("\t\tsetPtr_<%d>(getOffset_(t));" % (node.offset))
             self.o("\t\treturn *this;")
             self.o("\t}")
             self.o(
-                "\tscalgoproto::TextOut add%s(std::string_view t) noexcept {" % (uname)
+                "\tscalgoproto::TextOut add%s(std::string_view t) {" % (uname)
             )
             self.o("\t\tauto res = writer_.constructText(t);")
-            self.o("\t\tsetInner_<std::uint32_t, %d>(getOffset_(res));" % (node.offset))
+            self.o("\t\tsetPtr_<%d>(getOffset_(res));" % (node.offset))
             self.o("\t\treturn res;")
         self.o("\t}")
 
@@ -539,7 +727,7 @@ class Generator:
             self.o("\t\tsetSize_(text.size());")
             self.o("\t\taddInplaceText_(writer_, next_, text);")
         else:
-            self.o("\tvoid set%s(scalgoproto::TextOut t) noexcept {" % (uname))
+            self.o("\tvoid set%s(scalgoproto::TextOut t) {" % (uname))
             self.o("\t\tsetType_(%d);" % (idx))
             self.o("\t\tsetObject_(getOffset_(t));")
             self.o("\t}")
@@ -557,7 +745,19 @@ class Generator:
         self.o("\t}")
         self.o("\t")
         self.output_doc(node, "\t")
-        self.o("\tscalgoproto::Bytes %s()  {" % (lcamel(uname)))
+        if node.compressed:
+            # Decompressed on every read, so the reader holds no state
+            self.o("\tstd::string %s() const {" % (lcamel(uname)))
+            self.o(
+                "\t\treturn scalgoproto::zlibDecompress(%sCompressed());"
+                % (lcamel(uname))
+            )
+            self.o("\t}")
+            self.o("\t")
+            self.o("\t/// The zlib stream %s is stored as" % (lcamel(uname)))
+            self.o("\tscalgoproto::Bytes %sCompressed() const {" % (lcamel(uname)))
+        else:
+            self.o("\tscalgoproto::Bytes %s()  {" % (lcamel(uname)))
         self.o(
             "\t\treturn getBytes_(getPtr_<%s, scalgoproto::BYTESMAGIC, %d>());"
             % (bs(node.inplace), node.offset)
@@ -584,19 +784,47 @@ class Generator:
             self.o("\t}")
             self.o("\tvoid add%s(scalgoproto::Bytes bytes) noexcept {" % (uname,))
             self.o("\t\tadd%s(bytes.first, bytes.second);"%(uname, ));
+        elif node.compressed:
+            self.o(
+                "\tscalgoproto::BytesOut add%s(const char * data, size_t size) {"
+                % (uname,)
+            )
+            self.o("\t\tauto z = scalgoproto::zlibCompress(data, size);")
+            self.o("\t\tauto res = writer_.constructBytes(z.data(), z.size());")
+            self.o("\t\tsetPtr_<%d>(getOffset_(res));" % (node.offset,))
+            self.o("\t\treturn res;")
+            self.o("\t}")
+            self.o(
+                "\tscalgoproto::BytesOut add%s(scalgoproto::Bytes bytes) {" % (uname,)
+            )
+            self.o("\t\treturn add%s(bytes.first, bytes.second);" % (uname,))
+            self.o("\t}")
+            self.o("\t/// Set %s to a zlib stream compressed already" % (lcamel(uname)))
+            self.o(
+                "\t%s & set%sCompressed(scalgoproto::BytesOut b) {"
+                % (outer, uname)
+            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(b));" % (node.offset,))
+            self.o("\t\treturn *this;")
+            self.o("\t}")
+            self.o(
+                "\t%s & set%sCompressed(scalgoproto::Bytes bytes) noexcept {"
+                % (outer, uname)
+            )
+            self.o(
+                "\t\treturn set%sCompressed(writer_.constructBytes(bytes));" % (uname,)
+            )
         else:
-            self.o("\t%s & set%s(scalgoproto::BytesOut b) noexcept {" % (outer, uname))
-            self.o("\t\tsetInner_<std::uint32_t, %d>(getOffset_(b));" % (node.offset,))
+            self.o("\t%s & set%s(scalgoproto::BytesOut b) {" % (outer, uname))
+            self.o("\t\tsetPtr_<%d>(getOffset_(b));" % (node.offset,))
             self.o("\t\treturn *this;")
             self.o("\t}")
             self.o(
-                "\tscalgoproto::BytesOut add%s(const char * data, size_t size) noexcept {"
+                "\tscalgoproto::BytesOut add%s(const char * data, size_t size) {"
                 % (uname,)
             )
             self.o("\t\tauto res = writer_.constructBytes(data, size);")
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(res));" % (node.offset,)
-            )
+            self.o("\t\tsetPtr_<%d>(getOffset_(res));" % (node.offset,))
             self.o("\t\treturn res;")
             self.o("\t}")
             self.o(
@@ -604,10 +832,6 @@ class Generator:
                 % (uname,)
             )
             self.o("\t\treturn add%s(bytes.first, bytes.second);"%(uname, ))
-            self.o(
-                "\t\tsetInner_<std::uint32_t, %d>(getOffset_(res));" % (node.offset,)
-            )
-            self.o("\t\treturn res;")
         self.o("\t}")
 
     def generate_union_bytes_out(
@@ -622,7 +846,7 @@ class Generator:
             self.o("\tvoid add%s(scalgoproto::Bytes bytes) noexcept {" % (uname,))
             self.o("\t\tadd%s(bytes.first, bytes.second);"%(uname, ))
         else:
-            self.o("\tvoid set%s(scalgoproto::BytesOut b) noexcept {" % (uname,))
+            self.o("\tvoid set%s(scalgoproto::BytesOut b) {" % (uname,))
             self.o("\t\tsetType_(%d);" % (idx,))
             self.o("\t\tsetObject_(getOffset_(b));")
             self.o("\t}")
@@ -695,7 +919,17 @@ class Generator:
         n = self.value(node.identifier)
         uname = ucamel(n)
         typeName = self.value(node.type_)
-        if node.list_:
+        if node.columnar:
+            self.generate_columnar_in(node, uname)
+        elif node.packed:
+            self.generate_packed_in(node, uname)
+        elif node.dictionary:
+            self.generate_dictionary_in(node, uname)
+        elif node.map_:
+            self.generate_map_in(node, uname)
+        elif node.sorted_:
+            self.generate_sorted_in(node, uname)
+        elif node.list_:
             self.generate_list_in(node, uname)
         elif node.type_.type == TokenType.BOOL:
             self.generate_bool_in(node, uname)
@@ -719,7 +953,17 @@ class Generator:
     def generate_value_out(self, node: Value, outer: str) -> None:
         uname = ucamel(self.value(node.identifier))
         self.output_doc(node, "\t")
-        if node.list_:
+        if node.columnar:
+            self.generate_columnar_out(node, uname, outer)
+        elif node.packed:
+            self.generate_packed_out(node, uname, outer)
+        elif node.dictionary:
+            self.generate_dictionary_out(node, uname, outer)
+        elif node.map_:
+            self.generate_map_out(node, uname, outer)
+        elif node.sorted_:
+            self.generate_sorted_out(node, uname, outer)
+        elif node.list_:
             self.generate_list_out(node, uname, outer)
         elif node.type_.type == TokenType.BOOL:
             self.generate_bool_out(node, uname, outer)
@@ -744,6 +988,104 @@ class Generator:
         self.switch_namespace("scalgoproto")
         self.o(mm)
 
+    def generate_value_mut(self, table: Table, node: Value) -> None:
+        """Generate a setter changing node in place, or a getter of the table
+        node changing it in place. Pointers are set to objects written by a
+        writer appending to the message, see Writer::openAppend"""
+        if (
+            node.map_
+            or node.columnar
+            or node.packed
+            or node.dictionary
+            or node.sorted_
+        ):
+            return
+        uname = ucamel(self.value(node.identifier))
+        if node.list_:
+            if node.inplace or node.union:
+                return
+            self.o(
+                "\t%sMut & set%s(scalgoproto::ListOut<%s> value) {"
+                % (table.name, uname, self.out_list_type(node))
+            )
+            self.o("\t\tmutPtr_<%d>(outOffset_(value)-8);" % node.offset)
+            self.o("\t\treturn *this;")
+            self.o("\t}")
+            return
+        if node.table:
+            if node.table.empty:
+                return
+            self.o("\t%sMut %s() const {" % (self.qualify(node.table), lcamel(uname)))
+            self.o("\t\tassert(has%s());" % uname)
+            self.o(
+                "\t\treturn getObject_<%sMut>(reader_, getPtr_<%s, %sIn::MAGIC, %d>());"
+                % (
+                    self.qualify(node.table),
+                    bs(node.inplace),
+                    node.table.name,
+                    node.offset,
+                )
+            )
+            self.o("\t}")
+            if not node.inplace:
+                self.o(
+                    "\t%sMut & set%s(%sOut value) {"
+                    % (table.name, uname, self.qualify(node.table))
+                )
+                self.o("\t\tmutPtr_<%d>(outOffset_(value)-8);" % node.offset)
+                self.o("\t\treturn *this;")
+                self.o("\t}")
+            return
+        if node.type_.type in (TokenType.TEXT, TokenType.BYTES):
+            if node.inplace:
+                return
+            if node.compressed:
+                uname += "Compressed"
+            self.o(
+                "\t%sMut & set%s(scalgoproto::%sOut value) {"
+                % (
+                    table.name,
+                    uname,
+                    "Text" if node.type_.type == TokenType.TEXT else "Bytes",
+                )
+            )
+            self.o("\t\tmutPtr_<%d>(outOffset_(value));" % node.offset)
+            self.o("\t\treturn *this;")
+            self.o("\t}")
+            return
+        if node.type_.type == TokenType.BOOL:
+            tn = "bool"
+            setter = "mutBit_<%d, %d>(value);" % (node.offset, node.bit)
+        elif node.type_.type in typeMap:
+            tn = typeMap[node.type_.type]
+            setter = "mutInner_<%s, %d>(value);" % (tn, node.offset)
+        elif node.enum:
+            tn = self.qualify(node.enum)
+            setter = "mutInner_<%s, %d>(value);" % (tn, node.offset)
+        elif node.struct:
+            tn = "const %s &" % self.qualify(node.struct)
+            setter = "mutInner_<%s, %d>(value);" % (
+                self.qualify(node.struct),
+                node.offset,
+            )
+        else:
+            return
+        setters = [(node.offset, setter)]
+        if node.optional and node.type_.type not in (TokenType.F32, TokenType.F64):
+            setters.append(
+                (
+                    node.has_offset,
+                    "mutBit_<%d, %d>(true);" % (node.has_offset, node.has_bit),
+                )
+            )
+        self.o("\t%sMut & set%s(%s value) {" % (table.name, uname, tn))
+        # Members are checked to be stored on setting, so set the last one
+        # first to change nothing when it is not
+        for (_, setter) in sorted(setters, reverse=True):
+            self.o("\t\t%s" % setter)
+        self.o("\t\treturn *this;")
+        self.o("\t}")
+
     def generate_union_copy(self, union: Union, inplace: bool) -> None:
         self.o(
             "\tvoid copy_(%sIn<%s> i) {" % (union.name, "true" if inplace else "false")
@@ -768,9 +1110,15 @@ class Generator:
             elif node.table:
                 if node.table.empty:
                     self.o("\t\tcase %s: set%s(); break;" % (c, uname))
+                elif inplace:
+                    self.o(
+                        "\t\tcase %s: add%s().copy_(i.%s(), false); break;"
+                        % (c, uname, lname)
+                    )
                 else:
                     self.o(
-                        "\t\tcase %s: add%s().copy_(i.%s()); break;" % (c, uname, lname)
+                        "\t\tcase %s: set%s(copyTable_<%sOut>(writer_, i.%s())); break;"
+                        % (c, uname, self.qualify(node.table), lname)
                     )
             else:
                 raise ICE()
@@ -867,54 +1215,235 @@ class Generator:
             )
             self.o("")
 
+    def generate_member_copy(self, node: Value) -> None:
+        lname = lcamel(self.value(node.identifier))
+        uname = ucamel(lname)
+        if node.packed:
+            self.o(
+                "\t\tif (i.has%s()) set%s(writer_.constructPackedList(i.%s()));"
+                % (uname, uname, lname)
+            )
+        elif node.dictionary:
+            self.o(
+                "\t\tif (i.has%s()) set%s(writer_.constructDictionaryList(i.%s()));"
+                % (uname, uname, lname)
+            )
+        elif node.map_:
+            self.o(
+                "\t\tif (i.has%s()) set%s(writer_.constructMap<%s, %s>(i.%s()));"
+                % (
+                    uname,
+                    uname,
+                    self.map_key_type(node),
+                    self.out_list_type(node),
+                    lname,
+                )
+            )
+        elif node.list_:
+            self.o(
+                "\t\tif (i.has%s()) add%s(i.%s().size()).copy_(i.%s());"
+                % (uname, uname, lname, lname)
+            )
+        elif (
+            node.type_.type in typeMap
+            or node.type_.type == TokenType.BOOL
+            or node.enum
+            or node.struct
+        ):
+            if node.optional or node.enum:
+                self.o("\t\tif (i.has%s()) set%s(i.%s());" % (uname, uname, lname))
+            else:
+                self.o("\t\tset%s(i.%s());" % (uname, lname))
+        elif node.table:
+            if node.table.empty:
+                self.o("\t\tif (i.has%s()) add%s();" % (uname, uname))
+            elif node.inplace:
+                self.o(
+                    "\t\tif (i.has%s()) add%s().copy_(i.%s(), false);"
+                    % (uname, uname, lname)
+                )
+            else:
+                self.o(
+                    "\t\tif (i.has%s()) set%s(copyTable_<%sOut>(writer_, i.%s()));"
+                    % (uname, uname, self.qualify(node.table), lname)
+                )
+        elif node.union:
+            self.o("\t\tif (i.has%s()) %s().copy_(i.%s());" % (uname, lname, lname))
+        elif node.type_.type == TokenType.TEXT:
+            self.o("\t\tif (i.has%s()) add%s(i.%s());" % (uname, uname, lname))
+        elif node.compressed:
+            # Copy the compressed stream instead of compressing again
+            self.o(
+                "\t\tif (i.has%s()) set%sCompressed(i.%sCompressed());"
+                % (uname, uname, lname)
+            )
+        elif node.type_.type == TokenType.BYTES:
+            self.o(
+                "\t\tif (i.has%s()) add%s((const char*)i.%s().first, i.%s().second);"
+                % (uname, uname, lname, lname)
+            )
+        else:
+            raise ICE()
+
     def generate_table_copy(self, table: Table) -> None:
-        self.o("\tvoid copy_(%sIn i) {" % (table.name))
-        for ip in (True, False):
-            for node in table.members:
-                lname = lcamel(self.value(node.identifier))
-                uname = ucamel(lname)
-                if bool(node.inplace) != ip:
-                    continue
-                if node.list_:
-                    self.o(
-                        "\t\tif (i.has%s()) add%s(i.%s().size()).copy_(i.%s());"
-                        % (uname, uname, lname, lname)
-                    )
-                elif (
-                    node.type_.type in typeMap
-                    or node.type_.type == TokenType.BOOL
-                    or node.enum
-                    or node.struct
-                ):
-                    if node.optional:
-                        self.o(
-                            "\t\tif (i.has%s()) set%s(i.%s());" % (uname, uname, lname)
-                        )
-                    else:
-                        self.o("\t\tset%s(i.%s());" % (uname, lname))
-                elif node.table:
-                    if node.table.empty:
-                        self.o("\t\tif (i.has%s()) add%s();" % (uname, uname))
-                    else:
-                        self.o(
-                            "\t\tif (i.has%s()) add%s().copy_(i.%s());"
-                            % (uname, uname, lname)
-                        )
-                elif node.union:
-                    self.o(
-                        "\t\tif (i.has%s()) %s().copy_(i.%s());" % (uname, lname, lname)
-                    )
-                elif node.type_.type == TokenType.TEXT:
-                    self.o("\t\tif (i.has%s()) add%s(i.%s());" % (uname, uname, lname))
-                elif node.type_.type == TokenType.BYTES:
-                    self.o(
-                        "\t\tif (i.has%s()) add%s((const char*)i.%s().first, i.%s().second);"
-                        % (uname, uname, lname, lname)
-                    )
-                else:
-                    raise ICE()
+        # Inplace members follow the table so they are copied first. Tables
+        # without them are trimmed when compacting, see TableOut::trimCopy_,
+        # after the members stored in the table are copied
+        inplace = [node for node in table.members if node.inplace]
+        self.o(
+            "\tvoid copy_(%sIn i, bool%s=true) {"
+            % (table.name, "" if inplace else " trim")
+        )
+        for node in inplace:
+            self.generate_member_copy(node)
+        pointers = []
+        for node in table.members:
+            if node.inplace:
+                continue
+            if pointer_member(node):
+                pointers.append(node)
+            else:
+                self.generate_member_copy(node)
+        if not inplace:
+            fields = ", ".join("{%d, %d}" % f for f in trim_fields(table))
+            self.o("\t\tif (trim) trimCopy_<SIZE>(i, DEFAULT, {%s});" % fields)
+        for node in pointers:
+            self.generate_member_copy(node)
         self.o("\t}")
 
+    def column_widths(self, table: Table) -> str:
+        """Return the bytes per row of every column of table, zero for bits"""
+        return ", ".join(
+            "0" if node.type_.type == TokenType.BOOL else str(node.bytes)
+            for node in table.members
+        )
+
+    def column_type(self, node: Value) -> str:
+        if node.type_.type == TokenType.BOOL:
+            return "bool"
+        elif node.type_.type in typeMap:
+            return typeMap[node.type_.type]
+        elif node.enum:
+            return self.qualify(node.enum)
+        elif node.struct:
+            return self.qualify(node.struct)
+        else:
+            raise ICE()
+
+    def generate_columns(self, table: Table) -> None:
+        base = "scalgoproto::ColumnsIn<%s>" % self.column_widths(table)
+        defaults = b"".join(
+            table.default[node.offset : node.offset + node.bytes]
+            for node in table.members
+            if node.type_.type != TokenType.BOOL
+        )
+        self.output_doc(table)
+        self.o("class %sRowIn: public %s {" % (table.name, base))
+        self.o("\tfriend class %sColumnsIn;" % table.name)
+        self.o("\tstd::uint32_t index_;")
+        self.o(
+            "\t%sRowIn(const %s & columns, std::uint32_t index) noexcept: %s(columns), index_(index) {}"
+            % (table.name, base, base)
+        )
+        self.o("public:")
+        for (c, node) in enumerate(table.members):
+            lname = lcamel(self.value(node.identifier))
+            uname = ucamel(lname)
+            typeName = self.column_type(node)
+            if node.enum:
+                self.o("\tbool has%s() const noexcept {" % (uname))
+                self.o("\t\treturn get_<std::uint8_t, %d>(index_) != 255;" % c)
+                self.o("\t}")
+            self.output_doc(node, "\t")
+            self.o("\t%s %s() const noexcept {" % (typeName, lname))
+            if node.enum:
+                self.o("\t\tassert(has%s());" % uname)
+            self.o("\t\treturn get_<%s, %d>(index_);" % (typeName, c))
+            self.o("\t}")
+        self.o("};")
+        self.o("")
+        self.output_doc(table)
+        self.o("class %sColumnsIn: public %s {" % (table.name, base))
+        self.o("\tfriend class scalgoproto::In;")
+        self.o("protected:")
+        self.o(
+            '\t%sColumnsIn(const scalgoproto::Reader & reader, scalgoproto::Ptr p) noexcept: %s(reader, p, "%s") {}'
+            % (table.name, base, cescape(defaults))
+        )
+        self.o("public:")
+        self.o("\tusing value_type = %sRowIn;" % table.name)
+        self.o("\tusing iterator = scalgoproto::ColumnsIterator<%sColumnsIn>;" % table.name)
+        self.o("\t%sRowIn operator[](size_t index) const noexcept {" % table.name)
+        self.o("\t\tassert(index < size_);")
+        self.o("\t\treturn %sRowIn(*this, index);" % table.name)
+        self.o("\t}")
+        self.o("\t%sRowIn at(size_t index) const {" % table.name)
+        self.o('\t\tif (index >= size_) throw std::out_of_range("out of range");')
+        self.o("\t\treturn %sRowIn(*this, index);" % table.name)
+        self.o("\t}")
+        self.o("\titerator begin() const noexcept {return iterator(this, 0);}")
+        self.o("\titerator end() const noexcept {return iterator(this, size_);}")
+        for (c, node) in enumerate(table.members):
+            typeName = self.column_type(node)
+            self.output_doc(node, "\t")
+            self.o(
+                "\tscalgoproto::ListIn<%s> %s() const {"
+                % (typeName, lcamel(self.value(node.identifier)))
+            )
+            self.o("\t\treturn column_<%s, %d>();" % (typeName, c))
+            self.o("\t}")
+        self.o("};")
+        self.o("")
+
+        base = "scalgoproto::ColumnsOut<%s>" % self.column_widths(table)
+        self.output_doc(table)
+        self.o("class %sRowOut: public %s {" % (table.name, base))
+        self.o("\tfriend class %sColumnsOut;" % table.name)
+        self.o("\tstd::uint32_t index_;")
+        self.o(
+            "\t%sRowOut(const %s & columns, std::uint32_t index) noexcept: %s(columns), index_(index) {}"
+            % (table.name, base, base)
+        )
+        self.o("public:")
+        for (c, node) in enumerate(table.members):
+            typeName = self.column_type(node)
+            self.output_doc(node, "\t")
+            self.o(
+                "\t%sRowOut & set%s(const %s & value) noexcept {"
+                % (table.name, ucamel(self.value(node.identifier)), typeName)
+            )
+            self.o("\t\tset_<%s, %d>(index_, value);" % (typeName, c))
+            self.o("\t\treturn *this;")
+            self.o("\t}")
+        self.o("};")
+        self.o("")
+        self.output_doc(table)
+        self.o("class %sColumnsOut: public %s {" % (table.name, base))
+        self.o("\tfriend class scalgoproto::Out;")
+        self.o("\tfriend class scalgoproto::Writer;")
+        self.o("protected:")
+        self.o(
+            '\t%sColumnsOut(scalgoproto::Writer & writer, bool withHeader, std::uint32_t size): %s(writer, withHeader, size, "%s") {}'
+            % (table.name, base, cescape(defaults))
+        )
+        self.o("public:")
+        self.o("\tusing IN = %sColumnsIn;" % table.name)
+        self.o("\t%sRowOut operator[](size_t index) noexcept {" % table.name)
+        self.o("\t\tassert(index < size_);")
+        self.o("\t\treturn %sRowOut(*this, index);" % table.name)
+        self.o("\t}")
+        for (c, node) in enumerate(table.members):
+            typeName = self.column_type(node)
+            self.output_doc(node, "\t")
+            self.o(
+                "\tscalgoproto::ListOut<%s> %s() noexcept {"
+                % (typeName, lcamel(self.value(node.identifier)))
+            )
+            self.o("\t\treturn column_<%s, %d>();" % (typeName, c))
+            self.o("\t}")
+        self.o("};")
+        self.o("")
+
     def generate_table(self, table: Table) -> None:
         # Recursively generate direct contained members
         for value in table.members:
@@ -962,11 +1491,16 @@ class Generator:
         self.o("public:")
         self.o("\tstatic constexpr std::uint32_t SIZE = %d;" % (len(table.default)))
         self.o("\tstatic constexpr std::uint32_t MAGIC = 0x%08X;" % (table.magic))
+        if any(node.inplace for node in table.members):
+            self.o("\tstatic constexpr bool INPLACE = true;")
         self.o("\tusing IN=%sIn;" % (table.name))
         self.o("protected:")
         self.o(
-            '\t%sOut(scalgoproto::Writer & writer, bool withHeader): scalgoproto::TableOut(writer, withHeader, MAGIC, "%s", SIZE) {}'
-            % (table.name, cescape(table.default))
+            '\tstatic constexpr const char * DEFAULT = "%s";' % cescape(table.default)
+        )
+        self.o(
+            "\t%sOut(scalgoproto::Writer & writer, bool withHeader): scalgoproto::TableOut(writer, withHeader, MAGIC, DEFAULT, SIZE) {}"
+            % (table.name)
         )
         self.o("public:")
         for node in table.members:
@@ -978,6 +1512,30 @@ class Generator:
             % self.qualify(table, True)
         )
         self.o("")
+        self.switch_namespace(table.namespace)
+        self.o("/**")
+        self.o(
+            " * Change the members of fixed size of %s in place, in a message"
+            % table.name
+        )
+        self.o(" * in writable memory")
+        self.o(" */")
+        self.o("class %sMut: public %sIn {" % (table.name, table.name))
+        self.o("\tfriend class scalgoproto::In;")
+        self.o("\tfriend class scalgoproto::Reader;")
+        self.o("protected:")
+        self.o(
+            "\t%sMut(const scalgoproto::Reader & reader, scalgoproto::Ptr p): %sIn(reader, p) {}"
+            % (table.name, table.name)
+        )
+        self.o("public:")
+        for node in table.members:
+            self.generate_value_mut(table, node)
+        self.o("};")
+        self.o("")
+        if table.columnar:
+            self.switch_namespace(table.namespace)
+            self.generate_columns(table)
 
     def generate_struct(self, node: Struct) -> None:
         # Recursively generate direct contained members
@@ -1068,8 +1626,8 @@ class Generator:
             self.switch_namespace(None)
             self.o("#endif //__SCALGOPROTO_%s__" % self.current_file)
             po = os.path.join(output, "%s.hh" % self.current_file)
-            if not os.path.exists(po) or open(po, "r").read() != self.out.getvalue():
-                open(po, "w").write(self.out.getvalue())
+            write_if_changed(po, self.out.getvalue())
+            self.files.append(po)
         if name:
             self.out = io.StringIO()
             self.o("//THIS FILE IS GENERATED DO NOT EDIT")
@@ -1084,10 +1642,10 @@ class Generator:
 
             imports = set()
             for node in ast:
-                if node.document != 0:
+                if node.document != self.documents.root.id:
                     continue
                 for u in node.uses:
-                    if u.document == 0:
+                    if u.document == self.documents.root.id:
                         continue
                     imports.add(self.documents.by_id[u.document].name)
 
@@ -1095,7 +1653,7 @@ class Generator:
                 self.o('#include "%s.hh"' % i)
 
         for node in ast:
-            if node.document != 0:
+            if node.document != self.documents.root.id:
                 continue
 
             if not single:
@@ -1135,6 +1693,8 @@ def run(args) -> int:
             return 1
         g = Generator(documents)
         g.generate(ast, args.output, args.single)
+        if args.depfile:
+            write_depfile(args.depfile, g.files, documents.dependencies())
         return 0
     except ParseError as err:
         err.describe(documents)
@@ -1146,4 +1706,5 @@ def setup(subparsers) -> None:
     cmd.add_argument("schema", help="schema to generate things from")
     cmd.add_argument("output", help="where do we store the output")
     cmd.add_argument("--single", action="store_true")
+    cmd.add_argument("--depfile", help="write a make style depfile to this path")
     cmd.set_defaults(func=run)
@@ -11,19 +11,31 @@ class Documents:
     by_id: ty.List[Document] = []
     root: Document
     lookup = []
+    parsed: ty.Dict[int, ty.List[ty.Any]] = None
+    imports: ty.Dict[int, ty.List[int]] = None
+    annotated: ty.Set[int] = None
 
     def __init__(self):
         self.by_name = {}
         self.by_id = []
         self.lookup = []
+        self.parsed = {}
+        self.imports = {}
+        self.annotated = set()
 
-    def read_root(self, path: str):
-        data = open(path, "r").read()
-        self.lookup.append(os.path.dirname(path))
+    def read_root(self, path: str) -> Document:
         name = os.path.splitext(os.path.basename(path))[0]
-        self.root = Document(0, name, path, data)
+        lookup = os.path.dirname(path)
+        if not lookup in self.lookup:
+            self.lookup.append(lookup)
+        if name in self.by_name:
+            self.root = self.by_name[name]
+            return self.root
+        data = open(path, "r").read()
+        self.root = Document(len(self.by_id), name, path, data)
         self.by_name[name] = self.root
         self.by_id.append(self.root)
+        return self.root
 
     def read(self, name: str):
         for p in self.lookup:
@@ -36,6 +48,22 @@ class Documents:
                 return doc
         return None
 
+    def dependencies(self, root: int = None) -> ty.List[str]:
+        """Return the paths of the root document and all documents it imports"""
+        if root is None:
+            root = self.root.id
+        ans: ty.List[str] = []
+        seen = set([root])
+        stack = [root]
+        while stack:
+            d = stack.pop()
+            ans.append(self.by_id[d].path)
+            for i in self.imports.get(d, []):
+                if not i in seen:
+                    seen.add(i)
+                    stack.append(i)
+        return ans
+
 
 def addDocumentsParams(cmd):
     pass
@@ -6,7 +6,7 @@ import enum
 import typing as ty
 
 from .error import error
-from .sp_tokenize import Token, TokenType, tokenize
+from .sp_tokenize import Token, TokenType, contextual_keywords, tokenize
 from .documents import Documents, Document
 
 
@@ -92,7 +92,16 @@ class Enum(AstNode):
 
 
 class Table(AstNode):
-    __slots__ = ["identifier", "id_", "members", "default", "magic", "name", "empty"]
+    __slots__ = [
+        "identifier",
+        "id_",
+        "members",
+        "default",
+        "magic",
+        "name",
+        "empty",
+        "columnar",
+    ]
     identifier: Token
     id_: Token
     members: ty.List["Value"]
@@ -100,6 +109,7 @@ class Table(AstNode):
     name: str
     magic: int
     empty: bool
+    columnar: bool
 
     def __init__(
         self,
@@ -118,6 +128,7 @@ class Table(AstNode):
         self.magic: int = 0
         self.name = None
         self.empty = False
+        self.columnar = False
 
 
 class Union(AstNode):
@@ -160,6 +171,15 @@ class Value(AstNode):
         "parsed_value",
         "direct_enum",
         "direct_struct",
+        "columnar",
+        "packed",
+        "dictionary",
+        "map_",
+        "key",
+        "sorted_",
+        "sort_key",
+        "sort_member",
+        "compressed",
     ]
     identifier: Token
     value: Token
@@ -167,6 +187,15 @@ class Value(AstNode):
     optional: Token
     list_: Token
     inplace: Token
+    columnar: Token
+    packed: Token
+    dictionary: Token
+    map_: Token
+    key: Token
+    sorted_: Token
+    sort_key: Token
+    sort_member: "Value"
+    compressed: Token
     direct_table: Table
     direct_union: Union
     direct_enum: Enum
@@ -195,6 +224,14 @@ class Value(AstNode):
         direct_enum: Enum,
         direct_struct: Struct,
         doc_comment: Token,
+        columnar: Token = None,
+        packed: Token = None,
+        dictionary: Token = None,
+        map_: Token = None,
+        key: Token = None,
+        sorted_: Token = None,
+        sort_key: Token = None,
+        compressed: Token = None,
     ) -> None:
         super().__init__(token, document, doc_comment)
         self.identifier = identifier
@@ -203,6 +240,15 @@ class Value(AstNode):
         self.optional = optional
         self.list_ = list_
         self.inplace = inplace
+        self.columnar = columnar
+        self.packed = packed
+        self.dictionary = dictionary
+        self.map_ = map_
+        self.key = key
+        self.sorted_ = sorted_
+        self.sort_key = sort_key
+        self.sort_member = None
+        self.compressed = compressed
         self.direct_table = direct_table
         self.direct_union = direct_union
         self.direct_enum = direct_enum
@@ -240,7 +286,9 @@ class Parser:
         self.document = self.documents.root
         self.tokenizer = tokenize(self.document.content, self.document.id)
         self.docstack = [(self.document, self.tokenizer)]
+        self.seen: ty.Set[int] = set([self.document.id])
         self.token = None
+        self.peeked: Token = None
         self.next_token()
         self.context = ""
 
@@ -259,7 +307,26 @@ class Parser:
         return t
 
     def next_token(self) -> None:
-        self.token = next(self.tokenizer)
+        if self.peeked:
+            self.token, self.peeked = self.peeked, None
+        else:
+            self.token = next(self.tokenizer)
+
+    def peek_token(self) -> Token:
+        """Return the token following the current one without consuming it"""
+        if not self.peeked:
+            self.peeked = next(self.tokenizer)
+        return self.peeked
+
+    def contextual_keyword(self, types: ty.List[TokenType]) -> None:
+        """If the current token is an identifier spelling a contextual keyword
+        of one of the given types, turn it into that keyword"""
+        t = self.token
+        if t.type != TokenType.IDENTIFIER:
+            return
+        type_ = contextual_keywords.get(self.value(t))
+        if type_ in types:
+            self.token = t._replace(type=type_)
 
     def parse_content(self) -> ty.List[Value]:
         self.consume_token([TokenType.LBRACE])
@@ -281,12 +348,29 @@ class Parser:
                 optional: Token = None
                 list_: Token = None
                 inplace: Token = None
+                columnar: Token = None
+                packed: Token = None
+                dictionary: Token = None
+                map_: Token = None
+                key: Token = None
+                sorted_: Token = None
+                sort_key: Token = None
+                compressed: Token = None
                 value: Token = None
                 direct_table: Table = None
                 direct_union: Union = None
                 direct_enum: Enum = None
                 direct_struct: Struct = None
-                modifiers = [TokenType.OPTIONAL, TokenType.LIST, TokenType.INPLACE]
+                modifiers = [
+                    TokenType.OPTIONAL,
+                    TokenType.LIST,
+                    TokenType.INPLACE,
+                    TokenType.COLUMNAR,
+                    TokenType.PACKED,
+                    TokenType.DICTIONARY,
+                    TokenType.COMPRESSED,
+                ]
+                self.contextual_keyword(modifiers + [TokenType.MAP])
                 while self.token.type in modifiers:
                     if self.token.type == TokenType.OPTIONAL:
                         optional = self.consume_token([TokenType.OPTIONAL])
@@ -294,6 +378,36 @@ class Parser:
                         list_ = self.consume_token([TokenType.LIST])
                     elif self.token.type == TokenType.INPLACE:
                         inplace = self.consume_token([TokenType.INPLACE])
+                    elif self.token.type == TokenType.COLUMNAR:
+                        columnar = self.consume_token([TokenType.COLUMNAR])
+                    elif self.token.type == TokenType.PACKED:
+                        packed = self.consume_token([TokenType.PACKED])
+                    elif self.token.type == TokenType.DICTIONARY:
+                        dictionary = self.consume_token([TokenType.DICTIONARY])
+                    elif self.token.type == TokenType.COMPRESSED:
+                        compressed = self.consume_token([TokenType.COMPRESSED])
+                    self.contextual_keyword(modifiers + [TokenType.MAP])
+                if self.token.type == TokenType.MAP:
+                    map_ = self.consume_token([TokenType.MAP])
+                    key = self.consume_token(
+                        [
+                            TokenType.BOOL,
+                            TokenType.TEXT,
+                            TokenType.IDENTIFIER,
+                            TokenType.BYTES,
+                            TokenType.I8,
+                            TokenType.I16,
+                            TokenType.I32,
+                            TokenType.I64,
+                            TokenType.U8,
+                            TokenType.U16,
+                            TokenType.UI32,
+                            TokenType.UI64,
+                            TokenType.F32,
+                            TokenType.F64,
+                        ]
+                    )
+                    self.consume_token([TokenType.ARROW])
                 type_ = self.token
                 self.check_token(
                     self.token,
@@ -372,6 +486,18 @@ class Parser:
                                 TokenType.IDENTIFIER,
                             ]
                         )
+                # Without a separator sorted may also name the next member
+                if (
+                    self.token.type == TokenType.IDENTIFIER
+                    and self.value(self.token) == "sorted"
+                    and self.value(self.peek_token()) == "by"
+                ):
+                    self.contextual_keyword([TokenType.SORTED])
+                if self.token.type == TokenType.SORTED:
+                    sorted_ = self.consume_token([TokenType.SORTED])
+                    self.contextual_keyword([TokenType.BY])
+                    self.consume_token([TokenType.BY])
+                    sort_key = self.consume_token([TokenType.IDENTIFIER])
                 members.append(
                     Value(
                         colon,
@@ -387,6 +513,14 @@ class Parser:
                         direct_enum,
                         direct_struct,
                         doc_comment,
+                        columnar,
+                        packed,
+                        dictionary,
+                        map_,
+                        key,
+                        sorted_,
+                        sort_key,
+                        compressed,
                     )
                 )
                 doc_comment = None
@@ -437,8 +571,19 @@ class Parser:
     def value(self, t: Token) -> str:
         return self.documents.by_id[t.document].content[t.index : t.index + t.length]
 
+    def reuse_document(self, document: int) -> ty.List[AstNode]:
+        """Return the nodes of an already parsed document and its imports not seen yet"""
+        ans: ty.List[AstNode] = []
+        for i in self.documents.imports[document]:
+            if not i in self.seen:
+                self.seen.add(i)
+                ans += self.reuse_document(i)
+        ans += self.documents.parsed[document]
+        return ans
+
     def parse_document(self) -> ty.List[AstNode]:
         ans: ty.List[AstNode] = []
+        imports: ty.List[int] = []
         doc_comment: Token = None
         while self.token.type != TokenType.EOF:
             self.context = "message"
@@ -460,6 +605,8 @@ class Parser:
                 name = self.value(i)
                 if not name in self.documents.by_name:
                     self.document = self.documents.read(name)
+                    self.seen.add(self.document.id)
+                    imports.append(self.document.id)
                     self.tokenizer = tokenize(self.document.content, self.document.id)
                     self.docstack.append((self.document, self.tokenizer))
                     self.next_token()
@@ -467,6 +614,14 @@ class Parser:
                     self.docstack.pop()
                     self.document, self.tokenizer = self.docstack[-1]
                     self.content = ""
+                else:
+                    # The document has been parsed before, possibly by another parser
+                    # sharing the same documents, reuse the nodes from that parse
+                    document = self.documents.by_name[name].id
+                    imports.append(document)
+                    if not document in self.seen:
+                        self.seen.add(document)
+                        ans += self.reuse_document(document)
                 self.next_token()
             elif t.type == TokenType.DOCCOMMENT:
                 doc_comment = t
@@ -520,4 +675,8 @@ class Parser:
                 raise ICE()
             if self.token.type in [TokenType.COMMA, TokenType.SEMICOLON]:
                 self.next_token()
+        self.documents.imports[self.document.id] = imports
+        self.documents.parsed[self.document.id] = [
+            n for n in ans if n.document == self.document.id
+        ]
         return ans
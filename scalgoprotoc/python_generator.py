@@ -2,11 +2,13 @@
 """
 Generate python reader/wirter
 """
+import io
+import itertools
 import math
 import typing
 import os
 from types import SimpleNamespace
-from typing import Dict, List, NamedTuple, Set, TextIO, Tuple
+from typing import Dict, Iterator, List, NamedTuple, Set, TextIO, Tuple
 from .documents import Documents, addDocumentsParams
 
 from .annotate import annotate
@@ -23,7 +25,15 @@ from .parser import (
     ICE,
 )
 from .sp_tokenize import Token, TokenType
-from .util import cescape, snake, ucamel
+from .util import (
+    cescape,
+    pointer_member,
+    snake,
+    trim_fields,
+    ucamel,
+    write_depfile,
+    write_if_changed,
+)
 
 TypeInfo = NamedTuple("TypeInfo", [("n", str), ("p", str), ("s", str), ("w", int)])
 
@@ -194,7 +204,9 @@ class Generator:
         self.o()
 
     def generate_inplace_list_constructor(self, node: Value) -> None:
-        if node.type_.type in typeMap:
+        if node.type_.type == TokenType.BOOL:
+            self.o("        l = scalgoproto.BoolListOut(self._writer, size, False)")
+        elif node.type_.type in typeMap:
             ti = typeMap[node.type_.type]
             self.o(
                 "        l = scalgoproto.BasicListOut[%s](self._writer, '%s', %d, size, False)"
@@ -212,9 +224,15 @@ class Generator:
             )
         elif node.table:
             self.o(
-                "        l = scalgoproto.TableListOut[%sOut](self._writer, size, False)"
-                % (node.table)
+                "        l = scalgoproto.TableListOut[%sOut](self._writer, %sOut, size, False)"
+                % (node.table.name, node.table.name)
+            )
+        elif node.union:
+            self.o(
+                "        l = scalgoproto.UnionListOut[%sOut](self._writer, %sOut, size, False)"
+                % (node.union.name, node.union.name)
             )
+
         elif node.type_.type == TokenType.TEXT:
             self.o("        l = scalgoproto.TextListOut(self._writer, size, False)")
         elif node.type_.type == TokenType.BYTES:
@@ -259,7 +277,16 @@ class Generator:
             self.o("    @scalgoproto.Adder")
             self.o("    def %s(self, value: %s):" % (uname, self.out_list_type(node)))
             self.output_doc(node, "        ")
-            self.o("        self._set(%d, value._offset - 8)" % (idx,))
+            self.o("        self._set_ptr(%d, value._offset)" % (idx,))
+            self.o()
+            self.o(
+                "    def add_%s(self, size: int) -> %s:"
+                % (uname, self.out_list_type(node))
+            )
+            self.output_doc(node, "        ")
+            self.o("        res = self._writer.%s" % self.out_list_constructor(node))
+            self.o("        self._set_ptr(%d, res._offset)" % (idx,))
+            self.o("        return res")
             self.o()
         else:
             self.o(
@@ -272,6 +299,209 @@ class Generator:
             self.o("        return l")
             self.o()
 
+    def generate_packed_in(self, node: Value, uname: str) -> None:
+        self.o("    @property")
+        self.o("    def has_%s(self) -> bool:" % (uname,))
+        self.o("        return self._get_uint32(%d, 0) != 0" % (node.offset,))
+        self.o()
+        self.o("    @property")
+        self.o("    def %s(self) -> scalgoproto.PackedListIn:" % (uname,))
+        self.output_doc(node, "        ")
+        self.o("        assert self.has_%s" % uname)
+        self.o(
+            '        return scalgoproto.PackedListIn(self._reader, "%s", *self._get_ptr(%d, scalgoproto.LIST_MAGIC))'
+            % (typeMap[node.type_.type].s, node.offset)
+        )
+        self.o()
+
+    def generate_packed_out(self, node: Value, uname: str) -> None:
+        self.o("    @scalgoproto.Adder")
+        self.o(
+            "    def %s(self, value: typing_.Union[scalgoproto.PackedListOut, scalgoproto.PackedListIn, typing_.Iterable[int]]) -> None:"
+            % (uname,)
+        )
+        self.output_doc(node, "        ")
+        self.o("        self._set_packed_list(%d, value)" % (node.offset))
+        self.o()
+
+    def generate_dictionary_in(self, node: Value, uname: str) -> None:
+        self.o("    @property")
+        self.o("    def has_%s(self) -> bool:" % (uname,))
+        self.o("        return self._get_uint32(%d, 0) != 0" % (node.offset,))
+        self.o()
+        self.o("    @property")
+        self.o("    def %s(self) -> scalgoproto.DictionaryListIn:" % (uname,))
+        self.output_doc(node, "        ")
+        self.o("        assert self.has_%s" % uname)
+        self.o(
+            "        return scalgoproto.DictionaryListIn(self._reader, *self._get_ptr(%d, scalgoproto.LIST_MAGIC))"
+            % (node.offset)
+        )
+        self.o()
+
+    def generate_dictionary_out(self, node: Value, uname: str) -> None:
+        self.o("    @scalgoproto.Adder")
+        self.o(
+            "    def %s(self, value: typing_.Union[scalgoproto.DictionaryListOut, scalgoproto.DictionaryListIn, typing_.Iterable[typing_.Optional[str]]]) -> None:"
+            % (uname,)
+        )
+        self.output_doc(node, "        ")
+        self.o("        self._set_dictionary_list(%d, value)" % (node.offset))
+        self.o()
+
+    def map_types(self, node: Value, suffix: str) -> Tuple[str, str, str, str]:
+        """Return the python types of the keys and values of a map, and the
+        arguments describing them to the runtime. suffix is In or Out"""
+        if node.key.type == TokenType.TEXT:
+            (kt, ka) = ("str", '"text"')
+        else:
+            (kt, ka) = ("int", '"%s"' % typeMap[node.key.type].s)
+        if node.table:
+            vt = va = node.table.name + suffix
+        elif node.struct:
+            vt = va = node.struct.name
+        elif node.type_.type == TokenType.TEXT:
+            (vt, va) = ("str", '"text"')
+        elif node.type_.type == TokenType.BYTES:
+            (vt, va) = ("bytes", '"bytes"')
+        else:
+            ti = typeMap[node.type_.type]
+            (vt, va) = (ti.p, '"%s"' % ti.s)
+        return (kt, vt, ka, va)
+
+    def generate_map_in(self, node: Value, uname: str) -> None:
+        (kt, vt, ka, va) = self.map_types(node, "In")
+        self.o("    @property")
+        self.o("    def has_%s(self) -> bool:" % (uname,))
+        self.o("        return self._get_uint32(%d, 0) != 0" % (node.offset,))
+        self.o()
+        self.o("    @property")
+        self.o("    def %s(self) -> scalgoproto.MapIn[%s, %s]:" % (uname, kt, vt))
+        self.output_doc(node, "        ")
+        self.o("        assert self.has_%s" % uname)
+        self.o(
+            "        return scalgoproto.MapIn(self._reader, %s, %s, *self._get_ptr(%d, scalgoproto.MAP_MAGIC))"
+            % (ka, va, node.offset)
+        )
+        self.o()
+
+    def generate_map_out(self, node: Value, uname: str) -> None:
+        (kt, vt, ka, va) = self.map_types(node, "Out")
+        self.o("    @scalgoproto.Adder")
+        self.o(
+            "    def %s(self, value: typing_.Union[scalgoproto.MapOut, scalgoproto.MapIn, typing_.Mapping[%s, %s]]) -> None:"
+            % (uname, kt, vt)
+        )
+        self.output_doc(node, "        ")
+        self.o("        self._set_map(%d, value, %s, %s)" % (node.offset, ka, va))
+        self.o()
+
+    def sort_key(self, node: Value) -> Tuple[str, str]:
+        """Return the python type of the key of a sorted list, and a function
+        reading it from an element"""
+        key = node.sort_member
+        name = snake(self.value(key.identifier))
+        if key.type_.type == TokenType.TEXT:
+            return ("str", "lambda t: t.%s if t.has_%s else None" % (name, name))
+        return ("int", "lambda t: t.%s" % name)
+
+    def generate_sorted_in(self, node: Value, uname: str) -> None:
+        (kt, key) = self.sort_key(node)
+        tn = node.table.name + "In"
+        self.o("    @property")
+        self.o("    def has_%s(self) -> bool:" % (uname,))
+        self.o("        return self._get_uint32(%d, 0) != 0" % (node.offset,))
+        self.o()
+        self.o("    @property")
+        self.o(
+            "    def %s(self) -> scalgoproto.SortedListIn[%s, %s]:" % (uname, tn, kt)
+        )
+        self.output_doc(node, "        ")
+        self.o("        assert self.has_%s" % uname)
+        self.o(
+            "        l = self._reader._get_table_list(%s, *self._get_ptr(%d, scalgoproto.LIST_MAGIC))"
+            % (tn, node.offset)
+        )
+        self.o("        return scalgoproto.SortedListIn[%s, %s](l, %s)" % (tn, kt, key))
+        self.o()
+
+    def generate_sorted_out(self, node: Value, uname: str) -> None:
+        (kt, key) = self.sort_key(node)
+        tn = node.table.name
+        self.o("    @scalgoproto.Adder")
+        self.o(
+            "    def %s(self, value: scalgoproto.TableListOut[%sOut]) -> None:"
+            % (uname, tn)
+        )
+        self.output_doc(node, "        ", [], ["The list is sorted on finalize"])
+        self.o(
+            "        self._set_sorted_list(%d, value, %sIn, %s)"
+            % (node.offset, tn, key)
+        )
+        self.o()
+        self.o(
+            "    def add_%s(self, size: int) -> scalgoproto.TableListOut[%sOut]:"
+            % (uname, tn)
+        )
+        self.output_doc(node, "        ", [], ["The list is sorted on finalize"])
+        self.o("        res = self._writer.construct_table_list(%sOut, size)" % tn)
+        self.o(
+            "        self._set_sorted_list(%d, res, %sIn, %s)" % (node.offset, tn, key)
+        )
+        self.o("        return res")
+        self.o()
+
+    def generate_columnar_in(self, node: Value, uname: str) -> None:
+        self.o("    @property")
+        self.o("    def has_%s(self) -> bool:" % (uname,))
+        self.o("        return self._get_uint32(%d, 0) != 0" % (node.offset,))
+        self.o()
+        self.o("    @property")
+        self.o("    def %s(self) -> %sColumnsIn:" % (uname, node.table.name))
+        self.output_doc(node, "        ")
+        self.o("        assert self.has_%s" % uname)
+        self.o(
+            "        return %sColumnsIn(self._reader, *self._get_ptr%s(%d, scalgoproto.LIST_MAGIC))"
+            % (node.table.name, "_inplace" if node.inplace else "", node.offset)
+        )
+        self.o()
+
+    def generate_columnar_out(self, node: Value, uname: str) -> None:
+        if not node.inplace:
+            self.o("    @scalgoproto.Adder")
+            self.o(
+                "    def %s(self, value: %sColumnsOut) -> None:"
+                % (uname, node.table.name)
+            )
+            self.output_doc(node, "        ")
+            self.o("        self._set_list(%d, value)" % (node.offset))
+            self.o()
+            self.o(
+                "    def add_%s(self, size: int) -> %sColumnsOut:"
+                % (uname, node.table.name)
+            )
+            self.output_doc(node, "        ")
+            self.o(
+                "        res = self._writer.construct_columns(%sColumnsOut, size)"
+                % node.table.name
+            )
+            self.o("        self._set_list(%d, res)" % (node.offset))
+            self.o("        return res")
+            self.o()
+        else:
+            self.o(
+                "    def add_%s(self, size: int) -> %sColumnsOut:"
+                % (uname, node.table.name)
+            )
+            self.output_doc(node, "        ")
+            self.o("        assert self._writer._used == self._offset + self._SIZE")
+            self.o("        self._set_inplace_list(%d, size)" % (node.offset))
+            self.o(
+                "        return %sColumnsOut(self._writer, size, False)"
+                % node.table.name
+            )
+            self.o()
+
     def generate_bool_in(self, node: Value, uname: str) -> None:
         if node.inplace:
             raise ICE()
@@ -493,14 +723,14 @@ class Generator:
             self.o("    @scalgoproto.Adder")
             self.o("    def %s(self, value: %sOut) -> None:" % (uname, table.name))
             self.output_doc(node, "        ")
-            self.o("        self._set(%d, value._offset - 8)" % (idx))
+            self.o("        self._set_ptr(%d, value._offset)" % (idx))
             self.o()
             self.o("    def add_%s(self) -> %sOut:" % (uname, table.name))
             self.output_doc(node, "        ")
             self.o(
                 "        res = self._writer.construct_table(%sOut)" % node.table.name
             )
-            self.o("        self._set(%d, res._offset - 8)" % (idx,))
+            self.o("        self._set_ptr(%d, res._offset)" % (idx,))
             self.o("        return res")
             self.o()
         else:
@@ -580,6 +810,13 @@ class Generator:
         self.o("    def %s(self) -> bytes:" % (uname))
         self.output_doc(node, "        ")
         self.o("        assert self.has_%s" % (uname))
+        if node.compressed:
+            self.o("        return self._get_compressed_bytes(%d)" % (node.offset))
+            self.o()
+            self.o("    @property")
+            self.o("    def %s_compressed(self) -> bytes:" % (uname))
+            self.o('        """The zlib stream %s is stored as"""' % (uname))
+            self.o("        assert self.has_%s" % (uname))
         self.o(
             "        (o, s) = self._get_ptr%s(%d, scalgoproto.BYTES_MAGIC)"
             % ("_inplace" if node.inplace else "", node.offset)
@@ -600,6 +837,8 @@ class Generator:
         self.o("    @scalgoproto.Adder")
         if node.inplace:
             self.o("    def %s(self, value: bytes) -> None:" % (uname))
+        elif node.compressed:
+            self.o("    def %s(self, b: bytes) -> None:" % (uname))
         else:
             self.o(
                 "    def %s(self, b: typing_.Union[scalgoproto.BytesOut, bytes]) -> None:"
@@ -609,6 +848,16 @@ class Generator:
         if node.inplace:
             self.o("        assert self._writer._used == self._offset + self._SIZE")
             self.o("        self._add_inplace_bytes(%d, value)" % (node.offset))
+        elif node.compressed:
+            self.o("        self._set_compressed_bytes(%d, b)" % (node.offset))
+            self.o()
+            self.o("    @scalgoproto.Adder")
+            self.o(
+                "    def %s_compressed(self, b: typing_.Union[scalgoproto.BytesOut, bytes]) -> None:"
+                % (uname)
+            )
+            self.o('        """Set %s to a zlib stream compressed already"""' % (uname))
+            self.o("        self._set_bytes(%d, b)" % (node.offset))
         else:
             self.o("        self._set_bytes(%d, b)" % (node.offset))
         self.o()
@@ -625,10 +874,8 @@ class Generator:
                 % (uname)
             )
         self.output_doc(node, "        ")
-        if node.inplace:
-            self.o("        assert self._writer._used == self._end")
-            self.o("        self._set(%d, len(value))" % (idx))
-            self.o("        writer._add_inplace_bytes(value)")
+        if inplace:
+            self.o("        self._add_inplace_bytes(%d, value)" % (idx))
         else:
             self.o("        self._set_bytes(%d, b)" % (idx))
         self.o()
@@ -673,7 +920,17 @@ class Generator:
 
     def generate_value_in(self, table: Table, node: Value) -> None:
         uname = snake(self.value(node.identifier))
-        if node.list_:
+        if node.columnar:
+            self.generate_columnar_in(node, uname)
+        elif node.packed:
+            self.generate_packed_in(node, uname)
+        elif node.dictionary:
+            self.generate_dictionary_in(node, uname)
+        elif node.map_:
+            self.generate_map_in(node, uname)
+        elif node.sorted_:
+            self.generate_sorted_in(node, uname)
+        elif node.list_:
             self.generate_list_in(node, uname)
         elif node.type_.type == TokenType.BOOL:
             self.generate_bool_in(node, uname)
@@ -696,7 +953,17 @@ class Generator:
 
     def generate_value_out(self, table: Table, node: Value) -> None:
         uname = snake(self.value(node.identifier))
-        if node.list_:
+        if node.columnar:
+            self.generate_columnar_out(node, uname)
+        elif node.packed:
+            self.generate_packed_out(node, uname)
+        elif node.dictionary:
+            self.generate_dictionary_out(node, uname)
+        elif node.map_:
+            self.generate_map_out(node, uname)
+        elif node.sorted_:
+            self.generate_sorted_out(node, uname)
+        elif node.list_:
             self.generate_list_out(node, uname)
         elif node.type_.type == TokenType.BOOL:
             self.generate_bool_out(node, uname)
@@ -717,7 +984,99 @@ class Generator:
         else:
             raise ICE()
 
-    def generate_union_copy(self, union: Union) -> None:
+    def generate_value_mut(self, table: Table, node: Value) -> None:
+        """Generate setters changing node in place, or a getter of the table
+        node changing it in place. Pointers are set to objects written by a
+        writer appending to the message, see Writer.open_append"""
+        if (
+            node.map_
+            or node.columnar
+            or node.packed
+            or node.dictionary
+            or node.sorted_
+        ):
+            return
+        uname = snake(self.value(node.identifier))
+        if node.list_:
+            if node.inplace or node.union:
+                return
+            self.o("    @%sIn.%s.setter" % (table.name, uname))
+            self.o(
+                "    def %s(self, value: %s) -> None:"
+                % (uname, self.out_list_type(node))
+            )
+            self.o("        self._set_ptr(%d, value._offset)" % node.offset)
+            self.o()
+            return
+        if node.table:
+            if node.table.empty:
+                return
+            self.o("    @property")
+            self.o("    def %s(self) -> %sMut:" % (uname, node.table.name))
+            self.o("        assert self.has_%s" % uname)
+            self.o(
+                "        return %sMut(self._reader, *self._get_ptr%s(%d, %sIn._MAGIC))"
+                % (
+                    node.table.name,
+                    "_inplace" if node.inplace else "",
+                    node.offset,
+                    node.table.name,
+                )
+            )
+            self.o()
+            if not node.inplace:
+                self.o("    @%s.setter" % uname)
+                self.o(
+                    "    def %s(self, value: %sOut) -> None:" % (uname, node.table.name)
+                )
+                self.o("        self._set_ptr(%d, value._offset)" % node.offset)
+                self.o()
+            return
+        if node.type_.type in (TokenType.TEXT, TokenType.BYTES):
+            if node.inplace:
+                return
+            if node.compressed:
+                uname += "_compressed"
+            self.o("    @%sIn.%s.setter" % (table.name, uname))
+            self.o(
+                "    def %s(self, value: scalgoproto.%sOut) -> None:"
+                % (uname, "Text" if node.type_.type == TokenType.TEXT else "Bytes")
+            )
+            self.o("        self._set_ptr(%d, value._offset)" % node.offset)
+            self.o()
+            return
+        if node.type_.type == TokenType.BOOL:
+            tn = "bool"
+            setter = "self._set_bit(%d, %d, value)" % (node.offset, node.bit)
+        elif node.type_.type in typeMap:
+            ti = typeMap[node.type_.type]
+            tn = ti.p
+            setter = "self._set_%s(%d, value)" % (ti.n, node.offset)
+        elif node.enum:
+            tn = node.enum.name
+            setter = "self._set_uint8(%d, int(value))" % node.offset
+        elif node.struct:
+            tn = node.struct.name
+            setter = "self._set_struct(%d, %s, value)" % (node.offset, tn)
+        else:
+            return
+        setters = [(node.offset, setter)]
+        if node.optional and node.type_.type not in (TokenType.F32, TokenType.F64):
+            setters.append(
+                (
+                    node.has_offset,
+                    "self._set_bit(%d, %d, True)" % (node.has_offset, node.has_bit),
+                )
+            )
+        self.o("    @%sIn.%s.setter" % (table.name, uname))
+        self.o("    def %s(self, value: %s) -> None:" % (uname, tn))
+        # Members are checked to be stored on setting, so set the last one
+        # first to change nothing when it is not
+        for (_, setter) in sorted(setters, reverse=True):
+            self.o("        %s" % setter)
+        self.o()
+
+    def generate_union_copy(self, union: Union, inplace: bool) -> None:
         self.o("    def _copy(self, i:%sIn) -> None:" % union.name)
         self.o("        if False:")
         self.o("            pass")
@@ -732,12 +1091,20 @@ class Generator:
             elif (
                 node.type_.type == TokenType.TEXT or node.type_.type == TokenType.BYTES
             ):
-                self.o("            self.add_%s(i.%s)" % (uuname, uuname))
+                self.o("            self.%s = i.%s" % (uuname, uuname))
             elif node.table:
                 if node.table.empty:
                     self.o("            self.add_%s()" % (uuname))
+                elif inplace:
+                    self.o(
+                        "            self.add_%s()._copy(i.%s, False)"
+                        % (uuname, uuname)
+                    )
                 else:
-                    self.o("            self.add_%s()._copy(i.%s)" % (uuname, uuname))
+                    self.o(
+                        "            self.%s = self._writer.copy(%sOut, i.%s)"
+                        % (uuname, node.table.name, uuname)
+                    )
             else:
                 raise ICE()
         self.o()
@@ -835,7 +1202,7 @@ class Generator:
             else:
                 raise ICE()
             idx += 1
-        self.generate_union_copy(union)
+        self.generate_union_copy(union, False)
         self.o()
 
         self.o("class %sInplaceOut(scalgoproto.UnionOut):" % union.name)
@@ -863,46 +1230,79 @@ class Generator:
             else:
                 raise ICE()
             idx += 1
-        self.generate_union_copy(union)
+        self.generate_union_copy(union, True)
         self.o()
 
+    def generate_member_copy(self, node: Value) -> None:
+        uname = snake(self.value(node.identifier))
+        if node.packed or node.dictionary or node.map_:
+            self.o("        if i.has_%s:" % uname)
+            self.o("            self.%s = i.%s" % (uname, uname))
+        elif node.compressed:
+            # Copy the compressed stream instead of compressing again
+            self.o("        if i.has_%s:" % uname)
+            self.o("            self.%s_compressed = i.%s_compressed" % (uname, uname))
+        elif node.list_:
+            self.o("        if i.has_%s:" % uname)
+            self.o(
+                "            self.add_%s(len(i.%s))._copy(i.%s)" % (uname, uname, uname)
+            )
+        elif (
+            node.type_.type in typeMap
+            or node.type_.type == TokenType.BOOL
+            or node.enum
+            or node.struct
+            or node.type_.type == TokenType.TEXT
+            or node.type_.type == TokenType.BYTES
+        ):
+            if (
+                node.optional
+                or node.enum
+                or node.type_.type == TokenType.TEXT
+                or node.type_.type == TokenType.BYTES
+            ):
+                self.o("        if i.has_%s:" % uname)
+                self.o("            self.%s = i.%s" % (uname, uname))
+            else:
+                self.o("        self.%s = i.%s" % (uname, uname))
+        elif node.table:
+            self.o("        if i.has_%s:" % (uname))
+            if node.table.empty:
+                self.o("            self.add_%s()" % (uname))
+            elif node.inplace:
+                self.o("            self.add_%s()._copy(i.%s, False)" % (uname, uname))
+            else:
+                self.o(
+                    "            self.%s = self._writer.copy(%sOut, i.%s)"
+                    % (uname, node.table.name, uname)
+                )
+        elif node.union:
+            self.o("        if i.has_%s:" % (uname))
+            self.o("            self.%s._copy(i.%s)" % (uname, uname))
+        else:
+            raise ICE()
+
     def generate_table_copy(self, table: Table) -> None:
-        self.o("    def _copy(self, i:%sIn) -> None:" % table.name)
-        for ip in (True, False):
-            for node in table.members:
-                uname = snake(self.value(node.identifier))
-                if bool(node.inplace) != ip:
-                    continue
-                if node.list_:
-                    self.o("        if i.has_%s:" % uname)
-                    self.o(
-                        "            self.add_%s(len(i.%s))._copy(i.%s)"
-                        % (uname, uname, uname)
-                    )
-                elif (
-                    node.type_.type in typeMap
-                    or node.type_.type == TokenType.BOOL
-                    or node.enum
-                    or node.struct
-                    or node.type_.type == TokenType.TEXT
-                    or node.type_.type == TokenType.BYTES
-                ):
-                    if node.optional:
-                        self.o("        if i.has_%s:" % uname)
-                        self.o("            self.%s = i.%s" % (uname, uname))
-                    else:
-                        self.o("        self.%s = i.%s" % (uname, uname))
-                elif node.table:
-                    self.o("        if i.has_%s:" % (uname))
-                    if node.table.empty:
-                        self.o("            self.add_%s()")
-                    else:
-                        self.o("            self.add_%s()._copy(i.%s)" % (uname, uname))
-                elif node.union:
-                    self.o("        if i.has_%s:" % (uname))
-                    self.o("            self.%s._copy(i.%s)" % (uname, uname))
-                else:
-                    raise ICE()
+        self.o("    def _copy(self, i:%sIn, trim: bool = True) -> None:" % table.name)
+        # Inplace members follow the table so they are copied first. Tables
+        # without them are trimmed when compacting, see TableOut._trim, after
+        # the members stored in the table are copied
+        inplace = [node for node in table.members if node.inplace]
+        for node in inplace:
+            self.generate_member_copy(node)
+        pointers = []
+        for node in table.members:
+            if node.inplace:
+                continue
+            if pointer_member(node):
+                pointers.append(node)
+            else:
+                self.generate_member_copy(node)
+        if not inplace:
+            self.o("        if trim:")
+            self.o("            self._trim(i, %s)" % (trim_fields(table),))
+        for node in pointers:
+            self.generate_member_copy(node)
         self.o()
 
     def generate_table_str(self, table: Table) -> None:
@@ -910,7 +1310,7 @@ class Generator:
         self.o("        o = []")
         for node in table.members:
             uname = snake(self.value(node.identifier))
-            if node.optional or node.table or node.union:
+            if node.optional or node.table or node.union or node.map_:
                 self.o("        if self.has_%s:" % uname)
                 self.o("            o.append('%s: '+str(self.%s))" % (uname, uname))
             else:
@@ -918,6 +1318,201 @@ class Generator:
         self.o("        return '{%s}'%(', '.join(o))")
         self.o()
 
+    def column_widths(self, table: Table) -> str:
+        """Return the bytes per row of every column of table, zero for bits"""
+        widths = []
+        for node in table.members:
+            widths.append("0" if node.type_.type == TokenType.BOOL else str(node.bytes))
+        return "(%s%s)" % (", ".join(widths), "," if len(widths) == 1 else "")
+
+    def column_defaults(self, table: Table) -> str:
+        """Return the default value of every column of table, empty for bits"""
+        defaults = []
+        for node in table.members:
+            if node.type_.type == TokenType.BOOL:
+                defaults.append('b""')
+            else:
+                defaults.append(
+                    'b"%s"'
+                    % cescape(table.default[node.offset : node.offset + node.bytes])
+                )
+        return "(%s%s)" % (", ".join(defaults), "," if len(defaults) == 1 else "")
+
+    def generate_columns_in(self, table: Table) -> None:
+        self.o("class %sRowIn(scalgoproto.RowIn):" % table.name)
+        self.output_doc(table, "    ")
+        self.o("    __slots__ = []")
+        self.o()
+        for (c, node) in enumerate(table.members):
+            uname = snake(self.value(node.identifier))
+            if node.enum:
+                self.o("    @property")
+                self.o("    def has_%s(self) -> bool:" % (uname,))
+                self.o('        return self._get(%d, "<B", 1) != 255' % c)
+                self.o()
+            self.o("    @property")
+            if node.type_.type == TokenType.BOOL:
+                self.o("    def %s(self) -> bool:" % (uname,))
+                self.output_doc(node, "        ")
+                self.o("        return self._get_bit(%d)" % c)
+            elif node.type_.type in typeMap:
+                ti = typeMap[node.type_.type]
+                self.o("    def %s(self) -> %s:" % (uname, ti.p))
+                self.output_doc(node, "        ")
+                self.o('        return self._get(%d, "<%s", %d)' % (c, ti.s, ti.w))
+            elif node.enum:
+                self.o("    def %s(self) -> %s:" % (uname, node.enum.name))
+                self.output_doc(node, "        ")
+                self.o("        assert self.has_%s" % uname)
+                self.o(
+                    '        return %s(self._get(%d, "<B", 1))' % (node.enum.name, c)
+                )
+            elif node.struct:
+                self.o("    def %s(self) -> %s:" % (uname, node.struct.name))
+                self.output_doc(node, "        ")
+                self.o(
+                    "        return self._get_struct(%d, %s)" % (c, node.struct.name)
+                )
+            else:
+                raise ICE()
+            self.o()
+        self.o("    def __str__(self) ->  str:")
+        self.o("        o = []")
+        for node in table.members:
+            uname = snake(self.value(node.identifier))
+            if node.enum:
+                self.o("        if self.has_%s:" % uname)
+                self.o("            o.append('%s: '+str(self.%s))" % (uname, uname))
+            else:
+                self.o("        o.append('%s: '+str(self.%s))" % (uname, uname))
+        self.o("        return '{%s}'%(', '.join(o))")
+        self.o()
+        self.o()
+
+        self.o(
+            "class %sColumnsIn(scalgoproto.ColumnsIn[%sRowIn]):"
+            % (table.name, table.name)
+        )
+        self.output_doc(table, "    ")
+        self.o("    __slots__ = []")
+        self.o("    _WIDTHS: typing_.ClassVar[tuple] = %s" % self.column_widths(table))
+        self.o(
+            "    _DEFAULTS: typing_.ClassVar[tuple] = %s" % self.column_defaults(table)
+        )
+        self.o("    _ROW: typing_.ClassVar[type] = %sRowIn" % table.name)
+        self.o()
+        self.o(
+            "    def __init__(self, reader: scalgoproto.Reader, offset: int, size: int) -> None:"
+        )
+        self.o(
+            '        """Private constructor. Use the accessor methods on tables to get an instance"""'
+        )
+        self.o("        super().__init__(reader, offset, size)")
+        self.o()
+        for (c, node) in enumerate(table.members):
+            uname = snake(self.value(node.identifier))
+            (tn, acc) = self.in_list_help(node, "self._starts[%d], self._size" % c)
+            self.o("    @property")
+            self.o("    def %s(self) -> scalgoproto.ListIn[%s]:" % (uname, tn))
+            self.output_doc(node, "        ")
+            self.o(acc)
+            self.o()
+        self.o()
+
+    def generate_columns_out(self, table: Table) -> None:
+        self.o("class %sRowOut(scalgoproto.RowOut):" % table.name)
+        self.output_doc(table, "    ")
+        self.o("    __slots__ = []")
+        self.o()
+        for (c, node) in enumerate(table.members):
+            uname = snake(self.value(node.identifier))
+            self.o("    @scalgoproto.Adder")
+            if node.type_.type == TokenType.BOOL:
+                self.o("    def %s(self, value: bool) -> None:" % (uname,))
+                self.output_doc(node, "        ")
+                self.o("        self._set_bit(%d, value)" % c)
+            elif node.type_.type in typeMap:
+                ti = typeMap[node.type_.type]
+                self.o("    def %s(self, value: %s) -> None:" % (uname, ti.p))
+                self.output_doc(node, "        ")
+                self.o('        self._set(%d, "<%s", %d, value)' % (c, ti.s, ti.w))
+            elif node.enum:
+                self.o("    def %s(self, value: %s) -> None:" % (uname, node.enum.name))
+                self.output_doc(node, "        ")
+                self.o('        self._set(%d, "<B", 1, int(value))' % c)
+            elif node.struct:
+                self.o(
+                    "    def %s(self, value: %s) -> None:" % (uname, node.struct.name)
+                )
+                self.output_doc(node, "        ")
+                self.o(
+                    "        self._set_struct(%d, %s, value)" % (c, node.struct.name)
+                )
+            else:
+                raise ICE()
+            self.o()
+        self.o()
+
+        self.o(
+            "class %sColumnsOut(scalgoproto.ColumnsOut[%sRowOut]):"
+            % (table.name, table.name)
+        )
+        self.output_doc(table, "    ")
+        self.o("    __slots__ = []")
+        self.o("    _WIDTHS: typing_.ClassVar[tuple] = %s" % self.column_widths(table))
+        self.o(
+            "    _DEFAULTS: typing_.ClassVar[tuple] = %s" % self.column_defaults(table)
+        )
+        self.o("    _ROW: typing_.ClassVar[type] = %sRowOut" % table.name)
+        self.o()
+        self.o(
+            "    def __init__(self, writer: scalgoproto.Writer, size: int, with_header: bool = True) -> None:"
+        )
+        self.o(
+            '        """Private constructor. Call factory methods on scalgoproto.Writer to construct instances"""'
+        )
+        self.o("        super().__init__(writer, size, with_header)")
+        self.o()
+        for (c, node) in enumerate(table.members):
+            uname = snake(self.value(node.identifier))
+            self.o("    @scalgoproto.Adder")
+            if node.type_.type == TokenType.BOOL:
+                self.o(
+                    "    def %s(self, values: typing_.Sequence[bool]) -> None:"
+                    % (uname,)
+                )
+                self.output_doc(node, "        ")
+                self.o("        self._set_bit_column(%d, values)" % c)
+            elif node.type_.type in typeMap:
+                ti = typeMap[node.type_.type]
+                self.o(
+                    "    def %s(self, values: typing_.Sequence[%s]) -> None:"
+                    % (uname, ti.p)
+                )
+                self.output_doc(node, "        ")
+                self.o('        self._set_column(%d, "%s", values)' % (c, ti.s))
+            elif node.enum:
+                self.o(
+                    "    def %s(self, values: typing_.Sequence[%s]) -> None:"
+                    % (uname, node.enum.name)
+                )
+                self.output_doc(node, "        ")
+                self.o('        self._set_column(%d, "B", values)' % c)
+            elif node.struct:
+                self.o(
+                    "    def %s(self, values: typing_.Sequence[%s]) -> None:"
+                    % (uname, node.struct.name)
+                )
+                self.output_doc(node, "        ")
+                self.o(
+                    "        self._set_struct_column(%d, %s, values)"
+                    % (c, node.struct.name)
+                )
+            else:
+                raise ICE()
+            self.o()
+        self.o()
+
     def generate_table(self, table: Table) -> None:
         # Recursively generate direct contained members
         for value in table.members:
@@ -958,6 +1553,12 @@ class Generator:
         self.o("    __slots__ = []")
         self.o("    _MAGIC: typing_.ClassVar[int] = 0x%08X" % table.magic)
         self.o("    _SIZE: typing_.ClassVar[int] = %d" % len(table.default))
+        self.o(
+            '    _DEFAULT: typing_.ClassVar[bytes] = b"%s"' % (cescape(table.default))
+        )
+        if any(node.inplace for node in table.members):
+            self.o("    _INPLACE: typing_.ClassVar[bool] = True")
+        self.o("    _IN: typing_.ClassVar[type] = %sIn" % table.name)
         self.o()
         self.o(
             "    def __init__(self, writer: scalgoproto.Writer, withHeader: bool) -> None:"
@@ -965,16 +1566,141 @@ class Generator:
         self.o(
             '        """Private constructor. Call factory methods on scalgoproto.Reader to construct instances"""'
         )
-        self.o(
-            '        super().__init__(writer, withHeader, \n b"%s")'
-            % (cescape(table.default))
-        )
+        self.o("        super().__init__(writer, withHeader, self._DEFAULT)")
         self.o()
         for node in table.members:
             self.generate_value_out(table, node)
         self.generate_table_copy(table)
         self.o()
 
+        # Generate the table changer
+        self.o("class %sMut(%sIn, scalgoproto.TableMut):" % (table.name, table.name))
+        self.o(
+            '    """Change the members of fixed size of %s in place"""' % table.name
+        )
+        self.o("    __slots__ = []")
+        self.o()
+        for node in table.members:
+            self.generate_value_mut(table, node)
+        self.o()
+
+        if table.columnar:
+            self.generate_columns_in(table)
+            self.generate_columns_out(table)
+
+    def struct_format(self, node: Struct) -> str:
+        """Return the struct module format of node, with nested structs inlined"""
+        ans = ""
+        for v in node.members:
+            if v.type_.type in typeMap:
+                ans += typeMap[v.type_.type].s
+            elif v.enum:
+                ans += "B"
+            elif v.struct:
+                ans += self.struct_format(v.struct)
+            else:
+                raise ICE()
+        return ans
+
+    def struct_dtype(self, node: Struct) -> str:
+        """Return the numpy dtype specification of node"""
+        names = []
+        formats = []
+        offsets = []
+        for v in node.members:
+            names.append('"%s"' % snake(self.value(v.identifier)))
+            offsets.append(str(v.offset))
+            if v.type_.type == TokenType.BOOL:
+                formats.append('"?"')
+            elif v.type_.type in typeMap:
+                ti = typeMap[v.type_.type]
+                kind = "f" if v.type_.type in (TokenType.F32, TokenType.F64) else "i"
+                if ti.s.isupper():
+                    kind = "u"
+                formats.append('"<%s%d"' % (kind, ti.w))
+            elif v.enum:
+                formats.append('"u1"')
+            elif v.struct:
+                formats.append("%s._DTYPE" % v.struct.name)
+            else:
+                raise ICE()
+        return '{"names": [%s], "formats": [%s], "offsets": [%s], "itemsize": %d}' % (
+            ", ".join(names),
+            ", ".join(formats),
+            ", ".join(offsets),
+            node.bytes,
+        )
+
+    def struct_values(self, node: Struct, index: Iterator[int]) -> List[str]:
+        """Return expressions for the members of node given the unpacked values v"""
+        ans = []
+        for v in node.members:
+            if v.type_.type in typeMap:
+                ans.append("v[%d]" % next(index))
+            elif v.enum:
+                ans.append("%s(v[%d])" % (v.enum.name, next(index)))
+            elif v.struct:
+                ans.append(
+                    "%s(%s)"
+                    % (v.struct.name, ", ".join(self.struct_values(v.struct, index)))
+                )
+            else:
+                raise ICE()
+        return ans
+
+    def struct_assignments(
+        self, node: Struct, target: str, index: Iterator[int]
+    ) -> List[str]:
+        """Return statements assigning the unpacked values v to the members of target"""
+        ans = []
+        for v in node.members:
+            n = "%s.%s" % (target, snake(self.value(v.identifier)))
+            if v.type_.type in typeMap:
+                ans.append("%s = v[%d]" % (n, next(index)))
+            elif v.enum:
+                ans.append("%s = %s(v[%d])" % (n, v.enum.name, next(index)))
+            elif v.struct:
+                ans.extend(self.struct_assignments(v.struct, n, index))
+            else:
+                raise ICE()
+        return ans
+
+    def generate_struct_view(self, node: Struct) -> None:
+        self.o("class %sView(scalgoproto.StructView):" % node.name)
+        self.output_doc(node, "    ")
+        self.o("    __slots__ = []")
+        self.o("    _WIDTH: typing_.ClassVar[int] = %d" % node.bytes)
+        self.o()
+        for v in node.members:
+            n = snake(self.value(v.identifier))
+            self.o("    @property")
+            if v.type_.type in typeMap:
+                ti = typeMap[v.type_.type]
+                self.o("    def %s(self) -> %s:" % (n, ti.p))
+                self.output_doc(v, "        ")
+                self.o(
+                    '        return struct.unpack_from("<%s", self._reader._data, self._offset + %d)[0]'
+                    % (ti.s, v.offset)
+                )
+            elif v.enum:
+                self.o("    def %s(self) -> %s:" % (n, v.enum.name))
+                self.output_doc(v, "        ")
+                self.o(
+                    "        return %s(self._reader._data[self._offset + %d])"
+                    % (v.enum.name, v.offset)
+                )
+            elif v.struct:
+                self.o("    def %s(self) -> %sView:" % (n, v.struct.name))
+                self.output_doc(v, "        ")
+                self.o(
+                    "        return %sView(self._reader, self._offset + %d)"
+                    % (v.struct.name, v.offset)
+                )
+            else:
+                raise ICE()
+            self.o()
+        self.o()
+
     def generate_struct(self, node: Struct) -> None:
         # Recursively generate direct contained members
         for value in node.members:
@@ -983,14 +1709,13 @@ class Generator:
             if value.direct_struct:
                 self.generate_struct(value.direct_struct)
 
+        self.generate_struct_view(node)
         self.o("class %s(scalgoproto.StructType):" % node.name)
         init = []
         copy = []
         write = []
-        read = []
         slots = []
         for v in node.members:
-            thing = ("", "", "", 0, 0, "")
             n = snake(self.value(v.identifier))
             copy.append("self.%s = %s" % (n, n))
             slots.append('"%s"' % n)
@@ -1006,25 +1731,25 @@ class Generator:
                     'writer._data[offset + %d : offset + %d] = struct.pack("<%s", ins.%s)'
                     % (v.offset, v.offset + ti.w, ti.s, n)
                 )
-                read.append(
-                    'struct.unpack("<%s", reader._data[offset + %d : offset + %d])[0]'
-                    % (ti.s, v.offset, v.offset + ti.w)
-                )
             elif v.enum:
                 init.append("%s: %s = %s(0)" % (n, v.enum.name, v.enum.name))
                 write.append("writer._data[offset + %d] = int(ins.%s)" % (v.offset, n))
-                read.append("%s(reader._data[offset + %d])" % (v.enum.name, v.offset))
             elif v.struct:
                 init.append("%s: %s = %s()" % (n, v.struct.name, v.struct.name))
                 write.append(
                     "%s._write(writer, offset + %d, ins.%s)"
                     % (v.struct.name, v.offset, n)
                 )
-                read.append("%s._read(reader, offset + %d)" % (v.struct.name, v.offset))
             else:
                 raise ICE()
         self.o("    __slots__ = [%s]" % ", ".join(slots))
         self.o("    _WIDTH: typing_.ClassVar[int] = %d" % node.bytes)
+        self.o(
+            '    _STRUCT: typing_.ClassVar[struct.Struct] = struct.Struct("<%s")'
+            % self.struct_format(node)
+        )
+        self.o("    _VIEW: typing_.ClassVar[type] = %sView" % node.name)
+        self.o("    _DTYPE: typing_.ClassVar[dict] = %s" % self.struct_dtype(node))
         self.o()
         self.o("    def __init__(self, %s) -> None:" % (", ".join(init)))
         for line in copy:
@@ -1043,11 +1768,26 @@ class Generator:
             '    def _read(reader: scalgoproto.Reader, offset: int) -> "%s":'
             % node.name
         )
+        self.o(
+            "        v = %s._STRUCT.unpack_from(reader._data, offset)" % node.name
+        )
         self.o("        return %s(" % node.name)
-        for line in read:
+        for line in self.struct_values(node, itertools.count()):
             self.o("            %s," % line)
         self.o("        )")
         self.o()
+        self.o("    @staticmethod")
+        self.o(
+            '    def _read_into(reader: scalgoproto.Reader, offset: int, ins: "%s") -> "%s":'
+            % (node.name, node.name)
+        )
+        self.o(
+            "        v = %s._STRUCT.unpack_from(reader._data, offset)" % node.name
+        )
+        for line in self.struct_assignments(node, "ins", itertools.count()):
+            self.o("        %s" % line)
+        self.o("        return ins")
+        self.o()
         self.o()
 
     def generate_enum(self, node: Enum) -> None:
@@ -1063,16 +1803,17 @@ class Generator:
     def generate(self, ast: List[AstNode]) -> None:
         imports: Dict[str, Set[str]] = {}
         for node in ast:
-            if node.document != 0:
+            if node.document != self.documents.root.id:
                 continue
             for u in node.uses:
-                if u.document == 0:
+                if u.document == self.documents.root.id:
                     continue
                 if not u.document in imports:
                     imports[u.document] = set()
                 i = imports[u.document]
                 if isinstance(u, Struct):
                     i.add(u.name)
+                    i.add("%sView" % u.name)
                 elif isinstance(u, Enum):
                     i.add(u.name)
                 elif isinstance(u, Table):
@@ -1084,14 +1825,15 @@ class Generator:
                 else:
                     raise ICE()
 
-        for (d, imp) in imports.items():
+        for (d, imp) in sorted(imports.items()):
             doc = self.documents.by_id[d]
             self.o(
-                "from %s%s import %s" % (self.import_prefix, doc.name, ", ".join(imp))
+                "from %s%s import %s"
+                % (self.import_prefix, doc.name, ", ".join(sorted(imp)))
             )
 
         for node in ast:
-            if node.document != 0:
+            if node.document != self.documents.root.id:
                 continue
             if isinstance(node, Struct):
                 self.generate_struct(node)
@@ -1107,27 +1849,41 @@ class Generator:
                 raise ICE()
 
 
+def write(
+    documents: Documents, ast: List[AstNode], output: str, import_prefix: str
+) -> str:
+    """Write the python code for the root document of an annotated ast,
+    leaving the file untouched if its content would not change.
+    Returns the path of the file"""
+    out = io.StringIO()
+    g = Generator(documents, out, import_prefix)
+    print(
+        "# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-",
+        file=out,
+    )
+    print("# THIS FILE IS GENERATED DO NOT EDIT", file=out)
+    print("import scalgoproto, enum, struct", file=out)
+    print("import math as math_", file=out)
+    print("import typing as typing_", file=out)
+
+    g.generate(ast)
+    path = os.path.join(output, "%s.py" % documents.root.name)
+    write_if_changed(path, out.getvalue())
+    return path
+
+
 def run(args) -> int:
     documents = Documents()
     documents.read_root(args.schema)
     p = Parser(documents)
-    out = open(os.path.join(args.output, "%s.py" % documents.root.name), "w")
     try:
         ast = p.parse_document()
         if not annotate(documents, ast):
             print("Schema is invalid")
             return 1
-        g = Generator(documents, out, args.import_prefix)
-        print(
-            "# -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-",
-            file=out,
-        )
-        print("# THIS FILE IS GENERATED DO NOT EDIT", file=out)
-        print("import scalgoproto, enum, struct", file=out)
-        print("import math as math_", file=out)
-        print("import typing as typing_", file=out)
-
-        g.generate(ast)
+        path = write(documents, ast, args.output, args.import_prefix)
+        if args.depfile:
+            write_depfile(args.depfile, [path], documents.dependencies())
         return 0
     except ParseError as err:
         err.describe(documents)
@@ -1141,4 +1897,5 @@ def setup(subparsers) -> None:
     cmd.add_argument(
         "--import-prefix", help="Prefix to put infront of imports", default=""
     )
+    cmd.add_argument("--depfile", help="write a make style depfile to this path")
     cmd.set_defaults(func=run)
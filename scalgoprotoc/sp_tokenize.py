@@ -1,3 +1,4 @@
+import re
 import typing as ty
 from enum import Enum
 
@@ -40,6 +41,14 @@ class TokenType(Enum):
     DOCCOMMENT = 68
     INPLACE = 69
     IMPORT = 70
+    COLUMNAR = 71
+    PACKED = 72
+    DICTIONARY = 73
+    MAP = 74
+    ARROW = 75
+    SORTED = 76
+    BY = 77
+    COMPRESSED = 78
 
 
 Token = ty.NamedTuple(
@@ -47,147 +56,118 @@ Token = ty.NamedTuple(
 )
 
 
-def tokenize(data: str, document: int) -> ty.Iterator[Token]:
-    cur: int = 0
-    end: int = 0
-    ops: ty.Dict[str, TokenType] = {
-        ":": TokenType.COLON,
-        ";": TokenType.SEMICOLON,
-        ",": TokenType.COMMA,
-        "=": TokenType.EQUAL,
-        "{": TokenType.LBRACE,
-        "}": TokenType.RBRACE,
-    }
-
-    keywords: ty.Dict[str, TokenType] = {
-        "Bool": TokenType.BOOL,
-        "Bytes": TokenType.BYTES,
-        "F32": TokenType.F32,
-        "F64": TokenType.F64,
-        "I16": TokenType.I16,
-        "I32": TokenType.I32,
-        "I64": TokenType.I64,
-        "I8": TokenType.I8,
-        "list": TokenType.LIST,
-        "optional": TokenType.OPTIONAL,
-        "Text": TokenType.TEXT,
-        "U16": TokenType.U16,
-        "U32": TokenType.UI32,
-        "U64": TokenType.UI64,
-        "U8": TokenType.U8,
-        "enum": TokenType.ENUM,
-        "false": TokenType.FALSE,
-        "struct": TokenType.STRUCT,
-        "table": TokenType.TABLE,
-        "true": TokenType.TRUE,
-        "union": TokenType.UNION,
-        "namespace": TokenType.NAMESPACE,
-        "inplace": TokenType.INPLACE,
-        "import": TokenType.IMPORT,
-    }
-
-    while cur < len(data):
-        if data[cur] in " \t\n\r":
-            cur += 1
-            continue
+ops: ty.Dict[str, TokenType] = {
+    ":": TokenType.COLON,
+    ";": TokenType.SEMICOLON,
+    ",": TokenType.COMMA,
+    "=": TokenType.EQUAL,
+    "{": TokenType.LBRACE,
+    "}": TokenType.RBRACE,
+    "::": TokenType.COLONCOLON,
+    "->": TokenType.ARROW,
+}
+
+keywords: ty.Dict[str, TokenType] = {
+    "Bool": TokenType.BOOL,
+    "Bytes": TokenType.BYTES,
+    "F32": TokenType.F32,
+    "F64": TokenType.F64,
+    "I16": TokenType.I16,
+    "I32": TokenType.I32,
+    "I64": TokenType.I64,
+    "I8": TokenType.I8,
+    "list": TokenType.LIST,
+    "optional": TokenType.OPTIONAL,
+    "Text": TokenType.TEXT,
+    "U16": TokenType.U16,
+    "U32": TokenType.UI32,
+    "U64": TokenType.UI64,
+    "U8": TokenType.U8,
+    "enum": TokenType.ENUM,
+    "false": TokenType.FALSE,
+    "struct": TokenType.STRUCT,
+    "table": TokenType.TABLE,
+    "true": TokenType.TRUE,
+    "union": TokenType.UNION,
+    "namespace": TokenType.NAMESPACE,
+    "inplace": TokenType.INPLACE,
+    "import": TokenType.IMPORT,
+}
+
+# Words that are keywords only where the parser expects them. The tokenizer
+# returns them as identifiers, so they remain valid names of members
+contextual_keywords: ty.Dict[str, TokenType] = {
+    "columnar": TokenType.COLUMNAR,
+    "packed": TokenType.PACKED,
+    "dictionary": TokenType.DICTIONARY,
+    "map": TokenType.MAP,
+    "sorted": TokenType.SORTED,
+    "by": TokenType.BY,
+    "compressed": TokenType.COMPRESSED,
+}
+
+words: ty.Dict[str, TokenType] = dict(keywords, **ops)
+
+# Whitespace and comments are skipped in front of every token. After that
+# the alternatives are tried in order, so the more specific ones
+# (:: before :, -> before numbers, ## before #, /** before /*) must come
+# first.
+master = re.compile(
+    r"""
+    (?:[ \t\n\r]+|\#(?!\#)[^\n]*|//[^\n]*)*
+    (?:
+    (?P<WORD>[^\W\d]\w*|::|->|[:;,={}])
+    |(?P<NUMBER>(?=[-.0-9])-?[0-9]*(?:\.[0-9]*)?(?:[eE][+-]?[0-9]*)?)
+    |(?P<ID>@[0-9A-G]*)
+    |(?P<DOCCOMMENT>\#\#[^\n]*|/\*(?=\*)[\s\S]*?\*/)
+    |(?P<BADDOC>/\*\*[\s\S]*)
+    |(?P<NESTED>/\*)
+    |(?P<END>\Z)
+    |(?P<BAD>[\s\S])
+    )
+    """,
+    re.VERBOSE,
+)
 
-        if data[cur : cur + 2] == "::":
-            yield Token(TokenType.COLONCOLON, cur, 2, document)
-            cur += 2
-            continue
+nesting = re.compile(r"/\*|\*/")
 
-        if data[cur] in ops:
-            yield Token(ops[data[cur]], cur, 1, document)
-            cur += 1
-            continue
 
-        if data[cur : cur + 2] == "##" or data[cur : cur + 2] == "///":
-            start = cur
-            cur += 2
-            while cur < len(data) and data[cur] != "\n":
-                cur += 1
-            while True:
-                while cur < len(data) and data[cur] in " \t":
-                    cur += 1
-                if cur == len(data) or (
-                    data[cur] != "#" and data[cur : cur + 2] != "//"
-                ):
+def tokenize(data: str, document: int) -> ty.Iterator[Token]:
+    cur: int = 0
+    match = master.match
+    # Skip the python level __new__ of the named tuple
+    new = tuple.__new__
+    while True:
+        m = match(data, cur)
+        kind = m.lastgroup
+        start = m.start(kind)
+        cur = m.end()
+        if kind == "WORD":
+            if data[start] > "\x7f" and not data[start].isalpha():
+                # Unicode digits that are not decimal are word characters
+                # but may not start an identifier
+                yield new(Token, (TokenType.BAD, start, 1, document))
+                cur = start + 1
+                continue
+            type = words.get(data[start:cur], TokenType.IDENTIFIER)
+            yield new(Token, (type, start, cur - start, document))
+        elif kind == "NUMBER":
+            yield new(Token, (TokenType.NUMBER, start, cur - start, document))
+        elif kind == "ID":
+            yield new(Token, (TokenType.ID, start, cur - start, document))
+        elif kind == "DOCCOMMENT":
+            yield new(Token, (TokenType.DOCCOMMENT, start, cur - start, document))
+        elif kind == "NESTED":
+            cnt = 1
+            for n in nesting.finditer(data, cur):
+                cnt += 1 if n.group() == "/*" else -1
+                if cnt == 0:
+                    cur = n.end()
                     break
-                cur += 1
-                while cur < len(data) and data[cur] != "\n":
-                    cur += 1
-            yield Token(TokenType.DOCCOMMENT, start, cur - start, document)
-            continue
-
-        if data[cur : cur + 3] == "/**":
-            start = cur
-            cur += 2
-            while cur < len(data) and data[cur : cur + 2] != "*/":
-                cur += 1
-            if data[cur : cur + 2] == "*/":
-                cur += 2
-                yield Token(TokenType.DOCCOMMENT, start, cur - start, document)
             else:
-                yield Token(TokenType.BAD, start, cur - start, document)
-            continue
-
-        if data[cur] == "#" or data[cur : cur + 2] == "//":
-            while cur < len(data) and data[cur] != "\n":
-                cur += 1
-            continue
-        if data[cur : cur + 2] == "/*":
-            cnt = 1
-            cur += 2
-            while cnt != 0 and cur < len(data):
-                if data[cur : cur + 2] == "/*":
-                    cnt += 1
-                    cur += 2
-                elif data[cur : cur + 2] == "*/":
-                    cnt -= 1
-                    cur += 2
-                else:
-                    cur += 1
-            continue
-
-        if data[cur].isalpha() or data[cur] == "_":
-            end = cur + 1
-            while end < len(data) and (data[end] == "_" or data[end].isalnum()):
-                end += 1
-            type: TokenType = TokenType.IDENTIFIER
-            if data[cur:end] in keywords:
-                type = keywords[data[cur:end]]
-            yield Token(type, cur, end - cur, document)
-            cur = end
-            continue
-
-        if data[cur] == "@":
-            end = cur + 1
-            while end < len(data) and data[end] in "0123456789ABCDEFG":
-                end += 1
-            yield Token(TokenType.ID, cur, end - cur, document)
-            cur = end
-            continue
-
-        if data[cur] == "-" or data[cur] == "." or data[cur] in "0123456789":
-            end = cur
-            if end < len(data) and data[end] == "-":
-                end += 1
-            while end < len(data) and data[end] in "0123456789":
-                end += 1
-            if end < len(data) and data[end] == ".":
-                end += 1
-                while end < len(data) and data[end] in "0123456789":
-                    end += 1
-            if end < len(data) and data[end] in "eE":
-                end += 1
-                if end < len(data) and data[end] in "+-":
-                    end += 1
-                while end < len(data) and data[end] in "0123456789":
-                    end += 1
-            yield Token(TokenType.NUMBER, cur, end - cur, document)
-            cur = end
-            continue
-
-        yield Token(TokenType.BAD, cur, 1, document)
-        cur += 1
-    yield Token(TokenType.EOF, cur, 0, document)
+                cur = len(data)
+        elif kind == "END":
+            break
+        else:
+            yield new(Token, (TokenType.BAD, start, cur - start, document))
+    yield new(Token, (TokenType.EOF, cur, 0, document))
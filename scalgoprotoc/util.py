@@ -1,5 +1,8 @@
 # -*- mode: python; tab-width: 4; indent-tabs-mode: t; python-indent-offset: 4; coding: utf-8 -*-
-from typing import List
+import os
+from typing import List, Tuple
+
+from .sp_tokenize import TokenType
 
 
 def cescape(v: bytes) -> str:
@@ -35,3 +38,47 @@ def snake(n: str) -> str:
         else:
             out.append(c.lower())
     return "".join(out)
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """Write content to path unless the file already holds exactly that,
+    so that the mtime of unchanged outputs is preserved"""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
+def make_escape(path: str) -> str:
+    """Escape a path for use in a make rule"""
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def write_depfile(path: str, targets: List[str], dependencies: List[str]) -> None:
+    """Write a make style depfile stating that all targets depend on dependencies"""
+    content = "%s: %s\n" % (
+        " ".join(map(make_escape, targets)),
+        " \\\n  ".join(map(make_escape, dependencies)),
+    )
+    write_if_changed(path, content)
+
+
+def pointer_member(node) -> bool:
+    """Return true if a table stores a pointer for the member node, rather
+    than its value"""
+    return bool(node.list_ or node.map_ or node.table or node.union) or (
+        node.type_.type in (TokenType.TEXT, TokenType.BYTES)
+    )
+
+
+def trim_fields(table) -> Tuple[Tuple[int, int], ...]:
+    """Return the start and end of every member of table of more than one
+    byte, which a trimmed table must store entirely or not at all"""
+    return tuple(
+        (node.offset, node.offset + node.bytes)
+        for node in table.members
+        if node.bytes > 1
+    )
@@ -18,10 +18,10 @@ def runValidate(schema: str, fail: bool = False) -> bool:
 
 
 def runCppSetup(schemas: List[str], cpp: str) -> bool:
-    for schema in schemas:
-        subprocess.check_call(
-            ["python3", "-m", "scalgoprotoc", "cpp", schema, "tmp/", "--single"]
-        )
+    subprocess.check_call(
+        ["python3", "-m", "scalgoprotoc", "build", "--cpp", "tmp/", "--single"]
+        + schemas
+    )
     subprocess.check_call(
         [
             "g++",
@@ -36,6 +36,7 @@ def runCppSetup(schemas: List[str], cpp: str) -> bool:
             cpp,
             "-o",
             "tmp/bin",
+            "-lz",
         ]
     )
     return True
@@ -47,18 +48,40 @@ def runCpp(name: str, bin: str) -> bool:
 
 
 def runPySetup(schemas: List[str]) -> bool:
-    for schema in schemas:
-        subprocess.check_call(["python3", "-m", "scalgoprotoc", "py", schema, "tmp"])
+    subprocess.check_call(["python3", "-m", "scalgoprotoc", "build", "--py", "tmp"] + schemas)
     return True
 
 
 def runPy(name: str, bin: str, mod="test_base.py") -> bool:
+    # Run the tests with this interpreter and environment, so they see the
+    # same optional packages, like numpy
     subprocess.check_call(
-        ["python3", "test/%s"%mod, name, bin], env={"PYTHONPATH": "lib/python:tmp:test"}
+        [sys.executable, "test/%s" % mod, name, bin],
+        env={**os.environ, "PYTHONPATH": "lib/python:tmp:test"},
     )
     return True
 
 
+def runIncremental(schema: str, output: str, deps: List[str]) -> bool:
+    cmd = ["python3", "-m", "scalgoprotoc", "py", schema, "tmp", "--depfile", "tmp/dep.d"]
+    subprocess.check_call(cmd)
+    mtime = os.stat(output).st_mtime_ns
+    subprocess.check_call(cmd)
+    if os.stat(output).st_mtime_ns != mtime:
+        return False
+    content = open("tmp/dep.d", "r").read()
+    return content.startswith("%s:" % output) and all(d in content for d in deps)
+
+
+def runCompact(schema: str, table: str, message: str) -> bool:
+    output = "tmp/compacted.bin"
+    subprocess.check_call(
+        ["python3", "-m", "scalgoprotoc", "compact", schema, table, message, output],
+        env={"PYTHONPATH": "lib/python"},
+    )
+    return os.path.getsize(output) < os.path.getsize(message)
+
+
 def runTest(name: str, func: Callable[[], bool]) -> bool:
     l = 80 - len(name) - 4
     print("%s> %s <%s" % ("=" * (l // 2), name, "=" * (l - l // 2)))
@@ -112,6 +135,22 @@ def main():
             bad,
             good,
         )
+    # Modifiers are only keywords in front of the type of a member
+    for word in (
+        "columnar",
+        "packed",
+        "dictionary",
+        "map",
+        "sorted",
+        "by",
+        "compressed",
+    ):
+        runNeg(
+            "modifier member name %s" % word,
+            "table Monkey @8908828A {%s: U32; b: map Text -> U32}",
+            word.capitalize(),
+            word,
+        )
     # Test table types
     for (bad, good) in (
         ("Int", "I32"),
@@ -177,6 +216,89 @@ def main():
         "inplace",
     )
 
+    runNeg(
+        "columnar table",
+        "table Point @8908828B {x: %s} table Monkey @8908828A {a: list columnar Point}",
+        "Text",
+        "F64",
+    )
+    runNeg(
+        "columnar list",
+        "table Point @8908828B {x: F64} table Monkey @8908828A {a: %s columnar Point}",
+        "",
+        "list",
+    )
+
+    runNeg(
+        "packed type",
+        "table Monkey @8908828A {a: list packed %s}",
+        "F64",
+        "I64",
+    )
+    runNeg(
+        "packed list",
+        "table Monkey @8908828A {a: %s packed U32}",
+        "",
+        "list",
+    )
+
+    runNeg(
+        "dictionary type",
+        "table Monkey @8908828A {a: list dictionary %s}",
+        "Bytes",
+        "Text",
+    )
+
+    runNeg(
+        "map key",
+        "table Monkey @8908828A {a: map %s -> U32}",
+        "F64",
+        "U32",
+    )
+    runNeg(
+        "map value",
+        "table Monkey @8908828A {a: map Text -> %s}",
+        "Bool",
+        "U32",
+    )
+    runNeg(
+        "map list",
+        "table Monkey @8908828A {a: %s map Text -> U32}",
+        "list",
+        "",
+    )
+
+    runNeg(
+        "sorted key",
+        "table Monkey @8908828A {a: list table @1D94B6E3 {b: F64; c: U32} sorted by %s}",
+        "b",
+        "c",
+    )
+    runNeg(
+        "sorted member name",
+        "table Monkey @8908828A {a: list table @1D94B6E3 {c: U32} %s sorted: U32}",
+        "sorted by",
+        "",
+    )
+    runNeg(
+        "sorted list",
+        "table Monkey @8908828A {a: %s table @1D94B6E3 {c: U32} sorted by c}",
+        "",
+        "list",
+    )
+    runNeg(
+        "compressed type",
+        "table Monkey @8908828A {a: compressed %s}",
+        "Text",
+        "Bytes",
+    )
+    runNeg(
+        "compressed inplace",
+        "table Monkey @8908828A {a: %s compressed Bytes}",
+        "inplace",
+        "",
+    )
+
     runNeg(
         "multi inplace",
         "table Monkey @8908828A {a: inplace Bytes; b: %s Text}",
@@ -202,6 +324,10 @@ def main():
         runTest("cpp in simple", lambda: runCpp("in", "test/simple.bin"))
         runTest("cpp out complex", lambda: runCpp("out_complex", "test/complex.bin"))
         runTest("cpp in complex", lambda: runCpp("in_complex", "test/complex.bin"))
+        runTest(
+            "cpp out complex builder",
+            lambda: runCpp("out_complex_builder", "test/complex.bin"),
+        )
 
         runTest("cpp out inplace", lambda: runCpp("out_inplace", "test/inplace.bin"))
         runTest("cpp in inplace", lambda: runCpp("in_inplace", "test/inplace.bin"))
@@ -211,7 +337,97 @@ def main():
         runTest("cpp in extend2", lambda: runCpp("in_extend2", "test/extend2.bin"))
         runTest("cpp out complex2", lambda: runCpp("out_complex2", "test/complex2.bin"))
         runTest("cpp in complex2", lambda: runCpp("in_complex2", "test/complex2.bin"))
-    if runTest("py setup", lambda: runPySetup(["test/base.spr", "test/complex2.spr", "test/union.spr"])):
+        runTest(
+            "cpp out complex large",
+            lambda: runCpp("out_complex_large", "test/complex_large.bin"),
+        )
+        runTest(
+            "cpp in complex large", lambda: runCpp("in_complex", "test/complex_large.bin")
+        )
+        runTest(
+            "cpp out complex2 large",
+            lambda: runCpp("out_complex2_large", "test/complex2_large.bin"),
+        )
+        runTest(
+            "cpp in complex2 large",
+            lambda: runCpp("in_complex2", "test/complex2_large.bin"),
+        )
+        runTest("cpp copy simple", lambda: runCpp("copy", "test/simple.bin"))
+        runTest("cpp copy complex", lambda: runCpp("copy_complex", "test/complex.bin"))
+        runTest(
+            "cpp copy complex2", lambda: runCpp("copy_complex2", "test/complex2.bin")
+        )
+        runTest("cpp copy inplace", lambda: runCpp("copy_inplace", "test/inplace.bin"))
+        runTest("cpp out columnar", lambda: runCpp("out_columnar", "test/columnar.bin"))
+        runTest("cpp in columnar", lambda: runCpp("in_columnar", "test/columnar.bin"))
+        runTest(
+            "cpp copy columnar", lambda: runCpp("copy_columnar", "test/columnar.bin")
+        )
+        runTest(
+            "cpp in columnar old",
+            lambda: runCpp("in_columnar_old", "test/columnar_old.bin"),
+        )
+        runTest(
+            "cpp column columnar old",
+            lambda: runCpp("column_columnar_old", "test/columnar_old.bin"),
+        )
+        runTest(
+            "cpp copy columnar old",
+            lambda: runCpp("copy_columnar_old", "test/columnar_old.bin"),
+        )
+        runTest("cpp out packed", lambda: runCpp("out_packed", "test/packed.bin"))
+        runTest("cpp in packed", lambda: runCpp("in_packed", "test/packed.bin"))
+        runTest("cpp copy packed", lambda: runCpp("copy_packed", "test/packed.bin"))
+        runTest(
+            "cpp out dictionary",
+            lambda: runCpp("out_dictionary", "test/dictionary.bin"),
+        )
+        runTest(
+            "cpp in dictionary", lambda: runCpp("in_dictionary", "test/dictionary.bin")
+        )
+        runTest(
+            "cpp copy dictionary",
+            lambda: runCpp("copy_dictionary", "test/dictionary.bin"),
+        )
+        runTest("cpp out dedupe", lambda: runCpp("out_dedupe", "test/dedupe.bin"))
+        runTest("cpp in dedupe", lambda: runCpp("in_dedupe", "test/dedupe.bin"))
+        runTest("cpp out intern", lambda: runCpp("out_intern", "test/intern.bin"))
+        runTest("cpp in intern", lambda: runCpp("in_intern", "test/intern.bin"))
+        runTest("cpp out map", lambda: runCpp("out_map", "test/map.bin"))
+        runTest("cpp in map", lambda: runCpp("in_map", "test/map.bin"))
+        runTest("cpp copy map", lambda: runCpp("copy_map", "test/map.bin"))
+        runTest("cpp out sorted", lambda: runCpp("out_sorted", "test/sorted.bin"))
+        runTest("cpp in sorted", lambda: runCpp("in_sorted", "test/sorted.bin"))
+        runTest("cpp copy sorted", lambda: runCpp("copy_sorted", "test/sorted.bin"))
+        runTest("cpp compact", lambda: runCpp("compact", "test/compact.bin"))
+        runTest("cpp rollback", lambda: runCpp("rollback", "test/rollback.bin"))
+        runTest("cpp mut", lambda: runCpp("mut", "test/mut.bin"))
+        runTest("cpp append", lambda: runCpp("append", "test/append.bin"))
+        runTest(
+            "cpp out compressed",
+            lambda: runCpp("out_compressed", "test/compressed.bin"),
+        )
+        runTest(
+            "cpp in compressed", lambda: runCpp("in_compressed", "test/compressed.bin")
+        )
+        runTest(
+            "cpp copy compressed",
+            lambda: runCpp("copy_compressed", "test/compressed.bin"),
+        )
+        runTest(
+            "cpp compact simple", lambda: runCpp("compact_simple", "test/simple.bin")
+        )
+        runTest(
+            "cpp compact complex", lambda: runCpp("compact_complex", "test/complex.bin")
+        )
+        runTest(
+            "cpp compact complex2",
+            lambda: runCpp("compact_complex2", "test/complex2.bin"),
+        )
+        runTest(
+            "cpp compact inplace", lambda: runCpp("compact_inplace", "test/inplace.bin")
+        )
+    if runTest("py setup", lambda: runPySetup(["test/base.spr", "test/complex2.spr"])):
         runTest(
             "py out default simple",
             lambda: runPy("out_default", "test/simple_default.bin"),
@@ -224,14 +440,123 @@ def main():
         runTest("py in simple", lambda: runPy("in", "test/simple.bin"))
         runTest("py out complex", lambda: runPy("out_complex", "test/complex.bin"))
         runTest("py in complex", lambda: runPy("in_complex", "test/complex.bin"))
+        runTest(
+            "py out complex builder",
+            lambda: runPy("out_complex_builder", "test/complex.bin"),
+        )
         runTest("py out complex2", lambda: runPy("out_complex2", "test/complex2.bin"))
         runTest("py in complex2", lambda: runPy("in_complex2", "test/complex2.bin"))
+        runTest(
+            "py out complex large",
+            lambda: runPy("out_complex_large", "test/complex_large.bin"),
+        )
+        runTest(
+            "py in complex large", lambda: runPy("in_complex", "test/complex_large.bin")
+        )
+        runTest(
+            "py out complex2 large",
+            lambda: runPy("out_complex2_large", "test/complex2_large.bin"),
+        )
+        runTest(
+            "py in complex2 large",
+            lambda: runPy("in_complex2", "test/complex2_large.bin"),
+        )
         runTest("py out inplace", lambda: runPy("out_inplace", "test/inplace.bin"))
         runTest("py in inplace", lambda: runPy("in_inplace", "test/inplace.bin"))
         runTest("py out extend1", lambda: runPy("out_extend1", "test/extend1.bin"))
         runTest("py in extend1", lambda: runPy("in_extend1", "test/extend1.bin"))
         runTest("py out extend2", lambda: runPy("out_extend2", "test/extend2.bin"))
         runTest("py in extend2", lambda: runPy("in_extend2", "test/extend2.bin"))
+        runTest("py out copied", lambda: runPy("out_copied", "test/copied.bin"))
+        runTest("py in copied", lambda: runPy("in_copied", "test/copied.bin"))
+        runTest("py copy copied", lambda: runPy("copy_copied", "test/copied.bin"))
+        runTest("py copy simple", lambda: runPy("copy", "test/simple.bin"))
+        runTest("py copy complex", lambda: runPy("copy_complex", "test/complex.bin"))
+        runTest(
+            "py copy complex2", lambda: runPy("copy_complex2", "test/complex2.bin")
+        )
+        runTest("py copy inplace", lambda: runPy("copy_inplace", "test/inplace.bin"))
+        runTest("py out columnar", lambda: runPy("out_columnar", "test/columnar.bin"))
+        runTest("py in columnar", lambda: runPy("in_columnar", "test/columnar.bin"))
+        runTest("py copy columnar", lambda: runPy("copy_columnar", "test/columnar.bin"))
+        runTest(
+            "py in columnar old",
+            lambda: runPy("in_columnar_old", "test/columnar_old.bin"),
+        )
+        runTest(
+            "py copy columnar old",
+            lambda: runPy("copy_columnar_old", "test/columnar_old.bin"),
+        )
+        runTest("py out packed", lambda: runPy("out_packed", "test/packed.bin"))
+        runTest("py in packed", lambda: runPy("in_packed", "test/packed.bin"))
+        runTest("py copy packed", lambda: runPy("copy_packed", "test/packed.bin"))
+        runTest(
+            "py out dictionary", lambda: runPy("out_dictionary", "test/dictionary.bin")
+        )
+        runTest(
+            "py in dictionary", lambda: runPy("in_dictionary", "test/dictionary.bin")
+        )
+        runTest(
+            "py copy dictionary",
+            lambda: runPy("copy_dictionary", "test/dictionary.bin"),
+        )
+        runTest(
+            "py dictionary unset",
+            lambda: runPy("dictionary_unset", "test/dictionary.bin"),
+        )
+        runTest("py out dedupe", lambda: runPy("out_dedupe", "test/dedupe.bin"))
+        runTest("py in dedupe", lambda: runPy("in_dedupe", "test/dedupe.bin"))
+        runTest("py out intern", lambda: runPy("out_intern", "test/intern.bin"))
+        runTest("py in intern", lambda: runPy("in_intern", "test/intern.bin"))
+        runTest("py out map", lambda: runPy("out_map", "test/map.bin"))
+        runTest("py in map", lambda: runPy("in_map", "test/map.bin"))
+        runTest("py copy map", lambda: runPy("copy_map", "test/map.bin"))
+        runTest("py map many", lambda: runPy("map_many", "test/map.bin"))
+        runTest("py out sorted", lambda: runPy("out_sorted", "test/sorted.bin"))
+        runTest("py in sorted", lambda: runPy("in_sorted", "test/sorted.bin"))
+        runTest("py copy sorted", lambda: runPy("copy_sorted", "test/sorted.bin"))
+        runTest("py compact", lambda: runPy("compact", "test/compact.bin"))
+        runTest("py rollback", lambda: runPy("rollback", "test/rollback.bin"))
+        runTest("py mut", lambda: runPy("mut", "test/mut.bin"))
+        runTest("py append", lambda: runPy("append", "test/append.bin"))
+        runTest("py patch", lambda: runPy("patch", "test/append.bin"))
+        runTest("py archive", lambda: runPy("archive", "test/complex.bin"))
+        runTest(
+            "py out compressed", lambda: runPy("out_compressed", "test/compressed.bin")
+        )
+        runTest(
+            "py in compressed", lambda: runPy("in_compressed", "test/compressed.bin")
+        )
+        runTest(
+            "py copy compressed",
+            lambda: runPy("copy_compressed", "test/compressed.bin"),
+        )
+        runTest("py compact simple", lambda: runPy("compact_simple", "test/simple.bin"))
+        runTest(
+            "py compact complex", lambda: runPy("compact_complex", "test/complex.bin")
+        )
+        runTest(
+            "py compact complex2",
+            lambda: runPy("compact_complex2", "test/complex2.bin"),
+        )
+        runTest(
+            "py compact inplace", lambda: runPy("compact_inplace", "test/inplace.bin")
+        )
+        runTest("py tables", lambda: runPy("tables", "test/tables.bin"))
+        runTest("py cursor", lambda: runPy("cursor", "test/complex.bin"))
+        runTest("py struct views", lambda: runPy("struct_views", "test/simple.bin"))
+        runTest("py struct columns", lambda: runPy("struct_columns", "test/complex.bin"))
+
+    runTest(
+        "py incremental",
+        lambda: runIncremental(
+            "test/complex2.spr", "tmp/complex2.py", ["test/complex2.spr", "test/base.spr"]
+        ),
+    )
+    runTest(
+        "py compact cli",
+        lambda: runCompact("test/base.spr", "Simple", "test/simple.bin"),
+    )
 
     print("=" * 80)
     if not failures:
@@ -9,13 +9,24 @@
 using namespace scalgoprototest;
 using namespace scalgoprototest2;
 
-int main(int, char ** argv) {
-	if (!strcmp(argv[1], "out_default")) {
+const std::uint64_t packedIds[] = {5, 1000000, 1000003, 18446744073709551615ull, 0};
+const std::int32_t packedDeltas[] = {-5, 3, -2147483647 - 1, 2147483647, 0};
+const std::string_view dictionaryCountries[] = {"DK", "SE", "DK", "NO", "DK", "SE"};
+const std::string compressedPayload = []() {
+	std::string ans;
+	for (size_t i=0; i < 2000; ++i) ans += "tile " + std::to_string(i % 50) + ";";
+	return ans;
+}();
+const std::int16_t sortedIds[] = {7, 3, 9, 3, -1};
+const std::string_view sortedNames[] = {"pear", "apple", "fig"};
+
+int runTest(const char * test, const char * path) {
+	if (!strcmp(test, "out_default")) {
 		scalgoproto::Writer w;
 		auto s = w.construct<SimpleOut>();
 		auto [data, size] = w.finalize(s);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "out")) {
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "out")) {
 		scalgoproto::Writer w;
 		auto s = w.construct<SimpleOut>();
 		s.setE(MyEnum::c);
@@ -30,9 +41,9 @@ int main(int, char ** argv) {
 		s.setOi8(-60).setOi16(4055).setOi32(124465).setOi64(5465729);
 		s.setOf(5.0).setOd(6.4);
 		auto [data, size] = w.finalize(s);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<SimpleIn>();
 		REQUIRE(s.hasE(), true);
@@ -102,8 +113,8 @@ int main(int, char ** argv) {
 		REQUIRE(s.hasNi64(), false);
 		REQUIRE(s.hasNf(), false);
 		REQUIRE(s.hasNd(), false);
-	} else if (!strcmp(argv[1], "in_default")) {
-		auto o = readIn(argv[2]);
+	} else if (!strcmp(test, "in_default")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<SimpleIn>();
 		REQUIREQ(s.s().e, MyEnum::a	);
@@ -156,8 +167,8 @@ int main(int, char ** argv) {
 		REQUIRE(s.hasNi64(), false);
 		REQUIRE(s.hasNf(), false);
 		REQUIRE(s.hasNd(), false);
-	} else if (!strcmp(argv[1], "out_complex")) {
-		scalgoproto::Writer w;
+	} else if (!strcmp(test, "out_complex") || !strcmp(test, "out_complex_large")) {
+		scalgoproto::Writer w(256, !strcmp(test, "out_complex_large"));
 		auto m = w.construct<MemberOut>();
 		m.setId(42);
 		auto l = w.constructList<std::int32_t>(31);
@@ -206,9 +217,77 @@ int main(int, char ** argv) {
 		s.setBlist(l10);
 
 		auto [data, size] = w.finalize(s);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in_complex")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "out_complex_builder")) {
+		scalgoproto::Writer w;
+		auto m = w.construct<MemberOut>();
+		m.setId(42);
+		auto lb = w.constructListBuilder<std::int32_t>();
+		for (size_t i=0; i < 31; ++i)
+			lb.push_back(100-2*i);
+		auto l = lb.finish();
+		auto l2b = w.constructListBuilder<MyEnum>();
+		l2b.push_back(MyEnum::a);
+		l2b.skip();
+		auto l2 = l2b.finish();
+		auto l3b = w.constructListBuilder<MyStruct>(1);
+		l3b.push_back(MyStruct{});
+		auto l3 = l3b.finish();
+		auto b = w.constructBytes("bytes", 5);
+		auto t = w.constructText("text");
+
+		auto l4b = w.constructTextListBuilder();
+		l4b.push_back(t);
+		l4b.skip();
+		auto l4 = l4b.finish();
+		auto l5b = w.constructBytesListBuilder();
+		l5b.push_back(b);
+		auto l5 = l5b.finish();
+
+		auto l6b = w.constructListBuilder<MemberOut>();
+		l6b.push_back(m);
+		l6b.skip();
+		l6b.push_back(m);
+		auto l6 = l6b.finish();
+
+		auto l7b = w.constructListBuilder<float>();
+		l7b.skip();
+		l7b.push_back(98.0);
+		auto l7 = l7b.finish();
+
+		auto l8b = w.constructListBuilder<double>();
+		l8b.skip();
+		l8b.skip();
+		l8b.push_back(78.0);
+		auto l8 = l8b.finish();
+
+		auto l9b = w.constructListBuilder<uint8_t>();
+		l9b.push_back(4);
+		l9b.skip();
+		auto l9 = l9b.finish();
+
+		auto l10b = w.constructListBuilder<bool>(1);
+		for (size_t i=0; i < 10; ++i)
+			l10b.push_back(i == 0 || i == 2 || i == 8);
+		auto l10 = l10b.finish();
+
+		auto s = w.construct<ComplexOut>();
+		s.setMember(m).setText(t).setMyBytes(b);
+		s.setIntList(l);
+		s.setStructList(l3);
+		s.setEnumList(l2);
+		s.setTextList(l4);
+		s.setBytesList(l5);
+		s.setMemberList(l6);
+		s.setF32list(l7);
+		s.setF64list(l8);
+		s.setU8list(l9);
+		s.setBlist(l10);
+
+		auto [data, size] = w.finalize(s);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_complex")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<ComplexIn>();
 		REQUIRE(s.hasNmember(), false);
@@ -304,8 +383,8 @@ int main(int, char ** argv) {
 		REQUIRE(l10[9], false);
 
 		return 0;
-	} else if (!strcmp(argv[1], "out_complex2")) {
-		scalgoproto::Writer w;
+	} else if (!strcmp(test, "out_complex2") || !strcmp(test, "out_complex2_large")) {
+		scalgoproto::Writer w(256, !strcmp(test, "out_complex2_large"));
 
 		auto m = w.construct<MemberOut>();
 		m.setId(42);
@@ -339,9 +418,9 @@ int main(int, char ** argv) {
 		r.setL2(l3);
 
 		auto [data, size] = w.finalize(r);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in_complex2")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_complex2")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<Complex2In>();
 		REQUIRE(s.u1().isMember(), true);
@@ -375,7 +454,7 @@ int main(int, char ** argv) {
 		REQUIRE(l3[1].isMyBytes(), true);
 		REQUIRE(l3[1].myBytes().second, 5);
 		REQUIRE(memcmp(l3[1].myBytes().first, "bytes", 5), 0);
-	} else if (!strcmp(argv[1], "out_inplace")) {
+	} else if (!strcmp(test, "out_inplace")) {
 		scalgoproto::Writer w;
 		auto name = w.constructText("nilson");
 		auto u = w.construct<InplaceUnionOut>();
@@ -401,9 +480,9 @@ int main(int, char ** argv) {
 		auto root = w.construct<InplaceRootOut>();
 		root.setU(u).setU2(u2).setT(t).setB(b).setL(l);
 		auto [data, size] = w.finalize(root);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in_inplace")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_inplace")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<InplaceRootIn>();
 
@@ -443,21 +522,21 @@ int main(int, char ** argv) {
 		REQUIRE(ll[0], 24);
 		REQUIRE(ll[1], 99);
 		return 0;		
-	} else if (!strcmp(argv[1], "out_extend1")) {
+	} else if (!strcmp(test, "out_extend1")) {
 		scalgoproto::Writer w;
 		auto root = w.construct<Gen1Out>();
 		root.setAa(77);
 		auto [data, size] = w.finalize(root);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in_extend1")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_extend1")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<Gen2In>();
 		REQUIRE(s.aa(), 77);
 		REQUIRE(s.bb(), 42);
 		REQUIRE(s.hasU(), false);
 		return 0;
-	} else if (!strcmp(argv[1], "out_extend2")) {
+	} else if (!strcmp(test, "out_extend2")) {
 		scalgoproto::Writer w;
 		auto root = w.construct<Gen2Out>();
 		root.setAa(80);
@@ -465,9 +544,9 @@ int main(int, char ** argv) {
 		auto cake = root.u().addCake();
 		cake.setV(45);
 		auto [data, size] = w.finalize(root);
-		return !validateOut(data, size, argv[2]);
-	} else if (!strcmp(argv[1], "in_extend2")) {
-		auto o = readIn(argv[2]);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_extend2")) {
+		auto o = readIn(path);
 		scalgoproto::Reader r(o.data(), o.size());
 		auto s = r.root<Gen3In>();
 		REQUIRE(s.aa(), 80);
@@ -511,8 +590,573 @@ int main(int, char ** argv) {
 		REQUIRE(s.hasBytesList(), false);
 		REQUIRE(s.hasMemberList(), false);
 		return 0;
+	} else if (!strcmp(test, "out_columnar")) {
+		scalgoproto::Writer w;
+		auto c = w.construct<ColumnarOut>();
+		auto t = c.addTail(10);
+		t[9].setV(1000);
+		for (size_t i=0; i < 10; ++i) t.w()[i] = i % 3 == 0;
+		auto p = c.addPoints(3);
+		auto x = p.x();
+		for (size_t i=0; i < 3; ++i) x[i] = 0.5 + i;
+		p[1].setY(42);
+		p[2].setB(true);
+		p[0].setE(MyEnum::c);
+		p[2].setE(MyEnum::a);
+		for (size_t i=0; i < 3; ++i) p.s()[i] = MyStruct{(std::uint32_t)i, 2.0f * i, i == 1};
+		auto [data, size] = w.finalize(c);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_columnar")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto c = r.root<ColumnarIn>();
+		REQUIRE(c.hasPoints(), true);
+		auto p = c.points();
+		REQUIRE(p.size(), 3);
+		REQUIRE(p.x()[0], 0.5);
+		REQUIRE(p.x()[2], 2.5);
+		REQUIRE(p.y()[0], 7);
+		REQUIRE(p.y()[1], 42);
+		REQUIRE(p.b()[1], false);
+		REQUIRE(p.b()[2], true);
+		REQUIRE(p.e().has(1), false);
+		REQUIREQ(p.e()[0], MyEnum::c);
+		REQUIRE(p.s()[2].y, 4.0);
+		REQUIRE(p[1].y(), 42);
+		REQUIRE(p[2].b(), true);
+		REQUIRE(p[1].hasE(), false);
+		REQUIREQ(p[2].e(), MyEnum::a);
+		REQUIRE(p[1].s().z, true);
+		REQUIRE(c.hasTail(), true);
+		auto t = c.tail();
+		REQUIRE(t.size(), 10);
+		size_t i = 0;
+		for (auto row: t) {
+			REQUIRE(row.v(), (i == 9 ? 1000 : 3));
+			REQUIRE(row.w(), (i % 3 == 0));
+			++i;
+		}
+		REQUIRE(i, 10);
+		return 0;
+	} else if (!strcmp(test, "in_columnar_old")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto c = r.root<ColumnarIn>();
+		auto p = c.points();
+		REQUIRE(p.size(), 3);
+		REQUIRE(p.x()[2], 2.5);
+		REQUIRE(p.y()[1], 42);
+		REQUIRE(p[2].b(), false);
+		REQUIRE(p[0].hasE(), false);
+		REQUIRE(p[1].s().y, 0.0);
+		size_t i = 0;
+		for (auto row: c.tail()) {
+			REQUIRE(row.v(), (i == 9 ? 1000 : 3));
+			REQUIRE(row.w(), false);
+			++i;
+		}
+		REQUIRE(i, 10);
+		return 0;
+	} else if (!strcmp(test, "column_columnar_old")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto p = r.root<ColumnarIn>().points();
+		REQUIRE(p.y()[1], 42);
+		bool thrown = false;
+		try {
+			p.b();
+		} catch (std::out_of_range &) {
+			thrown = true;
+		}
+		REQUIRE(thrown, true);
+		return 0;
+	} else if (!strcmp(test, "out_packed")) {
+		scalgoproto::Writer w;
+		auto p = w.construct<PackedOut>();
+		p.addIds(packedIds, 5);
+		p.setDeltas(w.constructPackedList(packedDeltas, 5));
+		const std::uint8_t small[] = {255, 0, 7};
+		p.addSmall(small, 3);
+		p.addEmpty(nullptr, 0);
+		auto [data, size] = w.finalize(p);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_packed")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto p = r.root<PackedIn>();
+		REQUIRE(p.hasIds(), true);
+		REQUIRE(p.ids().size(), 5);
+		size_t i = 0;
+		for (auto v: p.ids()) {
+			REQUIRE(v, packedIds[i]);
+			++i;
+		}
+		REQUIRE(i, 5);
+		std::int32_t deltas[5];
+		p.deltas().decode(deltas);
+		for (i=0; i < 5; ++i) REQUIRE(deltas[i], packedDeltas[i]);
+		std::uint8_t small[3];
+		p.small().decode(small);
+		REQUIRE(small[0], 255);
+		REQUIRE(small[2], 7);
+		REQUIRE(p.empty().empty(), true);
+		REQUIRE((p.empty().begin() == p.empty().end()), true);
+		return 0;
+	} else if (!strcmp(test, "out_dictionary")) {
+		scalgoproto::Writer w;
+		auto d = w.construct<DictionaryOut>();
+		d.addCountries(dictionaryCountries, 6);
+		std::vector<std::string> many;
+		for (size_t i=0; i < 520; ++i) many.push_back("v" + std::to_string(i % 260));
+		std::vector<std::string_view> views(many.begin(), many.end());
+		d.setMany(w.constructDictionaryList(views.data(), views.size()));
+		auto [data, size] = w.finalize(d);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_dictionary")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto d = r.root<DictionaryIn>();
+		REQUIRE(d.hasCountries(), true);
+		auto c = d.countries();
+		REQUIRE(c.size(), 6);
+		size_t i = 0;
+		for (auto v: c) {
+			REQUIRE(v, dictionaryCountries[i]);
+			++i;
+		}
+		REQUIRE(i, 6);
+		REQUIRE(c.dictionary().size(), 3);
+		REQUIRE(c.width(), 1);
+		std::uint32_t codes[6];
+		c.codes(codes);
+		REQUIRE(codes[3], 2);
+		REQUIRE(codes[5], 1);
+		auto m = d.many();
+		REQUIRE(m.dictionary().size(), 260);
+		REQUIRE(m.width(), 2);
+		REQUIRE(m.code(265), 5);
+		REQUIRE(m[519], "v259");
+		return 0;
+	} else if (!strcmp(test, "out_compressed")) {
+		scalgoproto::Writer w;
+		auto c = w.construct<CompressedOut>();
+		c.addPayload(compressedPayload.data(), compressedPayload.size());
+		c.addRaw("raw", 3);
+		auto [data, size] = w.finalize(c);
+		REQUIRE(size < compressedPayload.size() / 10, true);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_compressed")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto c = r.root<CompressedIn>();
+		REQUIRE(c.hasPayload(), true);
+		REQUIRE(c.hasRaw(), true);
+		REQUIRE(c.hasEmpty(), false);
+		REQUIRE(c.payload(), compressedPayload);
+		REQUIRE(c.payloadCompressed().second < compressedPayload.size() / 10, true);
+		REQUIRE(std::string(c.raw().first, c.raw().second), "raw");
+
+		// Forwarding the compressed stream gives the same message
+		scalgoproto::Writer w;
+		auto f = w.construct<CompressedOut>();
+		f.setPayloadCompressed(c.payloadCompressed());
+		f.addRaw(c.raw());
+		auto [data, size] = w.finalize(f);
+		REQUIRE(size, o.size());
+		REQUIRE(memcmp(data, o.data(), size), 0);
+		return 0;
+	} else if (!strcmp(test, "out_dedupe")) {
+		scalgoproto::Writer w(256, false, true);
+		auto s = w.construct<ComplexOut>();
+		s.addText("hello");
+		s.addMyBytes("hello", 5);
+		auto l = s.addTextList(4);
+		l[0] = "hello";
+		l[1] = "world";
+		l[2] = "hello";
+		l[3] = "world";
+		auto b = s.addBytesList(2);
+		b[0] = w.constructBytes("hello", 5);
+		b[1] = w.constructBytes("hello", 5);
+		auto [data, size] = w.finalize(s);
+		auto report = w.dedupeReport();
+		REQUIRE(report.objects, 8);
+		REQUIRE(report.hits, 5);
+		REQUIRE(report.bytesSaved, 68);
+		REQUIRE(report.entries, 3);
+		REQUIRE(report.memory, 15);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_dedupe")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto s = r.root<ComplexIn>();
+		REQUIRE(s.text(), "hello");
+		REQUIRE(s.myBytes().second, 5);
+		auto l = s.textList();
+		REQUIRE(l.size(), 4);
+		REQUIRE(l[2], "hello");
+		REQUIRE(l[3], "world");
+		REQUIRE(s.bytesList().size(), 2);
+		REQUIRE(std::string_view(s.bytesList()[1].first, 5), "hello");
+		return 0;
+	} else if (!strcmp(test, "out_intern")) {
+		scalgoproto::Writer w;
+		auto s = w.construct<ComplexOut>();
+		auto l = s.addMemberList(4);
+		for (size_t i=0; i < 4; ++i) {
+			auto m = w.construct<MemberOut>();
+			m.setId(i % 2);
+			l[i] = w.internTable(m);
+		}
+		auto m = w.construct<MemberOut>();
+		m.setId(1);
+		s.setMember(w.internTable(m));
+		auto [data, size] = w.finalize(s);
+		auto report = w.dedupeReport();
+		REQUIRE(report.tables, 5);
+		REQUIRE(report.tableHits, 3);
+		REQUIRE(report.bytesSaved, 30);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_intern")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto s = r.root<ComplexIn>();
+		auto l = s.memberList();
+		REQUIRE(l.size(), 4);
+		for (size_t i=0; i < 4; ++i) REQUIRE(l[i].id(), (std::int16_t)(i % 2));
+		REQUIRE(s.member().id(), 1);
+		return 0;
+	} else if (!strcmp(test, "out_map")) {
+		scalgoproto::Writer w;
+		auto m = w.construct<MapsOut>();
+		auto a = w.construct<MemberOut>();
+		a.setId(1);
+		auto b = w.construct<MemberOut>();
+		b.setId(2);
+		const std::pair<std::string_view, MemberOut> members[] = {{"one", a}, {"two", b}};
+		m.addMembers(members, 2);
+		const std::pair<std::int64_t, MyStruct> points[] = {{-5, {1, 2.5, true}}, {1ll << 40, {3, 4.0, false}}};
+		m.addPoints(points, 2);
+		const std::pair<std::uint16_t, scalgoproto::TextOut> names[] = {
+			{3, w.constructText("three")},
+			{700, w.constructText("seven hundred")},
+			{0, w.constructText("zero")}};
+		m.addNames(names, 3);
+		const std::pair<std::string_view, double> weights[] = {{"a", 0.5}, {"b", 1.5}};
+		m.addWeights(weights, 2);
+		m.addEmpty(nullptr, 0);
+		auto [data, size] = w.finalize(m);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_map")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto m = r.root<MapsIn>();
+		REQUIRE(m.hasMembers(), true);
+		auto members = m.members();
+		REQUIRE(members.size(), 2);
+		REQUIRE(members.at("one").id(), 1);
+		REQUIRE(members.at("two").id(), 2);
+		REQUIRE(members.contains("one"), true);
+		REQUIRE(members.contains("three"), false);
+		REQUIRE(members.get("three").has_value(), false);
+		REQUIRE(m.points().at(1ll << 40).x, 3);
+		REQUIRE(m.points().at(-5).y, 2.5);
+		auto names = m.names();
+		REQUIRE(names.at(3), "three");
+		REQUIRE(names.at(700), "seven hundred");
+		REQUIRE(*names.get(0), "zero");
+		REQUIRE(names.contains(4), false);
+		size_t i = 0;
+		for (auto [k, v]: names) {
+			REQUIRE((k == 3 || k == 700 || k == 0), true);
+			REQUIRE(v.empty(), false);
+			++i;
+		}
+		REQUIRE(i, 3);
+		REQUIRE(m.weights().at("b"), 1.5);
+		REQUIRE(m.empty().empty(), true);
+		REQUIRE(m.empty().get(0).has_value(), false);
+		REQUIRE((m.empty().begin() == m.empty().end()), true);
+		return 0;
+	} else if (!strcmp(test, "out_sorted")) {
+		scalgoproto::Writer w;
+		// Clearing the writer forgets the lists to sort
+		w.constructText("before");
+		w.construct<SortedOut>().addById(3);
+		w.clear();
+		auto s = w.construct<SortedOut>();
+		auto l = s.addById(5);
+		for (size_t i=0; i < 5; ++i) l.add(i).setId(sortedIds[i]);
+		auto n = s.addByName(3);
+		for (size_t i=0; i < 2; ++i) {
+			auto t = n.add(i);
+			t.addName(sortedNames[i]);
+			t.setCount(i);
+		}
+		auto last = n.add(2);
+		last.setCount(2);
+		bool thrown = false;
+		try {
+			w.finalize(s);
+		} catch (scalgoproto::Error &) {
+			thrown = true;
+		}
+		REQUIRE(thrown, true);
+		// The failed finalize leaves the writer unchanged
+		last.addName(sortedNames[2]);
+		auto [data, size] = w.finalize(s);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "in_sorted")) {
+		auto o = readIn(path);
+		scalgoproto::Reader r(o.data(), o.size());
+		auto s = r.root<SortedIn>();
+		auto l = s.byId();
+		REQUIRE(l.size(), 5);
+		REQUIRE(l[0].id(), -1);
+		REQUIRE(l[4].id(), 9);
+		REQUIRE(l.lowerBound(3), 1);
+		REQUIRE(l.upperBound(3), 3);
+		REQUIRE(l.lowerBound(-5), 0);
+		REQUIRE(l.lowerBound(10), 5);
+		REQUIRE(l.find(9)->id(), 9);
+		REQUIRE(l.find(4).has_value(), false);
+		auto [begin, end] = l.range(0, 8);
+		size_t i = 0;
+		for (auto it = begin; it != end; ++it, ++i) REQUIRE((*it).id(), (i < 2 ? 3 : 7));
+		REQUIRE(i, 3);
+		auto n = s.byName();
+		REQUIRE(n[0].name(), "apple");
+		REQUIRE(n[2].name(), "pear");
+		REQUIRE(n.find("fig")->count(), 2);
+		REQUIRE(n.find("kiwi").has_value(), false);
+		return 0;
+	} else if (!strcmp(test, "compact")) {
+		scalgoproto::Writer w;
+		w.construct<SimpleOut>();
+		auto s = w.construct<ComplexOut>();
+		s.addText("dropped");
+		s.addText("kept");
+		s.addMember();
+		auto l = s.addMemberList(2);
+		l.add(0).setId(300);
+		l.add(1);
+		auto [d, dsize] = w.finalize(s);
+		std::vector<char> original(d, d + dsize);
+		scalgoproto::Reader r(original.data(), original.size());
+		scalgoproto::Writer w2;
+		auto [data, size] = scalgoproto::compact<ComplexOut>(r, w2);
+		REQUIRE(original.size() - size, 246);
+		scalgoproto::Reader r2(data, size);
+		auto c = r2.root<ComplexIn>();
+		REQUIRE(c.text(), "kept");
+		REQUIRE(c.member().id(), 0);
+		REQUIRE(c.hasNmember(), false);
+		REQUIRE(c.memberList()[0].id(), 300);
+		REQUIRE(c.memberList()[1].id(), 0);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "rollback")) {
+		scalgoproto::Writer w(256, false, true);
+		// Clearing rolls back to the start, the tables after it are live
+		w.construct<ComplexOut>().addText("cleared");
+		w.clear();
+		auto s = w.construct<ComplexOut>();
+		s.addText("hello");
+		auto mark = w.mark();
+		w.constructText("world");
+		auto m = w.construct<MemberOut>();
+		m.setId(5);
+		w.internTable(m);
+		w.rollback(mark);
+		REQUIRE(w.mark(), mark);
+		for (size_t i=0; i < 3; ++i) {
+			auto inner = w.mark();
+			w.construct<MemberOut>().setId(i);
+			w.rollback(inner);
+		}
+		auto l = s.addTextList(2);
+		l[0] = w.constructText("world");
+		l[1] = w.constructText("hello");
+		auto m2 = w.construct<MemberOut>();
+		m2.setId(5);
+		s.setMember(w.internTable(m2));
+		auto [data, size] = w.finalize(s);
+		auto report = w.dedupeReport();
+		REQUIRE(report.hits, 1);
+		REQUIRE(report.tableHits, 0);
+		return !validateOut(data, size, path);
+	} else if (!strcmp(test, "mut")) {
+		auto data = readIn("test/simple.bin");
+		scalgoproto::Reader r(data.data(), data.size());
+		auto s = r.root<SimpleMut>();
+		s.setE(MyEnum::a).setB(false).setU32(7).setD(1.5);
+		s.setOs(MyStruct{1, 2.0, false});
+		s.setNu8(5);
+		REQUIREQ(s.e(), MyEnum::a);
+		REQUIRE(s.b(), false);
+		REQUIRE(s.u32(), 7);
+		REQUIRE(s.d(), 1.5);
+		REQUIRE(s.os().x, 1);
+		REQUIRE(s.hasNu8(), true);
+		REQUIRE(s.nu8(), 5);
+		REQUIRE(s.hasNu16(), false);
+
+		// Tables stored without their trailing defaults can not be changed there
+		scalgoproto::Writer w;
+		auto [d, dsize] = w.finalize(w.construct<SimpleOut>());
+		std::vector<char> original(d, d + dsize);
+		scalgoproto::Reader r2(original.data(), original.size());
+		scalgoproto::Writer w2;
+		auto [c, csize] = scalgoproto::compact<SimpleOut>(r2, w2);
+		std::vector<char> shortData(c, c + csize);
+		scalgoproto::Reader r3(shortData.data(), shortData.size());
+		bool thrown = false;
+		try {
+			r3.root<SimpleMut>().setOd(1.0);
+		} catch (std::out_of_range &) {
+			thrown = true;
+		}
+		REQUIRE(thrown, true);
+
+		auto complexData = readIn("test/complex.bin");
+		scalgoproto::Reader r4(complexData.data(), complexData.size());
+		r4.root<ComplexMut>().member().setId(7);
+		REQUIRE(r4.root<ComplexIn>().member().id(), 7);
+		return !validateOut(data.data(), data.size(), path);
+	} else if (!strcmp(test, "append")) {
+		auto o = readIn("test/complex.bin");
+		auto w = scalgoproto::Writer::openAppend(o.data(), o.size());
+		auto m = w.construct<MemberOut>();
+		m.setId(9);
+		auto t = w.constructText("appended");
+		auto b = w.constructBytes("more", 4);
+		auto l = w.constructList<std::int32_t>(2);
+		l[0] = 1;
+		l[1] = 2;
+		scalgoproto::Reader r(w.finalize());
+		auto c = r.root<ComplexMut>();
+		c.setNmember(m).setNtext(t).setNbytes(b).setNintList(l);
+		c.member().setId(43);
+		auto [data, size] = w.finalize();
+		REQUIRE(size > o.size(), true);
+		scalgoproto::Reader r2(data, size);
+		auto s = r2.root<ComplexIn>();
+		REQUIRE(s.nmember().id(), 9);
+		REQUIRE(s.ntext(), "appended");
+		REQUIRE(std::string_view(s.nbytes().first, s.nbytes().second), "more");
+		REQUIRE(s.nintList().size(), 2);
+		REQUIRE(s.nintList()[1], 2);
+		REQUIRE(s.member().id(), 43);
+		REQUIRE(s.text(), "text");
+		bool thrown = false;
+		try {
+			scalgoproto::Writer().finalize();
+		} catch (std::logic_error &) {
+			thrown = true;
+		}
+		REQUIRE(thrown, true);
+		// A file is continued in place
+		{
+			std::ofstream os("tmp/append.bin", std::ofstream::binary);
+			os.write(o.data(), o.size());
+		}
+		{
+			auto fw = scalgoproto::Writer::openAppendFile("tmp/append.bin");
+			auto fm = fw.construct<MemberOut>();
+			fm.setId(9);
+			auto ft = fw.constructText("appended");
+			auto fb = fw.constructBytes("more", 4);
+			auto fl = fw.constructList<std::int32_t>(2);
+			fl[0] = 1;
+			fl[1] = 2;
+			scalgoproto::Reader fr(fw.finalize());
+			auto fc = fr.root<ComplexMut>();
+			fc.setNmember(fm).setNtext(ft).setNbytes(fb).setNintList(fl);
+			fc.member().setId(43);
+			auto [fdata, fsize] = fw.finalize();
+			REQUIRE(fsize, size);
+			REQUIRE(memcmp(fdata, data, size), 0);
+		}
+		auto f = readIn("tmp/append.bin");
+		REQUIRE(f.size(), size);
+		REQUIRE(memcmp(f.data(), data, size), 0);
+		// A cleared writer no longer continues the message
+		auto w2 = scalgoproto::Writer::openAppend(o.data(), o.size());
+		w2.clear();
+		thrown = false;
+		try {
+			w2.finalize();
+		} catch (std::logic_error &) {
+			thrown = true;
+		}
+		REQUIRE(thrown, true);
+		return !validateOut(data, size, path);
 	} else {
 		return 1;
 	}
 	return 0;
 }
+
+template <typename O>
+int copyTest(const char * test, const char * path) {
+	auto o = readIn(path);
+	scalgoproto::Reader r(o.data(), o.size());
+	scalgoproto::Writer w;
+	auto root = w.construct<O>();
+	scalgoproto::copy(root, r.root<typename O::IN>());
+	auto [data, size] = w.finalize(root);
+	const char * copyPath = "tmp/copy.bin";
+	{
+		std::ofstream os(copyPath, std::ofstream::binary);
+		os.write(data, size);
+	}
+	return runTest(test, copyPath);
+}
+
+template <typename O>
+int compactTest(const char * test, const char * path) {
+	auto o = readIn(path);
+	scalgoproto::Reader r(o.data(), o.size());
+	scalgoproto::Writer w;
+	auto [data, size] = scalgoproto::compact<O>(r, w);
+	REQUIRE(size <= o.size(), true);
+	const char * compactPath = "tmp/compact.bin";
+	{
+		std::ofstream os(compactPath, std::ofstream::binary);
+		os.write(data, size);
+	}
+	return runTest(test, compactPath);
+}
+
+int main(int, char ** argv) {
+	if (!strcmp(argv[1], "copy"))
+		return copyTest<SimpleOut>("in", argv[2]);
+	if (!strcmp(argv[1], "copy_complex"))
+		return copyTest<ComplexOut>("in_complex", argv[2]);
+	if (!strcmp(argv[1], "copy_complex2"))
+		return copyTest<Complex2Out>("in_complex2", argv[2]);
+	if (!strcmp(argv[1], "copy_inplace"))
+		return copyTest<InplaceRootOut>("in_inplace", argv[2]);
+	if (!strcmp(argv[1], "copy_columnar"))
+		return copyTest<ColumnarOut>("in_columnar", argv[2]);
+	if (!strcmp(argv[1], "copy_columnar_old"))
+		return copyTest<ColumnarOut>("in_columnar_old", argv[2]);
+	if (!strcmp(argv[1], "copy_packed"))
+		return copyTest<PackedOut>("in_packed", argv[2]);
+	if (!strcmp(argv[1], "copy_dictionary"))
+		return copyTest<DictionaryOut>("in_dictionary", argv[2]);
+	if (!strcmp(argv[1], "copy_map"))
+		return copyTest<MapsOut>("in_map", argv[2]);
+	if (!strcmp(argv[1], "copy_sorted"))
+		return copyTest<SortedOut>("in_sorted", argv[2]);
+	if (!strcmp(argv[1], "copy_compressed"))
+		return copyTest<CompressedOut>("in_compressed", argv[2]);
+	if (!strcmp(argv[1], "compact_simple"))
+		return compactTest<SimpleOut>("in", argv[2]);
+	if (!strcmp(argv[1], "compact_complex"))
+		return compactTest<ComplexOut>("in_complex", argv[2]);
+	if (!strcmp(argv[1], "compact_complex2"))
+		return compactTest<Complex2Out>("in_complex2", argv[2]);
+	if (!strcmp(argv[1], "compact_inplace"))
+		return compactTest<InplaceRootOut>("in_inplace", argv[2]);
+	return runTest(argv[1], argv[2]);
+}
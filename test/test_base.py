@@ -1,5 +1,9 @@
 # -*- mode: python; tab-width: 4; indent-tabs-mode: nil; python-indent-offset: 4; coding: utf-8 -*-
+import io
+import os
 import sys
+import tempfile
+import zlib
 
 import scalgoproto
 import base
@@ -388,8 +392,8 @@ def test_in_default(path: str) -> bool:
     return True
 
 
-def test_out_complex(path: str) -> bool:
-    w = scalgoproto.Writer()
+def test_out_complex(path: str, large: bool = False) -> bool:
+    w = scalgoproto.Writer(large)
 
     m = w.construct_table(base.MemberOut)
     m.id = 42
@@ -448,6 +452,77 @@ def test_out_complex(path: str) -> bool:
     return validate_out(data, path)
 
 
+def test_out_complex_builder(path: str) -> bool:
+    w = scalgoproto.Writer()
+
+    m = w.construct_table(base.MemberOut)
+    m.id = 42
+
+    l = w.construct_int32_list_builder()
+    l.extend(100 - 2 * i for i in range(31))
+    l.finish()
+
+    l2 = w.construct_enum_list_builder(base.MyEnum)
+    l2.append(base.MyEnum.a)
+    l2.skip()
+    l2.finish()
+
+    l3 = w.construct_struct_list_builder(base.MyStruct)
+    l3.append(base.MyStruct())
+    l3.finish()
+
+    b = w.construct_bytes(b"bytes")
+    t = w.construct_text("text")
+
+    l4 = w.construct_text_list_builder()
+    l4.append(t)
+    l4.skip()
+    l4.finish()
+    l5 = w.construct_bytes_list_builder()
+    l5.append(b)
+    l5.finish()
+
+    l6 = w.construct_table_list_builder(base.MemberOut)
+    l6.append(m)
+    l6.skip()
+    l6.append(m)
+    l6.finish()
+
+    l7 = w.construct_float32_list_builder()
+    l7.extend([0.0, 98.0])
+    l7.finish()
+
+    l8 = w.construct_float64_list_builder()
+    l8.extend([0.0, 0.0, 78.0])
+    l8.finish()
+
+    l9 = w.construct_uint8_list_builder()
+    l9.extend([4, 0])
+    l9.finish()
+
+    l10 = w.construct_bool_list_builder()
+    l10.extend(i in (0, 2, 8) for i in range(10))
+    l10.finish()
+
+    s = w.construct_table(base.ComplexOut)
+    s.member = m
+    s.text = t
+    s.my_bytes = b
+    s.int_list = l
+    s.struct_list = l3
+    s.enum_list = l2
+    s.text_list = l4
+    s.bytes_list = l5
+    s.member_list = l6
+    s.f32list = l7
+    s.f64list = l8
+    s.u8list = l9
+    s.blist = l10
+
+    data = w.finalize(s)
+    return validate_out(data, path)
+
+
 def test_in_complex(path: str) -> bool:
     r = scalgoproto.Reader(read_in(path))
 
@@ -602,8 +677,8 @@ def test_in_complex(path: str) -> bool:
     return True
 
 
-def test_out_complex2(path: str) -> bool:
-    w = scalgoproto.Writer()
+def test_out_complex2(path: str, large: bool = False) -> bool:
+    w = scalgoproto.Writer(large)
 
     m = w.construct_table(base.MemberOut)
     m.id = 42
@@ -903,6 +978,905 @@ def test_in_extend2(path: str) -> bool:
     return True
 
 
+def test_out_copied(path: str) -> bool:
+    w = scalgoproto.Writer()
+    c = w.construct_table(complex2.CopiedOut)
+    c.u.raw = b"bytes"
+    m = c.add_members().add_l(2)
+    m.add(0).id = 5
+    m.add(1).id = 7
+    b = c.add_bools().add_l(10)
+    b[3] = True
+    b[9] = True
+    u = c.add_unions().add_l(2)
+    u[0].text = "text"
+    u[1].my_bytes = b"raw"
+    data = w.finalize(c)
+    return validate_out(data, path)
+
+
+def test_in_copied(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    c = r.root(complex2.CopiedIn)
+    if require((c.u.is_raw, c.u.raw), (True, b"bytes")):
+        return False
+    if require([m.id for m in c.members.l], [5, 7]):
+        return False
+    if require([i for i in range(10) if c.bools.l[i]], [3, 9]):
+        return False
+    u = c.unions.l
+    if require((len(u), u[0].text, u[1].my_bytes), (2, "text", b"raw")):
+        return False
+    return True
+
+
+def test_copy_copied(path: str) -> bool:
+    return copy_in(path, complex2.CopiedIn, complex2.CopiedOut, test_in_copied)
+
+
+def copy_in(path: str, i, o, test) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    w = scalgoproto.Writer()
+    return run_on_data(w.finalize(w.copy(o, r.root(i))), test)
+
+
+def compact_in(path: str, o, test) -> bool:
+    original = read_in(path)
+    data = scalgoproto.compact(scalgoproto.Reader(original), o)
+    if len(data) > len(original):
+        print("Compacting grew the message", file=sys.stderr)
+        return False
+    return run_on_data(data, test)
+
+
+def run_on_data(data: bytes, test) -> bool:
+    """Run test on a file holding data"""
+    (fd, copy_path) = tempfile.mkstemp(suffix=".bin")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return test(copy_path)
+    finally:
+        os.unlink(copy_path)
+
+
+def test_copy(path: str) -> bool:
+    return copy_in(path, base.SimpleIn, base.SimpleOut, test_in)
+
+
+def test_copy_complex(path: str) -> bool:
+    return copy_in(path, base.ComplexIn, base.ComplexOut, test_in_complex)
+
+
+def test_copy_complex2(path: str) -> bool:
+    return copy_in(path, complex2.Complex2In, complex2.Complex2Out, test_in_complex2)
+
+
+def test_copy_inplace(path: str) -> bool:
+    return copy_in(path, base.InplaceRootIn, base.InplaceRootOut, test_in_inplace)
+
+
+def test_tables(path: str) -> bool:
+    messages = []
+    for bulk in (False, True):
+        w = scalgoproto.Writer()
+        s = w.construct_table(base.ComplexOut)
+        if bulk:
+            m = w.construct_tables(base.MemberOut, 1)[0]
+        else:
+            m = w.construct_table(base.MemberOut)
+        m.id = 42
+        s.member = m
+        l = s.add_member_list(100)
+        if bulk:
+            members = l.add_all()
+            if require(len(members), 100):
+                return False
+        else:
+            members = [l.add(i) for i in range(100)]
+        for (i, member) in enumerate(members):
+            member.id = i
+        messages.append(w.finalize(s))
+    if require(messages[0], messages[1]):
+        return False
+    s = scalgoproto.Reader(messages[1]).root(base.ComplexIn)
+    if require(s.member.id, 42):
+        return False
+    if require([m.id for m in s.member_list], list(range(100))):
+        return False
+    return validate_out(messages[1], path)
+
+
+def test_cursor(path: str) -> bool:
+    s = scalgoproto.Reader(read_in(path)).root(base.ComplexIn)
+    ids = []
+    members = set()
+    for m in s.member_list.cursor():
+        ids.append(m.id if m is not None else None)
+        if m is not None:
+            members.add(id(m))
+    if require(ids, [42, None, 42]):
+        return False
+    if require(len(members), 1):
+        return False
+    if require([v.x for v in s.struct_list.cursor()], [0]):
+        return False
+    if require(list(s.text_list.cursor()), ["text", None]):
+        return False
+    if require(list(s.enum_list.cursor()), [base.MyEnum.a, None]):
+        return False
+    return True
+
+
+def test_struct_views(path: str) -> bool:
+    w = scalgoproto.Writer()
+    s = w.construct_table(base.ComplexOut)
+    l = s.add_struct_list(10)
+    for i in range(10):
+        l[i] = base.MyStruct(i * 1000, i / 2, i % 3 == 0)
+    data = w.finalize(s)
+    eager = scalgoproto.Reader(data).root(base.ComplexIn).struct_list
+    views = scalgoproto.Reader(data, struct_views=True).root(base.ComplexIn).struct_list
+    if require(isinstance(views[3], base.MyStructView), True):
+        return False
+    for (e, v) in zip(eager, views.cursor()):
+        if require((v.x, v.y, v.z), (e.x, e.y, e.z)):
+            return False
+
+    r = scalgoproto.Reader(read_in(path)).root(base.SimpleIn)
+    fs = r.s
+    v = base.FullStructView(r._reader, r._offset + 1)
+    if require((v.e, v.s.x, v.s.y, v.s.z), (fs.e, fs.s.x, fs.s.y, fs.s.z)):
+        return False
+    if require((v.u64, v.i8, v.i64, v.f, v.d), (fs.u64, fs.i8, fs.i64, fs.f, fs.d)):
+        return False
+    return True
+
+
+def test_struct_columns(path: str) -> bool:
+    import numpy
+
+    w = scalgoproto.Writer()
+    s = w.construct_table(base.ComplexOut)
+    l = s.add_struct_list(10)
+    for i in range(10):
+        l[i] = base.MyStruct(i * 1000, i / 2, i % 3 == 0)
+    data = w.finalize(s)
+    l = scalgoproto.Reader(data).root(base.ComplexIn).struct_list
+    x = l.struct_column("x")
+    if require(x.tolist(), [i * 1000 for i in range(10)]):
+        return False
+    if require(x.strides, (base.MyStruct._WIDTH,)):
+        return False
+    records = l.to_records()
+    if require(records["y"].tolist(), [i / 2 for i in range(10)]):
+        return False
+    if require(records["z"].tolist(), [i % 3 == 0 for i in range(10)]):
+        return False
+    data[l._offset] = 7
+    if require(int(x[0]), 7):
+        return False
+
+    w = scalgoproto.Writer()
+    s = w.construct_table(base.SimpleOut)
+    l = w.construct_struct_list(base.FullStruct, 3)
+    for i in range(3):
+        l[i] = base.FullStruct(base.MyEnum.c, base.MyStruct(i, 2.5, True), d=i * 3.0)
+    data = w.finalize(s)
+    l = scalgoproto.Reader(data)._get_struct_list(base.FullStruct, l._offset, 3)
+    if require(l.struct_column("s.x").tolist(), [0, 1, 2]):
+        return False
+    if require(l.struct_column("d").tolist(), [0.0, 3.0, 6.0]):
+        return False
+    if require(l.struct_column("e").tolist(), [2, 2, 2]):
+        return False
+    return True
+
+
+def test_out_columnar(path: str) -> bool:
+    w = scalgoproto.Writer()
+    c = w.construct_table(complex2.ColumnarOut)
+    t = c.add_tail(10)
+    t[9].v = 1000
+    t.w = [i % 3 == 0 for i in range(10)]
+    p = c.add_points(3)
+    p.x = [0.5, 1.5, 2.5]
+    p[1].y = 42
+    p[2].b = True
+    p[0].e = base.MyEnum.c
+    p[2].e = base.MyEnum.a
+    p.s = [base.MyStruct(i, 2.0 * i, i == 1) for i in range(3)]
+    data = w.finalize(c)
+    return validate_out(data, path)
+
+
+def test_in_columnar(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    c = r.root(complex2.ColumnarIn)
+    if require(c.has_points, True):
+        return False
+    p = c.points
+    if require(len(p), 3):
+        return False
+    if require(list(p.x), [0.5, 1.5, 2.5]):
+        return False
+    if require(list(p.y), [7, 42, 7]):
+        return False
+    if require(list(p.b), [False, False, True]):
+        return False
+    if require([p.e.has(i) for i in range(3)], [True, False, True]):
+        return False
+    if require(p.e[0], base.MyEnum.c):
+        return False
+    if require([s.y for s in p.s], [0.0, 2.0, 4.0]):
+        return False
+    if require(p[1].y, 42):
+        return False
+    if require(p[-1].x, 2.5):
+        return False
+    if require(p[2].b, True):
+        return False
+    if require(p[1].has_e, False):
+        return False
+    if require(p[2].e, base.MyEnum.a):
+        return False
+    if require(p[1].s.z, True):
+        return False
+    if require(c.has_tail, True):
+        return False
+    t = c.tail
+    if require(len(t), 10):
+        return False
+    if require(list(t.v), [3] * 9 + [1000]):
+        return False
+    if require([r.w for r in t], [i % 3 == 0 for i in range(10)]):
+        return False
+    return True
+
+
+def test_copy_columnar(path: str) -> bool:
+    return copy_in(path, complex2.ColumnarIn, complex2.ColumnarOut, test_in_columnar)
+
+
+def test_in_columnar_old(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    c = r.root(complex2.ColumnarIn)
+    p = c.points
+    if require(len(p), 3):
+        return False
+    if require(list(p.x), [0.5, 1.5, 2.5]):
+        return False
+    if require(list(p.y), [7, 42, 7]):
+        return False
+    if require(list(p.b), [False, False, False]):
+        return False
+    if require([p.e.has(i) for i in range(3)], [False, False, False]):
+        return False
+    if require(p[1].s.y, 0.0):
+        return False
+    if require(list(c.tail.v), [3] * 9 + [1000]):
+        return False
+    if require([r.w for r in c.tail], [False] * 10):
+        return False
+    return True
+
+
+def test_copy_columnar_old(path: str) -> bool:
+    return copy_in(
+        path, complex2.ColumnarIn, complex2.ColumnarOut, test_in_columnar_old
+    )
+
+
+packed_ids = [5, 1000000, 1000003, 2 ** 64 - 1, 0]
+packed_deltas = [-5, 3, -(2 ** 31), 2 ** 31 - 1, 0]
+
+
+def test_out_packed(path: str) -> bool:
+    w = scalgoproto.Writer()
+    p = w.construct_table(complex2.PackedOut)
+    p.ids = packed_ids
+    p.deltas = w.construct_packed_list(packed_deltas)
+    p.small = bytes([255, 0, 7])
+    p.empty = []
+    data = w.finalize(p)
+    return validate_out(data, path)
+
+
+def test_in_packed(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    p = r.root(complex2.PackedIn)
+    if require(p.has_ids, True):
+        return False
+    if require(len(p.ids), 5):
+        return False
+    if require(list(p.ids), packed_ids):
+        return False
+    if require(p.ids[3], 2 ** 64 - 1):
+        return False
+    if require(list(p.deltas.to_array()), packed_deltas):
+        return False
+    if require(p.deltas[-3], -(2 ** 31)):
+        return False
+    if require(list(p.small), [255, 0, 7]):
+        return False
+    if require(len(p.empty), 0):
+        return False
+    import numpy
+
+    if require(p.ids.to_numpy().tolist(), packed_ids):
+        return False
+    if require(p.deltas.to_numpy().dtype, numpy.dtype("<i")):
+        return False
+    if require(p.deltas.to_numpy().tolist(), packed_deltas):
+        return False
+    if require(p.small.to_numpy().tolist(), [255, 0, 7]):
+        return False
+    if require(len(p.empty.to_numpy()), 0):
+        return False
+    return True
+
+
+def test_copy_packed(path: str) -> bool:
+    return copy_in(path, complex2.PackedIn, complex2.PackedOut, test_in_packed)
+
+
+compressed_payload = b"".join(b"tile %d;" % (i % 50) for i in range(2000))
+
+
+def test_out_compressed(path: str) -> bool:
+    w = scalgoproto.Writer()
+    c = w.construct_table(complex2.CompressedOut)
+    c.payload = compressed_payload
+    c.raw = b"raw"
+    data = w.finalize(c)
+    if require(len(data) < len(compressed_payload) // 10, True):
+        return False
+    return validate_out(data, path)
+
+
+def test_in_compressed(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    c = r.root(complex2.CompressedIn)
+    if require((c.has_payload, c.has_raw, c.has_empty), (True, True, False)):
+        return False
+    if require(c.payload, compressed_payload):
+        return False
+    # Decompressed once per reader
+    if require(c.payload is r.root(complex2.CompressedIn).payload, True):
+        return False
+    if require(zlib.decompress(c.payload_compressed), compressed_payload):
+        return False
+    if require(c.raw, b"raw"):
+        return False
+
+    # Forwarding the compressed stream gives the same message
+    w = scalgoproto.Writer()
+    o = w.construct_table(complex2.CompressedOut)
+    o.payload_compressed = c.payload_compressed
+    o.raw = c.raw
+    return not require(bytes(w.finalize(o)), bytes(r._data))
+
+
+def test_copy_compressed(path: str) -> bool:
+    return copy_in(
+        path, complex2.CompressedIn, complex2.CompressedOut, test_in_compressed
+    )
+
+
+dictionary_countries = ["DK", "SE", "DK", "NO", "DK", "SE"]
+dictionary_many = ["v%d" % (i % 260) for i in range(520)]
+
+
+def test_out_dictionary(path: str) -> bool:
+    w = scalgoproto.Writer()
+    d = w.construct_table(complex2.DictionaryOut)
+    d.countries = dictionary_countries
+    d.many = w.construct_dictionary_list(dictionary_many)
+    data = w.finalize(d)
+    return validate_out(data, path)
+
+
+def test_in_dictionary(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    d = r.root(complex2.DictionaryIn)
+    if require(d.has_countries, True):
+        return False
+    c = d.countries
+    if require(list(c), dictionary_countries):
+        return False
+    if require(list(c.dictionary), ["DK", "SE", "NO"]):
+        return False
+    if require(list(c.codes()), [0, 1, 0, 2, 0, 1]):
+        return False
+    if require(c.codes().itemsize, 1):
+        return False
+    if require(c[-3], "NO"):
+        return False
+    m = d.many
+    if require(len(m.dictionary), 260):
+        return False
+    if require(m.codes().itemsize, 2):
+        return False
+    if require(list(m), dictionary_many):
+        return False
+    import numpy
+
+    if require(numpy.bincount(c.codes_numpy()).tolist(), [3, 2, 1]):
+        return False
+    if require(m.codes_numpy()[265], 5):
+        return False
+    return True
+
+
+def test_copy_dictionary(path: str) -> bool:
+    return copy_in(
+        path, complex2.DictionaryIn, complex2.DictionaryOut, test_in_dictionary
+    )
+
+
+def test_dictionary_unset(path: str) -> bool:
+    w = scalgoproto.Writer()
+    d = w.construct_table(complex2.DictionaryOut)
+    d.countries = ["DK", None, "DK"]
+    r = scalgoproto.Reader(w.finalize(d))
+    c = r.root(complex2.DictionaryIn).countries
+    if require([c.has(i) for i in range(3)], [True, False, True]):
+        return False
+    if require(c[1], None):
+        return False
+    return True
+
+
+def test_out_dedupe(path: str) -> bool:
+    w = scalgoproto.Writer(dedupe=True)
+    s = w.construct_table(base.ComplexOut)
+    s.text = "hello"
+    s.my_bytes = b"hello"
+    l = s.add_text_list(4)
+    for (i, t) in enumerate(["hello", "world", "hello", "world"]):
+        l[i] = t
+    b = s.add_bytes_list(2)
+    b[0] = b"hello"
+    b[1] = b"hello"
+    data = w.finalize(s)
+    report = w.dedupe_report()
+    if require(
+        report,
+        {
+            "objects": 8,
+            "hits": 5,
+            "bytes_saved": 68,
+            "tables": 0,
+            "table_hits": 0,
+            "entries": 3,
+            "memory": 15,
+        },
+    ):
+        return False
+    w = scalgoproto.Writer(dedupe=True, dedupe_limit=5)
+    a = w.construct_text("hello")
+    w.construct_text("world")
+    if require(w.construct_text("hello")._offset == a._offset, False):
+        return False
+    if require((w.dedupe_report()["hits"], w.dedupe_report()["entries"]), (0, 1)):
+        return False
+    return validate_out(data, path)
+
+
+def test_in_dedupe(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    s = r.root(base.ComplexIn)
+    if require(s.text, "hello"):
+        return False
+    if require(s.my_bytes, b"hello"):
+        return False
+    if require(list(s.text_list), ["hello", "world", "hello", "world"]):
+        return False
+    if require(list(s.bytes_list), [b"hello", b"hello"]):
+        return False
+    return True
+
+
+def test_out_intern(path: str) -> bool:
+    w = scalgoproto.Writer()
+    s = w.construct_table(base.ComplexOut)
+    l = s.add_member_list(4)
+    for i in range(4):
+        m = w.construct_table(base.MemberOut)
+        m.id = i % 2
+        l[i] = w.intern_table(m)
+    m = w.construct_table(base.MemberOut)
+    m.id = 1
+    s.member = w.intern_table(m)
+    data = w.finalize(s)
+    report = w.dedupe_report()
+    if require((report["tables"], report["table_hits"]), (5, 3)):
+        return False
+    if require(report["bytes_saved"], 30):
+        return False
+
+    def nested():
+        m = w.construct_table(base.MemberOut)
+        m.id = 7
+        m = w.intern_table(m)
+        c = w.construct_table(base.ComplexOut)
+        c.member = m
+        return w.intern_table(c)
+
+    w = scalgoproto.Writer()
+    a = nested()
+    used = w._used
+    if require(nested()._offset, a._offset):
+        return False
+    if require(w._used, used):
+        return False
+    return validate_out(data, path)
+
+
+def test_in_intern(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    s = r.root(base.ComplexIn)
+    if require([m.id for m in s.member_list], [0, 1, 0, 1]):
+        return False
+    if require(s.member.id, 1):
+        return False
+    return True
+
+
+map_names = {3: "three", 700: "seven hundred", 0: "zero"}
+
+
+def test_out_map(path: str) -> bool:
+    w = scalgoproto.Writer()
+    m = w.construct_table(complex2.MapsOut)
+    a = w.construct_table(base.MemberOut)
+    a.id = 1
+    b = w.construct_table(base.MemberOut)
+    b.id = 2
+    m.members = {"one": a, "two": b}
+    m.points = {
+        -5: base.MyStruct(1, 2.5, True),
+        2 ** 40: base.MyStruct(3, 4.0, False),
+    }
+    m.names = map_names
+    m.weights = {"a": 0.5, "b": 1.5}
+    m.empty = {}
+    data = w.finalize(m)
+    return validate_out(data, path)
+
+
+def test_in_map(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    m = r.root(complex2.MapsIn)
+    if require(m.has_members, True):
+        return False
+    if require((m.members["one"].id, m.members["two"].id), (1, 2)):
+        return False
+    if require(("one" in m.members, "three" in m.members), (True, False)):
+        return False
+    if require(m.members.get("three"), None):
+        return False
+    p = m.points[2 ** 40]
+    if require((p.x, p.y, p.z), (3, 4.0, False)):
+        return False
+    if require(m.points[-5].y, 2.5):
+        return False
+    if require(dict(m.names), map_names):
+        return False
+    if require(m.weights.get("b"), 1.5):
+        return False
+    if require((len(m.empty), m.empty.get(0), list(m.empty)), (0, None, [])):
+        return False
+    try:
+        m.names[4]
+        print("Expected KeyError")
+        return False
+    except KeyError:
+        pass
+    return True
+
+
+def test_copy_map(path: str) -> bool:
+    return copy_in(path, complex2.MapsIn, complex2.MapsOut, test_in_map)
+
+
+def test_map_many(path: str) -> bool:
+    w = scalgoproto.Writer()
+    m = w.construct_table(complex2.MapsOut)
+    m.names = {i * 61: str(i) for i in range(1000)}
+    m.weights = {"k%d" % i: i / 2 for i in range(1000)}
+    r = scalgoproto.Reader(w.finalize(m))
+    m = r.root(complex2.MapsIn)
+    if require(len(m.names), 1000):
+        return False
+    for i in range(1000):
+        if require(m.names[i * 61], str(i)):
+            return False
+        if require(m.weights["k%d" % i], i / 2):
+            return False
+    if require([i * 61 + 1 in m.names for i in range(1000)], [False] * 1000):
+        return False
+    if require("k1000" in m.weights, False):
+        return False
+    return True
+
+
+sorted_ids = [7, 3, 9, 3, -1]
+sorted_names = ["pear", "apple", "fig"]
+
+
+def test_out_sorted(path: str) -> bool:
+    w = scalgoproto.Writer()
+    s = w.construct_table(complex2.SortedOut)
+    l = s.add_by_id(len(sorted_ids))
+    for (i, v) in enumerate(sorted_ids):
+        l.add(i).id = v
+    n = s.add_by_name(len(sorted_names))
+    for (i, v) in enumerate(sorted_names):
+        t = n.add(i)
+        if i + 1 < len(sorted_names):
+            t.name = v
+        t.count = i
+    try:
+        w.finalize(s)
+        print("Finalize with an unset key did not fail")
+        return False
+    except Exception as e:
+        if require(str(e), "Unset key in sorted list"):
+            return False
+    # The failed finalize leaves the writer unchanged
+    t.name = sorted_names[-1]
+    data = w.finalize(s)
+    return validate_out(data, path)
+
+
+def test_in_sorted(path: str) -> bool:
+    r = scalgoproto.Reader(read_in(path))
+    s = r.root(complex2.SortedIn)
+    l = s.by_id
+    if require([m.id for m in l], sorted(sorted_ids)):
+        return False
+    if require((l.lower_bound(3), l.upper_bound(3)), (1, 3)):
+        return False
+    if require((l.lower_bound(-5), l.lower_bound(10)), (0, 5)):
+        return False
+    if require((l.find(9).id, l.find(4)), (9, None)):
+        return False
+    if require([m.id for m in l.range(0, 8)], [3, 3, 7]):
+        return False
+    n = s.by_name
+    if require([t.name for t in n], sorted(sorted_names)):
+        return False
+    if require((n.find("fig").count, n.find("kiwi")), (2, None)):
+        return False
+    return True
+
+
+def test_copy_sorted(path: str) -> bool:
+    return copy_in(path, complex2.SortedIn, complex2.SortedOut, test_in_sorted)
+
+
+def test_compact(path: str) -> bool:
+    w = scalgoproto.Writer()
+    w.construct_table(base.SimpleOut)
+    s = w.construct_table(base.ComplexOut)
+    s.text = "dropped"
+    s.text = "kept"
+    s.add_member()
+    l = s.add_member_list(2)
+    l.add(0).id = 300
+    l.add(1)
+    original = bytes(w.finalize(s))
+    data = scalgoproto.compact(scalgoproto.Reader(original), base.ComplexOut)
+    if require(len(original) - len(data), 246):
+        return False
+    r = scalgoproto.Reader(data).root(base.ComplexIn)
+    if require((r.text, r.member.id, r.has_nmember), ("kept", 0, False)):
+        return False
+    if require([m.id for m in r.member_list], [300, 0]):
+        return False
+    return validate_out(data, path)
+
+
+def test_compact_simple(path: str) -> bool:
+    return compact_in(path, base.SimpleOut, test_in)
+
+
+def test_compact_complex(path: str) -> bool:
+    return compact_in(path, base.ComplexOut, test_in_complex)
+
+
+def test_compact_complex2(path: str) -> bool:
+    return compact_in(path, complex2.Complex2Out, test_in_complex2)
+
+
+def test_compact_inplace(path: str) -> bool:
+    return compact_in(path, base.InplaceRootOut, test_in_inplace)
+
+
+def test_rollback(path: str) -> bool:
+    w = scalgoproto.Writer(dedupe=True)
+    s = w.construct_table(base.ComplexOut)
+    s.text = "hello"
+    mark = w.mark()
+    w.construct_text("world")
+    m = w.construct_table(base.MemberOut)
+    m.id = 5
+    w.intern_table(m)
+    w.rollback(mark)
+    if require(w._used, mark):
+        return False
+    l = s.add_text_list(2)
+    l[0] = "world"
+    l[1] = "hello"
+    m = w.construct_table(base.MemberOut)
+    m.id = 5
+    s.member = w.intern_table(m)
+    data = w.finalize(s)
+    report = w.dedupe_report()
+    if require((report["hits"], report["table_hits"]), (1, 0)):
+        return False
+
+    w = scalgoproto.Writer(debug=True)
+    s = w.construct_table(base.ComplexOut)
+    mark = w.mark()
+    m = w.construct_table(base.MemberOut)
+    l = w.construct_int8_list(2)
+    w.rollback(mark)
+    for use in (lambda: setattr(m, "id", 1), lambda: l.__setitem__(0, 1)):
+        try:
+            use()
+            print("Expected use of a removed object to raise")
+            return False
+        except Exception:
+            pass
+    try:
+        s.member = m
+        print("Expected pointing to a removed table to raise")
+        return False
+    except Exception:
+        pass
+    return validate_out(data, path)
+
+
+def test_mut(path: str) -> bool:
+    data = bytearray(read_in("test/simple.bin"))
+    s = scalgoproto.Reader(data).root(base.SimpleMut)
+    s.e = base.MyEnum.a
+    s.b = False
+    s.u32 = 7
+    s.d = 1.5
+    s.os = base.MyStruct(1, 2.0, False)
+    s.nu8 = 5
+    if require((s.e, s.b, s.u32, s.d, s.os.x), (base.MyEnum.a, False, 7, 1.5, 1)):
+        return False
+    if require((s.has_nu8, s.nu8, s.has_nu16), (True, 5, False)):
+        return False
+
+    # Tables stored without their trailing defaults can not be changed there
+    w = scalgoproto.Writer()
+    short = scalgoproto.compact(
+        scalgoproto.Reader(w.finalize(w.construct_table(base.SimpleOut))),
+        base.SimpleOut,
+    )
+    m = scalgoproto.Reader(bytearray(short)).root(base.SimpleMut)
+    try:
+        m.od = 1.0
+        print("Expected setting a member not stored to raise")
+        return False
+    except Exception:
+        pass
+
+    complex_data = bytearray(read_in("test/complex.bin"))
+    scalgoproto.Reader(complex_data).root(base.ComplexMut).member.id = 7
+    if require(scalgoproto.Reader(complex_data).root(base.ComplexIn).member.id, 7):
+        return False
+    return validate_out(data, path)
+
+
+def test_append(path: str) -> bool:
+    original = read_in("test/complex.bin")
+    with open("test/complex.bin", "rb") as f:
+        w = scalgoproto.Writer.open_append(f)
+    m = w.construct_table(base.MemberOut)
+    m.id = 9
+    t = w.construct_text("appended")
+    b = w.construct_bytes(b"more")
+    l = w.construct_int32_list(2)
+    l[0] = 1
+    l[1] = 2
+    c = w.root(base.ComplexMut)
+    c.nmember = m
+    c.ntext = t
+    c.nbytes = b
+    c.nint_list = l
+    c.member.id = 43
+    data = w.finalize()
+    if require(len(data) > len(original), True):
+        return False
+    r = scalgoproto.Reader(data).root(base.ComplexIn)
+    if require((r.nmember.id, r.ntext, r.nbytes), (9, "appended", b"more")):
+        return False
+    if require((list(r.nint_list), r.member.id, r.text), ([1, 2], 43, "text")):
+        return False
+    try:
+        scalgoproto.Writer().finalize()
+        print("Finalize without a root did not fail")
+        return False
+    except Exception as e:
+        if require(str(e), "No root given"):
+            return False
+    # A file opened for writing is continued in place
+    with open("tmp/append.bin", "wb") as f:
+        f.write(original)
+    with open("tmp/append.bin", "r+b") as f:
+        w = scalgoproto.Writer.open_append(f)
+        c = w.root(base.ComplexMut)
+        c.nmember = w.construct_table(base.MemberOut)
+        c.nmember.id = 9
+        c.ntext = w.construct_text("appended")
+        c.nbytes = w.construct_bytes(b"more")
+        l = w.construct_int32_list(2)
+        l[0] = 1
+        l[1] = 2
+        c.nint_list = l
+        c.member.id = 43
+        if require(bytes(w.finalize()), data):
+            return False
+    if require(read_in("tmp/append.bin"), data):
+        return False
+    return validate_out(data, path)
+
+
+def test_patch(path: str) -> bool:
+    old = scalgoproto.Reader(read_in("test/complex.bin"))
+    new = scalgoproto.Reader(read_in(path))
+    patch = scalgoproto.diff(old, new)
+    if require(len(patch) < len(new._data) // 2, True):
+        return False
+    if require(scalgoproto.apply_patch(old, patch), new._data):
+        return False
+    try:
+        scalgoproto.apply_patch(new, patch)
+        print("Expected applying a patch to another message to raise")
+        return False
+    except Exception:
+        pass
+    same = scalgoproto.diff(old, old)
+    return not require(scalgoproto.apply_patch(old, same), old._data)
+
+
+def test_archive(path: str) -> bool:
+    messages = [read_in("test/simple.bin"), read_in(path), read_in("test/complex2.bin")]
+    for compression in ("zlib", "lzma", "none"):
+        f = io.BytesIO()
+        with scalgoproto.ArchiveWriter(f, 1000, compression) as w:
+            for i in range(30):
+                if require(w.add(messages[i % 3]), i):
+                    return False
+        a = scalgoproto.Archive(f, cache_blocks=2)
+        if require(len(a), 30):
+            return False
+        if require([r._data for r in a], messages * 10):
+            return False
+        # Reading the last block again is served by the cache, the first not
+        if require(a[-2].root(base.ComplexIn).member.id, 42):
+            return False
+        if require(a[0]._data, messages[0]):
+            return False
+        if require(a.cache_report(), {"hits": 24, "misses": 8}):
+            return False
+        # An archive written after other data is read from its own start
+        f = io.BytesIO()
+        f.write(b"preamble")
+        with scalgoproto.ArchiveWriter(f, 1000, compression) as w:
+            for i in range(30):
+                w.add(messages[i % 3])
+        if require([r._data for r in scalgoproto.Archive(f)], messages * 10):
+            return False
+    return True
+
+
 def main() -> None:
     ans = False
     test = sys.argv[1]
@@ -917,10 +1891,16 @@ def main() -> None:
         ans = test_in_default(path)
     elif test == "out_complex":
         ans = test_out_complex(path)
+    elif test == "out_complex_large":
+        ans = test_out_complex(path, True)
+    elif test == "out_complex_builder":
+        ans = test_out_complex_builder(path)
     elif test == "in_complex":
         ans = test_in_complex(path)
     elif test == "out_complex2":
         ans = test_out_complex2(path)
+    elif test == "out_complex2_large":
+        ans = test_out_complex2(path, True)
     elif test == "in_complex2":
         ans = test_in_complex2(path)
     elif test == "out_inplace":
@@ -935,6 +1915,100 @@ def main() -> None:
         ans = test_out_extend2(path)
     elif test == "in_extend2":
         ans = test_in_extend2(path)
+    elif test == "out_copied":
+        ans = test_out_copied(path)
+    elif test == "in_copied":
+        ans = test_in_copied(path)
+    elif test == "copy_copied":
+        ans = test_copy_copied(path)
+    elif test == "copy":
+        ans = test_copy(path)
+    elif test == "copy_complex":
+        ans = test_copy_complex(path)
+    elif test == "copy_complex2":
+        ans = test_copy_complex2(path)
+    elif test == "copy_inplace":
+        ans = test_copy_inplace(path)
+    elif test == "tables":
+        ans = test_tables(path)
+    elif test == "cursor":
+        ans = test_cursor(path)
+    elif test == "struct_views":
+        ans = test_struct_views(path)
+    elif test == "out_columnar":
+        ans = test_out_columnar(path)
+    elif test == "in_columnar":
+        ans = test_in_columnar(path)
+    elif test == "copy_columnar":
+        ans = test_copy_columnar(path)
+    elif test == "in_columnar_old":
+        ans = test_in_columnar_old(path)
+    elif test == "copy_columnar_old":
+        ans = test_copy_columnar_old(path)
+    elif test == "struct_columns":
+        ans = test_struct_columns(path)
+    elif test == "out_packed":
+        ans = test_out_packed(path)
+    elif test == "in_packed":
+        ans = test_in_packed(path)
+    elif test == "copy_packed":
+        ans = test_copy_packed(path)
+    elif test == "out_dictionary":
+        ans = test_out_dictionary(path)
+    elif test == "in_dictionary":
+        ans = test_in_dictionary(path)
+    elif test == "copy_dictionary":
+        ans = test_copy_dictionary(path)
+    elif test == "dictionary_unset":
+        ans = test_dictionary_unset(path)
+    elif test == "out_dedupe":
+        ans = test_out_dedupe(path)
+    elif test == "in_dedupe":
+        ans = test_in_dedupe(path)
+    elif test == "out_intern":
+        ans = test_out_intern(path)
+    elif test == "in_intern":
+        ans = test_in_intern(path)
+    elif test == "out_map":
+        ans = test_out_map(path)
+    elif test == "in_map":
+        ans = test_in_map(path)
+    elif test == "copy_map":
+        ans = test_copy_map(path)
+    elif test == "map_many":
+        ans = test_map_many(path)
+    elif test == "out_sorted":
+        ans = test_out_sorted(path)
+    elif test == "in_sorted":
+        ans = test_in_sorted(path)
+    elif test == "copy_sorted":
+        ans = test_copy_sorted(path)
+    elif test == "compact":
+        ans = test_compact(path)
+    elif test == "compact_simple":
+        ans = test_compact_simple(path)
+    elif test == "compact_complex":
+        ans = test_compact_complex(path)
+    elif test == "compact_complex2":
+        ans = test_compact_complex2(path)
+    elif test == "compact_inplace":
+        ans = test_compact_inplace(path)
+    elif test == "rollback":
+        ans = test_rollback(path)
+    elif test == "mut":
+        ans = test_mut(path)
+    elif test == "append":
+        ans = test_append(path)
+    elif test == "patch":
+        ans = test_patch(path)
+    elif test == "archive":
+        ans = test_archive(path)
+    elif test == "out_compressed":
+        ans = test_out_compressed(path)
+    elif test == "in_compressed":
+        ans = test_in_compressed(path)
+    elif test == "copy_compressed":
+        ans = test_copy_compressed(path)
     if not ans:
         sys.exit(1)
 